@@ -0,0 +1,207 @@
+"""Persistent cache for THREDDS catalogue responses
+
+Catalogue documents are stored in a SQLite database together with their
+ETag and Last-Modified headers so that they can be revalidated with a
+conditional GET.  The cache is limited in size with least recently used
+entries evicted first.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import io
+import re
+import time
+import sqlite3
+import logging
+import threading
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    '''Response served from the catalogue cache.  Provides the subset of the
+    requests.Response interface used by the validation
+    '''
+    status_code = 200
+    ok = True
+
+    def __init__(self, uri, content, headers=None):
+        self.url = uri
+        self.content = content
+        self.headers = headers or {}
+        self.raw = io.BytesIO(content)
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.raw.close()
+
+
+class CatalogResponseCache:
+    '''Cache catalogue responses on disk and revalidate them using
+    If-None-Match and If-Modified-Since request headers
+
+    Hits, misses and revalidations are counted in the stats attribute
+    '''
+    DB_FILENAME = 'catalog-cache.sqlite'
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+    MAX_AGE_PAT = re.compile(r'max-age=(\d+)')
+
+    def __init__(self, dirpath, max_size=DEFAULT_MAX_SIZE, ttl=None):
+        '''
+        :param dirpath: directory to hold the cache database.  It is
+        created if it doesn't already exist
+        :param max_size: maximum total size in bytes of cached content
+        :param ttl: time in seconds for which a cached catalogue is used
+        without revalidating it with the server.  This overrides any
+        Cache-Control max-age set by the server.  If None, the server's
+        max-age is used, otherwise catalogues are revalidated on every use
+        '''
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+        self.db_filepath = os.path.join(dirpath, self.__class__.DB_FILENAME)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = Counter()
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_filepath,
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS catalog_response ('
+                'uri TEXT PRIMARY KEY, '
+                'content BLOB NOT NULL, '
+                'size INTEGER NOT NULL, '
+                'etag TEXT, '
+                'last_modified TEXT, '
+                'expires REAL NOT NULL, '
+                'accessed REAL NOT NULL)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS catalog_response_accessed '
+                'ON catalog_response (accessed)')
+
+    def _get_expiry(self, resp_headers, now):
+        if self.ttl is not None:
+            return now + self.ttl
+
+        max_age_match = self.__class__.MAX_AGE_PAT.search(
+                                    resp_headers.get('Cache-Control', ''))
+        if max_age_match is not None:
+            return now + int(max_age_match.group(1))
+
+        return now
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _lookup(self, uri):
+        with self._lock:
+            return self._db.execute(
+                'SELECT content, etag, last_modified, expires '
+                'FROM catalog_response WHERE uri = ?', (uri,)).fetchone()
+
+    def _touch(self, uri, now, expires=None):
+        with self._lock, self._db:
+            if expires is None:
+                self._db.execute(
+                    'UPDATE catalog_response SET accessed = ? WHERE uri = ?',
+                    (now, uri))
+            else:
+                self._db.execute(
+                    'UPDATE catalog_response SET accessed = ?, expires = ? '
+                    'WHERE uri = ?', (now, expires, uri))
+
+    def _store(self, uri, content, etag, last_modified, expires, now):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO catalog_response '
+                '(uri, content, size, etag, last_modified, expires, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (uri, content, len(content), etag, last_modified, expires,
+                 now))
+            self._evict()
+
+    def _evict(self):
+        '''Remove least recently used entries until the cache is within its
+        size limit.  Call with the lock held
+        '''
+        total_size = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM catalog_response'
+            ).fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        evict_uris = []
+        for uri, size in self._db.execute(
+                'SELECT uri, size FROM catalog_response ORDER BY accessed'
+                ).fetchall():
+            if total_size <= self.max_size:
+                break
+            evict_uris.append((uri,))
+            total_size -= size
+
+        self._db.executemany('DELETE FROM catalog_response WHERE uri = ?',
+                             evict_uris)
+        self.stats['evictions'] += len(evict_uris)
+
+    def get(self, transport, uri):
+        '''Get catalogue response for the given URI from the cache, making a
+        conditional GET request with the transport if the cached entry is
+        stale or a full request if there is no entry.  Error responses are
+        returned as is and not cached.
+        '''
+        now = time.time()
+        entry = self._lookup(uri)
+        if entry is not None:
+            content, etag, last_modified, expires = entry
+            if now < expires:
+                self._touch(uri, now)
+                self._count('hits')
+                return CachedResponse(uri, content)
+
+        headers = {}
+        if entry is not None:
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+
+        resp = transport.get(uri, headers=headers)
+        if resp.status_code == 304 and entry is not None:
+            self._touch(uri, now, expires=self._get_expiry(resp.headers,
+                                                           now))
+            self._count('revalidated')
+            log.debug('Catalogue %r not modified', uri)
+            return CachedResponse(uri, content)
+
+        self._count('misses')
+        if not resp.ok:
+            return resp
+
+        content = resp.content
+        self._store(uri, content, resp.headers.get('ETag'),
+                    resp.headers.get('Last-Modified'),
+                    self._get_expiry(resp.headers, now), now)
+
+        return CachedResponse(uri, content, headers=resp.headers)
+
+    def clear(self):
+        '''Remove all entries from the cache'''
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM catalog_response')
+
+    def close(self):
+        self._db.close()
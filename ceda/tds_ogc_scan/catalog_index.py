@@ -0,0 +1,265 @@
+"""Single pass index of the services and datasets of a THREDDS catalogue
+
+A catalogue is read once, incrementally, into a CatalogIndex.  Services are
+indexed by name and by service type, including those nested in compound
+services, and dataset access by service name and by URL path.  Dataset
+access given by an access element or by the urlPath of a dataset with a
+serviceName is included.  Endpoints are resolved as the dataset access is
+read so that looking up the endpoint of a service type is a single
+dictionary lookup however many datasets the catalogue has.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+from collections import namedtuple
+
+from ceda.tds_ogc_scan import xml_stream
+
+COMPOUND_SERVICE_TYPE = 'COMPOUND'
+
+# Top-level datasets follow the top-level services of a catalogue
+DATASET_PATH = ('catalog', 'dataset')
+
+# Service declared in a catalogue.  service_type is in upper case and
+# parent_name is the name of the compound service it is nested in or None
+CatalogService = namedtuple('CatalogService',
+                            ('name', 'service_type', 'base', 'parent_name'))
+
+# Dataset access resolved to a service which is not a compound service
+DatasetEndpoint = namedtuple('DatasetEndpoint',
+                             ('service_type', 'base', 'url_path'))
+
+
+class _DatasetFrame:
+    '''urlPath and serviceName of a dataset being read'''
+    __slots__ = ('url_path', 'service_name')
+
+    def __init__(self, url_path):
+        self.url_path = url_path
+        self.service_name = None
+
+
+def iter_element_events(elem, path=()):
+    '''Yield ('start', path, elem) and ('end', path, elem) events for an
+    ElementTree element and its descendants, as xml_stream.iterparse_paths
+    does for a document being parsed'''
+    path = path + (xml_stream.local_name(elem.tag),)
+    yield 'start', path, elem
+    for child in elem:
+        yield from iter_element_events(child, path)
+
+    yield 'end', path, elem
+
+
+class CatalogIndex:
+    '''Services, dataset access and catalogue references of a THREDDS
+    catalogue, read in a single pass.  Build with read for a document or
+    from_element for a parsed ElementTree element
+    '''
+    def __init__(self):
+        self.services = {}
+        self.catalog_ref_hrefs = []
+        self._services_by_type = {}
+        self._child_services = {}
+        self._url_paths_by_service_name = {}
+        self._service_names_by_url_path = {}
+        self._endpoints_by_type = {}
+
+        self._service_stack = []
+        self._dataset_stack = []
+        self.datasets_started = False
+
+    @classmethod
+    def read(cls, source, service_types=None):
+        '''Read a catalogue document from file-like source.  If service_types
+        is set, reading stops as soon as the first endpoint of each of the
+        given service types has been found or is known to be absent
+        '''
+        catalog_index = cls()
+        pending = None
+        if service_types is not None:
+            pending = set(service_type.upper()
+                          for service_type in service_types)
+
+        for event, path, elem in xml_stream.iterparse_paths(source):
+            catalog_index.add_event(event, path, elem)
+
+            if pending is not None:
+                pending = {service_type for service_type in pending
+                           if service_type not in
+                           catalog_index._endpoints_by_type}
+
+                # No more top-level services can follow the first top-level
+                # dataset
+                if catalog_index.datasets_started:
+                    pending &= set(catalog_index._services_by_type)
+
+                if not pending:
+                    break
+
+        return catalog_index
+
+    @classmethod
+    def from_element(cls, catalog_elem):
+        '''Index a catalogue parsed into an ElementTree element'''
+        catalog_index = cls()
+        for event, path, elem in iter_element_events(catalog_elem):
+            catalog_index.add_event(event, path, elem)
+
+        return catalog_index
+
+    def add_event(self, event, path, elem):
+        '''Add an element from an xml_stream.iterparse_paths event'''
+        name = path[-1]
+        if event == 'start':
+            if name == 'service':
+                self._add_service(elem.attrib)
+
+            elif name == 'dataset':
+                if path == DATASET_PATH:
+                    self.datasets_started = True
+
+                self._dataset_stack.append(
+                                    _DatasetFrame(elem.attrib.get('urlPath')))
+
+            elif name == 'access':
+                self.add_access(self._get_dataset_service_name(
+                                            elem.attrib.get('serviceName')),
+                                elem.attrib.get('urlPath'))
+
+            elif name == 'catalogRef':
+                href = elem.attrib.get(xml_stream.XLINK_HREF_ATTR_NAME)
+                if href is not None:
+                    self.catalog_ref_hrefs.append(href)
+
+        elif name == 'service':
+            self._service_stack.pop()
+
+        elif name == 'serviceName':
+            if self._dataset_stack and elem.text:
+                self._dataset_stack[-1].service_name = elem.text.strip()
+
+        elif name == 'dataset':
+            dataset_frame = self._dataset_stack.pop()
+            if dataset_frame.url_path is not None:
+                service_name = (dataset_frame.service_name or
+                                self._get_dataset_service_name())
+                self.add_access(service_name, dataset_frame.url_path)
+
+    def _add_service(self, attrib):
+        parent_name = (self._service_stack[-1] if self._service_stack
+                       else None)
+        service = CatalogService(attrib.get('name'),
+                                 attrib.get('serviceType', '').upper(),
+                                 attrib.get('base', ''),
+                                 parent_name)
+        self._service_stack.append(service.name)
+
+        self.services.setdefault(service.name, service)
+        self._services_by_type.setdefault(service.service_type,
+                                          []).append(service)
+        if parent_name is not None:
+            self._child_services.setdefault(parent_name, []).append(service)
+
+    def _get_dataset_service_name(self, service_name=None):
+        '''Get the service name given or else inherited from the nearest
+        enclosing dataset'''
+        if service_name is not None:
+            return service_name
+
+        for dataset_frame in reversed(self._dataset_stack):
+            if dataset_frame.service_name is not None:
+                return dataset_frame.service_name
+
+        return None
+
+    def add_access(self, service_name, url_path):
+        '''Add dataset access by the named service to the URL path'''
+        if service_name is None or url_path is None:
+            return
+
+        self._url_paths_by_service_name.setdefault(service_name,
+                                                   []).append(url_path)
+        self._service_names_by_url_path.setdefault(url_path,
+                                                   []).append(service_name)
+
+        for service_type, base in self._resolve_service(service_name):
+            self._endpoints_by_type.setdefault(service_type, []).append(
+                            DatasetEndpoint(service_type, base, url_path))
+
+    def _resolve_service(self, service_name):
+        '''Get (service type, base) for each service accessed through a
+        service name'''
+        service = self.services.get(service_name)
+        if service is None:
+            # Undeclared services are taken to be named after their service
+            # type e.g. wms for WMS
+            service_type = service_name.upper()
+            services = self._services_by_type.get(service_type)
+            return [(service_type, services[0].base if services else None)]
+
+        if service.service_type == COMPOUND_SERVICE_TYPE:
+            return [resolved
+                    for child_service in self._child_services.get(
+                                                        service_name, [])
+                    for resolved in self._resolve_service(child_service.name)]
+
+        return [(service.service_type, service.base)]
+
+    def get_services(self, service_type):
+        '''Get the services of a service type in the order declared'''
+        return list(self._services_by_type.get(service_type.upper(), []))
+
+    def get_url_paths(self, service_name):
+        '''Get the URL paths of dataset access through the named service'''
+        return list(self._url_paths_by_service_name.get(service_name, []))
+
+    def get_service_names(self, url_path):
+        '''Get the names of the services through which a URL path is
+        accessed'''
+        return list(self._service_names_by_url_path.get(url_path, []))
+
+    def get_endpoints(self, service_type):
+        '''Get a DatasetEndpoint for each dataset access of a service type,
+        in document order'''
+        return list(self._endpoints_by_type.get(service_type.upper(), []))
+
+    def get_endpoint(self, service_type):
+        '''Get the first DatasetEndpoint of a service type or None'''
+        endpoints = self._endpoints_by_type.get(service_type.upper())
+        return endpoints[0] if endpoints else None
+
+    def get_uri_paths(self, service_types):
+        '''Get the service base path and dataset URL path of the first
+        endpoint of each service type
+
+        :return: dictionary keyed by service type of (base, urlPath) tuples.
+        Either can be None if not found
+        '''
+        uri_paths = {}
+        for service_type in service_types:
+            endpoint = self.get_endpoint(service_type)
+            if endpoint is not None:
+                uri_paths[service_type] = (endpoint.base, endpoint.url_path)
+            else:
+                services = self.get_services(service_type)
+                uri_paths[service_type] = (services[0].base if services
+                                           else None, None)
+
+        return uri_paths
+
+
+def find_service_uri_paths(source, service_types):
+    '''Find the service base path and dataset URL path of the first endpoint
+    for each of the given service types e.g. 'WMS', 'WCS'.  Reading stops as
+    soon as every service type has been resolved or is known to be absent
+    from the catalogue.
+
+    :return: dictionary keyed by service type of (base, urlPath) tuples.
+    Either can be None if not found
+    '''
+    return CatalogIndex.read(source,
+                             service_types=service_types).get_uri_paths(
+                                                                service_types)
@@ -0,0 +1,75 @@
+"""Helpers for running catalogue entry checks concurrently
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from six.moves.urllib.parse import urlparse
+
+
+class HostConcurrencyLimiter:
+    '''Limit the number of tasks in progress against any one host.  A
+    semaphore is created on demand for each host name seen
+    '''
+    def __init__(self, max_per_host=None):
+        '''Set max_per_host to None to apply no limit'''
+        self.max_per_host = max_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                self._semaphores[host] = semaphore
+
+            return semaphore
+
+    @contextmanager
+    def acquire(self, uri):
+        '''Block until a slot is free for the host of the given URI'''
+        if self.max_per_host is None:
+            yield
+            return
+
+        semaphore = self._get_semaphore(urlparse(uri).netloc)
+        with semaphore:
+            yield
+
+
+def run_concurrently(func, items, max_workers=1, max_workers_per_host=None,
+                     get_uri=None, host_limiter=None):
+    '''Call func for each item using a pool of max_workers threads, with no
+    more than max_workers_per_host calls in progress per host.  Results are
+    yielded in order of completion.  With a single worker, calls are made in
+    turn in the calling thread.
+
+    :param get_uri: function returning the URI for an item, used to find its
+    host.  Defaults to treating each item as a URI
+    :param host_limiter: HostConcurrencyLimiter to use in place of one
+    created from max_workers_per_host, so that a limit can be shared between
+    calls
+    '''
+    if max_workers is None or max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    if host_limiter is None:
+        host_limiter = HostConcurrencyLimiter(max_workers_per_host)
+
+    def _limited_func(item):
+        uri = item if get_uri is None else get_uri(item)
+        with host_limiter.acquire(uri):
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_limited_func, item) for item in items]
+        for future in as_completed(futures):
+            yield future.result()
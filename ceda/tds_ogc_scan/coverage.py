@@ -0,0 +1,76 @@
+"""Streamed checks of coverages returned by WCS GetCoverage
+
+A coverage can be gigabytes in size, so the response is never held in
+memory.  The first bytes are checked for a NetCDF or HDF5 signature and the
+rest is read in fixed size chunks, which are discarded, up to a cap on the
+number of bytes read.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+from collections import namedtuple
+
+# Formats identified from the signature at the start of a file
+NETCDF3 = 'NetCDF3'
+HDF5 = 'HDF5'
+
+# NetCDF classic, 64-bit offset and 64-bit data formats.  NetCDF-4 files are
+# HDF5 files
+NETCDF3_SIGNATURES = (b'CDF\x01', b'CDF\x02', b'CDF\x05')
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+# Size of each read from the response stream
+READ_CHUNK_SIZE = 65536
+
+# Format, number of bytes read and whether reading stopped at the cap
+# before the end of the content was reached
+CoverageStats = namedtuple('CoverageStats', ('format', 'n_bytes',
+                                             'truncated'))
+
+
+class CoverageError(Exception):
+    """Content is not a NetCDF or HDF5 file"""
+
+
+def get_coverage_format(header):
+    '''Get the format of a coverage from its first bytes or None if the
+    format is not recognised'''
+    if header.startswith(HDF5_SIGNATURE):
+        return HDF5
+
+    if header[:4] in NETCDF3_SIGNATURES:
+        return NETCDF3
+
+    return None
+
+
+def read_coverage_stats(stream, max_bytes, chunk_size=READ_CHUNK_SIZE):
+    '''Read a coverage from a file-like object, checking its signature, and
+    return CoverageStats.  Reading stops after max_bytes so that the caller
+    can abort the download
+
+    :raises CoverageError: if the content does not start with a NetCDF or
+    HDF5 signature
+    '''
+    header = b''
+    while len(header) < len(HDF5_SIGNATURE):
+        chunk = stream.read(len(HDF5_SIGNATURE) - len(header))
+        if not chunk:
+            break
+        header += chunk
+
+    coverage_format = get_coverage_format(header)
+    if coverage_format is None:
+        raise CoverageError('Content is not NetCDF or HDF5: starts with '
+                            '{!r}'.format(header))
+
+    n_bytes = len(header)
+    while n_bytes < max_bytes:
+        chunk = stream.read(min(chunk_size, max_bytes - n_bytes))
+        if not chunk:
+            return CoverageStats(coverage_format, n_bytes, False)
+        n_bytes += len(chunk)
+
+    return CoverageStats(coverage_format, n_bytes, True)
@@ -0,0 +1,176 @@
+"""Recursive crawler for THREDDS catalogues
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import logging
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import xml.etree.ElementTree as ET
+
+from six.moves.urllib.parse import urljoin
+
+from ceda.tds_ogc_scan import results, metrics
+from ceda.tds_ogc_scan.catalog_index import CatalogIndex
+from ceda.tds_ogc_scan.transport import TRANSPORT_ERRORS
+from ceda.tds_ogc_scan.validation import (OgcTdsValidation,
+                                          OgcTdsCatalogParseError)
+
+log = logging.getLogger(__name__)
+
+CatalogEndpoint = namedtuple('CatalogEndpoint',
+                             ('catalog_uri', 'service_type', 'uri'))
+
+
+class ThreddsCatalogCrawler:
+    '''Follow catalogRef links from a THREDDS catalogue breadth first and
+    yield the OGC dataset access endpoints found as each catalogue is read.
+    Each catalogue URI is read at most once.
+    '''
+    DEFAULT_MAX_DEPTH = 10
+    DEFAULT_MAX_PAGES = 100000
+
+    def __init__(self, validation_cls=OgcTdsValidation,
+                 service_types=('WMS', 'WCS'), max_depth=DEFAULT_MAX_DEPTH,
+                 max_pages=DEFAULT_MAX_PAGES, max_workers=1):
+        '''
+        :param validation_cls: OgcTdsValidation or a subclass used to read
+        catalogues so that its transport and catalogue cache are used
+        :param service_types: service types of endpoints to yield
+        :param max_depth: maximum number of catalogRef links to follow from
+        the starting catalogue
+        :param max_pages: maximum number of catalogues to read
+        :param max_workers: number of catalogues to read concurrently
+        '''
+        self.validation_cls = validation_cls
+        self.service_types = tuple(service_type.upper()
+                                   for service_type in service_types)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_workers = max_workers
+        self.stats = Counter()
+
+    def read_page(self, catalog_uri):
+        '''Read a catalogue and return a list of endpoints and a list of the
+        URIs of the catalogues it references.  Return None if the catalogue
+        could not be read
+        '''
+        timer = metrics.RequestTimer()
+        try:
+            catalog_resp = self.validation_cls.open_catalog_stream(catalog_uri)
+        except OgcTdsCatalogParseError as e:
+            self.validation_cls.record_result(catalog_uri, results.CATALOG,
+                                              timer,
+                                              status_code=e.status_code,
+                                              error=e.error)
+            return None
+
+        timer.received()
+
+        try:
+            index = CatalogIndex.read(catalog_resp.raw)
+            timer.parsed()
+
+        except (ET.ParseError,) + TRANSPORT_ERRORS as e:
+            log.error("Error parsing catalogue {!r}: {}".format(catalog_uri,
+                                                                e))
+            error = (results.PARSE_ERROR if isinstance(e, ET.ParseError)
+                     else type(e).__name__)
+            self.validation_cls.record_result(
+                        catalog_uri, results.CATALOG, timer,
+                        status_code=catalog_resp.status_code,
+                        n_bytes=self.validation_cls.get_n_bytes_read(
+                                                                catalog_resp),
+                        error=error)
+            return None
+
+        else:
+            self.validation_cls.record_result(
+                        catalog_uri, results.CATALOG, timer,
+                        status_code=catalog_resp.status_code,
+                        n_bytes=self.validation_cls.get_n_bytes_read(
+                                                                catalog_resp))
+        finally:
+            catalog_resp.close()
+
+        endpoints = [CatalogEndpoint(
+                            catalog_uri, service_type,
+                            urljoin(catalog_uri,
+                                    endpoint.base + endpoint.url_path))
+                     for service_type in self.service_types
+                     for endpoint in index.get_endpoints(service_type)
+                     if endpoint.base is not None]
+        catalog_ref_uris = [urljoin(catalog_uri, href)
+                            for href in index.catalog_ref_hrefs]
+        return endpoints, catalog_ref_uris
+
+    def crawl(self, uri):
+        '''Crawl catalogues starting from the given URI and yield a
+        CatalogEndpoint for each distinct endpoint found
+        '''
+        self.stats = Counter()
+        visited = {uri}
+        frontier = deque([(uri, 0)])
+        endpoint_uris = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_progress = {}
+            while frontier or in_progress:
+                while frontier and len(in_progress) < self.max_workers:
+                    catalog_uri, depth = frontier.popleft()
+                    future = executor.submit(self.read_page, catalog_uri)
+                    in_progress[future] = (catalog_uri, depth)
+
+                done, _ = wait(in_progress, return_when=FIRST_COMPLETED)
+                for future in done:
+                    catalog_uri, depth = in_progress.pop(future)
+                    self.stats['catalog_refs_tested'] += 1
+
+                    page = future.result()
+                    if page is None:
+                        continue
+
+                    self.stats['catalog_refs_ok'] += 1
+                    endpoints, catalog_ref_uris = page
+
+                    if depth < self.max_depth:
+                        for catalog_ref_uri in catalog_ref_uris:
+                            if catalog_ref_uri in visited:
+                                continue
+
+                            if len(visited) >= self.max_pages:
+                                self.stats['catalog_refs_skipped'] += 1
+                                continue
+
+                            visited.add(catalog_ref_uri)
+                            frontier.append((catalog_ref_uri, depth + 1))
+
+                    for endpoint in endpoints:
+                        if endpoint.uri not in endpoint_uris:
+                            endpoint_uris.add(endpoint.uri)
+                            yield endpoint
+
+        if self.stats['catalog_refs_skipped'] > 0:
+            log.warning('%d catalogues not read: limit of %d catalogues '
+                        'reached', self.stats['catalog_refs_skipped'],
+                        self.max_pages)
+
+    def check(self, uri, max_workers=1, max_workers_per_host=None):
+        '''Crawl catalogues from the given URI and test each endpoint as it
+        is found.  Catalogue counts in the summary are for all the catalogues
+        read by the crawler
+
+        :return: collections.Counter of test counts
+        '''
+        stats = self.validation_cls.check_endpoints(
+                                    self.crawl(uri),
+                                    max_workers=max_workers,
+                                    max_workers_per_host=max_workers_per_host)
+
+        for name in ('catalog_refs_tested', 'catalog_refs_ok'):
+            stats[name] = self.stats[name]
+
+        self.validation_cls.log_summary(stats)
+        return stats
@@ -0,0 +1,338 @@
+"""Resident daemon answering Nagios check requests over a UNIX socket
+
+The WMS and WCS checks run in a long-lived process which keeps its HTTP
+connection pools, resolved catalogues and the latest result of each check.
+The Nagios scripts ask the daemon for a result through
+nagios_test.client, so that a check costs a round trip on a local socket
+rather than a new interpreter reading the catalogue afresh.
+
+Each request is a line of JSON naming the check, optionally with the
+maximum age in seconds of a result acceptable, and is answered with a line
+of JSON giving the Nagios exit status and output line:
+
+{"check": "wms", "max_age": 300}
+{"status": 0, "output": "CCI_WMS_TEST OK - 12 tests passed", ...}
+
+Requests never wait for a check.  A result younger than the maximum age is
+returned as it is.  Otherwise the check is started in the background, unless
+it is already being made, and the latest result is returned marked as stale,
+or an UNKNOWN status if the check has not completed yet.  Checks can also be
+refreshed on a schedule so that results are always recent.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import unittest
+from collections import namedtuple
+from socketserver import ThreadingMixIn, StreamRequestHandler, UnixStreamServer
+
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.deadline import Deadline
+from ceda.tds_ogc_scan.nagios_test import settings
+from ceda.tds_ogc_scan.nagios_test.client import (SOCKET_ENV_NAME,
+                                                  MAX_RESPONSE_SIZE)
+from ceda.tds_ogc_scan.test.test_wms import tds_wms_testcase_factory
+from ceda.tds_ogc_scan.test.test_wcs import tds_wcs_testcase_factory
+
+log = logging.getLogger(__name__)
+
+# Nagios exit statuses
+NAGIOS_OK = 0
+NAGIOS_CRITICAL = 2
+NAGIOS_UNKNOWN = 3
+NAGIOS_STATUS_NAMES = {
+    NAGIOS_OK: 'OK',
+    NAGIOS_CRITICAL: 'CRITICAL',
+    NAGIOS_UNKNOWN: 'UNKNOWN'
+}
+
+# Nagios check name and unittest case class factory for each check
+NagiosCheck = namedtuple('NagiosCheck', ('check_name', 'testcase_factory'))
+CHECKS = {
+    'wms': NagiosCheck('CCI_WMS_TEST', tds_wms_testcase_factory),
+    'wcs': NagiosCheck('CCI_WCS_TEST', tds_wcs_testcase_factory)
+}
+
+# Result of a check.  checked is the time it completed in seconds since the
+# epoch and elapsed the time in seconds it took, both None if no check has
+# completed
+CheckResult = namedtuple('CheckResult', ('status', 'output', 'checked',
+                                         'elapsed'))
+
+
+class CheckRunner:
+    '''Make a Nagios check in process and keep its latest result.  Checks
+    made by runners sharing a run_lock are made one at a time since they
+    share the deadline set on OgcTdsValidation.  A runner makes one check at
+    a time
+    '''
+    MAX_FAILURES_LISTED = 5
+
+    def __init__(self, check, catalog_uri, max_workers=1, deadline=None,
+                 run_lock=None):
+        '''
+        :param check: NagiosCheck
+        :param catalog_uri: THREDDS catalogue to check
+        :param max_workers: number of catalogue entries to test concurrently
+        :param deadline: time in seconds allowed for each check.  None for
+        no limit
+        :param run_lock: lock held while a check is made
+        '''
+        self.check = check
+        self.catalog_uri = catalog_uri
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.result = None
+
+        self._lock = threading.Lock()
+        self._run_lock = run_lock or threading.Lock()
+
+    def get_result(self, max_age):
+        '''Get the latest result without waiting for a check.  If it is older
+        than max_age seconds, the check is started in the background and the
+        result is returned with its output marked as stale.  If no check has
+        completed yet, a result with UNKNOWN status is returned'''
+        result = self.result
+        if result is not None and time.time() - result.checked <= max_age:
+            return result
+
+        self.start()
+        if result is None:
+            return CheckResult(NAGIOS_UNKNOWN,
+                               '{} {} - check in progress'.format(
+                                    self.check.check_name,
+                                    NAGIOS_STATUS_NAMES[NAGIOS_UNKNOWN]),
+                               None, None)
+
+        return result._replace(
+                    output='{} (stale: checked {:.0f} s ago, check in '
+                           'progress)'.format(result.output,
+                                              time.time() - result.checked))
+
+    def start(self):
+        '''Start the check in a background thread unless it is already being
+        made'''
+        if not self._lock.acquire(blocking=False):
+            return
+
+        def _run():
+            try:
+                self._run()
+            finally:
+                self._lock.release()
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def run(self):
+        '''Make the check, once any already being made has completed, and
+        keep its result'''
+        with self._lock:
+            return self._run()
+
+    def _run(self):
+        with self._run_lock:
+            start_time = time.perf_counter()
+            if self.deadline is not None:
+                OgcTdsValidation.scan_deadline = Deadline(self.deadline)
+
+            try:
+                testcase_cls = self.check.testcase_factory(
+                                                self.catalog_uri,
+                                                max_workers=self.max_workers)
+                test_result = unittest.TestResult()
+                unittest.defaultTestLoader.loadTestsFromTestCase(
+                                                testcase_cls).run(test_result)
+                status, message = self._summarise(test_result)
+
+            except Exception as e:
+                log.exception('%s failed', self.check.check_name)
+                status, message = NAGIOS_UNKNOWN, 'Check failed: {}'.format(e)
+
+            finally:
+                OgcTdsValidation.scan_deadline = None
+
+        self.result = CheckResult(
+                        status,
+                        '{} {} - {}'.format(self.check.check_name,
+                                            NAGIOS_STATUS_NAMES[status],
+                                            message),
+                        time.time(), time.perf_counter() - start_time)
+        log.info(self.result.output)
+        return self.result
+
+    @classmethod
+    def _summarise(cls, test_result):
+        '''Get the Nagios status and a message for a unittest.TestResult'''
+        failures = test_result.failures + test_result.errors
+        n_skipped = len(test_result.skipped)
+        if not failures:
+            message = '{} tests passed'.format(test_result.testsRun -
+                                                n_skipped)
+            if n_skipped:
+                message += ', {} skipped'.format(n_skipped)
+
+            return NAGIOS_OK, message
+
+        failure_messages = []
+        for test, traceback_text in failures[:cls.MAX_FAILURES_LISTED]:
+            lines = traceback_text.strip().splitlines()
+            failure_messages.append('{}: {}'.format(
+                                        test.id().rsplit('.', 1)[-1],
+                                        lines[-1] if lines else ''))
+
+        message = '{} of {} tests failed: {}'.format(
+                                        len(failures), test_result.testsRun,
+                                        '; '.join(failure_messages))
+        return NAGIOS_CRITICAL, message
+
+
+class CheckRequestHandler(StreamRequestHandler):
+    '''Answer a request for the result of a check with a line of JSON'''
+    def handle(self):
+        line = self.rfile.readline(MAX_RESPONSE_SIZE)
+        try:
+            request = json.loads(line.decode('utf-8'))
+            runner = self.server.runners[request['check']]
+            max_age = float(request.get('max_age', self.server.max_age))
+
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            response = {'status': NAGIOS_UNKNOWN,
+                        'output': 'Invalid check request: {!r}'.format(e)}
+        else:
+            response = runner.get_result(max_age)._asdict()
+
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class CheckDaemon(ThreadingMixIn, UnixStreamServer):
+    '''Serve check results on a UNIX socket'''
+    daemon_threads = True
+    DEFAULT_MAX_AGE = 60.
+
+    def __init__(self, socket_path, runners, max_age=DEFAULT_MAX_AGE):
+        '''
+        :param socket_path: path of the socket to listen on.  A socket left
+        by a daemon which is no longer running is replaced
+        :param runners: dictionary of CheckRunner keyed by check name
+        :param max_age: age in seconds after which a result is stale and the
+        check made again if a request doesn't give one
+        '''
+        self._remove_stale_socket(socket_path)
+        super().__init__(socket_path, CheckRequestHandler)
+        self.runners = runners
+        self.max_age = max_age
+
+    @staticmethod
+    def _remove_stale_socket(socket_path):
+        if not os.path.exists(socket_path):
+            return
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)
+        else:
+            raise OSError('A check daemon is already listening on '
+                          '{}'.format(socket_path))
+        finally:
+            sock.close()
+
+    def refresh(self, interval, stop_event):
+        '''Make each check every interval seconds until stop_event is set'''
+        while not stop_event.is_set():
+            next_refresh_time = time.monotonic() + interval
+            for runner in self.runners.values():
+                if stop_event.is_set():
+                    return
+
+                runner.run()
+
+            stop_event.wait(max(0., next_refresh_time - time.monotonic()))
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def _make_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description='Make the Nagios WMS and WCS checks in a resident '
+                    'process and answer requests for their results on a '
+                    'UNIX socket.  The catalogue, caches and time limits '
+                    'are set with the same environment variables as the '
+                    'Nagios scripts')
+
+    parser.add_argument('--socket', default=os.getenv(SOCKET_ENV_NAME),
+                        help='path of the socket to listen on (default: '
+                             '${})'.format(SOCKET_ENV_NAME))
+    parser.add_argument('--checks', nargs='+', default=sorted(CHECKS),
+                        choices=sorted(CHECKS),
+                        help='checks to answer requests for (default: '
+                             '%(default)s)')
+    parser.add_argument('--max-age', type=float,
+                        default=CheckDaemon.DEFAULT_MAX_AGE,
+                        help='age in seconds after which a result is '
+                             'stale and the check is made again, for a '
+                             'request which doesn\'t give one (default: '
+                             '%(default)s)')
+    parser.add_argument('--refresh-interval', type=float, default=None,
+                        help='make each check every this number of seconds '
+                             'so that requests are answered from a recent '
+                             'result (default: check only when a request '
+                             'finds no recent result)')
+    return parser
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = _make_arg_parser()
+    args = parser.parse_args()
+    if args.socket is None:
+        parser.error('--socket or ${} is required'.format(SOCKET_ENV_NAME))
+
+    settings.configure_validation()
+
+    run_lock = threading.Lock()
+    runners = {
+        check: CheckRunner(CHECKS[check], settings.get_catalog_uri(),
+                           max_workers=settings.get_max_workers(),
+                           deadline=settings.get_deadline(),
+                           run_lock=run_lock)
+        for check in args.checks
+    }
+    server = CheckDaemon(args.socket, runners, max_age=args.max_age)
+    log.info('Answering %s checks on %s', ', '.join(args.checks),
+             args.socket)
+
+    stop_event = threading.Event()
+    if args.refresh_interval is not None:
+        refresh_thread = threading.Thread(
+                                    target=server.refresh,
+                                    args=(args.refresh_interval, stop_event),
+                                    daemon=True)
+        refresh_thread.start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""Deadlines for scans and time limits for requests
+
+A Deadline is set for a whole scan and, optionally, for each request from
+the time it is made.  DeadlineTransport wraps the transport used for
+requests so that the connect and read timeouts of each request are cut to
+the time left before the deadline and its response body is read through a
+stream which stops once the time is up.  The time limits are passed on to
+the wrapped transport so that retries are only made in the time left.  A
+request which runs out of time on its own limit fails with ResponseTimeout
+and is recorded as a failed check.  One which runs out of time on the scan
+deadline raises DeadlineExceeded, which is not a transport error, so that
+the check it belongs to is abandoned rather than failed.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import time
+
+import requests
+
+from ceda.tds_ogc_scan.transport import TRANSPORT_ERRORS
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the deadline of a scan has passed"""
+
+
+class ResponseTimeout(requests.exceptions.Timeout):
+    """Response not received and read within the time limit for a
+    request"""
+
+
+class Deadline:
+    '''Point in time a number of seconds from when the deadline is made'''
+    def __init__(self, timeout, clock=time.monotonic):
+        '''
+        :param timeout: time in seconds from now
+        :param clock: function returning the current time in seconds
+        '''
+        self.timeout = timeout
+        self._clock = clock
+        self.end_time = clock() + timeout
+
+    def remaining(self):
+        '''Get the time left in seconds.  Zero once the deadline has
+        passed'''
+        return max(self.end_time - self._clock(), 0.)
+
+    def expired(self):
+        return self._clock() >= self.end_time
+
+    def check(self):
+        '''Raise DeadlineExceeded if the deadline has passed'''
+        if self.expired():
+            raise DeadlineExceeded('Deadline of {} s exceeded'.format(
+                                   self.timeout))
+
+    def limit(self, timeout):
+        '''Cut a timeout in seconds to the time left.  A timeout of None,
+        meaning no limit, becomes the time left'''
+        remaining = self.remaining()
+        if timeout is None:
+            return remaining
+
+        return min(timeout, remaining)
+
+
+class TimeLimits:
+    '''Scan deadline and time limit of a single request'''
+    def __init__(self, deadline=None, request_deadline=None):
+        self.deadline = deadline
+        self.request_deadline = request_deadline
+
+    def check(self):
+        '''Raise DeadlineExceeded or ResponseTimeout if either time is up'''
+        if self.deadline is not None:
+            self.deadline.check()
+
+        if (self.request_deadline is not None and
+            self.request_deadline.expired()):
+            raise ResponseTimeout('Response not read within {} s'.format(
+                                  self.request_deadline.timeout))
+
+    def remaining(self):
+        '''Get the time left in seconds before either time is up, or None
+        if neither is set'''
+        remaining = [deadline.remaining()
+                     for deadline in (self.deadline, self.request_deadline)
+                     if deadline is not None]
+        return min(remaining) if remaining else None
+
+    def limit(self, timeout):
+        for deadline in (self.deadline, self.request_deadline):
+            if deadline is not None:
+                timeout = deadline.limit(timeout)
+
+        return timeout
+
+    def limit_timeout(self, timeout):
+        '''Cut a requests timeout, in seconds or a tuple of connect and read
+        timeouts, to (connect timeout, read timeout) within the time left'''
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+        else:
+            connect_timeout = read_timeout = timeout
+
+        return self.limit(connect_timeout), self.limit(read_timeout)
+
+    def call(self, func, *args, **kwargs):
+        '''Call func once the times have been checked.  A transport error
+        raised once the scan deadline has passed is raised as
+        DeadlineExceeded'''
+        self.check()
+        try:
+            return func(*args, **kwargs)
+
+        except TRANSPORT_ERRORS as e:
+            if self.deadline is not None and self.deadline.expired():
+                raise DeadlineExceeded('Deadline of {} s exceeded: '
+                                       '{}'.format(self.deadline.timeout,
+                                                   e)) from e
+            raise
+
+
+class TimeLimitedStream:
+    '''Wrap the raw stream of a response so that reads fail once the scan
+    deadline or the time limit of the request has passed.  Other attributes
+    are those of the wrapped stream
+    '''
+    def __init__(self, raw, time_limits):
+        self.raw = raw
+        self._time_limits = time_limits
+
+    @property
+    def decode_content(self):
+        return self.raw.decode_content
+
+    @decode_content.setter
+    def decode_content(self, decode_content):
+        self.raw.decode_content = decode_content
+
+    def read(self, *args, **kwargs):
+        return self._time_limits.call(self.raw.read, *args, **kwargs)
+
+    def read1(self, *args, **kwargs):
+        return self._time_limits.call(self.raw.read1, *args, **kwargs)
+
+    def readinto(self, *args, **kwargs):
+        return self._time_limits.call(self.raw.readinto, *args, **kwargs)
+
+    def stream(self, amt=65536, decode_content=None):
+        '''Yield chunks of the body as urllib3.HTTPResponse.stream does,
+        checking the time before each'''
+        if hasattr(self.raw, 'stream'):
+            chunks = self.raw.stream(amt, decode_content=decode_content)
+            read_chunk = lambda: next(chunks, None)
+        else:
+            read_chunk = lambda: self.raw.read(amt) or None
+
+        while True:
+            chunk = self._time_limits.call(read_chunk)
+            if chunk is None:
+                return
+
+            yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class DeadlineTransport:
+    '''Wrap a transport such as HttpTransport so that requests are bounded
+    by a scan deadline and a time limit for each request, including the
+    time to read the response body.  Bodies are read through a
+    TimeLimitedStream: requests not made with stream=True have their
+    content read before they are returned.  The TimeLimits of each request
+    are passed to the wrapped transport as the time_limits keyword, which
+    HttpTransport uses to cut its retries to the time left
+    '''
+    def __init__(self, transport, deadline=None, total_timeout=None):
+        '''
+        :param transport: transport to which requests are passed
+        :param deadline: Deadline of the scan.  None for no deadline
+        :param total_timeout: time in seconds allowed for each request from
+        when it is made until its response has been read.  None for no
+        limit
+        '''
+        self.transport = transport
+        self.deadline = deadline
+        self.total_timeout = total_timeout
+
+    @property
+    def timeout(self):
+        return getattr(self.transport, 'timeout', None)
+
+    def get_timeout(self, time_limits, timeout=None):
+        '''Get (connect timeout, read timeout) cut to the time left.  Uses
+        the timeout of the wrapped transport if none is given'''
+        if timeout is None:
+            timeout = self.timeout
+
+        return time_limits.limit_timeout(timeout)
+
+    def get(self, uri, **kwargs):
+        '''Make a HTTP GET request through the wrapped transport.  Keywords
+        are passed to its get method
+
+        :raises DeadlineExceeded: if the scan deadline passes before the
+        response has been read
+        :raises ResponseTimeout: if the time limit for the request passes
+        first
+        '''
+        request_deadline = None
+        if self.total_timeout is not None:
+            request_deadline = Deadline(self.total_timeout)
+
+        time_limits = TimeLimits(self.deadline, request_deadline)
+        kwargs['timeout'] = self.get_timeout(time_limits,
+                                             kwargs.get('timeout'))
+        kwargs['time_limits'] = time_limits
+        stream = kwargs.get('stream', False)
+        kwargs['stream'] = True
+
+        resp = time_limits.call(self.transport.get, uri, **kwargs)
+        resp.raw = TimeLimitedStream(resp.raw, time_limits)
+        if not stream:
+            try:
+                resp.content
+            except BaseException:
+                resp.close()
+                raise
+
+        return resp
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,306 @@
+"""Sampling of the catalogue entries tested in a scan
+
+EntrySampler chooses a random sample of entries with reservoir sampling as
+the catalogue references are read, so that the catalogue is never held in
+memory.  Given a seed, the same catalogue gives the same sample.
+
+RotatingEntrySampler persists the outcome of checking each entry between
+runs so that every entry is tested at least once every n_runs runs.  Each
+entry is due in one of every n_runs runs, chosen by a hash of its URI, and
+entries missed in their run are due again in the next.  Entries due are
+tested as soon as they are read.  The rest of the sample is chosen at
+random with more weight given to entries which failed or were slow the
+last time they were tested.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import math
+import time
+import heapq
+import random
+import sqlite3
+import hashlib
+import logging
+import itertools
+import threading
+
+from ceda.tds_ogc_scan.results import stats_ok
+
+log = logging.getLogger(__name__)
+
+
+def _random_open(rng):
+    '''Get a random number in the open interval (0, 1)'''
+    while True:
+        value = rng.random()
+        if value > 0.:
+            return value
+
+
+def reservoir_sample(items, n, rng=random):
+    '''Choose n items at random from an iterable of unknown length, reading
+    it once and holding no more than n items.  All items are returned if
+    there are n or fewer.  Uses Li's Algorithm L, which skips over runs of
+    items not chosen
+
+    :param rng: random.Random or the random module
+    :return: list of the items chosen
+    '''
+    if n <= 0:
+        return []
+
+    items = iter(items)
+    reservoir = list(itertools.islice(items, n))
+    if len(reservoir) < n:
+        return reservoir
+
+    weight = math.exp(math.log(_random_open(rng)) / n)
+    while True:
+        n_skipped = int(math.log(_random_open(rng)) / math.log(1. - weight))
+        item = next(itertools.islice(items, n_skipped, None), None)
+        if item is None:
+            return reservoir
+
+        reservoir[rng.randrange(n)] = item
+        weight *= math.exp(math.log(_random_open(rng)) / n)
+
+
+def get_rotation_slot(uri, n_runs):
+    '''Get the run, numbered from 0 to n_runs - 1, in each cycle of n_runs
+    runs in which an entry is due.  The hash is salted so that slots are
+    independent of sharding.get_shard_number'''
+    digest = hashlib.sha1('rotation:{}'.format(uri).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % n_runs
+
+
+class EntrySampler:
+    '''Choose a random sample of catalogue entries with reservoir sampling
+    '''
+    def __init__(self, seed=None):
+        '''
+        :param seed: seed for the random choice so that a run can be
+        reproduced.  The first sample from the same catalogue is then always
+        the same
+        '''
+        self.seed = seed
+        self._random = random.Random(seed)
+
+    def sample(self, catalog_ref_uris, n):
+        '''Yield n catalogue reference URIs chosen at random from an
+        iterable, or all of them if there are fewer.  The catalogue
+        references are read to the end before the first is yielded
+        '''
+        catalog_ref_uris = reservoir_sample(catalog_ref_uris, n,
+                                            rng=self._random)
+        log.info("%d randomly selected elements chosen for testing",
+                 len(catalog_ref_uris))
+        yield from catalog_ref_uris
+
+    def entry_checked(self, catalog_ref_uri, stats, elapsed=None):
+        '''Record the outcome of checking a catalogue entry
+
+        :param stats: collections.Counter of test counts for the entry
+        :param elapsed: time in seconds spent checking the entry
+        '''
+
+    def close(self):
+        pass
+
+
+class RotatingEntrySampler(EntrySampler):
+    '''Choose catalogue entries so that each is tested at least once every
+    n_runs runs, adding a sample weighted towards failing and slow entries.
+    The outcome of checking each entry and the number of runs are stored in
+    a SQLite database
+    '''
+    DEFAULT_N_RUNS = 7
+    DEFAULT_FAILURE_WEIGHT = 4.
+    DEFAULT_SLOW_WEIGHT = 1.
+
+    # Number of catalogue references read between writes of those not seen
+    # before
+    SEEN_BATCH_SIZE = 1000
+
+    def __init__(self, filepath, n_runs=DEFAULT_N_RUNS,
+                 failure_weight=DEFAULT_FAILURE_WEIGHT,
+                 slow_weight=DEFAULT_SLOW_WEIGHT, seed=None):
+        '''
+        :param filepath: path to the database.  It is created if it doesn't
+        already exist
+        :param n_runs: number of runs in which every entry is tested
+        :param failure_weight: weight added for an entry which failed the
+        last time it was tested.  Other entries have a weight of one
+        :param slow_weight: weight added for each multiple of the mean time
+        to check an entry by which an entry was slower than the mean
+        :param seed: seed for the random choice of entries not due
+        '''
+        super().__init__(seed=seed)
+
+        dirpath = os.path.dirname(filepath)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+        self.filepath = filepath
+        self.n_runs = n_runs
+        self.failure_weight = failure_weight
+        self.slow_weight = slow_weight
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filepath, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entry_schedule ('
+                'uri TEXT PRIMARY KEY, '
+                'last_run INTEGER NOT NULL, '
+                'ok INTEGER NOT NULL, '
+                'elapsed REAL, '
+                'checked REAL NOT NULL)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entry_seen ('
+                'uri TEXT PRIMARY KEY, '
+                'first_run INTEGER NOT NULL)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS sampler_run ('
+                'id INTEGER PRIMARY KEY CHECK (id = 0), '
+                'run INTEGER NOT NULL)')
+            self._db.execute(
+                'INSERT OR IGNORE INTO sampler_run (id, run) VALUES (0, 0)')
+
+        self.run = self._get_run()
+
+        # Set once a run has been started by sample.  Outcomes of checks
+        # made without sampling are not recorded
+        self._sampled_run = None
+
+    def is_due(self, uri, run):
+        '''Return True if an entry is due to be tested in a run by rotation
+        alone'''
+        return get_rotation_slot(uri, self.n_runs) == run % self.n_runs
+
+    def _get_run(self):
+        return self._db.execute('SELECT run FROM sampler_run '
+                                'WHERE id = 0').fetchone()[0]
+
+    def _start_run(self):
+        with self._lock, self._db:
+            self._db.execute('UPDATE sampler_run SET run = run + 1 '
+                             'WHERE id = 0')
+            self.run = self._get_run()
+            self._sampled_run = self.run
+            return self.run
+
+    def _record_seen(self, uris, run):
+        '''Record the run in which entries were first read'''
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO entry_seen (uri, first_run) '
+                'VALUES (?, ?)', [(uri, run) for uri in uris])
+
+    def get_overdue_uris(self, run):
+        '''Get the set of URIs of entries not tested in the last n_runs runs
+        before the given run, including those never tested which were first
+        read at least n_runs runs before'''
+        last_run = run - self.n_runs
+        with self._lock:
+            return {uri for (uri,) in self._db.execute(
+                            'SELECT uri FROM entry_schedule '
+                            'WHERE last_run <= ? '
+                            'UNION '
+                            'SELECT uri FROM entry_seen '
+                            'WHERE first_run <= ? AND uri NOT IN '
+                            '(SELECT uri FROM entry_schedule)',
+                            (last_run, last_run))}
+
+    def get_weights(self):
+        '''Get the weight of each entry which failed or was slower than the
+        mean the last time it was tested
+
+        :return: dictionary of weights keyed by URI.  Other entries have a
+        weight of one
+        '''
+        with self._lock:
+            mean_elapsed = self._db.execute(
+                    'SELECT AVG(elapsed) FROM entry_schedule').fetchone()[0]
+            rows = self._db.execute(
+                        'SELECT uri, ok, elapsed FROM entry_schedule '
+                        'WHERE ok = 0 OR elapsed > ?',
+                        (mean_elapsed or 0.,)).fetchall()
+
+        weights = {}
+        for uri, ok, elapsed in rows:
+            weight = 1.
+            if not ok:
+                weight += self.failure_weight
+
+            if mean_elapsed and elapsed is not None:
+                weight += self.slow_weight * max(elapsed / mean_elapsed - 1.,
+                                                 0.)
+            weights[uri] = weight
+
+        return weights
+
+    def sample(self, catalog_ref_uris, n):
+        '''Yield the catalogue reference URIs due in this run as they are
+        read, followed by a weighted random sample of the others to make up
+        n in total.  More than n are yielded if more are due
+        '''
+        run = self._start_run()
+        overdue_uris = self.get_overdue_uris(run)
+        weights = self.get_weights()
+
+        # Keep the n highest keys u ** (1 / weight) of the entries not due,
+        # with u uniform on (0, 1), as in the weighted reservoir sampling of
+        # Efraimidis and Spirakis
+        reservoir = []
+        n_due = 0
+        n_read = 0
+        read_uris = []
+        for catalog_ref_uri in catalog_ref_uris:
+            n_read += 1
+            read_uris.append(catalog_ref_uri)
+            if len(read_uris) >= self.SEEN_BATCH_SIZE:
+                self._record_seen(read_uris, run)
+                read_uris = []
+
+            if (catalog_ref_uri in overdue_uris or
+                self.is_due(catalog_ref_uri, run)):
+                n_due += 1
+                yield catalog_ref_uri
+                continue
+
+            key = _random_open(self._random) ** (
+                                    1. / weights.get(catalog_ref_uri, 1.))
+            if len(reservoir) < n:
+                heapq.heappush(reservoir, (key, n_read, catalog_ref_uri))
+            elif reservoir and key > reservoir[0][0]:
+                heapq.heapreplace(reservoir, (key, n_read, catalog_ref_uri))
+
+        self._record_seen(read_uris, run)
+
+        n_sampled = max(n - n_due, 0)
+        log.info("Run %d: %d of %d catalogue entries due for testing and %d "
+                 "chosen at random", run, n_due, n_read,
+                 min(n_sampled, len(reservoir)))
+        for _, _, catalog_ref_uri in heapq.nlargest(n_sampled, reservoir):
+            yield catalog_ref_uri
+
+    def entry_checked(self, catalog_ref_uri, stats, elapsed=None):
+        '''Record the outcome of checking a catalogue entry in the current
+        run.  Ignored if no run has been sampled'''
+        if self._sampled_run is None:
+            return
+
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entry_schedule '
+                '(uri, last_run, ok, elapsed, checked) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (catalog_ref_uri, self._sampled_run, int(stats_ok(stats)),
+                 elapsed, time.time()))
+
+    def close(self):
+        self._db.close()
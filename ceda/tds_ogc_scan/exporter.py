@@ -0,0 +1,290 @@
+"""Prometheus exporter for continuous monitoring of THREDDS OGC endpoints
+
+A THREDDS catalogue is scanned on a schedule and the results exposed in the
+Prometheus text format over HTTP.  Scrapes are served from the exposition
+rendered at the end of the latest scan and never trigger a scan themselves.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from ceda.tds_ogc_scan.validation import (OgcTdsValidation,
+                                          OgcTdsValidationError)
+from ceda.tds_ogc_scan.transport import TRANSPORT_ERRORS
+from ceda.tds_ogc_scan.results import stats_ok, HOST_UNHEALTHY_ERROR
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape_label_value(value):
+    return (str(value).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def _format_labels(**labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join(['{}="{}"'.format(name, _escape_label_value(value))
+                           for name, value in sorted(labels.items())]) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+class PrometheusScanMetrics:
+    '''Result sink accumulating request counts and latency histograms across
+    scans, with gauges for the outcome of the latest scan
+    '''
+    PREFIX = 'tds_ogc_scan'
+
+    # Upper bounds in seconds of the request duration histogram buckets
+    DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.,
+                        float('inf'))
+
+    def __init__(self):
+        self.n_requests = Counter()
+        self.duration_counts = defaultdict(
+                                    lambda: [0] * len(self.DURATION_BUCKETS))
+        self.duration_sum = Counter()
+
+        self.n_scans = Counter()
+        self.last_scan_duration = None
+        self.last_scan_timestamp = None
+        self.last_scan_ok = None
+        self.catalog_entry_up = {}
+
+        self._lock = threading.Lock()
+        self._exposition = b''
+
+    def add(self, result):
+        with self._lock:
+            if result.ok:
+                outcome = 'ok'
+            elif result.error == HOST_UNHEALTHY_ERROR:
+                outcome = 'skipped'
+            else:
+                outcome = 'error'
+            self.n_requests[(result.operation, outcome)] += 1
+            self.duration_sum[result.operation] += result.elapsed
+
+            buckets = self.duration_counts[result.operation]
+            for i, upper_bound in enumerate(self.DURATION_BUCKETS):
+                if result.elapsed <= upper_bound:
+                    buckets[i] += 1
+                    break
+
+    def scan_completed(self, duration, ok, catalog_entry_up):
+        '''Record the outcome of a scan and publish the metrics
+
+        :param duration: time in seconds taken by the scan
+        :param ok: True if every check in the scan passed
+        :param catalog_entry_up: dictionary of True/False for each catalogue
+        entry checked.  Replaces the entries from the previous scan
+        '''
+        with self._lock:
+            self.n_scans['ok' if ok else 'error'] += 1
+            self.last_scan_duration = duration
+            self.last_scan_timestamp = time.time()
+            self.last_scan_ok = ok
+            self.catalog_entry_up = dict(catalog_entry_up)
+
+            self._exposition = self.render().encode('utf-8')
+
+    @property
+    def exposition(self):
+        '''Metrics in the Prometheus text format as of the latest scan.  Empty
+        until the first scan completes
+        '''
+        with self._lock:
+            return self._exposition
+
+    def render(self):
+        '''Render current metrics in the Prometheus text format.  Call with
+        the lock held
+        '''
+        lines = []
+
+        def add_metric(name, metric_type, help_text, samples):
+            name = self.PREFIX + '_' + name
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix,
+                                                _format_labels(**labels),
+                                                _format_value(value)))
+
+        add_metric('requests_total', 'counter',
+                   'Requests made by OGC operation and outcome',
+                   [('', {'operation': operation, 'outcome': outcome}, n)
+                    for (operation, outcome), n in
+                    sorted(self.n_requests.items())])
+
+        samples = []
+        for operation in sorted(self.duration_counts):
+            cumulative_count = 0
+            for upper_bound, count in zip(self.DURATION_BUCKETS,
+                                          self.duration_counts[operation]):
+                cumulative_count += count
+                samples.append(('_bucket',
+                                {'operation': operation,
+                                 'le': _format_value(upper_bound)},
+                                cumulative_count))
+
+            samples.append(('_sum', {'operation': operation},
+                            self.duration_sum[operation]))
+            samples.append(('_count', {'operation': operation},
+                            cumulative_count))
+
+        add_metric('request_duration_seconds', 'histogram',
+                   'Time taken by requests by OGC operation', samples)
+
+        add_metric('scans_total', 'counter', 'Scans completed by outcome',
+                   [('', {'outcome': outcome}, n)
+                    for outcome, n in sorted(self.n_scans.items())])
+
+        if self.last_scan_timestamp is not None:
+            add_metric('last_scan_duration_seconds', 'gauge',
+                       'Time taken by the latest scan',
+                       [('', {}, self.last_scan_duration)])
+            add_metric('last_scan_timestamp_seconds', 'gauge',
+                       'Time at which the latest scan completed',
+                       [('', {}, self.last_scan_timestamp)])
+            add_metric('last_scan_success', 'gauge',
+                       '1 if every check in the latest scan passed',
+                       [('', {}, int(self.last_scan_ok))])
+
+        add_metric('catalog_entry_up', 'gauge',
+                   '1 if every check for a catalogue entry passed in the '
+                   'latest scan',
+                   [('', {'entry': uri}, int(up))
+                    for uri, up in sorted(self.catalog_entry_up.items())])
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    '''Serve the latest metrics from the server's scan_metrics'''
+    METRICS_PATH = '/metrics'
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != self.METRICS_PATH:
+            self.send_error(404)
+            return
+
+        content = self.server.scan_metrics.exposition
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    '''HTTP server for Prometheus scrapes'''
+    daemon_threads = True
+
+    def __init__(self, address, scan_metrics):
+        super().__init__(address, MetricsRequestHandler)
+        self.scan_metrics = scan_metrics
+
+
+class OgcTdsExporter:
+    '''Scan a THREDDS catalogue on a schedule and serve the results as
+    Prometheus metrics
+    '''
+    DEFAULT_SCAN_INTERVAL = 300.
+    DEFAULT_ADDRESS = '127.0.0.1'
+
+    def __init__(self, uri, validation_cls=OgcTdsValidation,
+                 scan_interval=DEFAULT_SCAN_INTERVAL, **check_kwargs):
+        '''
+        :param uri: THREDDS catalogue to scan
+        :param validation_cls: OgcTdsValidation or a subclass.  Its
+        transport, cache, state and result sinks are used for each scan
+        :param scan_interval: time in seconds from the start of one scan to
+        the start of the next
+        :param check_kwargs: keywords for OgcTdsValidation.check
+        '''
+        self.uri = uri
+        self.scan_interval = scan_interval
+        self.check_kwargs = check_kwargs
+        self.scan_metrics = PrometheusScanMetrics()
+        self._catalog_entry_up = {}
+
+        exporter = self
+
+        class _OgcTdsValidation(validation_cls):
+            result_sinks = (tuple(validation_cls.result_sinks) +
+                            (self.scan_metrics,))
+
+            @classmethod
+            def catalog_ref_checked(cls, catalog_ref_uri, catalog_hash,
+                                    stats, elapsed=None):
+                super().catalog_ref_checked(catalog_ref_uri, catalog_hash,
+                                            stats, elapsed=elapsed)
+                exporter._catalog_entry_up[catalog_ref_uri] = stats_ok(stats)
+
+        self.validation_cls = _OgcTdsValidation
+
+    def scan(self):
+        '''Run a scan and publish the metrics
+
+        :return: True if every check passed
+        '''
+        self._catalog_entry_up = {}
+        start_time = time.perf_counter()
+        try:
+            stats = self.validation_cls.check(self.uri, **self.check_kwargs)
+            ok = stats_ok(stats)
+
+        except (OgcTdsValidationError,) + TRANSPORT_ERRORS:
+            log.exception("Scan of {!r} failed".format(self.uri))
+            ok = False
+
+        self.scan_metrics.scan_completed(time.perf_counter() - start_time, ok,
+                                         self._catalog_entry_up)
+        return ok
+
+    def run(self, stop_event):
+        '''Scan repeatedly until stop_event is set'''
+        while not stop_event.is_set():
+            next_scan_time = time.monotonic() + self.scan_interval
+            self.scan()
+            stop_event.wait(max(0., next_scan_time - time.monotonic()))
+
+    def serve(self, port, address=DEFAULT_ADDRESS):
+        '''Serve metrics on the given port and scan until interrupted'''
+        server = MetricsServer((address, port), self.scan_metrics)
+        server_thread = threading.Thread(target=server.serve_forever,
+                                         daemon=True)
+        server_thread.start()
+        log.info("Serving metrics on http://{}:{}{}".format(
+                 address, server.server_address[1],
+                 MetricsRequestHandler.METRICS_PATH))
+
+        stop_event = threading.Event()
+        try:
+            self.run(stop_event)
+        except KeyboardInterrupt:
+            stop_event.set()
+        finally:
+            server.shutdown()
+            server.server_close()
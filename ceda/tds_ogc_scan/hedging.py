@@ -0,0 +1,277 @@
+"""Hedged requests for cutting the tail latency of a scan
+
+A few slow responses from a THREDDS server can decide how long a whole scan
+takes.  HedgedTransport wraps the transport used by the validation so that a
+request still waiting for its response once a high percentile of the latency
+of its operation has passed is duplicated.  The first good response is used
+and the other is closed as soon as its headers arrive so that its body is
+not downloaded.  The latency percentiles are learned from the responses of
+the scan itself, kept separately for catalogues and each OGC operation, and
+the number of duplicate requests is capped to a fraction of all requests so
+that hedging adds little load.  Once hedging has started, requests are made
+on a bounded pool of threads owned by the transport.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import math
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from six.moves.urllib.parse import urlparse, parse_qsl
+
+log = logging.getLogger(__name__)
+
+# Operation of requests with no OGC request parameter
+CATALOG_OPERATION = 'catalog'
+
+
+def get_operation(uri):
+    '''Get the operation a request is for: the value of the OGC request
+    parameter, e.g. GetMap, or catalog'''
+    for name, value in parse_qsl(urlparse(uri).query):
+        if name.lower() == 'request':
+            return value
+
+    return CATALOG_OPERATION
+
+
+class LatencyEstimator:
+    '''Estimate a quantile of the latency of each operation from its most
+    recent requests'''
+    DEFAULT_WINDOW = 200
+    DEFAULT_MIN_SAMPLES = 20
+
+    def __init__(self, quantile, window=DEFAULT_WINDOW,
+                 min_samples=DEFAULT_MIN_SAMPLES):
+        '''
+        :param quantile: quantile to estimate, between 0 and 1
+        :param window: number of the most recent latencies of each operation
+        kept
+        :param min_samples: number of latencies needed before an estimate
+        is made
+        '''
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, operation, latency):
+        with self._lock:
+            self._latencies[operation].append(latency)
+
+    def estimate(self, operation):
+        '''Get the quantile of the latency of an operation in seconds or
+        None if too few requests have been made'''
+        with self._lock:
+            latencies = sorted(self._latencies.get(operation, ()))
+
+        if len(latencies) < max(self.min_samples, 1):
+            return None
+
+        i = int(math.ceil(self.quantile * len(latencies))) - 1
+        return latencies[min(max(i, 0), len(latencies) - 1)]
+
+
+class HedgedTransport:
+    '''Wrap a transport such as HostControlledTransport so that a request
+    not answered within the estimated quantile of the latency of its
+    operation is duplicated.  The latency recorded is the time until the
+    response headers are received.  A response with a 5xx status or a
+    transport error only wins if the other request fails too.  Requests
+    are made on a pool of threads so that the caller can stop waiting on
+    the slower one.  Close the transport to shut the pool down
+    '''
+    DEFAULT_QUANTILE = 0.95
+    DEFAULT_MAX_HEDGE_RATIO = 0.05
+    DEFAULT_MAX_WORKERS = 20
+
+    def __init__(self, transport, quantile=DEFAULT_QUANTILE,
+                 max_hedge_ratio=DEFAULT_MAX_HEDGE_RATIO,
+                 latency_estimator=None, max_workers=DEFAULT_MAX_WORKERS):
+        '''
+        :param transport: transport to which requests are passed
+        :param quantile: quantile of the latency of an operation after
+        which a request is duplicated
+        :param max_hedge_ratio: maximum number of duplicate requests as a
+        fraction of all requests made
+        :param latency_estimator: LatencyEstimator to use in place of one
+        created for quantile, e.g. to set the number of requests needed
+        before hedging starts
+        :param max_workers: number of threads making requests and their
+        duplicates.  Set to at least twice the number of requests made
+        at once so that requests don't queue for a thread
+        '''
+        self.transport = transport
+        self.max_hedge_ratio = max_hedge_ratio
+        self.latency_estimator = (latency_estimator or
+                                  LatencyEstimator(quantile))
+
+        self.n_requests = 0
+        self.n_hedged = 0
+        self.n_hedges_won = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @property
+    def timeout(self):
+        return getattr(self.transport, 'timeout', None)
+
+    def get(self, uri, **kwargs):
+        '''Make a HTTP GET request through the wrapped transport, duplicating
+        it if it is slow to be answered.  Keywords are passed to its get
+        method
+        '''
+        operation = get_operation(uri)
+        hedge_delay = self.latency_estimator.estimate(operation)
+        with self._lock:
+            self.n_requests += 1
+
+        # Bodies are read once the response headers have been timed, and
+        # once the winner is known so that the loser can be closed without
+        # downloading its body
+        stream = kwargs.get('stream', False)
+        kwargs['stream'] = True
+
+        if hedge_delay is None:
+            start_time = time.perf_counter()
+            resp = self.transport.get(uri, **kwargs)
+            elapsed = time.perf_counter() - start_time
+        else:
+            # Stop waiting on a request which outlasts its own timeouts so
+            # that a stuck request can't hold up the caller
+            wait_timeout = self._get_wait_timeout(kwargs.get('timeout',
+                                                             self.timeout))
+            end_time = (None if wait_timeout is None else
+                        time.monotonic() + wait_timeout)
+            attempt = self._start(uri, kwargs)
+            if not wait((attempt,), timeout=hedge_delay).done:
+                if self._allow_hedge():
+                    log.debug('Hedging %s request not answered after %.3f '
+                              's: %s', operation, hedge_delay, uri)
+                    hedge = self._start(uri, kwargs)
+                    attempt = self._wait_first_ok(attempt, hedge, end_time)
+                    if attempt is hedge:
+                        with self._lock:
+                            self.n_hedges_won += 1
+
+            if not wait((attempt,), timeout=self._remaining(end_time)).done:
+                # A response arriving later is closed
+                attempt.add_done_callback(self._close)
+                raise requests.Timeout('No response within {} s: '
+                                       '{}'.format(wait_timeout, uri))
+
+            resp, elapsed = attempt.result()
+
+        self._record(operation, resp, elapsed)
+        if not stream:
+            try:
+                resp.content
+            except BaseException:
+                resp.close()
+                raise
+
+        return resp
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self.n_hedged >= self.max_hedge_ratio * self.n_requests:
+                return False
+
+            self.n_hedged += 1
+            return True
+
+    @staticmethod
+    def _get_wait_timeout(timeout):
+        '''Get the time in seconds to wait for a response: the connect and
+        read timeouts of the request together, or None if either is
+        unlimited'''
+        if isinstance(timeout, tuple):
+            if None in timeout:
+                return None
+
+            return sum(timeout)
+
+        return timeout
+
+    @staticmethod
+    def _remaining(end_time):
+        if end_time is None:
+            return None
+
+        return max(end_time - time.monotonic(), 0.)
+
+    def _start(self, uri, kwargs):
+        '''Make a request on the thread pool.  Returns a Future set to the
+        response and the time in seconds taken to receive it'''
+        def _get():
+            start_time = time.perf_counter()
+            resp = self.transport.get(uri, **kwargs)
+            return resp, time.perf_counter() - start_time
+
+        return self._executor.submit(_get)
+
+    @staticmethod
+    def _ok(attempt):
+        return (attempt.exception() is None and
+                attempt.result()[0].status_code < 500)
+
+    def _wait_first_ok(self, attempt, hedge, end_time=None):
+        '''Wait for the first of two requests to succeed, or for both to
+        complete if neither does, and cancel the other.  If end_time, in
+        time.monotonic seconds, passes first, the first request is returned
+        whether it has completed or not'''
+        winner = attempt
+        not_done = {attempt, hedge}
+        while not_done:
+            done, not_done = wait(not_done, timeout=self._remaining(end_time),
+                                  return_when=FIRST_COMPLETED)
+            if not done:
+                break
+
+            ok = [done_attempt for done_attempt in (attempt, hedge)
+                  if done_attempt in done and self._ok(done_attempt)]
+            if ok:
+                winner = ok[0]
+                break
+
+        loser = hedge if winner is attempt else attempt
+        loser.add_done_callback(self._close)
+        return winner
+
+    @staticmethod
+    def _close(attempt):
+        if attempt.exception() is None:
+            attempt.result()[0].close()
+
+    def _record(self, operation, resp, latency):
+        if resp.status_code < 500:
+            self.latency_estimator.record(operation, latency)
+
+    def log_summary(self):
+        '''Log the number of requests hedged and the state of the wrapped
+        transport'''
+        if self.n_hedged > 0:
+            log.info('{} of {} requests hedged, {} answered first by the '
+                     'duplicate request'.format(self.n_hedged,
+                                                self.n_requests,
+                                                self.n_hedges_won))
+
+        if hasattr(self.transport, 'log_summary'):
+            self.transport.log_summary()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,383 @@
+"""Per-host rate limiting, adaptive concurrency and circuit breaking
+
+HostControlledTransport wraps the HTTP transport used by the validation so
+that every request to a host passes through a token bucket, an adaptive
+concurrency limit and an optional circuit breaker kept for that host.  A
+host which is failing is sent fewer requests and, if the breaker is set,
+after repeated failures none at all for a while, so that a scan is not held
+up waiting on it.  Requests to healthy hosts are unaffected.
+
+Only errors showing that the host itself is down or overloaded count as
+failures: connection errors, timeouts and 502, 503 and 504 responses.  A
+500 response from ncWMS or WCS usually means that one dataset is broken, so
+it is left to be reported for that dataset.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import requests
+from six.moves.urllib.parse import urlparse
+
+from ceda.tds_ogc_scan.transport import TRANSPORT_ERRORS
+
+log = logging.getLogger(__name__)
+
+# Errors and response statuses counted as failures of the host
+HOST_FAILURE_ERRORS = (requests.ConnectionError, requests.Timeout)
+HOST_FAILURE_STATUS_CODES = (502, 503, 504)
+
+
+class HostUnhealthyError(requests.RequestException):
+    """Request skipped because the circuit breaker for its host is open"""
+
+
+class TokenBucket:
+    '''Limit the rate of requests.  Tokens are added at rate per second up
+    to capacity and each request takes one, waiting if none is left.
+    Waiting callers reserve their token so that they are served in turn
+    '''
+    def __init__(self, rate, capacity=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        '''
+        :param rate: number of tokens added per second
+        :param capacity: maximum number of tokens held, allowing a burst of
+        requests.  Defaults to rate, or 1 if rate is less than 1
+        '''
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1., rate))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last_update = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Take a token, waiting until one is available.  Returns the time
+        in seconds waited'''
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity,
+                               self._tokens +
+                               (now - self._last_update) * self.rate)
+            self._last_update = now
+            self._tokens -= 1.
+            wait = -self._tokens / self.rate if self._tokens < 0. else 0.
+
+        if wait > 0.:
+            self._sleep(wait)
+
+        return wait
+
+
+class AimdConcurrencyLimiter:
+    '''Limit the number of requests in progress, adapting the limit with
+    additive increase and multiplicative decrease.  Moving averages of the
+    latency and error rate are kept: while both are within their targets
+    the limit grows by about one for each limit's worth of requests
+    completed, and when either is exceeded the limit is cut by
+    decrease_factor, at most once every decrease_interval seconds
+    '''
+    DEFAULT_LATENCY_TARGET = 5.
+    DEFAULT_MAX_ERROR_RATE = 0.2
+    DEFAULT_DECREASE_FACTOR = 0.5
+    DEFAULT_DECREASE_INTERVAL = 1.
+
+    # Weight of each new sample in the moving averages
+    SMOOTHING = 0.2
+
+    def __init__(self, max_limit, min_limit=1, initial_limit=None,
+                 latency_target=DEFAULT_LATENCY_TARGET,
+                 max_error_rate=DEFAULT_MAX_ERROR_RATE,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR,
+                 decrease_interval=DEFAULT_DECREASE_INTERVAL,
+                 clock=time.monotonic):
+        '''
+        :param max_limit: maximum number of requests in progress
+        :param min_limit: the limit is never reduced below this
+        :param initial_limit: defaults to max_limit
+        :param latency_target: moving average latency in seconds above which
+        the limit is reduced
+        :param max_error_rate: moving average fraction of failed requests
+        above which the limit is reduced
+        '''
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit or max_limit)
+        self.latency_target = latency_target
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self._clock = clock
+
+        self.latency = None
+        self.error_rate = 0.
+        self.n_in_progress = 0
+        self._last_decrease = None
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def acquire(self):
+        '''Block until the number of requests in progress is below the
+        limit'''
+        with self._condition:
+            while self.n_in_progress >= int(self.limit):
+                self._condition.wait()
+            self.n_in_progress += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.n_in_progress -= 1
+                self._condition.notify()
+
+    def record(self, latency, ok):
+        '''Update the limit with the latency in seconds and outcome of a
+        completed request'''
+        with self._condition:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.SMOOTHING * (latency - self.latency)
+            self.error_rate += self.SMOOTHING * ((0. if ok else 1.) -
+                                                 self.error_rate)
+
+            if (self.latency > self.latency_target or
+                self.error_rate > self.max_error_rate):
+                now = self._clock()
+                if (self._last_decrease is None or
+                    now - self._last_decrease >= self.decrease_interval):
+                    self.limit = max(float(self.min_limit),
+                                     self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                previous_limit = int(self.limit)
+                self.limit = min(float(self.max_limit),
+                                 self.limit + 1. / self.limit)
+                if int(self.limit) > previous_limit:
+                    self._condition.notify()
+
+
+class CircuitBreaker:
+    '''Stop requests to a host after repeated failures.  The breaker opens
+    after failure_threshold consecutive failures.  Once reset_timeout
+    seconds have passed, one trial request is allowed: if it succeeds the
+    breaker closes again, otherwise it stays open for another reset_timeout
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_RESET_TIMEOUT = 60.
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+
+        self.state = self.CLOSED
+        self.n_failures = 0
+        self.n_opened = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        '''Return True if a request may be made'''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if (self.state == self.OPEN and
+                self._clock() - self._opened_at >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return True
+
+            return False
+
+    def record(self, ok):
+        '''Record the outcome of a request which was allowed.  Returns True
+        if the breaker was opened by this failure'''
+        with self._lock:
+            if ok:
+                self.state = self.CLOSED
+                self.n_failures = 0
+                return False
+
+            self.n_failures += 1
+            if (self.state == self.HALF_OPEN or
+                self.n_failures >= self.failure_threshold):
+                opened = self.state != self.OPEN
+                if opened:
+                    self.n_opened += 1
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+                return opened
+
+            return False
+
+
+class HostControl:
+    '''Rate limiter, concurrency limiter and circuit breaker for one host.
+    Any of them can be None'''
+    def __init__(self, token_bucket=None, concurrency_limiter=None,
+                 circuit_breaker=None):
+        self.token_bucket = token_bucket
+        self.concurrency_limiter = concurrency_limiter
+        self.circuit_breaker = circuit_breaker
+        self.n_skipped = 0
+
+
+class HostControlledTransport:
+    '''Wrap a transport such as HttpTransport, controlling requests to each
+    host.  A request fails if it raises one of HOST_FAILURE_ERRORS or gives
+    a response with one of HOST_FAILURE_STATUS_CODES.  A concurrency slot is
+    held until the response headers are received, which is also the latency
+    recorded.  Requests refused by the circuit breaker raise
+    HostUnhealthyError without contacting the host
+    '''
+    def __init__(self, transport, rate=None, burst=None, max_concurrency=None,
+                 min_concurrency=1,
+                 latency_target=AimdConcurrencyLimiter.DEFAULT_LATENCY_TARGET,
+                 max_error_rate=AimdConcurrencyLimiter.DEFAULT_MAX_ERROR_RATE,
+                 failure_threshold=None,
+                 reset_timeout=CircuitBreaker.DEFAULT_RESET_TIMEOUT):
+        '''
+        :param transport: transport to which requests are passed
+        :param rate: maximum requests per second for each host.  None for
+        no limit
+        :param burst: number of requests which can be made at once before
+        the rate applies.  Defaults to rate
+        :param max_concurrency: maximum number of requests in progress for
+        each host, adapted down when the host is slow or failing.  None for
+        no limit
+        :param failure_threshold: number of consecutive failures after which
+        requests to a host are stopped.  None, the default, to never stop
+        requests
+        :param reset_timeout: time in seconds before a trial request is made
+        to a host whose requests were stopped
+        '''
+        self.transport = transport
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.max_error_rate = max_error_rate
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.host_controls = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return getattr(self.transport, 'timeout', None)
+
+    def get_host_control(self, host):
+        '''Get the HostControl for a host, creating it if need be'''
+        with self._lock:
+            host_control = self.host_controls.get(host)
+            if host_control is None:
+                host_control = HostControl()
+                if self.rate is not None:
+                    host_control.token_bucket = TokenBucket(
+                                                    self.rate,
+                                                    capacity=self.burst)
+
+                if self.max_concurrency is not None:
+                    host_control.concurrency_limiter = AimdConcurrencyLimiter(
+                                        self.max_concurrency,
+                                        min_limit=self.min_concurrency,
+                                        latency_target=self.latency_target,
+                                        max_error_rate=self.max_error_rate)
+
+                if self.failure_threshold is not None:
+                    host_control.circuit_breaker = CircuitBreaker(
+                                    failure_threshold=self.failure_threshold,
+                                    reset_timeout=self.reset_timeout)
+
+                self.host_controls[host] = host_control
+
+            return host_control
+
+    @contextmanager
+    def _concurrency_slot(self, host_control):
+        if host_control.concurrency_limiter is None:
+            yield
+        else:
+            with host_control.concurrency_limiter.acquire():
+                yield
+
+    def get(self, uri, **kwargs):
+        '''Make a HTTP GET request through the wrapped transport.  Keywords
+        are passed to its get method
+
+        :raises HostUnhealthyError: if the circuit breaker for the host is
+        open
+        '''
+        host = urlparse(uri).netloc
+        host_control = self.get_host_control(host)
+        circuit_breaker = host_control.circuit_breaker
+
+        if circuit_breaker is not None and not circuit_breaker.allow():
+            with self._lock:
+                host_control.n_skipped += 1
+            raise HostUnhealthyError('Skipped: host {} unhealthy'.format(
+                                     host))
+
+        if host_control.token_bucket is not None:
+            host_control.token_bucket.acquire()
+
+        with self._concurrency_slot(host_control):
+            start_time = time.perf_counter()
+            try:
+                resp = self.transport.get(uri, **kwargs)
+
+            except TRANSPORT_ERRORS as e:
+                self._record(host, host_control,
+                             time.perf_counter() - start_time,
+                             not isinstance(e, HOST_FAILURE_ERRORS))
+                raise
+
+            self._record(host, host_control, time.perf_counter() - start_time,
+                         resp.status_code not in HOST_FAILURE_STATUS_CODES)
+
+        return resp
+
+    def _record(self, host, host_control, latency, ok):
+        if host_control.concurrency_limiter is not None:
+            host_control.concurrency_limiter.record(latency, ok)
+
+        circuit_breaker = host_control.circuit_breaker
+        if circuit_breaker is not None and circuit_breaker.record(ok):
+            log.warning('Stopping requests to unhealthy host {} for {} '
+                        's'.format(host, circuit_breaker.reset_timeout))
+
+    def log_summary(self):
+        '''Log the state of each host whose requests were limited'''
+        for host, host_control in sorted(self.host_controls.items()):
+            if host_control.n_skipped > 0:
+                log.info('{}: {} requests skipped: host unhealthy'.format(
+                         host, host_control.n_skipped))
+
+            limiter = host_control.concurrency_limiter
+            if limiter is not None and int(limiter.limit) < limiter.max_limit:
+                log.info('{}: concurrency reduced to {} of {}'.format(
+                         host, int(limiter.limit), limiter.max_limit))
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
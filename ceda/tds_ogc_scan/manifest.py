@@ -0,0 +1,292 @@
+"""Compiled manifest of the endpoints of a THREDDS catalogue
+
+A manifest holds, for each catalogue reference of a root catalogue, its WMS
+and WCS endpoint URIs.  It is compiled on a schedule of its own so that
+checks can start straight from it, without reading the root catalogue and
+every sub-catalogue first.
+
+The manifest is a SQLite file indexed by catalogue reference URI so that a
+single entry is looked up without loading the others, and entries are read
+in catalogue order a page at a time.  A manifest is written to a temporary
+file which replaces any previous one once it is complete, so that checks
+running while it is compiled read either the old or the new manifest.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import Counter, namedtuple
+
+from ceda.tds_ogc_scan.concurrency import run_concurrently
+from ceda.tds_ogc_scan.validation import OgcTdsCatalogParseError
+
+log = logging.getLogger(__name__)
+
+SERVICE_TYPES = ('WMS', 'WCS')
+
+# Endpoints of a catalogue reference.  ogc_uris is a dictionary of endpoint
+# URIs keyed by service type, or None if the sub-catalogue could not be read
+# when the manifest was compiled
+ManifestEntry = namedtuple('ManifestEntry', ('catalog_ref_uri', 'ogc_uris'))
+
+
+class EndpointManifestError(Exception):
+    """Manifest missing or compiled for a different catalogue"""
+
+
+class EndpointManifest:
+    '''Read or write a manifest of catalogue references and their endpoints
+    held in a SQLite file'''
+    PAGE_SIZE = 1000
+
+    def __init__(self, filepath, mode='r'):
+        '''
+        :param filepath: path to the manifest
+        :param mode: 'r' to read an existing manifest or 'w' to write a new
+        one, replacing the file on close
+        '''
+        if mode not in ('r', 'w'):
+            raise ValueError('Invalid manifest mode {!r}: expecting r or '
+                             'w'.format(mode))
+
+        self.filepath = filepath
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._db_filepath = filepath
+
+        if mode == 'r':
+            if not os.path.isfile(filepath):
+                raise EndpointManifestError('No manifest found at '
+                                            '{!r}'.format(filepath))
+
+            self._db = sqlite3.connect('file:{}?mode=ro'.format(filepath),
+                                       uri=True, check_same_thread=False)
+            return
+
+        dirpath = os.path.dirname(os.path.abspath(filepath))
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+        fd, self._db_filepath = tempfile.mkstemp(
+                                    prefix=os.path.basename(filepath) + '.',
+                                    dir=dirpath)
+        os.close(fd)
+
+        # mkstemp makes a file readable by its owner only.  Give the manifest
+        # the permissions of any other new file so that checks run by other
+        # users can read it
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self._db_filepath, 0o666 & ~umask)
+
+        self._db = sqlite3.connect(self._db_filepath, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE manifest_info ('
+                'name TEXT PRIMARY KEY, '
+                'value TEXT)')
+            self._db.execute(
+                'CREATE TABLE manifest_entry ('
+                'position INTEGER PRIMARY KEY, '
+                'catalog_ref_uri TEXT UNIQUE NOT NULL, '
+                'resolved INTEGER NOT NULL, '
+                'wms_uri TEXT, '
+                'wcs_uri TEXT)')
+
+    def _get_info(self, name):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM manifest_info '
+                                   'WHERE name = ?', (name,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def _set_info(self, name, value):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO manifest_info '
+                             '(name, value) VALUES (?, ?)', (name, value))
+
+    @property
+    def catalog_uri(self):
+        '''URI of the root catalogue the manifest was compiled from'''
+        return self._get_info('catalog_uri')
+
+    @catalog_uri.setter
+    def catalog_uri(self, catalog_uri):
+        self._set_info('catalog_uri', catalog_uri)
+
+    @property
+    def compiled(self):
+        '''Time the manifest was compiled in seconds since the epoch'''
+        compiled = self._get_info('compiled')
+        return None if compiled is None else float(compiled)
+
+    def check_catalog_uri(self, catalog_uri):
+        '''Raise EndpointManifestError if the manifest was compiled from a
+        different root catalogue'''
+        if catalog_uri != self.catalog_uri:
+            raise EndpointManifestError(
+                        'Manifest {!r} was compiled for catalogue {!r}, not '
+                        '{!r}'.format(self.filepath, self.catalog_uri,
+                                      catalog_uri))
+
+    def add(self, position, entry):
+        '''Add a ManifestEntry at a position in catalogue order'''
+        ogc_uris = entry.ogc_uris or {}
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO manifest_entry '
+                '(position, catalog_ref_uri, resolved, wms_uri, wcs_uri) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (position, entry.catalog_ref_uri,
+                 int(entry.ogc_uris is not None), ogc_uris.get('WMS'),
+                 ogc_uris.get('WCS')))
+
+    @staticmethod
+    def _make_entry(row):
+        catalog_ref_uri, resolved, wms_uri, wcs_uri = row
+        ogc_uris = None
+        if resolved:
+            ogc_uris = {'WMS': wms_uri, 'WCS': wcs_uri}
+
+        return ManifestEntry(catalog_ref_uri, ogc_uris)
+
+    def get(self, catalog_ref_uri):
+        '''Get the ManifestEntry for a catalogue reference URI or None if it
+        is not in the manifest'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT catalog_ref_uri, resolved, wms_uri, wcs_uri '
+                'FROM manifest_entry WHERE catalog_ref_uri = ?',
+                (catalog_ref_uri,)).fetchone()
+
+        return None if row is None else self._make_entry(row)
+
+    def __iter__(self):
+        '''Yield each ManifestEntry in catalogue order.  Entries are read a
+        page at a time'''
+        position = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT position, catalog_ref_uri, resolved, wms_uri, '
+                    'wcs_uri FROM manifest_entry WHERE position > ? '
+                    'ORDER BY position LIMIT ?',
+                    (position, self.PAGE_SIZE)).fetchall()
+
+            for row in rows:
+                position = row[0]
+                yield self._make_entry(row[1:])
+
+            if len(rows) < self.PAGE_SIZE:
+                return
+
+    def iter_catalog_ref_uris(self):
+        '''Yield the catalogue reference URIs in catalogue order'''
+        for entry in self:
+            yield entry.catalog_ref_uri
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                        'SELECT COUNT(*) FROM manifest_entry').fetchone()[0]
+
+    def close(self):
+        '''Close the manifest.  A manifest being written replaces the file
+        at filepath'''
+        if self._db is None:
+            return
+
+        if self.mode == 'w':
+            self._set_info('compiled', str(time.time()))
+
+        self._db.close()
+        self._db = None
+
+        if self.mode == 'w':
+            os.replace(self._db_filepath, self.filepath)
+
+    def discard(self):
+        '''Close a manifest being written without replacing the file at
+        filepath'''
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+        if self.mode == 'w' and os.path.exists(self._db_filepath):
+            os.remove(self._db_filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _resolve_entry(validation_cls, catalog_ref_uri):
+    '''Resolve the endpoints of a catalogue reference
+
+    :return: tuple of ManifestEntry and collections.Counter of counts
+    '''
+    stats = Counter()
+    try:
+        ogc_uris = validation_cls.get_ogc_uris_from_catalog(catalog_ref_uri,
+                                                            SERVICE_TYPES)
+    except OgcTdsCatalogParseError as e:
+        log.error('Catalogue reference %r not resolved: %s', catalog_ref_uri,
+                  e)
+        stats['catalog_refs_unresolved'] += 1
+        return ManifestEntry(catalog_ref_uri, None), stats
+
+    stats['catalog_refs_resolved'] += 1
+    return ManifestEntry(catalog_ref_uri, ogc_uris), stats
+
+
+def compile_manifest(validation_cls, uri, filepath, max_workers=1,
+                     max_workers_per_host=None):
+    '''Read a THREDDS catalogue and each of its sub-catalogues and write a
+    manifest of their endpoints.  Catalogue references whose sub-catalogue
+    cannot be read are included unresolved so that they are read when
+    checked
+
+    :param validation_cls: OgcTdsValidation or a subclass used to read the
+    catalogues.  Its manifest must not be set
+    :param uri: URI of the root catalogue
+    :param filepath: path to the manifest to write
+    :param max_workers: number of sub-catalogues read concurrently
+    :param max_workers_per_host: limit on the number of sub-catalogues read
+    concurrently from any one host
+    :return: collections.Counter of the numbers of catalogue references
+    resolved and unresolved
+    '''
+    if validation_cls.manifest is not None:
+        raise EndpointManifestError('A manifest cannot be compiled from '
+                                    'another manifest')
+
+    stats = Counter()
+    with EndpointManifest(filepath, mode='w') as manifest:
+        manifest.catalog_uri = uri
+        for position, (entry, entry_stats) in run_concurrently(
+                lambda item: (item[0], _resolve_entry(validation_cls,
+                                                      item[1])),
+                enumerate(validation_cls.get_catalog_ref_uris(uri)),
+                max_workers=max_workers,
+                max_workers_per_host=max_workers_per_host,
+                get_uri=lambda item: item[1]):
+            manifest.add(position, entry)
+            stats.update(entry_stats)
+
+    log.info('Manifest %r compiled for %r: %d catalogue references '
+             'resolved and %d unresolved', filepath, uri,
+             stats['catalog_refs_resolved'],
+             stats['catalog_refs_unresolved'])
+    return stats
@@ -0,0 +1,243 @@
+"""Latency and payload size instrumentation for OGC endpoint checks
+
+Timings and sizes are accumulated in histograms with fixed logarithmic
+buckets so that memory use is bounded however many requests are made.
+Percentiles are accurate to within the bucket growth factor.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import math
+import time
+import heapq
+import logging
+import threading
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+
+class RequestTimer:
+    '''Time the stages of a request: until the response headers are
+    received and until the body has been read and parsed
+    '''
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.received_time = None
+        self.parsed_time = None
+
+    def received(self):
+        '''Call when the response headers have been received'''
+        self.received_time = time.perf_counter()
+
+    def parsed(self):
+        '''Call when the response body has been read and parsed'''
+        self.parsed_time = time.perf_counter()
+
+    @property
+    def ttfb(self):
+        '''Time to first byte in seconds or None if no response received'''
+        if self.received_time is None:
+            return None
+
+        return self.received_time - self.start_time
+
+    @property
+    def parse_time(self):
+        '''Time in seconds reading and parsing the response body or None if
+        the body was not parsed
+        '''
+        if self.received_time is None or self.parsed_time is None:
+            return None
+
+        return self.parsed_time - self.received_time
+
+    def elapsed(self):
+        '''Time in seconds since the request started'''
+        return time.perf_counter() - self.start_time
+
+
+class LogHistogram:
+    '''Histogram with logarithmically spaced buckets.  Values below
+    min_value or above max_value are counted in underflow and overflow
+    buckets
+    '''
+    def __init__(self, min_value=1e-4, max_value=1e4, growth_factor=1.05):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.growth_factor = growth_factor
+        self._log_growth_factor = math.log(growth_factor)
+
+        n_buckets = int(math.ceil(math.log(max_value / min_value) /
+                                  self._log_growth_factor))
+        self.counts = [0] * (n_buckets + 2)
+
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def _get_bucket_index(self, value):
+        if value < self.min_value:
+            return 0
+
+        if value >= self.max_value:
+            return len(self.counts) - 1
+
+        return 1 + int(math.log(value / self.min_value) /
+                       self._log_growth_factor)
+
+    def _get_bucket_upper_bound(self, i):
+        if i == 0:
+            return self.min_value
+
+        if i == len(self.counts) - 1:
+            return self.max
+
+        return self.min_value * self.growth_factor ** i
+
+    def add(self, value):
+        self.counts[self._get_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        '''Add the counts from another histogram with the same buckets'''
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+
+        return self.total / self.count
+
+    def percentile(self, q):
+        '''Get an upper bound for the q-th percentile.  Return None if the
+        histogram is empty
+        '''
+        if self.count == 0:
+            return None
+
+        rank = max(1, int(math.ceil(q / 100. * self.count)))
+        cumulative_count = 0
+        for i, count in enumerate(self.counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return min(max(self._get_bucket_upper_bound(i), self.min),
+                           self.max)
+
+
+class OperationMetrics:
+    '''Histograms for the requests made for one operation'''
+    def __init__(self):
+        self.elapsed = LogHistogram()
+        self.ttfb = LogHistogram()
+        self.parse_time = LogHistogram()
+        self.n_bytes = LogHistogram(min_value=1., max_value=1e12)
+
+    def add(self, result):
+        self.elapsed.add(result.elapsed)
+        if result.ttfb is not None:
+            self.ttfb.add(result.ttfb)
+        if result.parse_time is not None:
+            self.parse_time.add(result.parse_time)
+        if result.n_bytes:
+            self.n_bytes.add(result.n_bytes)
+
+    def merge(self, other):
+        for name in ('elapsed', 'ttfb', 'parse_time', 'n_bytes'):
+            getattr(self, name).merge(getattr(other, name))
+
+
+def _format_percentiles(histogram, fmt):
+    return ' '.join(['p{}={}'.format(q, fmt(histogram.percentile(q)))
+                     for q in PerformanceSummary.PERCENTILES])
+
+
+class PerformanceSummary:
+    '''Result sink keeping latency and size histograms for each operation and
+    the slowest requests made
+    '''
+    PERCENTILES = (50, 95, 99)
+    DEFAULT_N_SLOWEST = 10
+
+    def __init__(self, n_slowest=DEFAULT_N_SLOWEST):
+        self.n_slowest = n_slowest
+        self.operations = defaultdict(OperationMetrics)
+
+        # Min heap of (elapsed, uri, operation) so that the fastest of the
+        # slowest requests can be replaced
+        self.slowest = []
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            self.operations[result.operation].add(result)
+
+            item = (result.elapsed, result.uri, result.operation)
+            if len(self.slowest) < self.n_slowest:
+                heapq.heappush(self.slowest, item)
+            elif self.n_slowest > 0 and item > self.slowest[0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def merge(self, other):
+        '''Add the histograms and slowest requests from another summary'''
+        with self._lock:
+            for operation, operation_metrics in other.operations.items():
+                self.operations[operation].merge(operation_metrics)
+
+            for item in other.slowest:
+                if len(self.slowest) < self.n_slowest:
+                    heapq.heappush(self.slowest, item)
+                elif self.n_slowest > 0 and item > self.slowest[0]:
+                    heapq.heapreplace(self.slowest, item)
+
+    def get_slowest(self):
+        '''Get (elapsed, uri, operation) tuples for the slowest requests,
+        slowest first'''
+        return sorted(self.slowest, reverse=True)
+
+    def log(self):
+        seconds = lambda value: ('-' if value is None
+                                 else '{:.3f}s'.format(value))
+        n_bytes = lambda value: '-' if value is None else '{:.0f}'.format(value)
+
+        log.info("Performance by operation")
+        log.info("========================")
+        for operation in sorted(self.operations):
+            operation_metrics = self.operations[operation]
+            log.info('{}: {} requests'.format(
+                     operation, operation_metrics.elapsed.count))
+            log.info('  total time: {}'.format(_format_percentiles(
+                     operation_metrics.elapsed, seconds)))
+            log.info('  time to first byte: {}'.format(_format_percentiles(
+                     operation_metrics.ttfb, seconds)))
+            if operation_metrics.parse_time.count > 0:
+                log.info('  read and parse time: {}'.format(
+                         _format_percentiles(operation_metrics.parse_time,
+                                             seconds)))
+            log.info('  bytes: {}'.format(_format_percentiles(
+                     operation_metrics.n_bytes, n_bytes)))
+
+        if self.slowest:
+            log.info("Slowest requests")
+            log.info("================")
+            for elapsed, uri, operation in self.get_slowest():
+                log.info('{:.3f}s {} {}'.format(elapsed, operation, uri))
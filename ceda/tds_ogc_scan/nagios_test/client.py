@@ -0,0 +1,119 @@
+"""Client for the check daemon used by the Nagios scripts
+
+The Nagios scripts first ask a check daemon listening on a UNIX socket for
+the result of their check so that no catalogue has to be read and no
+connection opened in the short-lived script process.  The client only uses
+the standard library so that it starts quickly.  If no daemon socket is
+configured or no daemon is listening on it, the script makes the check
+itself.  A daemon which is listening but fails to answer gives an UNKNOWN
+status rather than a second check made alongside its own.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import sys
+import json
+import socket
+
+# Path to the UNIX socket of the check daemon
+SOCKET_ENV_NAME = 'CEDA_TDS_OGC_SCAN_DAEMON_SOCKET'
+
+# Maximum age in seconds of a result from the daemon
+MAX_AGE_ENV_NAME = 'CEDA_TDS_OGC_SCAN_DAEMON_MAX_AGE'
+
+# Time in seconds to wait for the daemon to answer
+TIMEOUT_ENV_NAME = 'CEDA_TDS_OGC_SCAN_DAEMON_TIMEOUT'
+DEFAULT_TIMEOUT = 30.
+
+MAX_RESPONSE_SIZE = 2**20
+
+# Nagios exit status given if the daemon fails to answer
+NAGIOS_UNKNOWN = 3
+
+
+class CheckDaemonError(Exception):
+    """Invalid response from the check daemon"""
+
+
+class CheckDaemonUnavailable(Exception):
+    """No check daemon listening on the socket"""
+
+
+def request_check(socket_path, check, max_age=None, timeout=DEFAULT_TIMEOUT):
+    '''Ask the check daemon for the result of a check
+
+    :param check: name of the check, e.g. wms
+    :param max_age: maximum age in seconds of a result.  If the latest
+    result is older, the daemon starts the check again and answers with the
+    result marked as stale.  None for the daemon's default
+    :param timeout: time in seconds to wait for the answer
+    :return: tuple of Nagios exit status and output line
+    :raises CheckDaemonUnavailable: if the daemon can't be reached
+    :raises OSError: if the daemon doesn't answer in time
+    :raises CheckDaemonError: if the response is invalid
+    '''
+    request = {'check': check}
+    if max_age is not None:
+        request['max_age'] = max_age
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+
+        except OSError as e:
+            raise CheckDaemonUnavailable(
+                        'No check daemon listening on {}: {}'.format(
+                                                        socket_path, e))
+
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as response_file:
+            line = response_file.readline(MAX_RESPONSE_SIZE)
+    finally:
+        sock.close()
+
+    try:
+        response = json.loads(line.decode('utf-8'))
+        return int(response['status']), str(response['output'])
+
+    except (ValueError, KeyError, TypeError) as e:
+        raise CheckDaemonError('Invalid response from check daemon: '
+                               '{}'.format(e))
+
+
+def exit_with_daemon_result(check, check_name=None):
+    '''Print the result of a check from the daemon and exit with its status.
+    Returns without exiting if no daemon socket is set in the environment
+    or no daemon is listening on it, so that the check can be made in
+    process.  If the daemon fails to answer, exits with UNKNOWN status
+
+    :param check_name: Nagios check name printed if the daemon fails to
+    answer.  Defaults to check
+    '''
+    socket_path = os.getenv(SOCKET_ENV_NAME)
+    if not socket_path:
+        return
+
+    max_age = os.getenv(MAX_AGE_ENV_NAME)
+    timeout = os.getenv(TIMEOUT_ENV_NAME)
+    try:
+        status, output = request_check(
+                        socket_path, check,
+                        max_age=float(max_age) if max_age else None,
+                        timeout=float(timeout) if timeout else DEFAULT_TIMEOUT)
+
+    except CheckDaemonUnavailable as e:
+        sys.stderr.write('{}.  Checking in process\n'.format(e))
+        return
+
+    except (OSError, CheckDaemonError) as e:
+        print('{} UNKNOWN - check daemon at {} failed to answer: {}'.format(
+                                    check_name or check, socket_path, e))
+        sys.exit(NAGIOS_UNKNOWN)
+
+    print(output)
+    sys.exit(status)
@@ -0,0 +1,91 @@
+"""Configuration of the Nagios checks from environment variables
+
+Shared by the WMS and WCS check scripts and by the check daemon which runs
+them in a resident process.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import logging
+
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.cache import CatalogResponseCache
+from ceda.tds_ogc_scan.resolver import CatalogResolver
+from ceda.tds_ogc_scan.manifest import (EndpointManifest,
+                                        EndpointManifestError)
+from ceda.tds_ogc_scan.transport import HttpTransport
+from ceda.tds_ogc_scan.host_health import HostControlledTransport
+from ceda.tds_ogc_scan.hedging import HedgedTransport
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_URI = (
+    'https://cci-odp-data.ceda.ac.uk/thredds/esacci/catalog.xml'
+)
+
+
+def get_catalog_uri():
+    '''Get the THREDDS catalogue to be checked'''
+    return os.getenv('CEDA_TDS_OGC_SCAN_CATALOG_URI') or DEFAULT_CATALOG_URI
+
+
+def get_max_workers():
+    '''Get the number of catalogue entries to test concurrently'''
+    return int(os.getenv('CEDA_TDS_OGC_SCAN_MAX_WORKERS') or 1)
+
+
+def get_deadline():
+    '''Get the time in seconds allowed for a check or None for no limit'''
+    deadline = os.getenv('CEDA_TDS_OGC_SCAN_DEADLINE')
+    if deadline:
+        return float(deadline)
+
+    return None
+
+
+def configure_validation():
+    '''Set up the caches, time limits and manifest used by OgcTdsValidation
+    from the environment'''
+
+    # Optionally cache catalogues between checks.  Resolved catalogues are
+    # shared with the other OGC check for the monitoring cycle
+    cache_dirpath = os.getenv('CEDA_TDS_OGC_SCAN_CACHE_DIR')
+    if cache_dirpath:
+        OgcTdsValidation.catalog_cache = CatalogResponseCache(cache_dirpath)
+        resolver_ttl = float(os.getenv('CEDA_TDS_OGC_SCAN_RESOLVER_TTL') or
+                             CatalogResolver.DEFAULT_TTL)
+        OgcTdsValidation.catalog_resolver = CatalogResolver(
+                    os.path.join(cache_dirpath, CatalogResolver.DB_FILENAME),
+                    ttl=resolver_ttl)
+    else:
+        OgcTdsValidation.catalog_resolver = CatalogResolver()
+
+    # Optionally duplicate requests slower than this quantile of the
+    # latency of their operation so that a few slow responses don't hold up
+    # the check
+    hedge_quantile = os.getenv('CEDA_TDS_OGC_SCAN_HEDGE_QUANTILE')
+    if hedge_quantile:
+        OgcTdsValidation.transport = HedgedTransport(
+                                    HostControlledTransport(HttpTransport()),
+                                    quantile=float(hedge_quantile))
+
+    # Optionally limit the time for each request so that checks complete
+    # within the Nagios budget
+    request_timeout = os.getenv('CEDA_TDS_OGC_SCAN_REQUEST_TIMEOUT')
+    if request_timeout:
+        OgcTdsValidation.request_timeout = float(request_timeout)
+
+    # Optionally take the catalogue entries and their endpoints from a
+    # manifest compiled on a schedule of its own in place of reading the
+    # catalogues on every check.  The catalogues are read if the manifest
+    # hasn't been compiled yet
+    manifest_filepath = os.getenv('CEDA_TDS_OGC_SCAN_MANIFEST')
+    if manifest_filepath:
+        try:
+            OgcTdsValidation.manifest = EndpointManifest(manifest_filepath)
+
+        except EndpointManifestError as e:
+            log.warning('%s: reading the catalogues instead', e)
@@ -6,25 +6,46 @@ __date__ = "08/12/17"
 __copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
 __license__ = """BSD - See LICENSE file in top-level directory"""
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
-import os
+from ceda.tds_ogc_scan.nagios_test.client import exit_with_daemon_result
 
-from ceda.unittest_nagios_wrapper.script import nagios_script
-from ceda.tds_ogc_scan.test.test_wcs import tds_wcs_testcase_factory
+CHECK = 'wcs'
+CHECK_NAME = 'CCI_WCS_TEST'
 
 
 def main():
-    '''Entry point for script - use standard nagios script'''
+    '''Entry point for script - use standard nagios script.  If a check
+    daemon is running, its result is given in place of making the check
+    here'''
+    exit_with_daemon_result(CHECK, check_name=CHECK_NAME)
+
+    # Imported only when the check is made in this process so that the
+    # client for the daemon starts quickly
+    from ceda.unittest_nagios_wrapper.script import nagios_script
+    from ceda.tds_ogc_scan.validation import OgcTdsValidation
+    from ceda.tds_ogc_scan.deadline import Deadline
+    from ceda.tds_ogc_scan.nagios_test import settings
+    from ceda.tds_ogc_scan.test.test_wcs import tds_wcs_testcase_factory
 
     # These options can be overridden by the CLI options
     SLACK_CHANNEL = 'cci-odp-ops-logging'
     SLACK_USER = 'cci-ops-test'
 
-    catalog_uri = (os.getenv('CEDA_TDS_OGC_SCAN_CATALOG_URI') or
-        'https://cci-odp-data.ceda.ac.uk/thredds/esacci/catalog.xml'
-    )
-    TdsWcsTestCase = tds_wcs_testcase_factory(catalog_uri)
-    
-    nagios_script(TdsWcsTestCase, check_name='CCI_WCS_TEST',
+    # Caches, request time limit and manifest.  See settings for the
+    # environment variables
+    settings.configure_validation()
+
+    # Optionally limit the time for the whole check so that it completes
+    # within the Nagios budget.  Entries not tested by the deadline are
+    # skipped
+    deadline = settings.get_deadline()
+    if deadline is not None:
+        OgcTdsValidation.scan_deadline = Deadline(deadline)
+
+    TdsWcsTestCase = tds_wcs_testcase_factory(
+                                        settings.get_catalog_uri(),
+                                        max_workers=settings.get_max_workers())
+
+    nagios_script(TdsWcsTestCase, check_name=CHECK_NAME,
                   slack_channel=SLACK_CHANNEL, slack_user=SLACK_USER)
 
 
@@ -0,0 +1,374 @@
+"""Pipelined scan of the catalogue entries of a THREDDS catalogue
+
+A scan runs as a series of stages connected by bounded queues:
+
+discover: catalogue reference URIs are read from the root catalogue as it
+is parsed
+catalogue: each sub-catalogue is read and its WMS and WCS endpoints
+resolved
+WMS, WCS: the endpoints of each service type are checked
+results: the test counts of each entry are collected once all its checks
+are complete
+
+Each stage has its own pool of worker threads.  A stage whose output queue
+is full waits for the next stage to catch up, so that a slow stage holds
+back those before it rather than letting work pile up in memory.  Checks
+start as soon as the first catalogue references are read, before the root
+catalogue has been parsed to the end.
+
+With a deadline, the pipeline stops when it is reached.  The test counts of
+the entries completed so far are returned and the entries read but not
+completed are listed as untested.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import time
+import queue
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+from ceda.tds_ogc_scan.concurrency import HostConcurrencyLimiter
+from ceda.tds_ogc_scan.deadline import DeadlineExceeded
+
+log = logging.getLogger(__name__)
+
+SERVICE_TYPES = ('WMS', 'WCS')
+
+
+class PipelineStopped(Exception):
+    """Raised in a stage waiting on a queue when the pipeline has stopped"""
+
+
+class PipelineStage:
+    '''Pool of worker threads calling func for each item taken from a
+    bounded input queue'''
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, pipeline, name, func, n_workers=1, queue_size=None,
+                 host_limiter=None, get_uri=None):
+        '''
+        :param pipeline: ScanPipeline the stage belongs to
+        :param func: function called with each item
+        :param n_workers: number of worker threads
+        :param queue_size: maximum number of items waiting.  Defaults to
+        twice n_workers
+        :param host_limiter: concurrency.HostConcurrencyLimiter applied to
+        the URI of each item
+        :param get_uri: function returning the URI for an item
+        '''
+        self.pipeline = pipeline
+        self.name = name
+        self.func = func
+        self.n_workers = n_workers
+        self.host_limiter = host_limiter or HostConcurrencyLimiter()
+        self.get_uri = get_uri or (lambda item: item)
+        self.queue = queue.Queue(maxsize=queue_size or 2 * n_workers)
+        self._threads = []
+
+    def start(self):
+        for i in range(self.n_workers):
+            thread = threading.Thread(target=self._run,
+                                      name='{}-{}'.format(self.name, i + 1),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        '''Add an item, waiting while the queue is full'''
+        self.pipeline.put(self.queue, item)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.pipeline.get(self.queue)
+            except PipelineStopped:
+                return
+
+            try:
+                with self.host_limiter.acquire(self.get_uri(item)):
+                    self.func(item)
+
+            except PipelineStopped:
+                return
+
+            except DeadlineExceeded:
+                self.pipeline.expire()
+                return
+
+            except BaseException as e:
+                self.pipeline.fail(e)
+                return
+
+    def join(self, timeout=None):
+        '''Wait for the worker threads to finish.  With a timeout, threads
+        still running after it are left to finish in the background'''
+        end_time = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if end_time is None
+                        else max(end_time - time.monotonic(), 0.))
+
+
+class CatalogEntry:
+    '''Test counts for a catalogue entry whose checks are in progress'''
+    def __init__(self, catalog_ref_uri):
+        self.catalog_ref_uri = catalog_ref_uri
+        self.catalog_hash = None
+        self.stats = Counter()
+        self.n_pending = 0
+
+        # Time in seconds spent in the checks of the entry
+        self.elapsed = 0.
+        self._lock = threading.Lock()
+
+    def add(self, stats, elapsed):
+        '''Add the test counts and time of a completed check.  Returns True
+        if it was the last check pending'''
+        with self._lock:
+            self.stats.update(stats)
+            self.elapsed += elapsed
+            self.n_pending -= 1
+            return self.n_pending == 0
+
+
+class ScanPipeline:
+    '''Check catalogue entries in a pipeline of stages connected by bounded
+    queues.  The test counts of each catalogue entry are passed to
+    catalog_ref_checked of validation_cls as soon as all its checks are
+    complete
+    '''
+    DEFAULT_QUEUE_SIZE = 100
+
+    # Time in seconds to wait for checks in progress to stop once the
+    # deadline is reached.  Workers still waiting on a response after it are
+    # left to stop in the background
+    STOP_TIMEOUT = 1.
+
+    def __init__(self, validation_cls, catalog_workers=1, wms_workers=1,
+                 wcs_workers=1, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_workers_per_host=None, incremental=False,
+                 deadline=None):
+        '''
+        :param validation_cls: OgcTdsValidation or a subclass used to make
+        the checks
+        :param catalog_workers: number of sub-catalogues read concurrently
+        :param wms_workers: number of WMS endpoints checked concurrently
+        :param wcs_workers: number of WCS endpoints checked concurrently
+        :param queue_size: maximum number of catalogue references read ahead
+        of the sub-catalogues.  The queues between the other stages hold
+        twice the number of workers of the stage they feed
+        :param max_workers_per_host: limit on the number of items in
+        progress in each stage against any one host.  None for no limit
+        :param incremental: skip the checks of catalogue entries which are
+        unchanged and passed all their checks in a recent scan
+        :param deadline: deadline.Deadline at which the pipeline stops.
+        None for no deadline
+        '''
+        self.validation_cls = validation_cls
+        self.incremental = incremental
+        self.deadline = deadline
+
+        # Set by run if the deadline was reached
+        self.deadline_exceeded = False
+        self.untested_uris = []
+        self.catalog_read = False
+
+        self._stopped = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+        self._completed = queue.Queue()
+
+        # Catalogue references read whose checks are not complete
+        self._pending_uris = OrderedDict()
+
+        self.catalog_stage = PipelineStage(
+                    self, 'catalogue', self._check_catalog_ref,
+                    n_workers=catalog_workers, queue_size=queue_size,
+                    host_limiter=HostConcurrencyLimiter(max_workers_per_host))
+        self.endpoint_stages = {
+            'WMS': PipelineStage(
+                    self, 'WMS', self._check_endpoint, n_workers=wms_workers,
+                    host_limiter=HostConcurrencyLimiter(max_workers_per_host),
+                    get_uri=lambda item: item[2]),
+            'WCS': PipelineStage(
+                    self, 'WCS', self._check_endpoint, n_workers=wcs_workers,
+                    host_limiter=HostConcurrencyLimiter(max_workers_per_host),
+                    get_uri=lambda item: item[2])
+        }
+
+    def put(self, item_queue, item):
+        '''Put an item on a queue, waiting while it is full
+
+        :raises PipelineStopped: if the pipeline stops while waiting
+        '''
+        while not self.is_stopped():
+            try:
+                item_queue.put(item, timeout=PipelineStage.POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+        raise PipelineStopped()
+
+    def get(self, item_queue):
+        '''Get an item from a queue, waiting while it is empty
+
+        :raises PipelineStopped: if the pipeline stops while waiting
+        '''
+        while not self.is_stopped():
+            try:
+                return item_queue.get(timeout=PipelineStage.POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+        raise PipelineStopped()
+
+    def is_stopped(self):
+        '''Check whether the pipeline has stopped, stopping it if the
+        deadline has passed'''
+        if (self.deadline is not None and not self._stopped.is_set() and
+            self.deadline.expired()):
+            self.expire()
+
+        return self._stopped.is_set()
+
+    def fail(self, error):
+        '''Stop the pipeline, keeping the first error raised by a stage'''
+        with self._lock:
+            if self._error is None:
+                self._error = error
+
+        self._stopped.set()
+
+    def expire(self):
+        '''Stop the pipeline on reaching the deadline'''
+        with self._lock:
+            if not self._stopped.is_set():
+                self.deadline_exceeded = True
+
+        self._stopped.set()
+
+    def _discover(self, catalog_ref_uris):
+        try:
+            n_discovered = 0
+            for catalog_ref_uri in catalog_ref_uris:
+                with self._lock:
+                    self._pending_uris[catalog_ref_uri] = None
+
+                self.catalog_stage.put(catalog_ref_uri)
+                n_discovered += 1
+
+            self.put(self._completed, n_discovered)
+
+        except PipelineStopped:
+            return
+
+        except DeadlineExceeded:
+            self.expire()
+
+        except BaseException as e:
+            self.fail(e)
+
+    def _check_catalog_ref(self, catalog_ref_uri):
+        catalog_entry = CatalogEntry(catalog_ref_uri)
+        start_time = time.perf_counter()
+        (stats, catalog_entry.catalog_hash,
+         ogc_uris) = self.validation_cls.resolve_catalog_ref(
+                                                catalog_ref_uri,
+                                                incremental=self.incremental)
+        catalog_entry.stats.update(stats)
+        catalog_entry.elapsed = time.perf_counter() - start_time
+
+        endpoints = [(service_type, ogc_uris[service_type])
+                     for service_type in SERVICE_TYPES
+                     if ogc_uris is not None and
+                     ogc_uris[service_type] is not None]
+        if not endpoints:
+            self.put(self._completed, catalog_entry)
+            return
+
+        catalog_entry.n_pending = len(endpoints)
+        for service_type, uri in endpoints:
+            self.endpoint_stages[service_type].put((catalog_entry,
+                                                    service_type, uri))
+
+    def _check_endpoint(self, item):
+        catalog_entry, service_type, uri = item
+        start_time = time.perf_counter()
+        stats = self.validation_cls.check_endpoint(service_type, uri)
+        if catalog_entry.add(stats, time.perf_counter() - start_time):
+            self.put(self._completed, catalog_entry)
+
+    def run(self, catalog_ref_uris):
+        '''Check each catalogue entry from an iterable of catalogue
+        reference URIs.  The iterable is consumed in a thread of its own so
+        that it can be a generator reading the root catalogue
+
+        If the deadline is reached, deadline_exceeded is set, untested_uris
+        lists the catalogue references read whose checks were not complete
+        and catalog_read is False if the catalogue was not read to the end
+
+        :return: collections.Counter of test counts summed over the entries
+        completed
+        '''
+        stages = [self.catalog_stage] + list(self.endpoint_stages.values())
+        for stage in stages:
+            stage.start()
+
+        discover_thread = threading.Thread(target=self._discover,
+                                           args=(catalog_ref_uris,),
+                                           name='discover', daemon=True)
+        discover_thread.start()
+
+        stats = Counter()
+        n_discovered = None
+        n_completed = 0
+        try:
+            while n_discovered is None or n_completed < n_discovered:
+                item = self.get(self._completed)
+                if isinstance(item, int):
+                    n_discovered = item
+                    continue
+
+                with self._lock:
+                    self._pending_uris.pop(item.catalog_ref_uri, None)
+
+                self.validation_cls.catalog_ref_checked(item.catalog_ref_uri,
+                                                        item.catalog_hash,
+                                                        item.stats,
+                                                        elapsed=item.elapsed)
+                stats.update(item.stats)
+                n_completed += 1
+
+        except PipelineStopped:
+            pass
+
+        finally:
+            with self._lock:
+                self._stopped.set()
+
+            if self.deadline_exceeded:
+                end_time = time.monotonic() + self.STOP_TIMEOUT
+                discover_thread.join(self.STOP_TIMEOUT)
+                for stage in stages:
+                    stage.join(max(end_time - time.monotonic(), 0.))
+            else:
+                discover_thread.join()
+                for stage in stages:
+                    stage.join()
+
+        if self._error is not None:
+            raise self._error
+
+        self.catalog_read = n_discovered is not None
+        if self.deadline_exceeded:
+            with self._lock:
+                self.untested_uris = list(self._pending_uris)
+
+            stats['catalog_refs_untested'] += len(self.untested_uris)
+            stats['scan_deadline_exceeded'] += 1
+
+        return stats
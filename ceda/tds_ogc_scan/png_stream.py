@@ -0,0 +1,357 @@
+"""Incremental decoding of PNG images returned by WMS GetMap
+
+The image is read chunk by chunk from a file-like object and the compressed
+image data decompressed and unfiltered one row at a time, so that only the
+current and previous rows are held in memory.  Cheap statistics are
+gathered from each row to detect blank tiles.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import zlib
+import struct
+from collections import namedtuple
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Colour types and the number of samples per pixel for each
+GREYSCALE = 0
+TRUECOLOUR = 2
+INDEXED_COLOUR = 3
+GREYSCALE_ALPHA = 4
+TRUECOLOUR_ALPHA = 6
+N_CHANNELS = {
+    GREYSCALE: 1,
+    TRUECOLOUR: 3,
+    INDEXED_COLOUR: 1,
+    GREYSCALE_ALPHA: 2,
+    TRUECOLOUR_ALPHA: 4,
+}
+VALID_BIT_DEPTHS = {
+    GREYSCALE: (1, 2, 4, 8, 16),
+    TRUECOLOUR: (8, 16),
+    INDEXED_COLOUR: (1, 2, 4, 8),
+    GREYSCALE_ALPHA: (8, 16),
+    TRUECOLOUR_ALPHA: (8, 16),
+}
+
+# Maximum amount of decompressed data produced from each call to the
+# decompressor
+DECOMPRESS_CHUNK_SIZE = 65536
+
+
+class PngError(Exception):
+    """Invalid or truncated PNG image"""
+
+
+class PngImageStats(namedtuple('PngImageStats',
+                               ('width', 'height', 'n_non_transparent',
+                                'n_colours'))):
+    '''Dimensions and pixel statistics for a PNG image.  n_non_transparent
+    and n_colours are None if pixel statistics were not gathered.  n_colours
+    is the number of distinct colours of non-transparent pixels up to the
+    maximum counted
+    '''
+    __slots__ = ()
+
+    @property
+    def fraction_non_transparent(self):
+        if self.n_non_transparent is None:
+            return None
+
+        return self.n_non_transparent / float(self.width * self.height)
+
+
+def _read_exactly(stream, size):
+    content = b''
+    while len(content) < size:
+        chunk = stream.read(size - len(content))
+        if not chunk:
+            raise PngError('PNG image is truncated')
+        content += chunk
+
+    return content
+
+
+def iter_chunks(stream):
+    '''Yield (chunk type, data) for each chunk of a PNG image read from a
+    file-like object, checking the signature and the CRC of each chunk.
+    Iteration stops after the IEND chunk
+    '''
+    if _read_exactly(stream, len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise PngError('Content is not a PNG image')
+
+    while True:
+        length, chunk_type = struct.unpack('>I4s', _read_exactly(stream, 8))
+        data = _read_exactly(stream, length)
+        crc, = struct.unpack('>I', _read_exactly(stream, 4))
+        if zlib.crc32(chunk_type + data) & 0xffffffff != crc:
+            raise PngError('CRC error in PNG {} chunk'.format(
+                           chunk_type.decode('latin-1')))
+
+        yield chunk_type, data
+        if chunk_type == b'IEND':
+            return
+
+
+def _paeth_predictor(a, b, c):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    if pb <= pc:
+        return b
+    return c
+
+
+def unfilter_row(filter_type, row, prev_row, bpp):
+    '''Reverse the filter applied to a row of image data.  row is modified
+    in place and returned.  prev_row is the previous unfiltered row
+    '''
+    n_bytes = len(row)
+    if filter_type == 0:
+        pass
+
+    elif filter_type == 1:
+        for i in range(bpp, n_bytes):
+            row[i] = (row[i] + row[i - bpp]) & 0xff
+
+    elif filter_type == 2:
+        row = bytearray([(a + b) & 0xff for a, b in zip(row, prev_row)])
+
+    elif filter_type == 3:
+        for i in range(bpp):
+            row[i] = (row[i] + (prev_row[i] >> 1)) & 0xff
+        for i in range(bpp, n_bytes):
+            row[i] = (row[i] + ((row[i - bpp] + prev_row[i]) >> 1)) & 0xff
+
+    elif filter_type == 4:
+        for i in range(bpp):
+            row[i] = (row[i] + prev_row[i]) & 0xff
+        for i in range(bpp, n_bytes):
+            row[i] = (row[i] + _paeth_predictor(row[i - bpp], prev_row[i],
+                                                prev_row[i - bpp])) & 0xff
+    else:
+        raise PngError('Invalid PNG filter type {}'.format(filter_type))
+
+    return row
+
+
+def _make_unpack_table(bit_depth):
+    '''Map each byte value to the tuple of samples it packs'''
+    n_samples = 8 // bit_depth
+    mask = (1 << bit_depth) - 1
+    return [tuple((value >> (8 - bit_depth * (i + 1))) & mask
+                  for i in range(n_samples))
+            for value in range(256)]
+
+
+class _RowStats:
+    '''Gather pixel statistics from rows of unfiltered image data'''
+    def __init__(self, header, palette_alpha, transparent_colour, max_colours):
+        self.width = header['width']
+        self.colour_type = header['colour_type']
+        self.bit_depth = header['bit_depth']
+        self.n_channels = N_CHANNELS[self.colour_type]
+        self.max_colours = max_colours
+
+        self.unpack_table = None
+        if self.bit_depth < 8:
+            self.unpack_table = _make_unpack_table(self.bit_depth)
+
+        # Translation table from palette index to alpha
+        self.palette_alpha = None
+        if self.colour_type == INDEXED_COLOUR:
+            self.palette_alpha = bytes(bytearray(
+                        [palette_alpha[i] if i < len(palette_alpha) else 255
+                         for i in range(256)]))
+
+        self.transparent_colour = transparent_colour
+        self.n_non_transparent = 0
+        self.colours = set()
+
+    def _get_samples(self, row):
+        '''Get 8 bit samples from a row, taking the most significant byte of
+        16 bit samples and unpacking samples of less than 8 bits'''
+        if self.bit_depth == 16:
+            return bytes(row[0::2])
+
+        if self.unpack_table is not None:
+            samples = bytearray()
+            for value in row:
+                samples.extend(self.unpack_table[value])
+            return bytes(samples[:self.width])
+
+        return bytes(row)
+
+    def add(self, row):
+        samples = self._get_samples(row)
+        n_channels = self.n_channels
+
+        if n_channels == 1:
+            pixels = samples
+        else:
+            pixels = list(zip(*[samples[i::n_channels]
+                                for i in range(n_channels)]))
+
+        if self.colour_type == INDEXED_COLOUR:
+            n_transparent = samples.translate(self.palette_alpha).count(0)
+
+        elif self.colour_type in (GREYSCALE_ALPHA, TRUECOLOUR_ALPHA):
+            n_transparent = samples[n_channels - 1::n_channels].count(0)
+
+        elif self.transparent_colour is not None:
+            n_transparent = pixels.count(self.transparent_colour)
+        else:
+            n_transparent = 0
+
+        self.n_non_transparent += self.width - n_transparent
+
+        if len(self.colours) < self.max_colours:
+            self.colours.update(pixels)
+
+    @property
+    def n_colours(self):
+        '''Number of distinct colours of non-transparent pixels'''
+        colours = self.colours
+        if self.colour_type == INDEXED_COLOUR:
+            colours = [colour for colour in colours
+                       if self.palette_alpha[colour] > 0]
+
+        elif self.colour_type in (GREYSCALE_ALPHA, TRUECOLOUR_ALPHA):
+            colours = [colour for colour in colours if colour[-1] > 0]
+
+        elif self.transparent_colour is not None:
+            colours = [colour for colour in colours
+                       if colour != self.transparent_colour]
+
+        return min(len(colours), self.max_colours)
+
+
+def _parse_header(data):
+    if len(data) != 13:
+        raise PngError('Invalid PNG IHDR chunk')
+
+    (width, height, bit_depth, colour_type, compression_method,
+     filter_method, interlace_method) = struct.unpack('>IIBBBBB', data)
+
+    if (colour_type not in VALID_BIT_DEPTHS or
+        bit_depth not in VALID_BIT_DEPTHS[colour_type]):
+        raise PngError('Invalid PNG bit depth {} for colour type {}'.format(
+                       bit_depth, colour_type))
+
+    if width == 0 or height == 0:
+        raise PngError('Invalid PNG image dimensions {}x{}'.format(width,
+                                                                   height))
+
+    if compression_method != 0 or filter_method != 0:
+        raise PngError('Unsupported PNG compression or filter method')
+
+    return {
+        'width': width,
+        'height': height,
+        'bit_depth': bit_depth,
+        'colour_type': colour_type,
+        'interlace_method': interlace_method,
+    }
+
+
+def _parse_transparent_colour(data, colour_type, bit_depth):
+    '''Get the transparent colour from a tRNS chunk for a greyscale or
+    truecolour image as it appears in the 8 bit samples'''
+    n_samples = 1 if colour_type == GREYSCALE else 3
+    if len(data) != 2 * n_samples:
+        raise PngError('Invalid PNG tRNS chunk')
+
+    samples = struct.unpack('>{}H'.format(n_samples), data)
+    if bit_depth == 16:
+        samples = tuple(sample >> 8 for sample in samples)
+
+    if colour_type == GREYSCALE:
+        return samples[0]
+
+    return samples
+
+
+def read_png_stats(stream, max_colours=256):
+    '''Decode a PNG image read incrementally from a file-like object and
+    return PngImageStats for it.  Pixel statistics are not gathered for
+    interlaced images.  Samples of 16 bit images are compared on their most
+    significant byte.
+
+    :param max_colours: stop counting distinct colours at this number
+    '''
+    header = None
+    palette_alpha = b''
+    transparent_colour = None
+    row_stats = None
+    decompressor = zlib.decompressobj()
+    buffer = bytearray()
+    prev_row = None
+    n_rows = 0
+
+    for chunk_type, data in iter_chunks(stream):
+        if header is None:
+            if chunk_type != b'IHDR':
+                raise PngError('PNG image does not start with an IHDR chunk')
+            header = _parse_header(data)
+
+            n_bits_per_pixel = N_CHANNELS[header['colour_type']] * \
+                header['bit_depth']
+            row_size = (header['width'] * n_bits_per_pixel + 7) // 8
+            bpp = max(1, n_bits_per_pixel // 8)
+            prev_row = bytearray(row_size)
+
+        elif chunk_type == b'tRNS':
+            if header['colour_type'] == INDEXED_COLOUR:
+                palette_alpha = data
+            else:
+                transparent_colour = _parse_transparent_colour(
+                            data, header['colour_type'], header['bit_depth'])
+
+        elif chunk_type == b'IDAT':
+            if header['interlace_method'] != 0:
+                continue
+
+            if row_stats is None:
+                row_stats = _RowStats(header, palette_alpha,
+                                      transparent_colour, max_colours)
+            try:
+                while data:
+                    buffer.extend(decompressor.decompress(
+                                                    data,
+                                                    DECOMPRESS_CHUNK_SIZE))
+                    data = decompressor.unconsumed_tail
+
+                    while len(buffer) > row_size:
+                        if n_rows == header['height']:
+                            raise PngError('PNG image has too much data')
+
+                        row = unfilter_row(buffer[0],
+                                           buffer[1:row_size + 1],
+                                           prev_row, bpp)
+                        del buffer[:row_size + 1]
+                        row_stats.add(row)
+                        prev_row = row
+                        n_rows += 1
+
+            except zlib.error as e:
+                raise PngError('Error decompressing PNG image data: '
+                               '{}'.format(e))
+
+    if header is None:
+        raise PngError('PNG image has no IHDR chunk')
+
+    if header['interlace_method'] != 0:
+        return PngImageStats(header['width'], header['height'], None, None)
+
+    if n_rows != header['height'] or not decompressor.eof:
+        raise PngError('PNG image data is truncated: {} of {} rows'.format(
+                       n_rows, header['height']))
+
+    return PngImageStats(header['width'], header['height'],
+                         row_stats.n_non_transparent, row_stats.n_colours)
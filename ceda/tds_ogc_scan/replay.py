@@ -0,0 +1,457 @@
+"""Record and replay of HTTP responses for offline scans and benchmarks
+
+RecordingTransport wraps the transport used by the validation and saves
+every response to a ResponseArchive.  The archive is a zip file holding an
+index of the responses as JSON Lines and each distinct response body once,
+compressed.  ReplayTransport serves the responses from an archive in place
+of the network, and ReplayServer serves them over HTTP as a local stand-in
+for the THREDDS server.  Both can add latency and errors to responses so
+that a scan can be run against a slow or failing server.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import sys
+import time
+import json
+import random
+import hashlib
+import logging
+import argparse
+import zipfile
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from six.moves.urllib.parse import urlparse, urlunparse
+
+from ceda.tds_ogc_scan.transport import TRANSPORT_ERRORS
+
+log = logging.getLogger(__name__)
+
+# Headers saved with each response.  Others such as Content-Length and
+# Content-Encoding no longer apply once the body has been decoded
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified',
+                    'Cache-Control', 'Expires')
+
+# Response recorded for a URI.  error is the class name of the transport
+# error raised in place of a response, or None
+RecordedResponse = namedtuple('RecordedResponse',
+                              ('uri', 'status_code', 'headers', 'content',
+                               'error'))
+
+
+class ResponseArchive:
+    '''Archive of recorded responses keyed by URI.  Open with mode 'w' to
+    record responses and 'r' to read them.  Bodies are stored once for any
+    number of responses sharing them, named by their SHA-1 digest.  Bodies
+    read are kept in memory for reuse
+    '''
+    INDEX_NAME = 'index.jsonl'
+    BODY_PATH_TEMPLATE = 'bodies/{}'
+
+    def __init__(self, filepath, mode='r'):
+        if mode not in ('r', 'w'):
+            raise ValueError('Expecting mode "r" or "w"; got {!r}'.format(
+                             mode))
+
+        self.filepath = filepath
+        self.mode = mode
+        self._zip_file = zipfile.ZipFile(filepath, mode=mode,
+                                         compression=zipfile.ZIP_DEFLATED)
+        self._index = {}
+        self._bodies = {}
+        self._body_digests = set()
+        self._lock = threading.Lock()
+
+        if mode == 'r':
+            with self._zip_file.open(self.INDEX_NAME) as index_file:
+                for line in io.TextIOWrapper(index_file, encoding='utf-8'):
+                    record = json.loads(line)
+                    self._index[record['uri']] = record
+
+    @property
+    def uris(self):
+        '''Recorded URIs in the order they were added'''
+        return list(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, uri):
+        return uri in self._index
+
+    def add(self, uri, status_code=None, headers=None, content=b'',
+            error=None):
+        '''Record the response for a URI, replacing any recorded before.
+        Give error instead of a status code for a request which failed'''
+        digest = hashlib.sha1(content).hexdigest()
+        record = {
+            'uri': uri,
+            'status_code': status_code,
+            'headers': dict(headers or {}),
+            'body': digest,
+            'error': error
+        }
+        with self._lock:
+            if digest not in self._body_digests:
+                self._zip_file.writestr(self.BODY_PATH_TEMPLATE.format(digest),
+                                        content)
+                self._body_digests.add(digest)
+
+            self._index[uri] = record
+
+    def get(self, uri):
+        '''Get the RecordedResponse for a URI, or None if none was
+        recorded'''
+        record = self._index.get(uri)
+        if record is None:
+            return None
+
+        return RecordedResponse(uri, record['status_code'],
+                                record['headers'],
+                                self._get_body(record['body']),
+                                record['error'])
+
+    def _get_body(self, digest):
+        with self._lock:
+            content = self._bodies.get(digest)
+            if content is None:
+                content = self._zip_file.read(
+                                    self.BODY_PATH_TEMPLATE.format(digest))
+                self._bodies[digest] = content
+
+        return content
+
+    def close(self):
+        '''Write the index, if recording, and close the archive'''
+        with self._lock:
+            if self._zip_file is None:
+                return
+
+            if self.mode == 'w':
+                self._zip_file.writestr(
+                        self.INDEX_NAME,
+                        ''.join([json.dumps(record) + '\n'
+                                 for record in self._index.values()]))
+                log.info('Recorded {} responses to {}'.format(
+                         len(self._index), self.filepath))
+
+            self._zip_file.close()
+            self._zip_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayResponse:
+    '''Stand-in for requests.Response serving recorded content.  The body
+    can be read from raw in the same way as a streamed response'''
+    def __init__(self, uri, status_code=200, content=b'', headers=None):
+        self.url = uri
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.raw = io.BytesIO(content)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.raw.close()
+
+
+class RecordingTransport:
+    '''Wrap a transport such as HttpTransport, saving each response to a
+    ResponseArchive.  Each body is read in full, up to max_content_size,
+    before the response is returned.  Transport errors are recorded by
+    class name and raised again
+    '''
+    DEFAULT_MAX_CONTENT_SIZE = 16 * 2**20
+    READ_CHUNK_SIZE = 65536
+
+    def __init__(self, transport, archive,
+                 max_content_size=DEFAULT_MAX_CONTENT_SIZE):
+        '''
+        :param transport: transport to which requests are passed
+        :param archive: ResponseArchive opened for writing
+        :param max_content_size: bodies longer than this number of bytes
+        are truncated.  None for no limit
+        '''
+        self.transport = transport
+        self.archive = archive
+        self.max_content_size = max_content_size
+
+    @property
+    def timeout(self):
+        return getattr(self.transport, 'timeout', None)
+
+    def get(self, uri, **kwargs):
+        '''Make a HTTP GET request through the wrapped transport and record
+        the response.  Keywords are passed to its get method'''
+        try:
+            resp = self.transport.get(uri, **kwargs)
+            try:
+                content = self._read_content(resp)
+            finally:
+                resp.close()
+
+        except TRANSPORT_ERRORS as e:
+            self.archive.add(uri, error=type(e).__name__)
+            raise
+
+        headers = {name: resp.headers[name] for name in RECORDED_HEADERS
+                   if name in resp.headers}
+        self.archive.add(uri, resp.status_code, headers, content)
+        return ReplayResponse(uri, resp.status_code, content, headers)
+
+    def _read_content(self, resp):
+        chunks = []
+        n_bytes = 0
+        for chunk in resp.iter_content(chunk_size=self.READ_CHUNK_SIZE):
+            chunks.append(chunk)
+            n_bytes += len(chunk)
+            if (self.max_content_size is not None and
+                n_bytes >= self.max_content_size):
+                break
+
+        return b''.join(chunks)[:self.max_content_size]
+
+    def close(self):
+        self.transport.close()
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FaultInjector:
+    '''Delay responses and replace a fraction of them with errors'''
+    ERROR_STATUS_CODE = 503
+
+    def __init__(self, latency=0., jitter=0., error_rate=0., seed=None,
+                 sleep=time.sleep):
+        '''
+        :param latency: delay in seconds added to every response
+        :param jitter: a further random delay of up to this many seconds
+        :param error_rate: fraction of responses replaced with a 503 error
+        :param seed: seed for the random jitter and choice of errors
+        '''
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self):
+        '''Wait for the injected latency.  Returns True if an error should
+        be given in place of the response'''
+        with self._lock:
+            delay = self.latency + self._random.uniform(0., self.jitter)
+            error = self._random.random() < self.error_rate
+
+        if delay > 0.:
+            self._sleep(delay)
+
+        return error
+
+
+class ReplayTransport:
+    '''Transport serving recorded responses from an archive in place of the
+    network.  URIs not recorded give a 404 response.  Any object with a
+    get method returning a RecordedResponse or None can be used as the
+    archive
+    '''
+    def __init__(self, archive, fault_injector=None):
+        '''
+        :param archive: ResponseArchive opened for reading
+        :param fault_injector: FaultInjector adding latency and errors to
+        responses, or None to serve them as recorded
+        '''
+        self.archive = archive
+        self.fault_injector = fault_injector or FaultInjector()
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+    def get(self, uri, **kwargs):
+        '''Get the recorded response for a URI.  Keywords are ignored
+
+        :raises requests.RequestException: if a transport error was
+        recorded for the URI
+        '''
+        with self._lock:
+            self.n_requests += 1
+
+        if self.fault_injector.apply():
+            return ReplayResponse(uri, FaultInjector.ERROR_STATUS_CODE,
+                                  b'Injected error')
+
+        recorded_resp = self.archive.get(uri)
+        if recorded_resp is None:
+            return ReplayResponse(uri, 404, b'Not recorded')
+
+        if recorded_resp.error is not None:
+            error_cls = getattr(requests.exceptions, recorded_resp.error,
+                                requests.RequestException)
+            raise error_cls('Recorded {} for {}'.format(recorded_resp.error,
+                                                        uri))
+
+        return ReplayResponse(uri, recorded_resp.status_code,
+                              recorded_resp.content, recorded_resp.headers)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_base_uri(uri):
+    '''Get the scheme and host part of a URI'''
+    parsed_uri = urlparse(uri)
+    return urlunparse([parsed_uri.scheme, parsed_uri.netloc, '', '', '', ''])
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    '''Serve the recorded response for the request path appended to the
+    server's base URI'''
+
+    def do_GET(self):
+        if self.server.fault_injector.apply():
+            self._send(FaultInjector.ERROR_STATUS_CODE, b'Injected error')
+            return
+
+        recorded_resp = self.server.archive.get(self.server.base_uri +
+                                                self.path)
+        if recorded_resp is None:
+            self._send(404, b'Not recorded')
+
+        elif recorded_resp.error is not None:
+            # Drop the connection without a response
+            self.close_connection = True
+        else:
+            self._send(recorded_resp.status_code, recorded_resp.content,
+                       recorded_resp.headers)
+
+    def _send(self, status_code, content, headers=None):
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    '''HTTP server replaying recorded responses as a local stand-in for the
+    server they were recorded from.  Links in the recorded catalogues which
+    are relative or absolute paths resolve to this server
+    '''
+    daemon_threads = True
+    protocol_version = 'HTTP/1.1'
+    DEFAULT_ADDRESS = '127.0.0.1'
+
+    def __init__(self, address, archive, base_uri, fault_injector=None):
+        '''
+        :param address: (host, port) to listen on
+        :param archive: ResponseArchive opened for reading
+        :param base_uri: scheme and host of the recorded URIs e.g.
+        http://my-thredds-data-server
+        :param fault_injector: FaultInjector adding latency and errors to
+        responses, or None to serve them as recorded
+        '''
+        super().__init__(address, ReplayRequestHandler)
+        self.archive = archive
+        self.base_uri = base_uri.rstrip('/')
+        self.fault_injector = fault_injector or FaultInjector()
+
+    @property
+    def uri(self):
+        '''URI of this server to use in place of the base URI'''
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+
+def _make_arg_parser():
+    parser = argparse.ArgumentParser(
+        description='Serve responses recorded with ceda_tds_ogc_scan '
+                    '--record as a local stand-in for the THREDDS server')
+
+    parser.add_argument('archive', help='archive of recorded responses')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='port to listen on (default: %(default)s)')
+    parser.add_argument('--address', default=ReplayServer.DEFAULT_ADDRESS,
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('--base-uri', default=None,
+                        help='scheme and host of the recorded URIs to serve '
+                             '(default: those of the first URI recorded)')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='delay in seconds added to every response '
+                             '(default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='a further random delay of up to this many '
+                             'seconds (default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='fraction of requests answered with a 503 '
+                             'error (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for the random jitter and errors')
+    return parser
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = _make_arg_parser().parse_args()
+
+    with ResponseArchive(args.archive) as archive:
+        if len(archive) == 0:
+            sys.exit('No responses recorded in {}'.format(args.archive))
+
+        base_uri = args.base_uri or get_base_uri(archive.uris[0])
+        fault_injector = FaultInjector(latency=args.latency,
+                                       jitter=args.jitter,
+                                       error_rate=args.error_rate,
+                                       seed=args.seed)
+        server = ReplayServer((args.address, args.port), archive, base_uri,
+                              fault_injector=fault_injector)
+        log.info('Replaying {} responses for {} at {}'.format(
+                 len(archive), base_uri, server.uri))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
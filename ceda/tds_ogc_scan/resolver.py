@@ -0,0 +1,155 @@
+"""Memoized resolution of THREDDS catalogues
+
+The catalogue references of a catalogue and the OGC endpoint URIs published
+by a sub-catalogue are held for a limited time so that each catalogue is
+read once per monitoring cycle however many checks use it.  Resolved values
+are kept in a bounded in-memory LRU and optionally in a SQLite file shared
+between processes, for example the WMS and WCS Nagios checks.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class CatalogResolver:
+    '''Memoize resolved catalogue content with a time to live
+
+    Hits and misses are counted in the stats attribute
+    '''
+    DB_FILENAME = 'catalog-resolver.sqlite'
+    DEFAULT_TTL = 600.
+    DEFAULT_MAX_ENTRIES = 10000
+
+    CATALOG_REFS = 'catalog_refs'
+    OGC_URIS = 'ogc_uris'
+
+    def __init__(self, filepath=None, ttl=DEFAULT_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        '''
+        :param filepath: path to a SQLite file in which to share resolved
+        values between processes.  It is created if it doesn't already
+        exist.  If None, values are held in memory only
+        :param ttl: time in seconds for which a resolved value is used.  Set
+        this to the monitoring cycle
+        :param max_entries: maximum number of values held in memory and in
+        the file
+        '''
+        self.filepath = filepath
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = Counter()
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        self._db = None
+        if filepath is not None:
+            dirpath = os.path.dirname(filepath)
+            if dirpath and not os.path.isdir(dirpath):
+                os.makedirs(dirpath)
+
+            self._db = sqlite3.connect(filepath, check_same_thread=False)
+            with self._db:
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS resolved_catalog ('
+                    'kind TEXT NOT NULL, '
+                    'uri TEXT NOT NULL, '
+                    'value TEXT NOT NULL, '
+                    'resolved REAL NOT NULL, '
+                    'PRIMARY KEY (kind, uri))')
+                self._db.execute(
+                    'CREATE INDEX IF NOT EXISTS resolved_catalog_resolved '
+                    'ON resolved_catalog (resolved)')
+
+    def _get(self, kind, uri):
+        now = time.time()
+        key = (kind, uri)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, resolved = entry
+                if now - resolved < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return value
+
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, resolved FROM resolved_catalog '
+                    'WHERE kind = ? AND uri = ? AND resolved > ?',
+                    (kind, uri, now - self.ttl)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._set_entry(key, value, row[1])
+                    self.stats['hits'] += 1
+                    return value
+
+            self.stats['misses'] += 1
+            return None
+
+    def _set_entry(self, key, value, resolved):
+        self._entries[key] = (value, resolved)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _put(self, kind, uri, value):
+        now = time.time()
+        with self._lock:
+            self._set_entry((kind, uri), value, now)
+
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO resolved_catalog '
+                        '(kind, uri, value, resolved) VALUES (?, ?, ?, ?)',
+                        (kind, uri, json.dumps(value), now))
+                    self._db.execute(
+                        'DELETE FROM resolved_catalog WHERE resolved <= ?',
+                        (now - self.ttl,))
+                    self._db.execute(
+                        'DELETE FROM resolved_catalog WHERE rowid IN ('
+                        'SELECT rowid FROM resolved_catalog '
+                        'ORDER BY resolved DESC LIMIT -1 OFFSET ?)',
+                        (self.max_entries,))
+
+    def get_catalog_ref_uris(self, uri):
+        '''Get a list of the catalogue reference URIs for a catalogue or None
+        if not resolved within the TTL'''
+        return self._get(self.CATALOG_REFS, uri)
+
+    def set_catalog_ref_uris(self, uri, catalog_ref_uris):
+        self._put(self.CATALOG_REFS, uri, list(catalog_ref_uris))
+
+    def get_ogc_uris(self, catalog_uri):
+        '''Get a dictionary of OGC endpoint URIs keyed by service type for a
+        catalogue or None if not resolved within the TTL'''
+        return self._get(self.OGC_URIS, catalog_uri)
+
+    def set_ogc_uris(self, catalog_uri, ogc_uris):
+        self._put(self.OGC_URIS, catalog_uri, dict(ogc_uris))
+
+    def clear(self):
+        '''Remove all resolved values'''
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                with self._db:
+                    self._db.execute('DELETE FROM resolved_catalog')
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
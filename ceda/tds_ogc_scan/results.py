@@ -0,0 +1,204 @@
+"""Structured results for OGC endpoint checks
+
+A compact record is made for each request made by the validation.  Records
+are passed to result sinks as they are produced: writers which stream them
+to a JSON Lines or CSV file and a summary which keeps aggregate counts, so
+that nothing is held in memory per record.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import csv
+import json
+import logging
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+log = logging.getLogger(__name__)
+
+# Operations
+CATALOG = 'Catalog'
+WMS_GET_CAPABILITIES = 'WMS GetCapabilities'
+WMS_GET_MAP = 'WMS GetMap'
+WCS_GET_CAPABILITIES = 'WCS GetCapabilities'
+WCS_DESCRIBE_COVERAGE = 'WCS DescribeCoverage'
+WCS_GET_COVERAGE = 'WCS GetCoverage'
+
+# GetMap for a batch of layers.  A failed batch is split and its layers
+# checked again, so it only locates failures: these are not counted as checks
+WMS_GET_MAP_BATCH = 'WMS GetMap batch'
+PROBE_OPERATIONS = frozenset((WMS_GET_MAP_BATCH,))
+
+# Error classes other than those named after transport exceptions
+HTTP_ERROR = 'HTTPError'
+PARSE_ERROR = 'ParseError'
+NO_LAYERS_ERROR = 'NoLayers'
+SERVICE_EXCEPTION_ERROR = 'ServiceException'
+CONTENT_TYPE_ERROR = 'ContentTypeError'
+IMAGE_ERROR = 'ImageError'
+BLANK_TILE_ERROR = 'BlankTile'
+COVERAGE_FORMAT_ERROR = 'CoverageFormatError'
+
+# Error class for requests not made because their host was unhealthy.  Named
+# after host_health.HostUnhealthyError
+HOST_UNHEALTHY_ERROR = 'HostUnhealthyError'
+
+RESULT_FIELD_NAMES = ('uri', 'operation', 'status_code', 'elapsed', 'ttfb',
+                      'parse_time', 'n_bytes', 'error')
+
+
+class EndpointCheckResult(namedtuple('EndpointCheckResult',
+                                     RESULT_FIELD_NAMES)):
+    '''Result of a single request made when checking an endpoint.  error is
+    the name of the class of error or None if the check passed.  Times are in
+    seconds: elapsed is the total time, ttfb the time until the response
+    headers were received and parse_time the time reading and parsing the
+    response body.  ttfb and parse_time are None where they don't apply
+    '''
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def stats_ok(stats):
+    '''Return True if every test counted in stats succeeded.  Counts of tests
+    are keyed '<name>_tested' or '<name>_uris_tested' with the corresponding
+    count of successes keyed '<name>_ok'
+    '''
+    for name, n_tested in stats.items():
+        if name.endswith('_uris_tested'):
+            ok_name = name[:-len('_uris_tested')] + '_ok'
+        elif name.endswith('_tested'):
+            ok_name = name[:-len('_tested')] + '_ok'
+        else:
+            continue
+
+        if stats.get(ok_name, 0) < n_tested:
+            return False
+
+    return True
+
+
+class ResultWriter:
+    '''Base class for writers streaming results to a file'''
+    def __init__(self, file):
+        '''file is a path or an open text file'''
+        if isinstance(file, str):
+            self.file = open(file, 'w', newline='')
+            self._close_file = True
+        else:
+            self.file = file
+            self._close_file = False
+
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            self._write(result)
+
+    def _write(self, result):
+        raise NotImplementedError()
+
+    def close(self):
+        if self._close_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class JsonLinesResultWriter(ResultWriter):
+    '''Write each result as a JSON object on its own line'''
+    def _write(self, result):
+        self.file.write(json.dumps(OrderedDict(zip(RESULT_FIELD_NAMES,
+                                                   result))))
+        self.file.write('\n')
+
+
+def iter_json_lines_results(file):
+    '''Yield an EndpointCheckResult for each line of a file written by
+    JsonLinesResultWriter.  file is a path or an open text file'''
+    if isinstance(file, str):
+        with open(file) as json_lines_file:
+            for result in iter_json_lines_results(json_lines_file):
+                yield result
+        return
+
+    for line in file:
+        if line.strip():
+            record = json.loads(line)
+            yield EndpointCheckResult(*[record.get(name)
+                                        for name in RESULT_FIELD_NAMES])
+
+
+class CsvResultWriter(ResultWriter):
+    '''Write results as CSV with a header row'''
+    def __init__(self, file):
+        super().__init__(file)
+        self._csv_writer = csv.writer(self.file)
+        self._csv_writer.writerow(RESULT_FIELD_NAMES)
+
+    def _write(self, result):
+        self._csv_writer.writerow(result)
+
+
+def make_result_writer(filepath):
+    '''Make a JSON Lines or CSV writer depending on the file extension'''
+    if filepath.lower().endswith('.csv'):
+        return CsvResultWriter(filepath)
+
+    return JsonLinesResultWriter(filepath)
+
+
+class ResultSummary:
+    '''Aggregate results by operation.  Failures of probe operations such as
+    batched GetMap requests are counted but are not errors'''
+    def __init__(self):
+        self.n_tested = Counter()
+        self.n_failed = Counter()
+        self.n_bytes = Counter()
+        self.elapsed = Counter()
+        self.errors = Counter()
+        self.n_skipped = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            self.n_tested[result.operation] += 1
+            self.n_bytes[result.operation] += result.n_bytes or 0
+            self.elapsed[result.operation] += result.elapsed
+            if not result.ok:
+                self.n_failed[result.operation] += 1
+                if result.operation in PROBE_OPERATIONS:
+                    return
+
+                self.errors[(result.operation, result.error)] += 1
+                if result.error == HOST_UNHEALTHY_ERROR:
+                    self.n_skipped[result.operation] += 1
+
+    @property
+    def ok(self):
+        return not any(n_failed for operation, n_failed in
+                       self.n_failed.items()
+                       if operation not in PROBE_OPERATIONS)
+
+    def log(self):
+        log.info("Results by operation")
+        log.info("====================")
+        for operation in sorted(self.n_tested):
+            n_tested = self.n_tested[operation]
+            log.info('{}: {} calls, {} failed, mean time {:.3f}s, {} bytes '
+                     'in total'.format(operation, n_tested,
+                                       self.n_failed[operation],
+                                       self.elapsed[operation] / n_tested,
+                                       self.n_bytes[operation]))
+
+        for (operation, error), n_errors in sorted(self.errors.items()):
+            log.info('{}: {} x {}'.format(operation, n_errors, error))
+
+        for operation, n_skipped in sorted(self.n_skipped.items()):
+            log.info('{}: {} skipped: host unhealthy'.format(operation,
+                                                             n_skipped))
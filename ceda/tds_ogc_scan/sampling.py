@@ -0,0 +1,174 @@
+"""Sampling of layers and tiles for WMS GetMap checks
+
+Choose which layers of a WMS endpoint to request and, for each layer, a set
+of tiles covering different parts of its geographic extent and different
+values of its time and elevation dimensions.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import random
+import logging
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Parameters for a single GetMap request.  bbox is a (west, south, east,
+# north) tuple in CRS:84 or None for the whole globe.  time and elevation are
+# None to use the server default
+GetMapRequest = namedtuple('GetMapRequest',
+                           ('layer_name', 'bbox', 'time', 'elevation'))
+
+
+def get_dimension_values(dimension):
+    '''Get a list of values from a (default, values) dimension tuple from
+    WmsLayer.dimensions.  Values are separated by commas.  For an interval of
+    the form start/end/resolution, the start and end are used
+    '''
+    default, values_text = dimension
+    values = []
+    for value in values_text.split(','):
+        value = value.strip()
+        if not value:
+            continue
+
+        if '/' in value:
+            values.extend(value.split('/')[:2])
+        else:
+            values.append(value)
+
+    if not values and default:
+        values.append(default)
+
+    return values
+
+
+class GetMapSampler:
+    '''Select layers and tiles for GetMap requests
+
+    Layers are selected with one of the following strategies:
+
+    first: the first n_layers layers in the capabilities document
+    all: every layer
+    random: n_layers chosen at random
+    stratified: the layers are split in document order into n_layers groups
+    of similar size and one layer chosen at random from each.  This spreads
+    the sample across the datasets of an aggregated endpoint
+
+    The first tile for each layer covers the whole of the layer's bounding
+    box with the default time and elevation.  Further tiles cover a random
+    quarter of the bounding box with time and elevation values spread evenly
+    across the layer's dimension values
+    '''
+    FIRST = 'first'
+    ALL = 'all'
+    RANDOM = 'random'
+    STRATIFIED = 'stratified'
+    LAYER_SELECTIONS = (FIRST, ALL, RANDOM, STRATIFIED)
+
+    GLOBAL_BBOX = (-180., -90., 180., 90.)
+
+    def __init__(self, layer_selection=FIRST, n_layers=1, n_tiles=1,
+                 seed=None):
+        '''
+        :param layer_selection: one of LAYER_SELECTIONS
+        :param n_layers: number of layers to select.  Ignored for all
+        :param n_tiles: number of tiles to request for each layer
+        :param seed: seed for random selection of layers and tiles
+        '''
+        if layer_selection not in self.LAYER_SELECTIONS:
+            raise ValueError('Invalid layer selection {!r}: expecting one '
+                             'of {}'.format(layer_selection,
+                                            ', '.join(self.LAYER_SELECTIONS)))
+
+        self.layer_selection = layer_selection
+        self.n_layers = n_layers
+        self.n_tiles = n_tiles
+        self._random = random.Random(seed)
+
+    @property
+    def max_layers(self):
+        '''Number of layers which need to be read from the capabilities
+        document or None if all are needed'''
+        if self.layer_selection == self.FIRST:
+            return self.n_layers
+
+        return None
+
+    def is_default(self):
+        '''Return True if only the first layer of an endpoint is requested
+        with a single tile'''
+        return (self.layer_selection == self.FIRST and self.n_layers == 1 and
+                self.n_tiles == 1)
+
+    def select_layers(self, layers):
+        '''Select layers from a list in document order'''
+        layers = list(layers)
+        n_layers = min(self.n_layers, len(layers))
+
+        if self.layer_selection == self.ALL:
+            return layers
+
+        if self.layer_selection == self.FIRST:
+            return layers[:n_layers]
+
+        if self.layer_selection == self.RANDOM:
+            return self._random.sample(layers, n_layers)
+
+        # Stratified
+        selected_layers = []
+        for i in range(n_layers):
+            start = i * len(layers) // n_layers
+            end = (i + 1) * len(layers) // n_layers
+            selected_layers.append(layers[self._random.randrange(start, end)])
+
+        return selected_layers
+
+    def _get_sub_bbox(self, bbox):
+        west, south, east, north = bbox
+        width = (east - west) / 2.
+        height = (north - south) / 2.
+        sub_west = west + self._random.random() * width
+        sub_south = south + self._random.random() * height
+        return (sub_west, sub_south, sub_west + width, sub_south + height)
+
+    @staticmethod
+    def _spread(values, i, n):
+        '''Pick the ith of n values spread evenly across a list'''
+        if not values:
+            return None
+
+        if n <= 1:
+            return values[0]
+
+        return values[int(round(i * (len(values) - 1) / float(n - 1)))]
+
+    def get_tiles(self, layer):
+        '''Get a list of GetMapRequest for a WmsLayer'''
+        tiles = [GetMapRequest(layer.name, layer.bbox, None, None)]
+
+        bbox = layer.bbox or self.GLOBAL_BBOX
+        time_values = get_dimension_values(
+                                layer.dimensions.get('time', (None, '')))
+        elevation_values = get_dimension_values(
+                                layer.dimensions.get('elevation', (None, '')))
+
+        n_extra_tiles = self.n_tiles - 1
+        for i in range(n_extra_tiles):
+            tiles.append(GetMapRequest(
+                            layer.name,
+                            self._get_sub_bbox(bbox),
+                            self._spread(time_values, i, n_extra_tiles),
+                            self._spread(elevation_values, i, n_extra_tiles)))
+
+        return tiles
+
+    def get_requests(self, layers):
+        '''Get a list of GetMapRequest for the layers of an endpoint'''
+        requests = []
+        for layer in self.select_layers(layers):
+            requests.extend(self.get_tiles(layer))
+
+        return requests
@@ -9,44 +9,679 @@ __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = '$Id$'
 import sys
 import os
+import shutil
 import logging
+import argparse
+import tempfile
+import functools
+from collections import Counter
 
 from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.transport import HttpTransport
+from ceda.tds_ogc_scan.host_health import (HostControlledTransport,
+                                           AimdConcurrencyLimiter,
+                                           CircuitBreaker)
+from ceda.tds_ogc_scan.hedging import HedgedTransport
+from ceda.tds_ogc_scan.replay import (ResponseArchive, RecordingTransport,
+                                      ReplayTransport)
+from ceda.tds_ogc_scan.cache import CatalogResponseCache
+from ceda.tds_ogc_scan.resolver import CatalogResolver
+from ceda.tds_ogc_scan.crawler import ThreddsCatalogCrawler
+from ceda.tds_ogc_scan.state import ScanStateStore
+from ceda.tds_ogc_scan.metrics import PerformanceSummary
+from ceda.tds_ogc_scan.exporter import OgcTdsExporter
+from ceda.tds_ogc_scan.sampling import GetMapSampler
+from ceda.tds_ogc_scan.entry_sampling import (EntrySampler,
+                                              RotatingEntrySampler)
+from ceda.tds_ogc_scan.concurrency import HostConcurrencyLimiter
+from ceda.tds_ogc_scan.sharding import Shard, run_shards
+from ceda.tds_ogc_scan.pipeline import ScanPipeline
+from ceda.tds_ogc_scan.manifest import (EndpointManifest,
+                                        EndpointManifestError,
+                                        compile_manifest)
+from ceda.tds_ogc_scan.results import (ResultSummary, make_result_writer,
+                                       stats_ok, JsonLinesResultWriter,
+                                       iter_json_lines_results)
 
+log = logging.getLogger(__name__)
 
-def main():
-    logging.basicConfig(level=logging.INFO)
+
+def _parse_shard(text):
+    try:
+        return Shard.parse(text)
+
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _make_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description='Scan a THREDDS catalogue and test the WMS and WCS '
+                    'endpoints it publishes',
+        epilog='Run "%(prog)s compile --manifest FILE URI" to write a '
+               'manifest of the endpoints of a catalogue for use with '
+               '--manifest')
+
+    parser.add_argument('uri', help='URI to TDS catalogue path to scan')
+    parser.add_argument('catalog_entries', nargs='*',
+                        help='list of catalogue entries to test or a number n '
+                             'to test a random sample of n entries from the '
+                             'catalogue')
+
+    parser.add_argument('--max-workers', type=int, default=1,
+                        help='number of workers for each stage of the scan: '
+                             'sub-catalogues read, WMS endpoints checked and '
+                             'WCS endpoints checked concurrently (default: '
+                             '%(default)s)')
+    parser.add_argument('--max-workers-per-host', type=int, default=None,
+                        help='limit on the number of requests in progress '
+                             'in each stage of the scan against any one host '
+                             '(default: no limit)')
+    parser.add_argument('--catalog-workers', type=int, default=None,
+                        help='number of sub-catalogues to read concurrently '
+                             '(default: --max-workers)')
+    parser.add_argument('--wms-workers', type=int, default=None,
+                        help='number of WMS endpoints to check concurrently '
+                             '(default: --max-workers)')
+    parser.add_argument('--wcs-workers', type=int, default=None,
+                        help='number of WCS endpoints to check concurrently '
+                             '(default: --max-workers)')
+    parser.add_argument('--queue-size', type=int,
+                        default=ScanPipeline.DEFAULT_QUEUE_SIZE,
+                        help='maximum number of catalogue references read '
+                             'ahead of the sub-catalogues being checked '
+                             '(default: %(default)s)')
+
+    parser.add_argument('--manifest', default=None,
+                        help='take the catalogue references and their '
+                             'endpoints from a manifest made with the '
+                             'compile command in place of reading the '
+                             'catalogues.  With compile, the manifest to '
+                             'write')
+
+    parser.add_argument('--shard', type=_parse_shard, default=None,
+                        metavar='I/N',
+                        help='test only the catalogue entries in shard I of '
+                             'N, numbered from 1.  Entries are assigned to '
+                             'shards by a hash of their URI so that N hosts '
+                             'can each scan a shard with no coordination')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='split the catalogue entries into this number '
+                             'of shards and scan each in its own process, '
+                             'merging the results into one summary.  A '
+                             'random sample is divided between the shards')
+
+    parser.add_argument('--recursive', action='store_true',
+                        help='follow catalogue references recursively and '
+                             'test every WMS and WCS endpoint found')
+    parser.add_argument('--max-depth', type=int,
+                        default=ThreddsCatalogCrawler.DEFAULT_MAX_DEPTH,
+                        help='with --recursive, the maximum number of '
+                             'catalogue references to follow (default: '
+                             '%(default)s)')
+    parser.add_argument('--max-pages', type=int,
+                        default=ThreddsCatalogCrawler.DEFAULT_MAX_PAGES,
+                        help='with --recursive, the maximum number of '
+                             'catalogues to read (default: %(default)s)')
+
+    parser.add_argument('--wms-layers', default=GetMapSampler.FIRST,
+                        choices=GetMapSampler.LAYER_SELECTIONS,
+                        help='how to choose the layers of each WMS endpoint '
+                             'to test with GetMap: the first '
+                             '--wms-n-layers, all, a random sample or a '
+                             'sample stratified over the capabilities '
+                             'document (default: %(default)s)')
+    parser.add_argument('--wms-n-layers', type=int, default=1,
+                        help='number of layers of each WMS endpoint to test '
+                             '(default: %(default)s)')
+    parser.add_argument('--wms-n-tiles', type=int, default=1,
+                        help='number of GetMap tiles to request for each '
+                             'layer.  Tiles after the first cover part of the '
+                             'layer extent at different times and elevations '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for the random choice of catalogue '
+                             'entries, GetMap layers and tiles')
+    parser.add_argument('--wms-batch-size', type=int, default=None,
+                        help='request up to this number of layers together '
+                             'in each GetMap.  A batch which fails is split '
+                             'in two until the layers which fail are found '
+                             '(default: one layer per request)')
+    parser.add_argument('--get-map-max-workers', type=int, default=1,
+                        help='number of GetMap requests to make concurrently '
+                             'for each WMS endpoint (default: %(default)s)')
+    parser.add_argument('--get-map-max-workers-per-host', type=int,
+                        default=None,
+                        help='limit on the number of GetMap requests in '
+                             'progress against any one host across all '
+                             'endpoints (default: no limit)')
+    parser.add_argument('--wcs-n-coverages', type=int,
+                        default=OgcTdsValidation.wcs_max_coverages,
+                        help='number of coverages of each WCS endpoint to '
+                             'test with DescribeCoverage and GetCoverage.  '
+                             'Set to 0 to test all coverages (default: '
+                             '%(default)s)')
+    parser.add_argument('--wcs-max-bytes', type=int,
+                        default=OgcTdsValidation.get_coverage_max_bytes,
+                        help='stop reading each GetCoverage response after '
+                             'this number of bytes (default: %(default)s)')
+
+    parser.add_argument('--state-file', default=None,
+                        help='file in which to record the outcome of checking '
+                             'each catalogue entry')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip catalogue entries which are unchanged and '
+                             'passed all their checks within the freshness '
+                             'window.  Requires --state-file')
+    parser.add_argument('--freshness', type=float,
+                        default=ScanStateStore.DEFAULT_FRESHNESS,
+                        help='time in seconds for which a passed check '
+                             'remains valid for an unchanged catalogue entry '
+                             '(default: %(default)s)')
+
+    parser.add_argument('--sample-state', default=None,
+                        help='with a random sample of n entries, file in '
+                             'which to record the entries tested in each run '
+                             'so that every entry is tested at least once '
+                             'every --sample-runs runs.  The rest of the '
+                             'sample favours entries which failed or were '
+                             'slow')
+    parser.add_argument('--sample-runs', type=int,
+                        default=RotatingEntrySampler.DEFAULT_N_RUNS,
+                        help='with --sample-state, the number of runs in '
+                             'which every catalogue entry is tested '
+                             '(default: %(default)s)')
+
+    parser.add_argument('--report', nargs='?', default=None,
+                        const=OgcTdsValidation.REPORT_FILEPATH,
+                        help='write a record of each endpoint check to this '
+                             'file as JSON Lines, or as CSV if the file '
+                             'extension is .csv (default file: '
+                             '%(const)s)')
+    parser.add_argument('--n-slowest', type=int,
+                        default=PerformanceSummary.DEFAULT_N_SLOWEST,
+                        help='number of slowest requests to list in the '
+                             'summary (default: %(default)s)')
+
+    parser.add_argument('--serve-metrics', type=int, default=None,
+                        metavar='PORT',
+                        help='run continuously, scanning the catalogue every '
+                             '--scan-interval seconds, and serve Prometheus '
+                             'metrics for the latest scan on this port')
+    parser.add_argument('--metrics-address',
+                        default=OgcTdsExporter.DEFAULT_ADDRESS,
+                        help='with --serve-metrics, the address to listen on '
+                             '(default: %(default)s)')
+    parser.add_argument('--scan-interval', type=float,
+                        default=OgcTdsExporter.DEFAULT_SCAN_INTERVAL,
+                        help='with --serve-metrics, time in seconds between '
+                             'the start of each scan (default: %(default)s)')
+
+    parser.add_argument('--pool-size', type=int, default=None,
+                        help='number of HTTP connections kept open per host '
+                             '(default: the larger of the number of requests '
+                             'which can be in progress at once and {})'.format(
+                                        HttpTransport.DEFAULT_POOL_SIZE))
+    parser.add_argument('--connect-timeout', type=float,
+                        default=HttpTransport.DEFAULT_CONNECT_TIMEOUT,
+                        help='HTTP connect timeout in seconds (default: '
+                             '%(default)s)')
+    parser.add_argument('--read-timeout', type=float,
+                        default=HttpTransport.DEFAULT_READ_TIMEOUT,
+                        help='HTTP read timeout in seconds (default: '
+                             '%(default)s)')
+    parser.add_argument('--request-timeout', type=float, default=None,
+                        help='time in seconds allowed for each request '
+                             'from when it is made until its response has '
+                             'been read.  Requests taking longer fail '
+                             '(default: no limit)')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='stop the scan after this many seconds, '
+                             'reporting the results of the catalogue '
+                             'entries tested so far and listing those left '
+                             'untested (default: no deadline)')
+    parser.add_argument('--max-retries', type=int,
+                        default=HttpTransport.DEFAULT_MAX_RETRIES,
+                        help='number of retries for connection errors and '
+                             '502, 503 and 504 responses, made after a '
+                             'random exponential delay.  Read timeouts are '
+                             'not retried (default: %(default)s)')
+    parser.add_argument('--hedge-quantile', type=float, default=None,
+                        help='duplicate a request not answered within this '
+                             'quantile of the latency of its operation, '
+                             'e.g. 0.95, using whichever response comes '
+                             'first.  Latencies are learned during the scan '
+                             '(default: no hedging)')
+    parser.add_argument('--hedge-max-ratio', type=float,
+                        default=HedgedTransport.DEFAULT_MAX_HEDGE_RATIO,
+                        help='with --hedge-quantile, maximum number of '
+                             'duplicate requests as a fraction of all '
+                             'requests (default: %(default)s)')
+    parser.add_argument('--no-keep-alive', dest='keep_alive',
+                        action='store_false',
+                        help='close HTTP connections after each request')
+    parser.add_argument('--host-rate-limit', type=float, default=None,
+                        help='maximum number of requests per second to any '
+                             'one host (default: no limit)')
+    parser.add_argument('--host-burst', type=int, default=None,
+                        help='with --host-rate-limit, number of requests '
+                             'which can be made to a host at once before the '
+                             'rate applies (default: the rate)')
+    parser.add_argument('--host-max-concurrency', type=int, default=None,
+                        help='maximum number of requests in progress '
+                             'against any one host.  The limit is reduced '
+                             'while a host is slow or failing and restored '
+                             'as it recovers (default: the pool size)')
+    parser.add_argument('--latency-target', type=float,
+                        default=AimdConcurrencyLimiter.DEFAULT_LATENCY_TARGET,
+                        help='average time in seconds to receive response '
+                             'headers above which requests in progress '
+                             'against a host are reduced (default: '
+                             '%(default)s)')
+    parser.add_argument('--breaker-threshold', type=int, default=0,
+                        help='number of consecutive failed requests to a '
+                             'host, counting connection errors, timeouts '
+                             'and 502, 503 and 504 responses, after which '
+                             'further checks against it are skipped.  0 to '
+                             'never skip checks (default: %(default)s)')
+    parser.add_argument('--breaker-reset', type=float,
+                        default=CircuitBreaker.DEFAULT_RESET_TIMEOUT,
+                        help='time in seconds after which a trial request '
+                             'is made to a host whose checks are being '
+                             'skipped (default: %(default)s)')
+
+    parser.add_argument('--record', default=None, metavar='ARCHIVE',
+                        help='save every response received to this archive '
+                             'so that the scan can be replayed offline')
+    parser.add_argument('--replay', default=None, metavar='ARCHIVE',
+                        help='serve responses from an archive saved with '
+                             '--record in place of the THREDDS server')
+
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory for a persistent cache of catalogue '
+                             'responses (default: no caching)')
+    parser.add_argument('--cache-max-size', type=int,
+                        default=CatalogResponseCache.DEFAULT_MAX_SIZE // 2**20,
+                        help='maximum size of the catalogue cache in MiB '
+                             '(default: %(default)s)')
+    parser.add_argument('--cache-ttl', type=float, default=None,
+                        help='time in seconds to use cached catalogues '
+                             'without revalidating them with the server '
+                             '(default: revalidate on every use unless the '
+                             'server sets a max-age)')
+    parser.add_argument('--resolver-ttl', type=float, default=None,
+                        help='time in seconds for which catalogue references '
+                             'and endpoint URIs read from catalogues are '
+                             'reused.  They are shared between processes '
+                             'through a file in --cache-dir if set (default: '
+                             'read catalogues every time)')
+    return parser
+
+
+def _configure_logging(prefix=''):
+    logging.basicConfig(level=logging.INFO,
+                        format=prefix + logging.BASIC_FORMAT)
 
     # Suppress requests logging
     requests_logger = logging.getLogger(
                                 'requests.packages.urllib3.connectionpool')
     requests_logger.setLevel(logging.WARNING)
 
-    if len(sys.argv) < 2:
-        raise SystemExit('Usage: {} <URI to TDS catalogue path to scan> '
-                         '(<list of catalogue entries to test>|'
-                         '<test n random sample of entries from the '
-                         'catalogue>)'.format(os.path.basename(sys.argv[0])))
+
+def _get_catalog_entry_selection(args):
+    '''Get the catalogue entries filter and random sample size from the
+    positional arguments'''
+    if len(args.catalog_entries) == 1 and args.catalog_entries[0].isdigit():
+        return None, int(args.catalog_entries[0])
+
+    elif len(args.catalog_entries) > 0:
+        return args.catalog_entries, None
+
+    return None, None
+
+
+def _get_check_kwargs(args):
+    '''Get the number of workers for each stage of the scan pipeline, the
+    queue size and the deadline as keywords for OgcTdsValidation.check'''
+    return {
+        'catalog_workers': args.catalog_workers or args.max_workers,
+        'wms_workers': args.wms_workers or args.max_workers,
+        'wcs_workers': args.wcs_workers or args.max_workers,
+        'queue_size': args.queue_size,
+        'deadline': args.deadline
+    }
+
+
+def configure_validation(args):
+    '''Set up the transport, caches, state and sampling used by
+    OgcTdsValidation from the command line arguments'''
+    pool_size = args.pool_size
+    if pool_size is None:
+        check_kwargs = _get_check_kwargs(args)
+        pool_size = max(check_kwargs['catalog_workers'] +
+                        check_kwargs['wms_workers'] *
+                        args.get_map_max_workers +
+                        check_kwargs['wcs_workers'],
+                        HttpTransport.DEFAULT_POOL_SIZE)
+
+    if args.replay is not None:
+        transport = ReplayTransport(ResponseArchive(args.replay))
     else:
-        uri = sys.argv[1]
+        transport = HttpTransport(pool_size=pool_size,
+                                  connect_timeout=args.connect_timeout,
+                                  read_timeout=args.read_timeout,
+                                  max_retries=args.max_retries,
+                                  keep_alive=args.keep_alive)
+        if args.record is not None:
+            transport = RecordingTransport(
+                                    transport,
+                                    ResponseArchive(args.record, mode='w'))
 
-    if len(sys.argv) > 2:
-        if sys.argv[2].isdigit():
-            rand_sample = int(sys.argv[2])
-            catalog_entries_filter = None
-        else:
-            rand_sample = None
-            catalog_entries_filter = sys.argv[2:]
+    OgcTdsValidation.transport = HostControlledTransport(
+                            transport,
+                            rate=args.host_rate_limit,
+                            burst=args.host_burst,
+                            max_concurrency=(args.host_max_concurrency or
+                                             pool_size),
+                            latency_target=args.latency_target,
+                            failure_threshold=args.breaker_threshold or None,
+                            reset_timeout=args.breaker_reset)
+    if args.hedge_quantile is not None:
+        # A thread for each request in progress and one for its duplicate
+        OgcTdsValidation.transport = HedgedTransport(
+                                        OgcTdsValidation.transport,
+                                        quantile=args.hedge_quantile,
+                                        max_hedge_ratio=args.hedge_max_ratio,
+                                        max_workers=2 * pool_size)
+
+    OgcTdsValidation.request_timeout = args.request_timeout
+
+    if args.cache_dir is not None:
+        OgcTdsValidation.catalog_cache = CatalogResponseCache(
+                                        args.cache_dir,
+                                        max_size=args.cache_max_size * 2**20,
+                                        ttl=args.cache_ttl)
+
+    if args.resolver_ttl is not None:
+        resolver_filepath = None
+        if args.cache_dir is not None:
+            resolver_filepath = os.path.join(args.cache_dir,
+                                             CatalogResolver.DB_FILENAME)
+
+        OgcTdsValidation.catalog_resolver = CatalogResolver(
+                                                    resolver_filepath,
+                                                    ttl=args.resolver_ttl)
+
+    OgcTdsValidation.get_map_sampler = GetMapSampler(
+                                        layer_selection=args.wms_layers,
+                                        n_layers=args.wms_n_layers,
+                                        n_tiles=args.wms_n_tiles,
+                                        seed=args.seed)
+    OgcTdsValidation.get_map_batch_size = args.wms_batch_size
+    OgcTdsValidation.get_map_max_workers = args.get_map_max_workers
+    OgcTdsValidation.get_map_host_limiter = HostConcurrencyLimiter(
+                                        args.get_map_max_workers_per_host)
+    OgcTdsValidation.wcs_max_coverages = args.wcs_n_coverages or None
+    OgcTdsValidation.get_coverage_max_bytes = args.wcs_max_bytes
+
+    if args.sample_state is not None:
+        OgcTdsValidation.entry_sampler = RotatingEntrySampler(
+                                                args.sample_state,
+                                                n_runs=args.sample_runs,
+                                                seed=args.seed)
     else:
-        catalog_entries_filter = None
-        rand_sample = None
+        OgcTdsValidation.entry_sampler = EntrySampler(seed=args.seed)
+
+    if args.manifest is not None and not args.compile:
+        OgcTdsValidation.manifest = EndpointManifest(args.manifest)
+
+    if args.state_file is not None:
+        OgcTdsValidation.scan_state = ScanStateStore(args.state_file,
+                                                     freshness=args.freshness)
+
+
+def _get_shard_report_filepath(report_dirpath, shard):
+    return os.path.join(report_dirpath, 'shard-{}.jsonl'.format(shard.number))
+
+
+def _scan_shard(args, report_dirpath, shard):
+    '''Scan one shard of the catalogue in a worker process, writing the
+    results to a file in report_dirpath
+
+    :return: dictionary of test counts
+    '''
+    _configure_logging(prefix='[shard {}] '.format(shard))
+    configure_validation(args)
+    catalog_entries_filter, rand_sample = _get_catalog_entry_selection(args)
+
+    # The sample is divided between the shards
+    if rand_sample is not None:
+        rand_sample = shard.split(rand_sample)
+
+    result_writer = JsonLinesResultWriter(
+                        _get_shard_report_filepath(report_dirpath, shard))
+    OgcTdsValidation.result_sinks = (result_writer,)
+    try:
+        stats = OgcTdsValidation.check(
+                                args.uri,
+                                catalog_entries_filter=catalog_entries_filter,
+                                rand_sample=rand_sample,
+                                max_workers=args.max_workers,
+                                max_workers_per_host=args.max_workers_per_host,
+                                incremental=args.incremental,
+                                shard=shard,
+                                **_get_check_kwargs(args))
+    finally:
+        result_writer.close()
+
+    OgcTdsValidation.transport.log_summary()
+    return dict(stats)
 
-    status = OgcTdsValidation.check(uri,
-                             catalog_entries_filter=catalog_entries_filter,
-                             rand_sample=rand_sample)
+
+def run_sharded_scan(args, result_sinks):
+    '''Scan the catalogue in args.processes shards, each in its own
+    process, and pass the results of every shard to result_sinks
+
+    :return: collections.Counter of test counts summed over the shards
+    '''
+    report_dirpath = tempfile.mkdtemp(prefix='tds_ogc_scan-')
+    try:
+        stats = Counter()
+        for shard, shard_stats in run_shards(
+                        functools.partial(_scan_shard, args, report_dirpath),
+                        args.processes):
+            log.info('Shard {} completed'.format(shard))
+            stats.update(shard_stats)
+
+            for result in iter_json_lines_results(
+                        _get_shard_report_filepath(report_dirpath, shard)):
+                for result_sink in result_sinks:
+                    result_sink.add(result)
+    finally:
+        shutil.rmtree(report_dirpath)
+
+    OgcTdsValidation.log_summary(stats)
+    return stats
+
+
+def run_compile(args):
+    '''Compile a manifest of the endpoints of the catalogue
+
+    :return: collections.Counter of the numbers of catalogue references
+    resolved and unresolved
+    '''
+    try:
+        return compile_manifest(
+                        OgcTdsValidation, args.uri, args.manifest,
+                        max_workers=args.catalog_workers or args.max_workers,
+                        max_workers_per_host=args.max_workers_per_host)
+    finally:
+        if args.record is not None:
+            OgcTdsValidation.transport.close()
+
+
+def main():
+    _configure_logging()
+
+    parser = _make_arg_parser()
+    argv = sys.argv[1:]
+    compile_command = argv[:1] == ['compile']
+    if compile_command:
+        parser.prog += ' compile'
+        parser.epilog = None
+        parser.description = ('Read a THREDDS catalogue and its '
+                              'sub-catalogues and write a manifest of the '
+                              'WMS and WCS endpoints they publish')
+        argv = argv[1:]
+
+    args = parser.parse_args(argv)
+    args.compile = compile_command
+
+    if args.compile:
+        if args.manifest is None:
+            parser.error('compile requires --manifest')
+
+        if (len(args.catalog_entries) > 0 or args.recursive or
+            args.processes is not None or args.serve_metrics is not None):
+            parser.error('compile cannot be used with catalogue entries, '
+                         '--recursive, --processes or --serve-metrics')
+
+    if args.manifest is not None and args.recursive:
+        parser.error('--manifest cannot be used with --recursive')
+
+    if args.manifest is not None and args.incremental:
+        parser.error('--manifest cannot be used with --incremental')
+
+    if args.recursive and len(args.catalog_entries) > 0:
+        parser.error('catalogue entries cannot be selected with --recursive')
+
+    if args.incremental and args.state_file is None:
+        parser.error('--incremental requires --state-file')
+
+    if args.incremental and args.recursive:
+        parser.error('--incremental cannot be used with --recursive')
+
+    if args.serve_metrics is not None and args.recursive:
+        parser.error('--serve-metrics cannot be used with --recursive')
+
+    if args.shard is not None and args.recursive:
+        parser.error('--shard cannot be used with --recursive')
+
+    if args.deadline is not None and args.recursive:
+        parser.error('--deadline cannot be used with --recursive')
+
+    if args.processes is not None:
+        if args.processes < 1:
+            parser.error('--processes must be at least 1')
+
+        if args.recursive or args.serve_metrics is not None:
+            parser.error('--processes cannot be used with --recursive or '
+                         '--serve-metrics')
+
+        if args.shard is not None:
+            parser.error('--shard cannot be used with --processes')
+
+        if args.sample_state is not None:
+            parser.error('--sample-state cannot be used with --processes')
+
+    if args.record is not None:
+        if args.replay is not None:
+            parser.error('--record cannot be used with --replay')
+
+        if args.processes is not None or args.serve_metrics is not None:
+            parser.error('--record cannot be used with --processes or '
+                         '--serve-metrics')
+
+    if args.hedge_quantile is not None and not 0. < args.hedge_quantile < 1.:
+        parser.error('--hedge-quantile must be between 0 and 1')
+
+    catalog_entries_filter, rand_sample = _get_catalog_entry_selection(args)
+    try:
+        configure_validation(args)
+        if OgcTdsValidation.manifest is not None:
+            OgcTdsValidation.manifest.check_catalog_uri(args.uri)
+
+    except EndpointManifestError as e:
+        parser.error(str(e))
+
+    if args.compile:
+        stats = run_compile(args)
+        OgcTdsValidation.transport.log_summary()
+        sys.exit(1 if stats['catalog_refs_unresolved'] else 0)
+
+    if args.serve_metrics is not None:
+        if args.report is not None:
+            result_writer = make_result_writer(args.report)
+            OgcTdsValidation.result_sinks = (result_writer,)
+
+        exporter = OgcTdsExporter(
+                                args.uri,
+                                scan_interval=args.scan_interval,
+                                catalog_entries_filter=catalog_entries_filter,
+                                rand_sample=rand_sample,
+                                max_workers=args.max_workers,
+                                max_workers_per_host=args.max_workers_per_host,
+                                incremental=args.incremental,
+                                shard=args.shard,
+                                **_get_check_kwargs(args))
+        try:
+            exporter.serve(args.serve_metrics, address=args.metrics_address)
+        finally:
+            if args.report is not None:
+                result_writer.close()
+
+        sys.exit(0)
+
+    result_summary = ResultSummary()
+    performance_summary = PerformanceSummary(n_slowest=args.n_slowest)
+    result_sinks = [result_summary, performance_summary]
+    if args.report is not None:
+        result_writer = make_result_writer(args.report)
+        result_sinks.append(result_writer)
+
+    OgcTdsValidation.result_sinks = result_sinks
+
+    try:
+        if args.recursive:
+            crawler = ThreddsCatalogCrawler(max_depth=args.max_depth,
+                                            max_pages=args.max_pages,
+                                            max_workers=args.max_workers)
+            stats = crawler.check(
+                                args.uri, max_workers=args.max_workers,
+                                max_workers_per_host=args.max_workers_per_host)
+
+        elif args.processes is not None:
+            stats = run_sharded_scan(args, result_sinks)
+        else:
+            stats = OgcTdsValidation.check(
+                                args.uri,
+                                catalog_entries_filter=catalog_entries_filter,
+                                rand_sample=rand_sample,
+                                max_workers=args.max_workers,
+                                max_workers_per_host=args.max_workers_per_host,
+                                incremental=args.incremental,
+                                shard=args.shard,
+                                **_get_check_kwargs(args))
+    finally:
+        if args.report is not None:
+            result_writer.close()
+
+        # Write the index of recorded responses
+        if args.record is not None:
+            OgcTdsValidation.transport.close()
+
+        OgcTdsValidation.entry_sampler.close()
+
+    result_summary.log()
+    performance_summary.log()
+    if args.processes is None:
+        OgcTdsValidation.transport.log_summary()
+
+    # Exit with non-zero status if any check failed
+    status = 0 if stats_ok(stats) and result_summary.ok else 1
     sys.exit(status)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,82 @@
+"""Partitioning of catalogue references into shards for distributed scans
+
+Each catalogue reference URI is assigned to a shard by a hash of the URI, so
+that independent processes or hosts given the same number of shards divide
+the catalogue between them with no coordination.  The assignment of a URI
+does not depend on the other URIs in the catalogue.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import hashlib
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def get_shard_number(uri, n_shards):
+    '''Get the shard, numbered from 1 to n_shards, to which a URI belongs.
+    The hash is stable across processes and Python versions'''
+    digest = hashlib.sha1(uri.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % n_shards + 1
+
+
+class Shard(namedtuple('Shard', ('number', 'count'))):
+    '''Shard number of count, numbered from 1'''
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, text):
+        '''Parse a shard given as "<number>/<count>" e.g. 2/8
+
+        :raises ValueError: if the text is not a valid shard
+        '''
+        try:
+            number, count = [int(value) for value in text.split('/')]
+
+        except ValueError:
+            raise ValueError('Invalid shard {!r}: expecting '
+                             '<number>/<count>'.format(text))
+
+        if count < 1 or not 1 <= number <= count:
+            raise ValueError('Invalid shard {!r}: expecting a number from 1 '
+                             'to the count of shards'.format(text))
+
+        return cls(number, count)
+
+    def includes(self, uri):
+        '''Return True if the URI belongs to this shard'''
+        return get_shard_number(uri, self.count) == self.number
+
+    def select(self, uris):
+        '''Get a list of the URIs belonging to this shard, in order'''
+        return [uri for uri in uris if self.includes(uri)]
+
+    def split(self, n):
+        '''Get the share of this shard of n items divided as evenly as
+        possible between the shards, with the first shards taking one more
+        of any remainder'''
+        return n // self.count + (1 if self.number <= n % self.count else 0)
+
+    def __str__(self):
+        return '{}/{}'.format(self.number, self.count)
+
+
+def run_shards(func, n_shards, max_processes=None):
+    '''Call func with each Shard of n_shards in a pool of processes and
+    yield (shard, result) tuples in order of completion.  Processes are
+    started fresh rather than forked so that no threads, connections or
+    open files are inherited.  func and its result must be picklable
+
+    :param max_processes: size of the process pool.  Defaults to n_shards
+    '''
+    mp_context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_processes or n_shards,
+                             mp_context=mp_context) as executor:
+        futures = {executor.submit(func, Shard(number, n_shards)):
+                   Shard(number, n_shards)
+                   for number in range(1, n_shards + 1)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -0,0 +1,117 @@
+"""Persisted scan state for incremental scans of a THREDDS catalogue
+
+For each catalogue reference, the store holds a hash of the sub-catalogue
+content, the test counts from the last time it was checked and when that
+was.  Entries whose catalogue is unchanged and which passed all their
+checks recently enough can be skipped on the next scan.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from ceda.tds_ogc_scan.results import stats_ok
+
+log = logging.getLogger(__name__)
+
+
+class HashingReader:
+    '''File-like wrapper which updates a hashlib object with all the content
+    read from a stream
+    '''
+    CHUNK_SIZE = 65536
+
+    def __init__(self, stream, content_hash):
+        self.stream = stream
+        self.content_hash = content_hash
+
+    def read(self, size=-1):
+        content = self.stream.read(size)
+        self.content_hash.update(content)
+        return content
+
+    def drain(self):
+        '''Read the rest of the stream so that the hash covers all of the
+        content'''
+        while self.read(self.__class__.CHUNK_SIZE):
+            pass
+
+
+class ScanStateStore:
+    '''Store the result of checking each catalogue reference in a SQLite
+    database
+    '''
+    DEFAULT_FRESHNESS = 7 * 24 * 60 * 60
+
+    def __init__(self, filepath, freshness=DEFAULT_FRESHNESS):
+        '''
+        :param filepath: path to the state database.  It is created if it
+        doesn't already exist
+        :param freshness: time in seconds for which a passed check remains
+        valid for an unchanged catalogue
+        '''
+        dirpath = os.path.dirname(filepath)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+        self.filepath = filepath
+        self.freshness = freshness
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filepath, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS catalog_ref_state ('
+                'uri TEXT PRIMARY KEY, '
+                'catalog_hash TEXT, '
+                'stats TEXT NOT NULL, '
+                'ok INTEGER NOT NULL, '
+                'checked REAL NOT NULL)')
+
+    def get(self, uri):
+        '''Get state for a catalogue reference as a (catalog_hash, stats,
+        ok, checked) tuple or None if it has not been checked before
+        '''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT catalog_hash, stats, ok, checked '
+                'FROM catalog_ref_state WHERE uri = ?', (uri,)).fetchone()
+
+        if row is None:
+            return None
+
+        catalog_hash, stats, ok, checked = row
+        return catalog_hash, json.loads(stats), bool(ok), checked
+
+    def is_unchanged(self, uri, catalog_hash):
+        '''Return True if the catalogue reference passed all its checks
+        within the freshness window and its catalogue content hash is
+        unchanged since
+        '''
+        state = self.get(uri)
+        if state is None:
+            return False
+
+        last_catalog_hash, _, ok, checked = state
+        return (ok and last_catalog_hash == catalog_hash and
+                time.time() - checked < self.freshness)
+
+    def update(self, uri, catalog_hash, stats):
+        '''Record the result of checking a catalogue reference'''
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO catalog_ref_state '
+                '(uri, catalog_hash, stats, ok, checked) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (uri, catalog_hash, json.dumps(dict(stats)),
+                 int(stats_ok(stats)), time.time()))
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,254 @@
+"""Offline benchmarks of catalogue scans against generated THREDDS responses
+
+Each benchmark generates a root catalogue of a given number of entries, with
+the sub-catalogue and WMS and WCS responses of every entry, and scans it
+through a ReplayTransport or, with --server, over HTTP from a local
+ReplayServer.  The time to parse the root catalogue, the throughput of the
+scan and the peak memory allocated are reported for each catalogue size.
+Run with:
+
+python -m ceda.tds_ogc_scan.test.benchmark --sizes 10 1000 100000
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import functools
+import threading
+import tracemalloc
+from collections import namedtuple
+
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.transport import HttpTransport
+from ceda.tds_ogc_scan.replay import (RecordedResponse, ReplayTransport,
+                                      ReplayServer, FaultInjector,
+                                      get_base_uri)
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, make_catalog_xml,
+                                             iter_entry_responses)
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+DEFAULT_N_SCANNED = 100
+
+BenchmarkResult = namedtuple('BenchmarkResult',
+                             ('n_entries', 'n_scanned', 'n_requests',
+                              'parse_time', 'scan_time', 'throughput',
+                              'peak_memory'))
+
+
+@functools.lru_cache(maxsize=256)
+def _get_entry_responses(entry_name):
+    return {uri: (content, headers)
+            for uri, content, headers in iter_entry_responses(entry_name)}
+
+
+class SyntheticThreddsArchive:
+    '''Archive of responses generated on request for a root catalogue of
+    n_entries entries, each as served by make_thredds_transport.  Only the
+    root catalogue is held in memory
+    '''
+    ENTRY_NAME_PAT = re.compile(r'/(entry\d+)(?:\.xml$|-agg\?)')
+
+    def __init__(self, n_entries):
+        self.entry_names = ['entry{:06d}'.format(i) for i in range(n_entries)]
+        self.catalog_content = make_catalog_xml(
+                                            self.entry_names).encode('utf-8')
+
+    def get(self, uri):
+        '''Get the RecordedResponse for a URI, or None if there is none'''
+        if uri == CATALOG_URI:
+            return RecordedResponse(uri, 200, {}, self.catalog_content, None)
+
+        match = self.ENTRY_NAME_PAT.search(uri)
+        if match is None:
+            return None
+
+        content, headers = _get_entry_responses(match.group(1)).get(
+                                                            uri, (None, None))
+        if content is None:
+            return None
+
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+
+        return RecordedResponse(uri, 200, headers or {}, content, None)
+
+
+class CountingTransport:
+    '''Count the requests passed to a transport'''
+    def __init__(self, transport):
+        self.transport = transport
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+    def get(self, uri, **kwargs):
+        with self._lock:
+            self.n_requests += 1
+
+        return self.transport.get(uri, **kwargs)
+
+    def close(self):
+        self.transport.close()
+
+
+def _scan(validation_cls, catalog_uri, n_entries, n_scanned, max_workers):
+    rand_sample = n_scanned if n_scanned < n_entries else None
+    return validation_cls.check(catalog_uri, rand_sample=rand_sample,
+                                max_workers=max_workers)
+
+
+def run_benchmark(n_entries, n_scanned=DEFAULT_N_SCANNED, max_workers=1,
+                  fault_injector=None, server=False, measure_memory=True,
+                  seed=0):
+    '''Scan a generated catalogue of n_entries entries, testing a random
+    sample of n_scanned of them
+
+    :param fault_injector: FaultInjector adding latency and errors to the
+    responses
+    :param server: make requests over HTTP to a ReplayServer rather than
+    directly to a ReplayTransport
+    :param measure_memory: repeat the scan with tracemalloc to get the peak
+    memory allocated.  The times are taken from a scan without it
+    :return: BenchmarkResult.  peak_memory is in bytes
+    '''
+    archive = SyntheticThreddsArchive(n_entries)
+    replay_server = None
+    if server:
+        replay_server = ReplayServer((ReplayServer.DEFAULT_ADDRESS, 0),
+                                     archive, get_base_uri(CATALOG_URI),
+                                     fault_injector=fault_injector)
+        threading.Thread(target=replay_server.serve_forever,
+                         daemon=True).start()
+        catalog_uri = CATALOG_URI.replace(get_base_uri(CATALOG_URI),
+                                          replay_server.uri)
+        transport = CountingTransport(HttpTransport(
+                                        pool_size=max(max_workers, 10)))
+    else:
+        catalog_uri = CATALOG_URI
+        transport = CountingTransport(ReplayTransport(
+                                        archive,
+                                        fault_injector=fault_injector))
+
+    class _OgcTdsValidation(OgcTdsValidation):
+        pass
+
+    _OgcTdsValidation.transport = transport
+    n_scanned = min(n_scanned, n_entries)
+
+    try:
+        start_time = time.perf_counter()
+        n_catalog_ref_uris = len(list(
+                        _OgcTdsValidation.get_catalog_ref_uris(catalog_uri)))
+        parse_time = time.perf_counter() - start_time
+        if n_catalog_ref_uris != n_entries:
+            raise ValueError('Expecting {} catalogue references; read '
+                             '{}'.format(n_entries, n_catalog_ref_uris))
+
+        random.seed(seed)
+        transport.n_requests = 0
+        start_time = time.perf_counter()
+        _scan(_OgcTdsValidation, catalog_uri, n_entries, n_scanned,
+              max_workers)
+        scan_time = time.perf_counter() - start_time
+        n_requests = transport.n_requests
+
+        peak_memory = None
+        if measure_memory:
+            random.seed(seed)
+            tracemalloc.start()
+            try:
+                _scan(_OgcTdsValidation, catalog_uri, n_entries, n_scanned,
+                      max_workers)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    finally:
+        transport.close()
+        if replay_server is not None:
+            replay_server.shutdown()
+            replay_server.server_close()
+
+    return BenchmarkResult(n_entries, n_scanned, n_requests, parse_time,
+                           scan_time, n_scanned / scan_time, peak_memory)
+
+
+def _make_arg_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark scans of generated THREDDS catalogues '
+                    'offline')
+
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=DEFAULT_SIZES,
+                        help='numbers of catalogue entries to benchmark '
+                             '(default: %(default)s)')
+    parser.add_argument('--n-scanned', type=int, default=DEFAULT_N_SCANNED,
+                        help='number of entries chosen at random from each '
+                             'catalogue to test (default: %(default)s)')
+    parser.add_argument('--max-workers', type=int, default=1,
+                        help='number of catalogue entries to test '
+                             'concurrently (default: %(default)s)')
+    parser.add_argument('--server', action='store_true',
+                        help='make requests over HTTP to a local replay '
+                             'server')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='delay in seconds added to every response '
+                             '(default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='a further random delay of up to this many '
+                             'seconds (default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='fraction of requests answered with a 503 '
+                             'error (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the choice of entries, latency and '
+                             'errors (default: %(default)s)')
+    parser.add_argument('--no-memory', dest='measure_memory',
+                        action='store_false',
+                        help='skip the measurement of peak memory')
+    parser.add_argument('--output', default=None,
+                        help='append the results to this file as JSON Lines '
+                             'for comparison between runs')
+    return parser
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    args = _make_arg_parser().parse_args()
+
+    print('{:>8} {:>8} {:>9} {:>10} {:>10} {:>11} {:>11}'.format(
+          'entries', 'scanned', 'requests', 'parse (s)', 'scan (s)',
+          'entries/s', 'peak (MiB)'))
+
+    for n_entries in args.sizes:
+        fault_injector = FaultInjector(latency=args.latency,
+                                       jitter=args.jitter,
+                                       error_rate=args.error_rate,
+                                       seed=args.seed)
+        result = run_benchmark(n_entries, n_scanned=args.n_scanned,
+                               max_workers=args.max_workers,
+                               fault_injector=fault_injector,
+                               server=args.server,
+                               measure_memory=args.measure_memory,
+                               seed=args.seed)
+
+        peak_memory = ('-' if result.peak_memory is None
+                       else '{:.1f}'.format(result.peak_memory / 2**20))
+        print('{:>8} {:>8} {:>9} {:>10.3f} {:>10.3f} {:>11.1f} {:>11}'.format(
+              result.n_entries, result.n_scanned, result.n_requests,
+              result.parse_time, result.scan_time, result.throughput,
+              peak_memory))
+
+        if args.output is not None:
+            with open(args.output, 'a') as output_file:
+                output_file.write(json.dumps(dict(vars(args),
+                                                  **result._asdict())) + '\n')
+
+
+if __name__ == '__main__':
+    main()
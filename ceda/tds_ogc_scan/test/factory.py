@@ -7,21 +7,34 @@ __copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
 __license__ = """BSD - See LICENSE file in top-level directory"""
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.deadline import DeadlineExceeded
 
 
 class ThreddsCatalogUnittestCaseFactory:
     '''Create a unittest case class for testing endpoints from a THREDDS
     catalogue
+
+    If max_workers is greater than one, the test methods of the generated
+    class are run concurrently in a thread pool when the class is set up.
+    Each test method then reports the outcome of its own run so that results
+    are still given per method through the standard unittest protocol
+
+    If OgcTdsValidation.scan_deadline is set, test methods which have not
+    completed by the deadline are skipped
     '''
-    def __init__(self, catalog_uri, unittest_method_factory, method_extension=None):
+    def __init__(self, catalog_uri, unittest_method_factory, method_extension=None,
+                 max_workers=1):
         '''Provide the URI to the THREDDS catalogue + a unit test method
-        factory which generates the tests needed
+        factory which generates the tests needed.  max_workers sets the
+        number of test methods to run concurrently
         '''
         self.catalog_uri = catalog_uri
         self.unittest_method_factory = unittest_method_factory
         self.method_extension = method_extension
+        self.max_workers = max_workers
 
     def _gen_unittest_methods(self):
         '''Make a list of unittest methods based on contents of a THREDDS 
@@ -32,7 +45,7 @@ class ThreddsCatalogUnittestCaseFactory:
         for catalog_ref_uri in catalog_ref_uris:
             unittest_method = self.unittest_method_factory(catalog_ref_uri)
 
-            yield unittest_method
+            yield DeadlineUnittestMethod(unittest_method)
 
     def  __call__(self):
         '''Generate new unittest case class from a list of unittest methods
@@ -45,6 +58,71 @@ class ThreddsCatalogUnittestCaseFactory:
                 method_extension = '_{}'.format(self.method_extension)
             _attr['test_{:03d}{}'.format(i, method_extension)] = unittest_method
 
+        if self.max_workers > 1:
+            _attr = self._make_concurrent_attrs(_attr)
+
         TdsCatalogServiceTestCase = type('TdsCatalogServiceTestCase',
                                          (unittest.TestCase, ), _attr)
         return TdsCatalogServiceTestCase
+
+    def _make_concurrent_attrs(self, unittest_methods):
+        '''Make class attributes for running the given unittest methods
+        concurrently.  Each method is submitted to a thread pool in
+        setUpClass and replaced with a method which waits for its result
+        '''
+        max_workers = self.max_workers
+
+        def setUpClass(cls):
+            cls._executor = ThreadPoolExecutor(max_workers=max_workers)
+            cls._futures = {
+                name: cls._executor.submit(unittest_method)
+                for name, unittest_method in sorted(unittest_methods.items())
+            }
+
+        def tearDownClass(cls):
+            for future in cls._futures.values():
+                future.cancel()
+
+            cls._executor.shutdown(wait=True)
+
+        _attr = {
+            'setUpClass': classmethod(setUpClass),
+            'tearDownClass': classmethod(tearDownClass),
+        }
+        for name in unittest_methods:
+            _attr[name] = _make_concurrent_unittest_method(name)
+
+        return _attr
+
+
+class DeadlineUnittestMethod:
+    '''Wrap a unittest method so that it is skipped if the scan deadline
+    has passed before or while it runs'''
+    def __init__(self, unittest_method):
+        self.unittest_method = unittest_method
+
+        # Required for unittest.loader.TestLoader
+        self.__qualname__ = unittest_method.__qualname__
+
+    def __call__(self):
+        deadline = OgcTdsValidation.scan_deadline
+        try:
+            if deadline is not None:
+                deadline.check()
+
+            self.unittest_method()
+
+        except DeadlineExceeded as e:
+            raise unittest.SkipTest('Untested: {}'.format(e))
+
+
+def _make_concurrent_unittest_method(name):
+    '''Make a test method which waits for the result of a unittest method
+    submitted to the thread pool.  Exceptions raised by the unittest method
+    are re-raised so that it is reported as a failure or error
+    '''
+    def unittest_method(self):
+        self._futures[name].result()
+
+    unittest_method.__name__ = name
+    return unittest_method
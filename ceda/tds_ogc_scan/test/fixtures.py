@@ -0,0 +1,296 @@
+"""Local stand-in transport and sample documents for offline unit tests
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import zlib
+import struct
+import threading
+
+import requests
+
+THREDDS_URI = 'http://tds.test.ac.uk/thredds'
+CATALOG_URI = THREDDS_URI + '/catalog.xml'
+
+CATALOG_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+    xmlns:xlink="http://www.w3.org/1999/xlink" name="Test catalogue">
+  <service name="all" serviceType="Compound" base="">
+    <service name="http" serviceType="HTTPServer" base="/thredds/fileServer/"/>
+  </service>
+  {}
+</catalog>
+'''
+
+CATALOG_REF_XML = ('<catalogRef xlink:href="{0}.xml" xlink:title="{0}" '
+                   'name=""/>')
+
+SUB_CATALOG_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+    xmlns:xlink="http://www.w3.org/1999/xlink" name="{0}">
+  <service name="wms" serviceType="WMS" base="/thredds/wms/"/>
+  <service name="wcs" serviceType="WCS" base="/thredds/wcs/"/>
+  <dataset name="{0}" ID="{0}">
+    <dataset name="{0}-agg" ID="{0}-agg" urlPath="{0}-agg">
+      <access serviceName="wms" urlPath="{0}-agg"/>
+      <access serviceName="wcs" urlPath="{0}-agg"/>
+    </dataset>
+  </dataset>
+</catalog>
+'''
+
+WMS_GET_CAPABILITIES_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<WMS_Capabilities xmlns="http://www.opengis.net/wms" version="1.3.0">
+  <Service><Name>WMS</Name></Service>
+  <Capability>
+    <Layer>
+      <Title>Test</Title>
+      <Layer>
+        <Title>{0}</Title>
+        {1}
+      </Layer>
+    </Layer>
+  </Capability>
+</WMS_Capabilities>
+'''
+
+WMS_LAYER_XML = '<Layer queryable="1"><Name>{0}</Name><Title>{0}</Title></Layer>'
+
+WCS_GET_CAPABILITIES_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<WCS_Capabilities xmlns="http://www.opengis.net/wcs" version="1.0.0">
+  <ContentMetadata>
+    {0}
+  </ContentMetadata>
+</WCS_Capabilities>
+'''
+
+WCS_COVERAGE_OFFERING_XML = ('<CoverageOfferingBrief><name>{0}</name>'
+                             '<label>{0}</label></CoverageOfferingBrief>')
+
+WCS_DESCRIBE_COVERAGE_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<CoverageDescription xmlns="http://www.opengis.net/wcs"
+    xmlns:gml="http://www.opengis.net/gml" version="1.0.0">
+  {0}
+</CoverageDescription>
+'''
+
+WCS_COVERAGE_XML = '''<CoverageOffering>
+    <name>{0}</name>
+    <lonLatEnvelope srsName="urn:ogc:def:crs:OGC:1.3:CRS84">
+      <gml:pos>-180 -90</gml:pos><gml:pos>180 90</gml:pos>
+    </lonLatEnvelope>
+    <domainSet>
+      <temporalDomain>
+        <gml:timePosition>2000-01-01T00:00:00Z</gml:timePosition>
+        <gml:timePosition>2000-02-01T00:00:00Z</gml:timePosition>
+      </temporalDomain>
+    </domainSet>
+    <supportedFormats>
+      <formats>GeoTIFF</formats><formats>NetCDF3</formats>
+    </supportedFormats>
+  </CoverageOffering>'''
+
+# GetCoverage query for the subset of a coverage described by
+# WCS_COVERAGE_XML
+WCS_GET_COVERAGE_QUERY = ('?service=WCS&version=1.0.0&request=GetCoverage&'
+                          'COVERAGE={}&BBOX=-18.0000,-9.0000,18.0000,9.0000&'
+                          'CRS=OGC:CRS84&FORMAT=NetCDF3&'
+                          'TIME=2000-01-01T00%3A00%3A00Z')
+
+# NetCDF classic signature followed by padding
+NETCDF_CONTENT = b'CDF\x01' + bytes(4092)
+
+
+def _png_chunk(chunk_type, data):
+    return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def _paeth_predictor(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _filter_row(filter_type, row, prev_row, bpp):
+    filtered = bytearray([filter_type])
+    for i, value in enumerate(row):
+        left = row[i - bpp] if i >= bpp else 0
+        up = prev_row[i]
+        up_left = prev_row[i - bpp] if i >= bpp else 0
+        predictor = (0, left, up, (left + up) >> 1,
+                     _paeth_predictor(left, up, up_left))[filter_type]
+        filtered.append((value - predictor) & 0xff)
+
+    return filtered
+
+
+def make_png(width, rows, colour_type=6, bit_depth=8, chunks=()):
+    '''Encode a PNG image from rows of unfiltered sample bytes.  Rows are
+    filtered with each filter type in turn.  chunks is a sequence of
+    (chunk type, data) to include before the image data, e.g. PLTE or tRNS
+    '''
+    n_channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[colour_type]
+    bpp = max(1, n_channels * bit_depth // 8)
+    prev_row = bytes(len(rows[0]))
+    image_data = bytearray()
+    for i, row in enumerate(rows):
+        image_data.extend(_filter_row(i % 5, row, prev_row, bpp))
+        prev_row = row
+
+    header = struct.pack('>IIBBBBB', width, len(rows), bit_depth,
+                         colour_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) +
+            b''.join([_png_chunk(chunk_type, data)
+                      for chunk_type, data in chunks]) +
+            _png_chunk(b'IDAT', zlib.compress(bytes(image_data))) +
+            _png_chunk(b'IEND', b''))
+
+
+def make_rgba_png(width, height, transparent=False):
+    '''Make an RGBA PNG image with a colour gradient, or fully transparent
+    if transparent is True'''
+    alpha = 0 if transparent else 255
+    rows = [bytes(bytearray([value for x in range(width)
+                             for value in (x % 256, y % 256, 128, alpha)]))
+            for y in range(height)]
+    return make_png(width, rows)
+
+
+PNG_CONTENT = make_rgba_png(256, 256)
+
+
+class FakeResponse:
+    '''Minimal stand-in for requests.Response'''
+    def __init__(self, uri, status_code=200, content=b'', headers=None):
+        self.url = uri
+        self.status_code = status_code
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        self.content = content
+        self.headers = headers or {}
+        self.raw = io.BytesIO(content)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.raw.close()
+
+
+class UnreadableResponse(FakeResponse):
+    '''FakeResponse whose body can't be read, as for a streamed response
+    whose connection is lost after the headers are received'''
+    @property
+    def content(self):
+        raise requests.ConnectionError('Connection reset by peer')
+
+    @content.setter
+    def content(self, content):
+        pass
+
+    @property
+    def text(self):
+        return self.content
+
+
+class FakeTransport:
+    '''Stand-in for HttpTransport serving responses from a dictionary keyed
+    by URI.  URIs not found give a 404 response.  Requests made are recorded
+    in order
+    '''
+    def __init__(self, responses=None):
+        self.responses = responses or {}
+        self.requested_uris = []
+        self._lock = threading.Lock()
+
+    def add(self, uri, content, status_code=200, headers=None):
+        self.responses[uri] = (status_code, content, headers)
+
+    def get(self, uri, **kwargs):
+        with self._lock:
+            self.requested_uris.append(uri)
+
+        status_code, content, headers = self.responses.get(uri,
+                                                           (404, '', None))
+        return FakeResponse(uri, status_code=status_code, content=content,
+                            headers=headers)
+
+    def close(self):
+        pass
+
+
+def make_catalog_xml(entry_names):
+    '''Make a root catalogue with a catalogue reference for each entry
+    name'''
+    catalog_refs = '\n  '.join([CATALOG_REF_XML.format(entry_name)
+                                for entry_name in entry_names])
+    return CATALOG_XML.format(catalog_refs)
+
+
+def iter_entry_responses(entry_name, layer_names=('sst', 'sst_error')):
+    '''Yield (URI, content, headers) for the sub-catalogue of an entry and
+    the WMS and WCS requests made for its endpoints
+    '''
+    yield ('{}/{}.xml'.format(THREDDS_URI, entry_name),
+           SUB_CATALOG_XML.format(entry_name), None)
+
+    wms_uri = 'http://tds.test.ac.uk/thredds/wms/{}-agg'.format(entry_name)
+    layers = ''.join([WMS_LAYER_XML.format(layer_name)
+                      for layer_name in layer_names])
+    yield (wms_uri + '?service=WMS&version=1.3.0&request=GetCapabilities',
+           WMS_GET_CAPABILITIES_XML.format(entry_name, layers), None)
+    yield (wms_uri + '?service=WMS&version=1.3.0&request=GetMap&'
+           'BBOX=-180,-90,180,90&LAYERS={}&CRS=CRS:84&WIDTH=256&'
+           'HEIGHT=256&STYLES=&FORMAT=image/png&'
+           'COLORSCALERANGE=auto'.format(layer_names[0]),
+           PNG_CONTENT, {'Content-Type': 'image/png'})
+
+    wcs_uri = 'http://tds.test.ac.uk/thredds/wcs/{}-agg'.format(entry_name)
+    coverages = ''.join([WCS_COVERAGE_OFFERING_XML.format(layer_name)
+                         for layer_name in layer_names])
+    yield (wcs_uri + '?service=WCS&version=1.0.0&request=GetCapabilities',
+           WCS_GET_CAPABILITIES_XML.format(coverages), None)
+    describe_coverage_uri = (wcs_uri + '?service=WCS&version=1.0.0&'
+                             'request=DescribeCoverage')
+    yield (describe_coverage_uri,
+           WCS_DESCRIBE_COVERAGE_XML.format(''.join(
+                                    [WCS_COVERAGE_XML.format(layer_name)
+                                     for layer_name in layer_names])), None)
+    for layer_name in layer_names:
+        yield (describe_coverage_uri + '&COVERAGE=' + layer_name,
+               WCS_DESCRIBE_COVERAGE_XML.format(
+                                    WCS_COVERAGE_XML.format(layer_name)),
+               None)
+        yield (wcs_uri + WCS_GET_COVERAGE_QUERY.format(layer_name),
+               NETCDF_CONTENT, {'Content-Type': 'application/x-netcdf'})
+
+
+def make_thredds_transport(entry_names, layer_names=('sst', 'sst_error')):
+    '''Make a FakeTransport serving a root catalogue with a catalogue
+    reference for each entry name.  Each sub-catalogue publishes WMS and WCS
+    endpoints
+    '''
+    transport = FakeTransport()
+    transport.add(CATALOG_URI, make_catalog_xml(entry_names))
+
+    for entry_name in entry_names:
+        for uri, content, headers in iter_entry_responses(entry_name,
+                                                          layer_names):
+            transport.add(uri, content, headers=headers)
+
+    return transport
@@ -0,0 +1,101 @@
+"""Unit tests for the persistent catalogue response cache
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import shutil
+import tempfile
+import unittest
+
+from ceda.tds_ogc_scan.cache import CatalogResponseCache
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, FakeTransport,
+                                             FakeResponse,
+                                             make_thredds_transport)
+
+
+class ConditionalFakeTransport(FakeTransport):
+    '''Give a 304 response for requests with a matching If-None-Match
+    header'''
+    ETAG = '"abc123"'
+
+    def get(self, uri, headers=None, **kwargs):
+        if headers and headers.get('If-None-Match') == self.ETAG:
+            self.requested_uris.append(uri)
+            return FakeResponse(uri, status_code=304)
+
+        resp = super().get(uri, **kwargs)
+        resp.headers['ETag'] = self.ETAG
+        return resp
+
+
+class CatalogResponseCacheTestCase(unittest.TestCase):
+    URI = 'http://tds.test.ac.uk/thredds/catalog.xml'
+
+    def setUp(self):
+        self.cache_dirpath = tempfile.mkdtemp()
+        self.transport = ConditionalFakeTransport()
+        self.transport.add(self.URI, '<catalog/>')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dirpath)
+
+    def test01_revalidate(self):
+        cache = CatalogResponseCache(self.cache_dirpath)
+        self.assertEqual(cache.get(self.transport, self.URI).text,
+                         '<catalog/>')
+        self.assertEqual(cache.get(self.transport, self.URI).text,
+                         '<catalog/>')
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['revalidated'], 1)
+        cache.close()
+
+    def test02_ttl(self):
+        cache = CatalogResponseCache(self.cache_dirpath, ttl=3600)
+        cache.get(self.transport, self.URI)
+        cache.close()
+
+        # Read from a new instance to check content has been persisted
+        cache = CatalogResponseCache(self.cache_dirpath, ttl=3600)
+        self.assertEqual(cache.get(self.transport, self.URI).text,
+                         '<catalog/>')
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(len(self.transport.requested_uris), 1)
+        cache.close()
+
+    def test03_evict_least_recently_used(self):
+        cache = CatalogResponseCache(self.cache_dirpath, max_size=25,
+                                     ttl=3600)
+        uris = ['{}?{}'.format(self.URI, i) for i in range(3)]
+        for uri in uris:
+            self.transport.add(uri, '<catalog/>')
+
+        cache.get(self.transport, uris[0])
+        cache.get(self.transport, uris[1])
+        cache.get(self.transport, uris[0])
+        cache.get(self.transport, uris[2])
+
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertIsNone(cache._lookup(uris[1]))
+        self.assertIsNotNone(cache._lookup(uris[0]))
+        cache.close()
+
+    def test04_check_summary_stats(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            transport = make_thredds_transport(['entry01', 'entry02'])
+            catalog_cache = CatalogResponseCache(self.cache_dirpath,
+                                                 ttl=3600)
+
+        stats = _OgcTdsValidation.check(CATALOG_URI)
+        self.assertEqual(stats['catalog_cache_misses'], 3)
+
+        stats = _OgcTdsValidation.check(CATALOG_URI)
+        self.assertEqual(stats['catalog_cache_hits'], 3)
+        self.assertEqual(stats['catalog_refs_ok'], 2)
+        _OgcTdsValidation.catalog_cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Unit tests for the single pass catalogue index
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import unittest
+import xml.etree.ElementTree as ET
+
+from ceda.tds_ogc_scan import catalog_index
+from ceda.tds_ogc_scan.catalog_index import CatalogIndex
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import SUB_CATALOG_XML
+
+COMPOUND_CATALOG_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+    xmlns:xlink="http://www.w3.org/1999/xlink" name="compound">
+  <service name="all" serviceType="Compound" base="">
+    <service name="odap" serviceType="OpenDAP" base="/thredds/dodsC/"/>
+    <service name="wms" serviceType="WMS" base="/thredds/wms/"/>
+  </service>
+  <service name="wcs" serviceType="WCS" base="/thredds/wcs/"/>
+  <dataset name="collection">
+    <metadata inherited="true"><serviceName>all</serviceName></metadata>
+    {0}
+    <dataset name="coverage" urlPath="coverage">
+      <serviceName>wcs</serviceName>
+    </dataset>
+  </dataset>
+  <catalogRef xlink:href="next.xml" xlink:title="next" name=""/>
+</catalog>
+'''
+
+DATASET_XML = '<dataset name="ds{0}" urlPath="ds{0}.nc"/>'
+
+
+class CatalogIndexTestCase(unittest.TestCase):
+    N_DATASETS = 20000
+
+    def _make_source(self, content):
+        return io.BytesIO(content.encode('utf-8'))
+
+    def _make_compound_catalog(self, n_datasets=2):
+        return COMPOUND_CATALOG_XML.format(''.join([DATASET_XML.format(i)
+                                                    for i in range(
+                                                            n_datasets)]))
+
+    def test01_find_service_uri_paths(self):
+        source = self._make_source(SUB_CATALOG_XML.format('entry'))
+        uri_paths = catalog_index.find_service_uri_paths(source,
+                                                         ('WMS', 'WCS'))
+
+        self.assertEqual(uri_paths, {'WMS': ('/thredds/wms/', 'entry-agg'),
+                                     'WCS': ('/thredds/wcs/', 'entry-agg')})
+
+    def test02_find_service_uri_paths_missing_service(self):
+        source = self._make_source(SUB_CATALOG_XML.format('entry'))
+        uri_paths = catalog_index.find_service_uri_paths(source,
+                                                         ('WMS', 'SOS'))
+
+        self.assertEqual(uri_paths['SOS'], (None, None))
+        self.assertEqual(uri_paths['WMS'], ('/thredds/wms/', 'entry-agg'))
+
+    def test03_compound_services(self):
+        index = CatalogIndex.read(self._make_source(
+                                            self._make_compound_catalog()))
+
+        self.assertEqual(index.services['wms'].parent_name, 'all')
+        self.assertEqual([service.name
+                          for service in index.get_services('opendap')],
+                         ['odap'])
+
+        # Datasets inherit the compound service and so are accessed through
+        # each of the services nested in it
+        self.assertEqual(index.get_uri_paths(('WMS', 'OpenDAP', 'WCS')),
+                         {'WMS': ('/thredds/wms/', 'ds0.nc'),
+                          'OpenDAP': ('/thredds/dodsC/', 'ds0.nc'),
+                          'WCS': ('/thredds/wcs/', 'coverage')})
+        self.assertEqual(index.get_url_paths('all'), ['ds0.nc', 'ds1.nc'])
+        self.assertEqual(index.get_service_names('coverage'), ['wcs'])
+        self.assertEqual(index.catalog_ref_hrefs, ['next.xml'])
+
+    def test04_large_catalog(self):
+        content = self._make_compound_catalog(self.N_DATASETS)
+        index = CatalogIndex.read(self._make_source(content))
+        self.assertEqual(len(index.get_endpoints('WMS')), self.N_DATASETS)
+        self.assertEqual(index.get_endpoint('wms').url_path, 'ds0.nc')
+
+        # Reading stops once the first endpoint of each type is found
+        source = self._make_source(content)
+        index = CatalogIndex.read(source, service_types=('WMS',))
+        self.assertEqual(index.get_endpoint('WMS').url_path, 'ds0.nc')
+        self.assertLess(source.tell(), len(content) // 2)
+
+    def test05_from_element(self):
+        content = self._make_compound_catalog()
+        index = CatalogIndex.from_element(ET.fromstring(content))
+        streamed_index = CatalogIndex.read(self._make_source(content))
+        self.assertEqual(index.get_uri_paths(('WMS', 'WCS')),
+                         streamed_index.get_uri_paths(('WMS', 'WCS')))
+
+        catalog_uri = 'http://tds.test.ac.uk/thredds/catalog.xml'
+        catalog_elem = ET.fromstring(SUB_CATALOG_XML.format('entry'))
+        self.assertEqual(OgcTdsValidation.get_wms_uri_from_catalog(
+                                                    catalog_uri,
+                                                    catalog_elem=catalog_elem),
+                         'http://tds.test.ac.uk/thredds/wms/entry-agg')
+        self.assertEqual(OgcTdsValidation.get_wcs_uri_from_catalog(
+                                                    catalog_uri,
+                                                    catalog_elem=catalog_elem),
+                         'http://tds.test.ac.uk/thredds/wcs/entry-agg')
+
+
+if __name__ == '__main__':
+    unittest.main()
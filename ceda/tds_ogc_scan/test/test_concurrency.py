@@ -0,0 +1,47 @@
+"""Unit tests for concurrent execution of catalogue entry checks
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import threading
+import time
+import unittest
+from collections import Counter
+
+from ceda.tds_ogc_scan.concurrency import run_concurrently
+
+
+class RunConcurrentlyTestCase(unittest.TestCase):
+    URIS = ['http://host{}.ac.uk/catalog{}.xml'.format(i % 2, i)
+            for i in range(8)]
+
+    def test01_sequential(self):
+        results = list(run_concurrently(lambda uri: uri, self.URIS))
+        self.assertEqual(results, self.URIS)
+
+    def test02_max_workers_per_host(self):
+        lock = threading.Lock()
+        in_progress = Counter()
+        peak = Counter()
+
+        def _check(uri):
+            host = uri.split('/')[2]
+            with lock:
+                in_progress[host] += 1
+                peak[host] = max(peak[host], in_progress[host])
+            time.sleep(0.02)
+            with lock:
+                in_progress[host] -= 1
+            return uri
+
+        results = list(run_concurrently(_check, self.URIS, max_workers=8,
+                                        max_workers_per_host=2))
+
+        self.assertEqual(sorted(results), sorted(self.URIS))
+        self.assertLessEqual(max(peak.values()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
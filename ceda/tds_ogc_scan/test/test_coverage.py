@@ -0,0 +1,172 @@
+"""Unit tests for streamed WCS GetCoverage checks
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import unittest
+
+from ceda.tds_ogc_scan import coverage, results
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.xml_stream import WcsCoverage
+from ceda.tds_ogc_scan.test.fixtures import (FakeTransport, NETCDF_CONTENT,
+                                             UnreadableResponse,
+                                             make_thredds_transport)
+
+
+class ReadCoverageStatsTestCase(unittest.TestCase):
+    def test01_netcdf(self):
+        coverage_stats = coverage.read_coverage_stats(
+                                            io.BytesIO(NETCDF_CONTENT), 8192)
+        self.assertEqual(coverage_stats, (coverage.NETCDF3,
+                                          len(NETCDF_CONTENT), False))
+
+    def test02_hdf5_truncated(self):
+        stream = io.BytesIO(coverage.HDF5_SIGNATURE + bytes(100000))
+        coverage_stats = coverage.read_coverage_stats(stream, 1000,
+                                                      chunk_size=256)
+        self.assertEqual(coverage_stats, (coverage.HDF5, 1000, True))
+
+        # Nothing is read beyond the cap
+        self.assertEqual(stream.tell(), 1000)
+
+    def test03_invalid(self):
+        for content in (b'', b'CDF', b'<ServiceExceptionReport/>',
+                        b'\x89PNG\r\n\x1a\n'):
+            with self.assertRaises(coverage.CoverageError):
+                coverage.read_coverage_stats(io.BytesIO(content), 1000)
+
+
+class CheckWcsGetCoverageTestCase(unittest.TestCase):
+    WCS_URI = 'http://tds.test.ac.uk/thredds/wcs/entry00-agg'
+    GET_COVERAGE_URI = (WCS_URI + '?service=WCS&version=1.0.0&'
+                        'request=GetCoverage&COVERAGE=sst&BBOX=0,0,1,1&'
+                        'CRS=OGC:CRS84&FORMAT=NetCDF3')
+
+    def setUp(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = FakeTransport()
+        self.result_summary = results.ResultSummary()
+        _OgcTdsValidation.result_sinks = (self.result_summary,)
+        self.validation_cls = _OgcTdsValidation
+
+    def _check(self, content, content_type='application/x-netcdf'):
+        self.validation_cls.transport.add(
+                                    self.GET_COVERAGE_URI, content,
+                                    headers={'Content-Type': content_type})
+        return self.validation_cls.check_wcs_get_coverage_resp(
+                                                        self.GET_COVERAGE_URI)
+
+    def _get_errors(self):
+        return [error for (_, error) in self.result_summary.errors]
+
+    def test01_ok(self):
+        self.assertTrue(self._check(NETCDF_CONTENT))
+        self.assertTrue(self.result_summary.ok)
+
+    def test02_size_cap(self):
+        self.validation_cls.get_coverage_max_bytes = 1024
+        self.assertTrue(self._check(coverage.HDF5_SIGNATURE +
+                                    bytes(10 * 2**20)))
+        self.assertEqual(self.result_summary.n_bytes[results.WCS_GET_COVERAGE],
+                         1024)
+
+    def test03_service_exception(self):
+        self.assertFalse(self._check(
+                                '<ServiceExceptionReport/>',
+                                content_type='application/vnd.ogc.se_xml'))
+        self.assertEqual(self._get_errors(),
+                         [results.SERVICE_EXCEPTION_ERROR])
+
+    def test04_wrong_format(self):
+        self.assertFalse(self._check(b'II*\x00' + bytes(100),
+                                     content_type='image/tiff'))
+        self.assertEqual(self._get_errors(), [results.COVERAGE_FORMAT_ERROR])
+
+    def test06_unreadable_error_response(self):
+        # The connection is lost reading the body of an error response or
+        # service exception
+        for status_code, content_type in ((500, 'text/html'),
+                                          (200, 'application/vnd.ogc.se_xml')):
+            self.validation_cls.transport.get = (
+                lambda uri, **kwargs: UnreadableResponse(
+                                    uri, status_code=status_code,
+                                    headers={'Content-Type': content_type}))
+            self.assertFalse(self.validation_cls.check_wcs_get_coverage_resp(
+                                                        self.GET_COVERAGE_URI))
+
+        self.assertEqual(self._get_errors(), ['ConnectionError'])
+        self.assertEqual(
+                self.result_summary.n_failed[results.WCS_GET_COVERAGE], 2)
+
+    def test05_get_coverage_uri(self):
+        wcs_coverage = WcsCoverage('sst', (-10., 40., 30., 70.), None,
+                                   ['GeoTIFF', 'NetCDF3'])
+        coverage_format = self.validation_cls.get_wcs_get_coverage_format(
+                                                                wcs_coverage)
+        self.assertEqual(coverage_format, 'NetCDF3')
+        self.assertEqual(self.validation_cls.get_wcs_get_coverage_uri(
+                                                            self.WCS_URI,
+                                                            wcs_coverage,
+                                                            coverage_format),
+                         self.WCS_URI + '?service=WCS&version=1.0.0&'
+                         'request=GetCoverage&COVERAGE=sst&'
+                         'BBOX=8.0000,53.5000,12.0000,56.5000&'
+                         'CRS=OGC:CRS84&FORMAT=NetCDF3')
+
+        self.assertIsNone(self.validation_cls.get_wcs_get_coverage_format(
+                                wcs_coverage._replace(formats=['GeoTIFF'])))
+
+
+class CheckWcsEndpointTestCase(unittest.TestCase):
+    WCS_URI = 'http://tds.test.ac.uk/thredds/wcs/entry00-agg'
+
+    def setUp(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = make_thredds_transport(['entry00'])
+        self.validation_cls = _OgcTdsValidation
+
+    def test01_default(self):
+        stats = self.validation_cls.check_wcs_endpoint(self.WCS_URI)
+        self.assertEqual(stats['wcs_describe_coverage_ok'], 1)
+        self.assertEqual(stats['wcs_get_coverage_uris_tested'], 1)
+        self.assertEqual(stats['wcs_get_coverage_ok'], 1)
+
+    def test02_all_coverages(self):
+        self.validation_cls.wcs_max_coverages = None
+        stats = self.validation_cls.check_wcs_endpoint(self.WCS_URI)
+        self.assertEqual(stats['wcs_describe_coverage_ok'], 2)
+        self.assertEqual(stats['wcs_get_coverage_ok'], 2)
+        self.assertTrue(results.stats_ok(stats))
+
+    def test03_malformed_describe_coverage(self):
+        # A position with a missing or non-numeric coordinate fails the
+        # DescribeCoverage check of the endpoint only
+        transport = self.validation_cls.transport
+        for uri in transport.responses:
+            if 'DescribeCoverage' in uri:
+                status_code, content, headers = transport.responses[uri]
+                transport.add(uri, content.replace('-180 -90', '-180'),
+                              status_code=status_code, headers=headers)
+
+        stats = self.validation_cls.check_wcs_endpoint(self.WCS_URI)
+        self.assertEqual(stats['wcs_describe_coverage_ok'], 0)
+        self.assertFalse(results.stats_ok(stats))
+
+    def test04_unreadable_error_response(self):
+        self.validation_cls.transport.get = (
+                lambda uri, **kwargs: UnreadableResponse(uri,
+                                                         status_code=503))
+        stats = self.validation_cls.check_wcs_endpoint(self.WCS_URI)
+        self.assertEqual(stats['wcs_get_capabilities_ok'], 0)
+        self.assertFalse(results.stats_ok(stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
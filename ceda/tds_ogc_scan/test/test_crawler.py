@@ -0,0 +1,72 @@
+"""Unit tests for the recursive THREDDS catalogue crawler
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import unittest
+
+from ceda.tds_ogc_scan.crawler import ThreddsCatalogCrawler
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, CATALOG_XML,
+                                             CATALOG_REF_XML, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+class ThreddsCatalogCrawlerTestCase(unittest.TestCase):
+    '''Root catalogue -> group catalogue -> entry catalogues, with a link
+    back to the root catalogue to check each is only read once'''
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(4)]
+
+    def setUp(self):
+        transport = make_thredds_transport(self.ENTRY_NAMES)
+        transport.add(CATALOG_URI,
+                      CATALOG_XML.format(CATALOG_REF_XML.format('group')))
+
+        catalog_refs = ''.join([CATALOG_REF_XML.format(entry_name)
+                                for entry_name in self.ENTRY_NAMES + [
+                                                                'catalog']])
+        transport.add(THREDDS_URI + '/group.xml',
+                      CATALOG_XML.format(catalog_refs))
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = transport
+        self.transport = transport
+        self.validation_cls = _OgcTdsValidation
+
+    def test01_crawl(self):
+        crawler = ThreddsCatalogCrawler(self.validation_cls, max_workers=3)
+        endpoints = list(crawler.crawl(CATALOG_URI))
+
+        self.assertEqual(len(endpoints), 2 * len(self.ENTRY_NAMES))
+        self.assertIn('http://tds.test.ac.uk/thredds/wms/entry00-agg',
+                      [endpoint.uri for endpoint in endpoints])
+        self.assertEqual(crawler.stats['catalog_refs_tested'],
+                         2 + len(self.ENTRY_NAMES))
+        self.assertEqual(len(self.transport.requested_uris),
+                         len(set(self.transport.requested_uris)))
+
+    def test02_max_depth(self):
+        crawler = ThreddsCatalogCrawler(self.validation_cls, max_depth=1)
+        self.assertEqual(list(crawler.crawl(CATALOG_URI)), [])
+        self.assertEqual(crawler.stats['catalog_refs_tested'], 2)
+
+    def test03_max_pages(self):
+        crawler = ThreddsCatalogCrawler(self.validation_cls, max_pages=4)
+        endpoints = list(crawler.crawl(CATALOG_URI))
+        self.assertEqual(len(endpoints), 4)
+        self.assertEqual(crawler.stats['catalog_refs_skipped'], 2)
+
+    def test04_check(self):
+        crawler = ThreddsCatalogCrawler(self.validation_cls, max_workers=2)
+        stats = crawler.check(CATALOG_URI, max_workers=4)
+        self.assertEqual(stats['wms_get_map_ok'], len(self.ENTRY_NAMES))
+        self.assertEqual(stats['wcs_describe_coverage_ok'],
+                         len(self.ENTRY_NAMES))
+
+
+if __name__ == '__main__':
+    unittest.main()
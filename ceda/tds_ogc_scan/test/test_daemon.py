@@ -0,0 +1,258 @@
+"""Unit tests for the check daemon and its client
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ceda.tds_ogc_scan.daemon import (CheckDaemon, CheckRunner, NagiosCheck,
+                                      CHECKS, NAGIOS_OK, NAGIOS_CRITICAL,
+                                      NAGIOS_UNKNOWN)
+from ceda.tds_ogc_scan.nagios_test.client import (request_check,
+                                                  exit_with_daemon_result,
+                                                  SOCKET_ENV_NAME,
+                                                  TIMEOUT_ENV_NAME)
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI,
+                                             make_thredds_transport)
+
+
+class CountingTestCaseFactory:
+    '''Make a TestCase class with one passing and optionally one failing
+    test, counting the classes made.  Checks complete once release is set'''
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.n_calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, catalog_uri, max_workers=1):
+        self.n_calls += 1
+        fail = self.fail
+        release = self.release
+
+        class _TestCase(unittest.TestCase):
+            def test01_ok(self):
+                release.wait()
+
+            def test02_maybe_fail(self):
+                self.assertFalse(fail, 'Map broken')
+
+        return _TestCase
+
+
+class CheckDaemonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_dirpath = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.socket_dirpath, 'check.sock')
+        self.factory = CountingTestCaseFactory()
+        self.runners = {
+            'wms': CheckRunner(NagiosCheck('CCI_WMS_TEST', self.factory),
+                               CATALOG_URI)
+        }
+        self.daemon = None
+
+    def tearDown(self):
+        if self.daemon is not None:
+            self.daemon.shutdown()
+            self.daemon.server_close()
+
+        shutil.rmtree(self.socket_dirpath)
+
+    def _start_daemon(self):
+        self.daemon = CheckDaemon(self.socket_path, self.runners)
+        thread = threading.Thread(target=self.daemon.serve_forever,
+                                  daemon=True)
+        thread.start()
+
+    def _wait_for_result(self, previous_result=None, timeout=5.):
+        '''Wait for a check started in the background to complete'''
+        runner = self.runners['wms']
+        end_time = time.monotonic() + timeout
+        while runner.result is previous_result:
+            self.assertLess(time.monotonic(), end_time)
+            time.sleep(0.01)
+
+        return runner.result
+
+    def test01_request(self):
+        self._start_daemon()
+
+        # The check is started without waiting for it to complete
+        status, output = request_check(self.socket_path, 'wms')
+        self.assertEqual(status, NAGIOS_UNKNOWN)
+        self.assertEqual(output, 'CCI_WMS_TEST UNKNOWN - check in progress')
+
+        result = self._wait_for_result()
+        status, output = request_check(self.socket_path, 'wms')
+        self.assertEqual(status, NAGIOS_OK)
+        self.assertEqual(output, 'CCI_WMS_TEST OK - 2 tests passed')
+
+        # The result is reused until it is older than the maximum age
+        request_check(self.socket_path, 'wms', max_age=60.)
+        self.assertEqual(self.factory.n_calls, 1)
+
+        # After which it is given as stale while the check is made again
+        status, output = request_check(self.socket_path, 'wms', max_age=0.)
+        self.assertEqual(status, NAGIOS_OK)
+        self.assertTrue(output.startswith('CCI_WMS_TEST OK - 2 tests passed '
+                                          '(stale: checked '), output)
+        self._wait_for_result(result)
+        self.assertEqual(self.factory.n_calls, 2)
+
+    def test02_failure(self):
+        self.factory.fail = True
+        self.runners['wms'].run()
+        self._start_daemon()
+        status, output = request_check(self.socket_path, 'wms')
+        self.assertEqual(status, NAGIOS_CRITICAL)
+        self.assertTrue(output.startswith(
+                'CCI_WMS_TEST CRITICAL - 1 of 2 tests failed: '
+                'test02_maybe_fail: AssertionError: True is not false : '
+                'Map broken'), output)
+
+    def test03_invalid_request(self):
+        self._start_daemon()
+        status, output = request_check(self.socket_path, 'wfs')
+        self.assertEqual(status, NAGIOS_UNKNOWN)
+        self.assertIn('Invalid check request', output)
+        self.assertEqual(self.factory.n_calls, 0)
+
+    def test04_concurrent_requests(self):
+        # Requests arriving while the check is being made are answered
+        # without waiting for it, and share the one check
+        self.factory.release.clear()
+        self._start_daemon()
+        statuses = []
+
+        def _request():
+            statuses.append(request_check(self.socket_path, 'wms',
+                                          timeout=5.)[0])
+
+        threads = [threading.Thread(target=_request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [NAGIOS_UNKNOWN] * 5)
+        self.factory.release.set()
+        self._wait_for_result()
+        self.assertEqual(self.factory.n_calls, 1)
+
+    def test05_stale_socket(self):
+        # Left by a daemon which has exited
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        sock.close()
+        self._start_daemon()
+        self.assertTrue(request_check(self.socket_path, 'wms')[1].startswith(
+                                                            'CCI_WMS_TEST '))
+
+        # A second daemon can't take over from a running one
+        with self.assertRaises(OSError):
+            CheckDaemon(self.socket_path, self.runners)
+
+        self.daemon.shutdown()
+        self.daemon.server_close()
+        self.daemon = None
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test06_client_fallback(self):
+        # No daemon is listening so the script makes the check itself
+        os.environ[SOCKET_ENV_NAME] = self.socket_path
+        try:
+            self.assertIsNone(exit_with_daemon_result('wms'))
+        finally:
+            del os.environ[SOCKET_ENV_NAME]
+
+        # Nor with no socket set
+        self.assertIsNone(exit_with_daemon_result('wms'))
+
+    def test07_client_exit(self):
+        self.runners['wms'].run()
+        self._start_daemon()
+        os.environ[SOCKET_ENV_NAME] = self.socket_path
+        try:
+            with self.assertRaises(SystemExit) as context:
+                exit_with_daemon_result('wms')
+        finally:
+            del os.environ[SOCKET_ENV_NAME]
+
+        self.assertEqual(context.exception.code, NAGIOS_OK)
+
+    def test08_stale_while_checking(self):
+        # A request finding a stale result doesn't wait for the check
+        result = self.runners['wms'].run()
+        self.factory.release.clear()
+        self._start_daemon()
+        status, output = request_check(self.socket_path, 'wms', max_age=0.,
+                                       timeout=5.)
+        self.assertEqual(status, NAGIOS_OK)
+        self.assertIn('check in progress', output)
+
+        self.factory.release.set()
+        self._wait_for_result(result)
+        self.assertEqual(self.factory.n_calls, 2)
+
+    def test09_client_timeout(self):
+        # A daemon listening but not answering: the client gives UNKNOWN
+        # status rather than making a second check in process
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        sock.listen(1)
+        os.environ[SOCKET_ENV_NAME] = self.socket_path
+        os.environ[TIMEOUT_ENV_NAME] = '0.1'
+        try:
+            with self.assertRaises(SystemExit) as context:
+                exit_with_daemon_result('wms', check_name='CCI_WMS_TEST')
+        finally:
+            del os.environ[SOCKET_ENV_NAME]
+            del os.environ[TIMEOUT_ENV_NAME]
+            sock.close()
+
+        self.assertEqual(context.exception.code, NAGIOS_UNKNOWN)
+
+
+class CheckRunnerTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry00', 'entry01']
+
+    def setUp(self):
+        # The Nagios test case factories check with OgcTdsValidation itself
+        self.transport = OgcTdsValidation.transport
+        OgcTdsValidation.transport = make_thredds_transport(self.ENTRY_NAMES)
+
+    def tearDown(self):
+        OgcTdsValidation.transport = self.transport
+
+    def test01_wms(self):
+        runner = CheckRunner(CHECKS['wms'], CATALOG_URI, max_workers=2,
+                             deadline=60.)
+        result = runner.run()
+        self.assertEqual(result.status, NAGIOS_OK, result.output)
+        self.assertTrue(result.output.startswith('CCI_WMS_TEST OK'))
+        self.assertIsNone(OgcTdsValidation.scan_deadline)
+
+        # Kept for the next request
+        self.assertIs(runner.get_result(60.), result)
+
+    def test02_wcs_unavailable(self):
+        OgcTdsValidation.transport.responses.clear()
+        runner = CheckRunner(CHECKS['wcs'], CATALOG_URI)
+        result = runner.run()
+        self.assertNotEqual(result.status, NAGIOS_OK)
+        self.assertTrue(result.output.startswith('CCI_WCS_TEST '))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+"""Unit tests for scan deadlines and request time limits
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import time
+import unittest
+
+import requests
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.deadline import (Deadline, DeadlineExceeded,
+                                        DeadlineTransport, ResponseTimeout)
+from ceda.tds_ogc_scan.pipeline import ScanPipeline
+from ceda.tds_ogc_scan.transport import HttpTransport
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, FakeResponse,
+                                             FakeTransport,
+                                             make_thredds_transport)
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.
+
+    def __call__(self):
+        return self.time
+
+
+class _TimeoutTransport(FakeTransport):
+    '''Record the timeout of each request'''
+    timeout = (10., 60.)
+
+    def __init__(self, responses=None):
+        super().__init__(responses)
+        self.timeouts = []
+
+    def get(self, uri, **kwargs):
+        self.timeouts.append(kwargs.get('timeout'))
+        return super().get(uri, **kwargs)
+
+
+class _SlowReader(io.BytesIO):
+    '''Stream delaying each read'''
+    DELAY = 0.02
+
+    def read(self, *args):
+        time.sleep(self.DELAY)
+        return super().read(*args)
+
+
+class _SlowBodyTransport(FakeTransport):
+    def get(self, uri, **kwargs):
+        resp = super().get(uri, **kwargs)
+        resp.raw = _SlowReader(resp.content)
+        return resp
+
+
+class _HangingTransport(FakeTransport):
+    '''Stand in for a server which stops responding to GetMap requests for
+    some entries.  Requests wait until their read timeout and fail'''
+    def __init__(self, responses, hanging_entry_names):
+        super().__init__(responses)
+        self.hanging_entry_names = hanging_entry_names
+
+    def get(self, uri, **kwargs):
+        if 'GetMap' in uri and any(entry_name in uri for entry_name in
+                                   self.hanging_entry_names):
+            time.sleep(kwargs['timeout'][1])
+            raise requests.ReadTimeout('Read timed out')
+
+        return super().get(uri, **kwargs)
+
+
+class DeadlineTestCase(unittest.TestCase):
+    def test01_deadline(self):
+        clock = FakeClock()
+        deadline = Deadline(5., clock=clock)
+        self.assertEqual(deadline.remaining(), 5.)
+        self.assertEqual(deadline.limit(10.), 5.)
+        self.assertEqual(deadline.limit(None), 5.)
+        self.assertFalse(deadline.expired())
+
+        clock.time = 6.
+        self.assertTrue(deadline.expired())
+        self.assertEqual(deadline.remaining(), 0.)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.check()
+
+    def test02_timeouts_cut_to_deadline(self):
+        clock = FakeClock()
+        transport = _TimeoutTransport()
+        transport.add(CATALOG_URI, 'content')
+        deadline_transport = DeadlineTransport(
+                                        transport,
+                                        deadline=Deadline(30., clock=clock))
+
+        deadline_transport.get(CATALOG_URI)
+        clock.time = 25.
+        resp = deadline_transport.get(CATALOG_URI, stream=True)
+        self.assertEqual(transport.timeouts, [(10., 30.), (5., 5.)])
+        self.assertEqual(resp.raw.read(), b'content')
+
+        # No requests are made after the deadline
+        clock.time = 30.
+        with self.assertRaises(DeadlineExceeded):
+            deadline_transport.get(CATALOG_URI)
+
+        self.assertEqual(len(transport.requested_uris), 2)
+
+    def test03_error_after_deadline(self):
+        clock = FakeClock()
+
+        class _ErrorTransport(FakeTransport):
+            def get(self, uri, **kwargs):
+                clock.time = 2.
+                raise requests.ReadTimeout('Read timed out')
+
+        deadline_transport = DeadlineTransport(
+                                        _ErrorTransport(),
+                                        deadline=Deadline(1., clock=clock))
+        with self.assertRaises(DeadlineExceeded):
+            deadline_transport.get(CATALOG_URI)
+
+    def test04_response_timeout(self):
+        transport = _SlowBodyTransport()
+        transport.add(CATALOG_URI, b'x' * 100)
+        deadline_transport = DeadlineTransport(transport, total_timeout=0.05)
+
+        resp = deadline_transport.get(CATALOG_URI, stream=True)
+        with self.assertRaises(ResponseTimeout):
+            while resp.raw.read(10):
+                pass
+
+        # Recorded as a failed check like any other timeout
+        self.assertIsInstance(ResponseTimeout(), requests.Timeout)
+
+    def test05_check_with_deadline(self):
+        entry_names = ['entry{:02d}'.format(i) for i in range(10)]
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = _HangingTransport(
+                                make_thredds_transport(entry_names).responses,
+                                entry_names[3:])
+        result_summary = results.ResultSummary()
+        _OgcTdsValidation.result_sinks = (result_summary,)
+
+        deadline = 0.5
+        start_time = time.monotonic()
+        stats = _OgcTdsValidation.check(CATALOG_URI, deadline=deadline)
+        elapsed = time.monotonic() - start_time
+
+        self.assertLess(elapsed, deadline + ScanPipeline.STOP_TIMEOUT + 0.5)
+        self.assertEqual(stats['scan_deadline_exceeded'], 1)
+
+        # Partial results for the entries completed.  The checks abandoned
+        # at the deadline are not failures
+        self.assertEqual(stats['catalog_refs_tested'], 3)
+        self.assertGreater(stats['catalog_refs_untested'], 0)
+        self.assertTrue(results.stats_ok(stats))
+        self.assertTrue(result_summary.ok)
+        self.assertIsNone(_OgcTdsValidation.scan_deadline)
+
+    def test06_untested_uris(self):
+        entry_names = ['entry{:02d}'.format(i) for i in range(4)]
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = _HangingTransport(
+                                make_thredds_transport(entry_names).responses,
+                                entry_names[1:])
+        _OgcTdsValidation.scan_deadline = Deadline(0.3)
+        catalog_ref_uris = list(_OgcTdsValidation.get_catalog_ref_uris(
+                                                                CATALOG_URI))
+
+        pipeline = ScanPipeline(_OgcTdsValidation,
+                                deadline=_OgcTdsValidation.scan_deadline)
+        stats = pipeline.run(iter(catalog_ref_uris))
+
+        self.assertTrue(pipeline.deadline_exceeded)
+        self.assertTrue(pipeline.catalog_read)
+        self.assertEqual(pipeline.untested_uris, catalog_ref_uris[1:])
+        self.assertEqual(stats['catalog_refs_untested'], 3)
+
+    def test07_retries_within_deadline(self):
+        # Each attempt takes a second and is answered with a 503
+        clock = FakeClock()
+        timeouts = []
+        sleeps = []
+
+        class _UnavailableSession:
+            def __init__(self, retry_after):
+                self.retry_after = retry_after
+
+            def get(self, uri, **kwargs):
+                timeouts.append(kwargs['timeout'])
+                clock.time += 1.
+                return FakeResponse(uri, status_code=503, headers={
+                                        'Retry-After': self.retry_after})
+
+        def _sleep(duration):
+            sleeps.append(duration)
+            clock.time += duration
+
+        transport = HttpTransport(max_retries=2, sleep=_sleep)
+        transport.session = _UnavailableSession('2')
+        deadline_transport = DeadlineTransport(
+                                        transport,
+                                        deadline=Deadline(2.5, clock=clock))
+
+        # No retry is made if the wait before it runs past the deadline
+        resp = deadline_transport.get(CATALOG_URI)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(timeouts, [(2.5, 2.5)])
+        self.assertEqual(sleeps, [])
+
+        # The timeouts of retries are cut to the time left
+        del timeouts[:]
+        transport.session = _UnavailableSession('0.25')
+        deadline_transport.deadline = Deadline(2.5, clock=clock)
+        resp = deadline_transport.get(CATALOG_URI)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(timeouts, [(2.5, 2.5), (1.25, 1.25)])
+        self.assertEqual(sleeps, [0.25])
+
+
+if __name__ == '__main__':
+    unittest.main()
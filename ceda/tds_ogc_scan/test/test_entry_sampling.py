@@ -0,0 +1,170 @@
+"""Unit tests for the sampling of catalogue entries
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+from ceda.tds_ogc_scan.entry_sampling import (EntrySampler,
+                                              RotatingEntrySampler,
+                                              reservoir_sample)
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+class ReservoirSampleTestCase(unittest.TestCase):
+    def test01_sample_size(self):
+        rng = random.Random(1)
+        self.assertEqual(reservoir_sample(range(3), 5, rng=rng), [0, 1, 2])
+        self.assertEqual(reservoir_sample(range(3), 0, rng=rng), [])
+
+        sample = reservoir_sample(range(1000), 10, rng=rng)
+        self.assertEqual(len(sample), 10)
+        self.assertEqual(len(set(sample)), 10)
+
+    def test02_uniform(self):
+        rng = random.Random(2)
+        n_trials = 2000
+        counts = Counter()
+        for _ in range(n_trials):
+            counts.update(reservoir_sample(iter(range(20)), 5, rng=rng))
+
+        # Each item is chosen with probability 1/4
+        expected = n_trials / 4.
+        for item in range(20):
+            self.assertAlmostEqual(counts[item] / expected, 1., delta=0.15)
+
+    def test03_seed(self):
+        uris = ['uri{}'.format(i) for i in range(100)]
+        sample = list(EntrySampler(seed=3).sample(iter(uris), 5))
+        self.assertEqual(list(EntrySampler(seed=3).sample(iter(uris), 5)),
+                         sample)
+
+
+class RotatingEntrySamplerTestCase(unittest.TestCase):
+    N_RUNS = 4
+    URIS = ['{}/entry{:02d}.xml'.format(THREDDS_URI, i) for i in range(40)]
+
+    def setUp(self):
+        self.state_dirpath = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.state_dirpath, 'sample.sqlite')
+        self.sampler = RotatingEntrySampler(self.filepath,
+                                            n_runs=self.N_RUNS, seed=1)
+
+    def tearDown(self):
+        self.sampler.close()
+        shutil.rmtree(self.state_dirpath)
+
+    def _run(self, n, ok_uris=None):
+        '''Sample and check entries, all passing if ok_uris is None'''
+        uris = list(self.sampler.sample(iter(self.URIS), n))
+        for uri in uris:
+            ok = ok_uris is None or uri in ok_uris
+            self.sampler.entry_checked(uri, Counter(
+                                wms_get_map_uris_tested=1,
+                                wms_get_map_ok=int(ok)), elapsed=1.)
+        return uris
+
+    def test01_coverage(self):
+        tested_uris = set()
+        for _ in range(self.N_RUNS):
+            tested_uris.update(self._run(2))
+
+        self.assertEqual(tested_uris, set(self.URIS))
+
+    def test02_overdue(self):
+        # Entries due in runs where the checks were not recorded are tested
+        # in the next
+        run_uris = self._run(0)
+        for _ in range(self.N_RUNS):
+            list(self.sampler.sample(iter(self.URIS), 0))
+
+        uris = list(self.sampler.sample(iter(self.URIS), 0))
+        self.assertTrue(set(run_uris).issubset(uris))
+
+    def test03_persisted(self):
+        self._run(2)
+        self.sampler.close()
+
+        self.sampler = RotatingEntrySampler(self.filepath,
+                                            n_runs=self.N_RUNS)
+        self.assertEqual(self.sampler.run, 1)
+
+    def test04_failures_favoured(self):
+        # Rotate slowly enough that few entries are due
+        self.sampler.close()
+        self.sampler = RotatingEntrySampler(self.filepath, n_runs=1000,
+                                            seed=1)
+        failed_uris = set(self.URIS[:5])
+        list(self.sampler.sample(iter(self.URIS), len(self.URIS)))
+        for uri in self.URIS:
+            self.sampler.entry_checked(uri, Counter(
+                                wms_get_map_uris_tested=1,
+                                wms_get_map_ok=int(uri not in failed_uris)),
+                                elapsed=1.)
+
+        self.assertEqual(set(self.sampler.get_weights()), failed_uris)
+
+        counts = Counter()
+        for _ in range(100):
+            counts.update(self.sampler.sample(iter(self.URIS), 5))
+
+        n_failed = sum(counts[uri] for uri in failed_uris)
+        n_passed = sum(counts.values()) - n_failed
+        self.assertGreater(n_failed / len(failed_uris),
+                           2 * n_passed / (len(self.URIS) -
+                                           len(failed_uris)))
+
+    def test05_check(self):
+        entry_names = ['entry{:02d}'.format(i) for i in range(8)]
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            entry_sampler = self.sampler
+
+        _OgcTdsValidation.transport = make_thredds_transport(entry_names)
+
+        tested = Counter()
+        for _ in range(self.N_RUNS):
+            stats = _OgcTdsValidation.check(CATALOG_URI, rand_sample=1)
+            tested['catalog_refs_tested'] += stats['catalog_refs_tested']
+
+        self.assertGreaterEqual(tested['catalog_refs_tested'],
+                                len(entry_names))
+        self.assertEqual(self.sampler.get_overdue_uris(self.N_RUNS * 2),
+                         {'{}/{}.xml'.format(THREDDS_URI, entry_name)
+                          for entry_name in entry_names})
+
+    def test06_missed_slot(self):
+        # Entries due in run 2 are missed, before any has been tested.  They
+        # are due again once a rotation has passed since they were first
+        # read, rather than waiting for their next slot
+        self._run(0)
+        missed_uris = list(self.sampler.sample(iter(self.URIS), 0))
+        for _ in range(self.N_RUNS - 2):
+            self._run(0)
+
+        uris = list(self.sampler.sample(iter(self.URIS), 0))
+        self.assertEqual(self.sampler.run, self.N_RUNS + 1)
+        self.assertTrue(missed_uris)
+        self.assertTrue(set(missed_uris).issubset(uris))
+
+    def test07_unsampled_check_ignored(self):
+        # Outcomes of checks made without sampling don't change the schedule
+        uri = self.URIS[0]
+        self.sampler.entry_checked(uri, Counter(catalog_refs_tested=1,
+                                                catalog_refs_ok=1))
+        self.assertEqual(self.sampler.get_weights(), {})
+        self.assertNotIn(uri, self.sampler.get_overdue_uris(
+                                                        self.N_RUNS * 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
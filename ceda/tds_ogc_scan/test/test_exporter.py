@@ -0,0 +1,104 @@
+"""Unit tests for the Prometheus exporter
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import threading
+import unittest
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.exporter import (OgcTdsExporter, MetricsServer,
+                                        PrometheusScanMetrics)
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+class OgcTdsExporterTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry00', 'entry01']
+
+    def setUp(self):
+        self.transport = make_thredds_transport(self.ENTRY_NAMES)
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = self.transport
+        self.exporter = OgcTdsExporter(CATALOG_URI,
+                                       validation_cls=_OgcTdsValidation)
+
+    def test01_scan(self):
+        exposition = self.exporter.scan_metrics.exposition
+        self.assertEqual(exposition, b'')
+
+        # Make the WMS GetMap fail for the second entry
+        for uri in list(self.transport.responses):
+            if 'entry01' in uri and 'GetMap' in uri:
+                self.transport.add(uri, 'Server error', status_code=500)
+
+        self.assertFalse(self.exporter.scan())
+
+        exposition = self.exporter.scan_metrics.exposition.decode('utf-8')
+        lines = exposition.splitlines()
+        self.assertIn('tds_ogc_scan_requests_total{{operation="{}",'
+                      'outcome="ok"}} 1.0'.format(results.WMS_GET_MAP),
+                      lines)
+        self.assertIn('tds_ogc_scan_request_duration_seconds_count'
+                      '{{operation="{}"}} 2.0'.format(results.WMS_GET_MAP),
+                      lines)
+        self.assertIn('tds_ogc_scan_request_duration_seconds_bucket'
+                      '{{le="+Inf",operation="{}"}} 2.0'.format(
+                                                    results.WMS_GET_MAP),
+                      lines)
+        self.assertIn('tds_ogc_scan_last_scan_success 0.0', lines)
+
+        entry_up = [line for line in lines
+                    if line.startswith('tds_ogc_scan_catalog_entry_up{')]
+        self.assertEqual(len(entry_up), 2)
+        self.assertTrue(entry_up[0].endswith(' 1.0'))
+        self.assertTrue(entry_up[1].endswith(' 0.0'))
+
+    def test02_scrape_does_not_scan(self):
+        self.exporter.scan()
+        n_requests = len(self.transport.requested_uris)
+
+        server = MetricsServer(('127.0.0.1', 0), self.exporter.scan_metrics)
+        server_thread = threading.Thread(target=server.serve_forever,
+                                         daemon=True)
+        server_thread.start()
+        try:
+            metrics_uri = 'http://127.0.0.1:{}/metrics'.format(
+                                                    server.server_address[1])
+            for _ in range(2):
+                with urlopen(metrics_uri) as resp:
+                    content = resp.read()
+
+            self.assertEqual(content, self.exporter.scan_metrics.exposition)
+            self.assertEqual(len(self.transport.requested_uris), n_requests)
+
+            with self.assertRaises(HTTPError):
+                urlopen(metrics_uri.replace('/metrics', '/'))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test03_failed_scan(self):
+        exporter = OgcTdsExporter(THREDDS_URI + '/missing.xml',
+                                  validation_cls=self.exporter.validation_cls)
+        self.assertFalse(exporter.scan())
+        self.assertIn(b'tds_ogc_scan_scans_total{outcome="error"} 1.0',
+                      exporter.scan_metrics.exposition)
+
+    def test04_label_escaping(self):
+        scan_metrics = PrometheusScanMetrics()
+        scan_metrics.scan_completed(1., True, {'http://host/a"b\\c': True})
+        self.assertIn(b'{entry="http://host/a\\"b\\\\c"} 1.0',
+                      scan_metrics.exposition)
+
+
+if __name__ == '__main__':
+    unittest.main()
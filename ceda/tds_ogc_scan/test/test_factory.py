@@ -0,0 +1,104 @@
+"""Unit tests for concurrent execution of generated unittest methods
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import time
+import unittest
+
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.deadline import Deadline
+from ceda.tds_ogc_scan.test.test_wms import tds_wms_testcase_factory
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, FakeTransport,
+                                             make_thredds_transport)
+
+
+class SlowFakeTransport(FakeTransport):
+    '''Delay each response and record the peak number of requests in
+    progress'''
+    DELAY = 0.02
+
+    def __init__(self, responses=None):
+        super().__init__(responses)
+        self.n_in_progress = 0
+        self.peak_in_progress = 0
+
+    def get(self, uri, **kwargs):
+        with self._lock:
+            self.n_in_progress += 1
+            self.peak_in_progress = max(self.peak_in_progress,
+                                        self.n_in_progress)
+        time.sleep(self.DELAY)
+        with self._lock:
+            self.n_in_progress -= 1
+
+        return super().get(uri, **kwargs)
+
+
+class ThreddsCatalogUnittestCaseFactoryTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(4)]
+
+    def setUp(self):
+        self.transport = SlowFakeTransport(
+                    make_thredds_transport(self.ENTRY_NAMES).responses)
+
+        # Make the WMS GetMap fail for the second entry
+        for uri in list(self.transport.responses):
+            if 'entry01' in uri and 'GetMap' in uri:
+                self.transport.add(uri, 'Server error', status_code=500)
+
+        self._transport = OgcTdsValidation.transport
+        OgcTdsValidation.transport = self.transport
+
+    def tearDown(self):
+        OgcTdsValidation.transport = self._transport
+
+    def _run_testcase(self, max_workers):
+        TdsWmsTestCase = tds_wms_testcase_factory(CATALOG_URI,
+                                                  max_workers=max_workers)
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+                                                            TdsWmsTestCase)
+        result = unittest.TestResult()
+        suite.run(result)
+        return result
+
+    def test01_sequential(self):
+        result = self._run_testcase(1)
+        self.assertEqual(result.testsRun, 4)
+        self.assertEqual(self.transport.peak_in_progress, 1)
+        self.assertEqual([test.id().rsplit('.', 1)[-1]
+                          for test, _ in result.failures], ['test_002_wms'])
+
+    def test02_concurrent(self):
+        result = self._run_testcase(4)
+        self.assertEqual(result.testsRun, 4)
+        self.assertGreater(self.transport.peak_in_progress, 1)
+
+        # Outcomes are still reported for each method
+        self.assertEqual(len(result.errors), 0)
+        self.assertEqual([test.id().rsplit('.', 1)[-1]
+                          for test, _ in result.failures], ['test_002_wms'])
+        self.assertIn('WMS GetMap call failed', result.failures[0][1])
+
+    def test03_deadline_exceeded(self):
+        TdsWmsTestCase = tds_wms_testcase_factory(CATALOG_URI, max_workers=4)
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+                                                            TdsWmsTestCase)
+        result = unittest.TestResult()
+
+        OgcTdsValidation.scan_deadline = Deadline(0.)
+        try:
+            suite.run(result)
+        finally:
+            OgcTdsValidation.scan_deadline = None
+
+        # Tests not run by the deadline are skipped rather than failed
+        self.assertEqual(result.testsRun, 4)
+        self.assertEqual(len(result.skipped), 4)
+        self.assertEqual(len(result.failures) + len(result.errors), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
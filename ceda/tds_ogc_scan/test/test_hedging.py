@@ -0,0 +1,335 @@
+"""Unit tests for hedged requests and classified retries
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import time
+import random
+import threading
+import unittest
+
+import requests
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.hedging import (HedgedTransport, LatencyEstimator,
+                                       get_operation, CATALOG_OPERATION)
+from ceda.tds_ogc_scan.transport import HttpTransport, RetryPolicy
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, FakeResponse,
+                                             make_thredds_transport)
+
+GET_MAP_URI = ('http://tds.test.ac.uk/thredds/wms/entry00-agg?service=WMS&'
+               'version=1.3.0&REQUEST=GetMap&LAYERS=sst')
+
+
+class SlowFakeTransport:
+    '''Wrap a FakeTransport delaying responses to URIs containing a given
+    string.  Responses closed are counted'''
+    def __init__(self, transport, slow_text=None, delay=0.):
+        self.transport = transport
+        self.slow_text = slow_text
+        self.delay = delay
+        self.n_closed = 0
+        self._slow_uris = set()
+        self._lock = threading.Lock()
+
+    def get(self, uri, **kwargs):
+        if self.slow_text is not None and self.slow_text in uri:
+            with self._lock:
+                # Only the first request for the URI is slow
+                slow = uri not in self._slow_uris
+                self._slow_uris.add(uri)
+
+            if slow:
+                time.sleep(self.delay)
+
+        resp = self.transport.get(uri, **kwargs)
+        resp.close = self._count_close
+        return resp
+
+    def _count_close(self):
+        with self._lock:
+            self.n_closed += 1
+
+    def close(self):
+        pass
+
+
+class LatencyEstimatorTestCase(unittest.TestCase):
+
+    def test01_get_operation(self):
+        self.assertEqual(get_operation(GET_MAP_URI), 'GetMap')
+        self.assertEqual(get_operation(CATALOG_URI), CATALOG_OPERATION)
+
+    def test02_estimate(self):
+        estimator = LatencyEstimator(0.9, window=100, min_samples=10)
+        for latency in range(9):
+            estimator.record('GetMap', float(latency))
+
+        self.assertIsNone(estimator.estimate('GetMap'))
+        estimator.record('GetMap', 9.)
+        self.assertEqual(estimator.estimate('GetMap'), 8.)
+        self.assertIsNone(estimator.estimate('GetCapabilities'))
+
+        # Only the most recent latencies are kept
+        for _ in range(100):
+            estimator.record('GetMap', 0.5)
+
+        self.assertEqual(estimator.estimate('GetMap'), 0.5)
+
+
+class HedgedTransportTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(20)]
+
+    def setUp(self):
+        self.fake_transport = make_thredds_transport(self.ENTRY_NAMES)
+        self.slow_transport = SlowFakeTransport(self.fake_transport)
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        self.validation_cls = _OgcTdsValidation
+
+    def _make_transport(self, max_hedge_ratio=1.,
+                        max_workers=HedgedTransport.DEFAULT_MAX_WORKERS):
+        estimator = LatencyEstimator(0.9, min_samples=5)
+        for _ in range(5):
+            estimator.record('GetMap', 0.01)
+
+        return HedgedTransport(self.slow_transport,
+                               max_hedge_ratio=max_hedge_ratio,
+                               latency_estimator=estimator,
+                               max_workers=max_workers)
+
+    def test01_no_estimate(self):
+        transport = HedgedTransport(self.slow_transport)
+        resp = transport.get(CATALOG_URI)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(transport.n_hedged, 0)
+        self.assertEqual(
+            len(transport.latency_estimator._latencies[CATALOG_OPERATION]), 1)
+
+    def test02_hedge(self):
+        uri = [uri for uri in self.fake_transport.responses
+               if 'GetMap' in uri][0]
+        self.slow_transport.slow_text = uri
+        self.slow_transport.delay = 1.
+        transport = self._make_transport()
+
+        start_time = time.perf_counter()
+        resp = transport.get(uri)
+        self.assertLess(time.perf_counter() - start_time, 0.5)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(transport.n_hedged, 1)
+        self.assertEqual(transport.n_hedges_won, 1)
+
+        # The slow response is closed once it arrives
+        time.sleep(1.2)
+        self.assertEqual(self.fake_transport.requested_uris, [uri, uri])
+        self.assertEqual(self.slow_transport.n_closed, 1)
+
+    def test03_hedge_failed(self):
+        # A duplicate request which fails doesn't replace a slow but good
+        # response
+        uri = [uri for uri in self.fake_transport.responses
+               if 'GetMap' in uri][0]
+        responses = iter([0.3, 0.])
+
+        class FailingHedgeTransport(SlowFakeTransport):
+            def get(self, uri, **kwargs):
+                delay = next(responses)
+                time.sleep(delay)
+                if delay == 0.:
+                    return FakeResponse(uri, status_code=503)
+
+                return self.transport.get(uri, **kwargs)
+
+        self.slow_transport = FailingHedgeTransport(self.fake_transport)
+        transport = self._make_transport()
+        resp = transport.get(uri)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(transport.n_hedged, 1)
+        self.assertEqual(transport.n_hedges_won, 0)
+
+    def test04_max_hedge_ratio(self):
+        uri = [uri for uri in self.fake_transport.responses
+               if 'GetMap' in uri][0]
+        self.slow_transport.slow_text = uri
+        self.slow_transport.delay = 0.2
+        transport = self._make_transport(max_hedge_ratio=0.)
+        resp = transport.get(uri)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(transport.n_hedged, 0)
+        self.assertEqual(self.fake_transport.requested_uris, [uri])
+
+    def test05_check(self):
+        # One entry's GetMap is slow: the scan doesn't wait for it once the
+        # GetMap latency has been learned from the others
+        self.slow_transport.slow_text = 'entry19-agg?service=WMS&version=' \
+                                        '1.3.0&request=GetMap'
+        self.slow_transport.delay = 2.
+        estimator = LatencyEstimator(0.9, min_samples=5)
+        self.validation_cls.transport = HedgedTransport(
+                                            self.slow_transport,
+                                            max_hedge_ratio=0.1,
+                                            latency_estimator=estimator)
+
+        start_time = time.perf_counter()
+        stats = self.validation_cls.check(CATALOG_URI)
+        self.assertLess(time.perf_counter() - start_time, 2.)
+        self.assertTrue(results.stats_ok(stats))
+        self.assertEqual(stats['wms_get_map_ok'], len(self.ENTRY_NAMES))
+        self.assertEqual(self.validation_cls.transport.n_hedges_won, 1)
+
+    def test06_no_estimate_streamed(self):
+        # Before hedging starts, the latency recorded is the time until the
+        # headers are received, not including reading the body
+        stream_args = []
+
+        class SlowBodyResponse(FakeResponse):
+            @property
+            def content(self):
+                time.sleep(0.2)
+                return b'<catalog/>'
+
+            @content.setter
+            def content(self, content):
+                pass
+
+        class SlowBodyTransport(SlowFakeTransport):
+            def get(self, uri, **kwargs):
+                stream_args.append(kwargs.get('stream'))
+                return SlowBodyResponse(uri)
+
+        transport = HedgedTransport(SlowBodyTransport(self.fake_transport))
+        transport.get(CATALOG_URI)
+        self.assertEqual(stream_args, [True])
+        latencies = transport.latency_estimator._latencies[CATALOG_OPERATION]
+        self.assertEqual(len(latencies), 1)
+        self.assertLess(latencies[0], 0.1)
+
+    def test07_thread_pool(self):
+        # Requests are made on a bounded pool of threads, reused between
+        # requests
+        thread_names = set()
+
+        class ThreadRecordingTransport(SlowFakeTransport):
+            def get(self, uri, **kwargs):
+                thread_names.add(threading.current_thread().name)
+                return super().get(uri, **kwargs)
+
+        self.slow_transport = ThreadRecordingTransport(self.fake_transport)
+        transport = self._make_transport(max_workers=2)
+        uri = [uri for uri in self.fake_transport.responses
+               if 'GetMap' in uri][0]
+        for _ in range(10):
+            self.assertEqual(transport.get(uri).status_code, 200)
+
+        self.assertLessEqual(len(thread_names), 2)
+        self.assertNotIn(threading.current_thread().name, thread_names)
+
+        transport.close()
+        with self.assertRaises(RuntimeError):
+            transport.get(uri)
+
+    def test08_stuck_request(self):
+        # The caller stops waiting once the request outlasts its timeouts
+        uri = [uri for uri in self.fake_transport.responses
+               if 'GetMap' in uri][0]
+        self.slow_transport.slow_text = uri
+        self.slow_transport.delay = 1.
+        self.slow_transport.timeout = (0.1, 0.1)
+        transport = self._make_transport(max_hedge_ratio=0.)
+
+        start_time = time.perf_counter()
+        with self.assertRaises(requests.Timeout):
+            transport.get(uri)
+
+        self.assertLess(time.perf_counter() - start_time, 0.5)
+
+        # The response is closed once it arrives
+        time.sleep(1.)
+        self.assertEqual(self.slow_transport.n_closed, 1)
+        transport.close()
+
+
+class FakeSession:
+    '''Stand-in for requests.Session raising or returning each of a list of
+    outcomes in turn'''
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.n_requests = 0
+
+    def get(self, uri, **kwargs):
+        self.n_requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        return FakeResponse(uri, status_code=outcome)
+
+    def close(self):
+        pass
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.transport = HttpTransport(max_retries=2,
+                                       sleep=self.sleeps.append)
+
+    def test01_classify(self):
+        retry_policy = RetryPolicy()
+        self.assertTrue(retry_policy.is_retryable(
+                                error=requests.ConnectionError('refused')))
+        self.assertTrue(retry_policy.is_retryable(
+                                error=requests.ConnectTimeout('timed out')))
+        self.assertFalse(retry_policy.is_retryable(
+                                error=requests.ReadTimeout('timed out')))
+        self.assertFalse(retry_policy.is_retryable(
+                                error=requests.exceptions.SSLError('bad')))
+        self.assertTrue(retry_policy.is_retryable(
+                                resp=FakeResponse(CATALOG_URI, 503)))
+        self.assertFalse(retry_policy.is_retryable(
+                                resp=FakeResponse(CATALOG_URI, 500)))
+        self.assertFalse(retry_policy.is_retryable(
+                                method='POST',
+                                resp=FakeResponse(CATALOG_URI, 503)))
+
+    def test02_backoff(self):
+        retry_policy = RetryPolicy(backoff_factor=1., max_backoff=3.,
+                                   rand=random.Random(1))
+        for n_retries in range(4):
+            backoff = retry_policy.get_backoff(n_retries)
+            self.assertTrue(0. <= backoff <= min(2**n_retries, 3.))
+
+        resp = FakeResponse(CATALOG_URI, 503, headers={'Retry-After': '2'})
+        self.assertEqual(retry_policy.get_backoff(0, resp=resp), 2.)
+
+    def test03_retry(self):
+        self.transport.session = FakeSession(
+                            [requests.ConnectionError('refused'), 502, 200])
+        resp = self.transport.get(CATALOG_URI)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test04_retries_exhausted(self):
+        self.transport.session = FakeSession([503, 503, 503, 200])
+        resp = self.transport.get(CATALOG_URI)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.transport.session.n_requests, 3)
+
+    def test05_not_retried(self):
+        self.transport.session = FakeSession(
+                                [requests.ReadTimeout('timed out'), 200])
+        with self.assertRaises(requests.ReadTimeout):
+            self.transport.get(CATALOG_URI)
+
+        self.assertEqual(self.sleeps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+"""Unit tests for per-host rate limiting, adaptive concurrency and circuit
+breaking
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import unittest
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.host_health import (TokenBucket,
+                                           AimdConcurrencyLimiter,
+                                           CircuitBreaker,
+                                           HostControlledTransport,
+                                           HostUnhealthyError)
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, FakeTransport,
+                                             make_thredds_transport)
+
+
+class FakeClock:
+    '''Clock advanced by calls to sleep'''
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now += duration
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test01_rate(self):
+        clock = FakeClock()
+        token_bucket = TokenBucket(2., capacity=2, clock=clock,
+                                   sleep=clock.sleep)
+
+        # The burst is served at once and then one request every 0.5 s
+        waits = [token_bucket.acquire() for _ in range(4)]
+        self.assertEqual(waits, [0., 0., 0.5, 0.5])
+        self.assertEqual(clock.now, 1.)
+
+        clock.now += 10.
+        self.assertEqual(token_bucket.acquire(), 0.)
+
+
+class AimdConcurrencyLimiterTestCase(unittest.TestCase):
+    def test01_decrease_and_recover(self):
+        clock = FakeClock()
+        limiter = AimdConcurrencyLimiter(8, latency_target=1.,
+                                         decrease_interval=1., clock=clock)
+
+        # Failures halve the limit at most once per decrease interval
+        limiter.record(0.1, False)
+        limiter.record(0.1, False)
+        self.assertEqual(int(limiter.limit), 4)
+
+        for _ in range(3):
+            clock.now += 1.
+            limiter.record(10., False)
+        self.assertEqual(int(limiter.limit), 1)
+
+        # Fast successful requests restore the limit
+        for _ in range(200):
+            limiter.record(0.1, True)
+        self.assertEqual(int(limiter.limit), 8)
+
+    def test02_acquire(self):
+        limiter = AimdConcurrencyLimiter(2)
+        with limiter.acquire():
+            with limiter.acquire():
+                self.assertEqual(limiter.n_in_progress, 2)
+        self.assertEqual(limiter.n_in_progress, 0)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def test01_open_and_reset(self):
+        clock = FakeClock()
+        circuit_breaker = CircuitBreaker(failure_threshold=2,
+                                         reset_timeout=60., clock=clock)
+
+        circuit_breaker.record(False)
+        circuit_breaker.record(True)
+        self.assertFalse(circuit_breaker.record(False))
+        self.assertTrue(circuit_breaker.record(False))
+        self.assertFalse(circuit_breaker.allow())
+
+        # One trial request after the reset timeout.  A failure opens the
+        # breaker again at once
+        clock.now += 60.
+        self.assertTrue(circuit_breaker.allow())
+        self.assertFalse(circuit_breaker.allow())
+        circuit_breaker.record(False)
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.OPEN)
+
+        clock.now += 60.
+        self.assertTrue(circuit_breaker.allow())
+        circuit_breaker.record(True)
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(circuit_breaker.n_opened, 2)
+
+
+class HostControlledTransportTestCase(unittest.TestCase):
+    def test01_skip_unhealthy_host(self):
+        fake_transport = FakeTransport()
+        fake_transport.add('http://up.test.ac.uk/ok', 'OK')
+        fake_transport.add('http://up.test.ac.uk/error', 'Error',
+                           status_code=503)
+        transport = HostControlledTransport(fake_transport,
+                                            max_concurrency=4,
+                                            failure_threshold=2)
+
+        for _ in range(2):
+            self.assertEqual(transport.get(
+                        'http://up.test.ac.uk/error').status_code, 503)
+
+        with self.assertRaises(HostUnhealthyError):
+            transport.get('http://up.test.ac.uk/ok')
+
+        # The request was not passed on, and other hosts are unaffected
+        self.assertEqual(len(fake_transport.requested_uris), 2)
+        self.assertEqual(transport.get('http://other.test.ac.uk/').status_code,
+                         404)
+
+        host_control = transport.get_host_control('up.test.ac.uk')
+        self.assertEqual(host_control.n_skipped, 1)
+        transport.log_summary()
+
+    def test02_check(self):
+        fake_transport = make_thredds_transport(['entry{:02d}'.format(i)
+                                                 for i in range(5)])
+        for uri in list(fake_transport.responses):
+            if uri != CATALOG_URI:
+                fake_transport.add(uri, 'Service unavailable',
+                                   status_code=503)
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = HostControlledTransport(
+                                                    fake_transport,
+                                                    failure_threshold=2)
+        result_summary = results.ResultSummary()
+        _OgcTdsValidation.result_sinks = (result_summary,)
+
+        stats = _OgcTdsValidation.check(CATALOG_URI)
+
+        # Root catalogue and the first 2 sub-catalogues are requested.  The
+        # remaining entries are skipped
+        self.assertEqual(stats['catalog_refs_tested'], 5)
+        self.assertEqual(stats['catalog_refs_ok'], 0)
+        self.assertEqual(len(fake_transport.requested_uris), 3)
+        self.assertEqual(result_summary.n_skipped[results.CATALOG], 3)
+
+    def test03_dataset_errors(self):
+        # 500 responses for broken datasets don't stop requests for the
+        # others on the same host
+        fake_transport = FakeTransport()
+        fake_transport.add('http://up.test.ac.uk/ok', 'OK')
+        for i in range(5):
+            fake_transport.add('http://up.test.ac.uk/broken{}'.format(i),
+                               'Error', status_code=500)
+
+        transport = HostControlledTransport(fake_transport,
+                                            failure_threshold=2)
+        for i in range(5):
+            transport.get('http://up.test.ac.uk/broken{}'.format(i))
+
+        self.assertEqual(transport.get('http://up.test.ac.uk/ok').status_code,
+                         200)
+        circuit_breaker = transport.get_host_control(
+                                            'up.test.ac.uk').circuit_breaker
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.CLOSED)
+
+    def test04_no_breaker_by_default(self):
+        fake_transport = FakeTransport()
+        transport = HostControlledTransport(fake_transport)
+        self.assertIsNone(
+                transport.get_host_control('up.test.ac.uk').circuit_breaker)
+
+
+if __name__ == '__main__':
+    unittest.main()
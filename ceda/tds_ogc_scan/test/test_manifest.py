@@ -0,0 +1,175 @@
+"""Unit tests for the compiled manifest of catalogue endpoints
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.manifest import (EndpointManifest,
+                                        EndpointManifestError, ManifestEntry,
+                                        compile_manifest)
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.nagios_test import settings
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+class EndpointManifestTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(5)]
+
+    def setUp(self):
+        self.manifest_dirpath = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.manifest_dirpath, 'manifest.sqlite')
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        self.transport = make_thredds_transport(self.ENTRY_NAMES)
+        _OgcTdsValidation.transport = self.transport
+        self.validation_cls = _OgcTdsValidation
+        self.catalog_ref_uris = ['{}/{}.xml'.format(THREDDS_URI, entry_name)
+                                 for entry_name in self.ENTRY_NAMES]
+
+    def tearDown(self):
+        if self.validation_cls.manifest is not None:
+            self.validation_cls.manifest.close()
+
+        shutil.rmtree(self.manifest_dirpath)
+
+    def test01_compile(self):
+        stats = compile_manifest(self.validation_cls, CATALOG_URI,
+                                 self.filepath, max_workers=3)
+        self.assertEqual(stats['catalog_refs_resolved'],
+                         len(self.ENTRY_NAMES))
+        self.assertEqual(os.listdir(self.manifest_dirpath),
+                         ['manifest.sqlite'])
+
+        with EndpointManifest(self.filepath) as manifest:
+            self.assertEqual(manifest.catalog_uri, CATALOG_URI)
+            self.assertIsNotNone(manifest.compiled)
+            self.assertEqual(len(manifest), len(self.ENTRY_NAMES))
+
+            # Entries are in catalogue order whatever order they were
+            # resolved in
+            self.assertEqual(list(manifest.iter_catalog_ref_uris()),
+                             self.catalog_ref_uris)
+
+            entry = manifest.get(self.catalog_ref_uris[2])
+            self.assertEqual(entry.ogc_uris, {
+                    'WMS': 'http://tds.test.ac.uk/thredds/wms/entry02-agg',
+                    'WCS': 'http://tds.test.ac.uk/thredds/wcs/entry02-agg'})
+
+            self.assertIsNone(manifest.get(CATALOG_URI))
+
+    def test02_pages(self):
+        with EndpointManifest(self.filepath, mode='w') as manifest:
+            for position in range(25):
+                manifest.add(position, ManifestEntry(
+                                        'uri{:02d}'.format(position),
+                                        {'WMS': None, 'WCS': None}))
+
+        with EndpointManifest(self.filepath) as manifest:
+            manifest.PAGE_SIZE = 10
+            self.assertEqual(list(manifest.iter_catalog_ref_uris()),
+                             ['uri{:02d}'.format(position)
+                              for position in range(25)])
+
+    def test03_discarded_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with EndpointManifest(self.filepath, mode='w'):
+                raise RuntimeError('Compile failed')
+
+        self.assertEqual(os.listdir(self.manifest_dirpath), [])
+        with self.assertRaises(EndpointManifestError):
+            EndpointManifest(self.filepath)
+
+    def test04_check_from_manifest(self):
+        compile_manifest(self.validation_cls, CATALOG_URI, self.filepath)
+        self.validation_cls.manifest = EndpointManifest(self.filepath)
+        self.transport.requested_uris.clear()
+
+        stats = self.validation_cls.check(CATALOG_URI, max_workers=2)
+        self.assertEqual(stats['catalog_refs_tested'], len(self.ENTRY_NAMES))
+        self.assertEqual(stats['wms_get_map_ok'], len(self.ENTRY_NAMES))
+        self.assertTrue(results.stats_ok(stats))
+
+        # No catalogues are read
+        self.assertFalse([uri for uri in self.transport.requested_uris
+                          if uri.endswith('.xml')])
+
+    def test05_unresolved(self):
+        # The sub-catalogue of one entry can't be read when the manifest is
+        # compiled
+        catalog_ref_uri = self.catalog_ref_uris[1]
+        response = self.transport.responses.pop(catalog_ref_uri)
+        stats = compile_manifest(self.validation_cls, CATALOG_URI,
+                                 self.filepath)
+        self.assertEqual(stats['catalog_refs_unresolved'], 1)
+
+        self.validation_cls.manifest = EndpointManifest(self.filepath)
+        self.assertIsNone(
+                    self.validation_cls.manifest.get(catalog_ref_uri).ogc_uris)
+
+        # It is read when checked
+        self.transport.responses[catalog_ref_uri] = response
+        self.transport.requested_uris.clear()
+        stats = self.validation_cls.check(CATALOG_URI)
+        self.assertTrue(results.stats_ok(stats))
+        self.assertEqual(stats['wms_get_map_ok'], len(self.ENTRY_NAMES))
+        self.assertEqual([uri for uri in self.transport.requested_uris
+                          if uri.endswith('.xml')], [catalog_ref_uri])
+
+    def test06_different_catalogue(self):
+        compile_manifest(self.validation_cls, CATALOG_URI, self.filepath)
+        self.validation_cls.manifest = EndpointManifest(self.filepath)
+        with self.assertRaises(EndpointManifestError):
+            list(self.validation_cls.get_catalog_ref_uris(
+                                    '{}/other.xml'.format(THREDDS_URI)))
+
+    def test07_file_mode(self):
+        # The manifest is readable by others as any new file would be
+        umask = os.umask(0o022)
+        try:
+            compile_manifest(self.validation_cls, CATALOG_URI, self.filepath)
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.filepath).st_mode), 0o644)
+
+    def test08_settings_without_manifest(self):
+        # Nagios checks read the catalogues if the manifest hasn't been
+        # compiled yet
+        env_names = ('CEDA_TDS_OGC_SCAN_MANIFEST',
+                     'CEDA_TDS_OGC_SCAN_CACHE_DIR',
+                     'CEDA_TDS_OGC_SCAN_HEDGE_QUANTILE',
+                     'CEDA_TDS_OGC_SCAN_REQUEST_TIMEOUT')
+        environ = {name: os.environ.get(name) for name in env_names}
+        catalog_resolver = OgcTdsValidation.catalog_resolver
+        for name in env_names:
+            os.environ.pop(name, None)
+
+        os.environ['CEDA_TDS_OGC_SCAN_MANIFEST'] = self.filepath
+        try:
+            with self.assertLogs(settings.log, 'WARNING'):
+                settings.configure_validation()
+
+            self.assertIsNone(OgcTdsValidation.manifest)
+        finally:
+            OgcTdsValidation.manifest = None
+            OgcTdsValidation.catalog_resolver = catalog_resolver
+            for name, value in environ.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Unit tests for latency and payload size instrumentation
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import unittest
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.metrics import LogHistogram, PerformanceSummary
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI,
+                                             make_thredds_transport)
+
+
+class LogHistogramTestCase(unittest.TestCase):
+    def test01_percentiles(self):
+        histogram = LogHistogram(growth_factor=1.01)
+        for i in range(1, 1001):
+            histogram.add(i / 1000.)
+
+        self.assertEqual(histogram.count, 1000)
+        for q in (50, 95, 99):
+            self.assertAlmostEqual(histogram.percentile(q), q / 100.,
+                                   delta=q / 100. * 0.011)
+
+        self.assertEqual(histogram.percentile(100), 1.)
+
+    def test02_bounded_buckets(self):
+        histogram = LogHistogram()
+        n_buckets = len(histogram.counts)
+        for value in (0., 1e-9, 5., 1e9):
+            histogram.add(value)
+
+        self.assertEqual(len(histogram.counts), n_buckets)
+        self.assertEqual(histogram.percentile(50), histogram.min_value)
+        self.assertEqual(histogram.percentile(100), 1e9)
+
+    def test03_empty(self):
+        self.assertIsNone(LogHistogram().percentile(50))
+
+    def test04_merge(self):
+        histogram1 = LogHistogram()
+        histogram2 = LogHistogram()
+        for value in (0.1, 0.2):
+            histogram1.add(value)
+        histogram2.add(3.)
+
+        histogram1.merge(histogram2)
+        self.assertEqual(histogram1.count, 3)
+        self.assertEqual(histogram1.max, 3.)
+        self.assertEqual(histogram1.percentile(100), 3.)
+
+
+class PerformanceSummaryTestCase(unittest.TestCase):
+    def test01_slowest(self):
+        performance_summary = PerformanceSummary(n_slowest=2)
+        for i, elapsed in enumerate((0.5, 3., 0.1, 2.)):
+            performance_summary.add(results.EndpointCheckResult(
+                                'http://host/{}'.format(i), results.WMS_GET_MAP,
+                                200, elapsed, elapsed / 2, None, 100, None))
+
+        self.assertEqual([uri for _, uri, _ in
+                          performance_summary.get_slowest()],
+                         ['http://host/1', 'http://host/3'])
+
+    def test02_check(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = make_thredds_transport(['entry00',
+                                                              'entry01'])
+        performance_summary = PerformanceSummary()
+        _OgcTdsValidation.result_sinks = (performance_summary,)
+
+        _OgcTdsValidation.check(CATALOG_URI)
+
+        operations = performance_summary.operations
+        self.assertEqual(operations[results.CATALOG].elapsed.count, 2)
+        self.assertEqual(operations[results.WMS_GET_MAP].elapsed.count, 2)
+
+        # Time to first byte and parse time are recorded for every request
+        for operation in (results.WMS_GET_CAPABILITIES, results.WMS_GET_MAP):
+            self.assertEqual(operations[operation].ttfb.count, 2)
+            self.assertEqual(operations[operation].parse_time.count, 2)
+
+        self.assertGreater(
+                operations[results.WCS_DESCRIBE_COVERAGE].n_bytes.percentile(
+                                                                        50), 0)
+
+        performance_summary.log()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Unit tests for the pipelined scan of catalogue entries
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import threading
+import unittest
+from collections import Counter
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.pipeline import ScanPipeline
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+class ScanPipelineTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(20)]
+    TIMEOUT = 10.
+
+    def setUp(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            checked_uris = []
+
+            @classmethod
+            def catalog_ref_checked(cls, catalog_ref_uri, catalog_hash,
+                                    stats, elapsed=None):
+                super().catalog_ref_checked(catalog_ref_uri, catalog_hash,
+                                            stats, elapsed=elapsed)
+                cls.checked_uris.append(catalog_ref_uri)
+
+        _OgcTdsValidation.transport = make_thredds_transport(self.ENTRY_NAMES)
+        self.validation_cls = _OgcTdsValidation
+        self.catalog_ref_uris = ['{}/{}.xml'.format(THREDDS_URI, entry_name)
+                                 for entry_name in self.ENTRY_NAMES]
+
+    def test01_run(self):
+        pipeline = ScanPipeline(self.validation_cls, catalog_workers=2,
+                                wms_workers=3, wcs_workers=1, queue_size=4)
+        stats = pipeline.run(iter(self.catalog_ref_uris))
+
+        self.assertEqual(sorted(self.validation_cls.checked_uris),
+                         self.catalog_ref_uris)
+
+        # The same counts as checking each entry in turn
+        entry_stats = self.validation_cls.check_catalog_ref(
+                                                    self.catalog_ref_uris[0])
+        self.assertEqual(stats, Counter({name: count * len(self.ENTRY_NAMES)
+                                         for name, count in
+                                         entry_stats.items()}))
+        self.assertTrue(results.stats_ok(stats))
+
+    def test02_results_before_discovery_ends(self):
+        first_checked = threading.Event()
+
+        class _OgcTdsValidation(self.validation_cls):
+            @classmethod
+            def catalog_ref_checked(cls, catalog_ref_uri, catalog_hash,
+                                    stats, elapsed=None):
+                super().catalog_ref_checked(catalog_ref_uri, catalog_hash,
+                                            stats, elapsed=elapsed)
+                first_checked.set()
+
+        def _iter_catalog_ref_uris():
+            yield self.catalog_ref_uris[0]
+
+            # The first entry is checked while the rest are still to be read
+            self.assertTrue(first_checked.wait(self.TIMEOUT))
+            yield from self.catalog_ref_uris[1:]
+
+        stats = ScanPipeline(_OgcTdsValidation).run(_iter_catalog_ref_uris())
+        self.assertEqual(stats['catalog_refs_tested'], len(self.ENTRY_NAMES))
+
+    def test03_backpressure(self):
+        release = threading.Event()
+
+        class _OgcTdsValidation(self.validation_cls):
+            @classmethod
+            def check_endpoint(cls, service_type, uri):
+                release.wait(ScanPipelineTestCase.TIMEOUT)
+                return super().check_endpoint(service_type, uri)
+
+        n_read = []
+
+        def _iter_catalog_ref_uris():
+            for i, catalog_ref_uri in enumerate(self.catalog_ref_uris):
+                n_read.append(i)
+                yield catalog_ref_uri
+
+        pipeline = ScanPipeline(_OgcTdsValidation, queue_size=2)
+        thread = threading.Thread(
+                        target=lambda: pipeline.run(_iter_catalog_ref_uris()))
+        thread.start()
+
+        # Reading stops while the endpoint checks are held up
+        thread.join(0.5)
+        self.assertTrue(thread.is_alive())
+        self.assertLess(len(n_read), 10)
+
+        release.set()
+        thread.join(self.TIMEOUT)
+        self.assertEqual(len(n_read), len(self.ENTRY_NAMES))
+
+    def test04_error(self):
+        class _OgcTdsValidation(self.validation_cls):
+            @classmethod
+            def check_endpoint(cls, service_type, uri):
+                raise RuntimeError('Check failed')
+
+        with self.assertRaises(RuntimeError):
+            ScanPipeline(_OgcTdsValidation, wms_workers=2).run(
+                                                iter(self.catalog_ref_uris))
+
+    def test05_check(self):
+        stats = self.validation_cls.check(CATALOG_URI, max_workers=2,
+                                          wms_workers=4, queue_size=1)
+        self.assertEqual(stats['catalog_refs_tested'], len(self.ENTRY_NAMES))
+        self.assertEqual(stats['wms_get_map_ok'], len(self.ENTRY_NAMES))
+        self.assertTrue(results.stats_ok(stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""Unit tests for incremental PNG decoding and GetMap content checks
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import struct
+import unittest
+
+from ceda.tds_ogc_scan import png_stream, results
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (FakeTransport, PNG_CONTENT,
+                                             UnreadableResponse, make_png,
+                                             make_rgba_png)
+
+
+class ReadPngStatsTestCase(unittest.TestCase):
+    def test01_rgba(self):
+        image_stats = png_stream.read_png_stats(io.BytesIO(PNG_CONTENT))
+        self.assertEqual((image_stats.width, image_stats.height), (256, 256))
+        self.assertEqual(image_stats.fraction_non_transparent, 1.)
+        self.assertEqual(image_stats.n_colours, 256)
+
+    def test02_transparent_rgba(self):
+        image_stats = png_stream.read_png_stats(io.BytesIO(
+                                make_rgba_png(16, 8, transparent=True)))
+        self.assertEqual(image_stats.n_non_transparent, 0)
+        self.assertEqual(image_stats.n_colours, 0)
+
+    def test03_indexed_colour(self):
+        # 2 bits per pixel: index 0 is transparent and 1 and 2 opaque
+        palette = bytes(bytearray([0, 0, 0, 255, 0, 0, 0, 255, 0]))
+        rows = [bytes(bytearray([0b00011000, 0b01000000]))] * 4
+        image = make_png(6, rows, colour_type=3, bit_depth=2,
+                         chunks=((b'PLTE', palette), (b'tRNS', b'\x00')))
+
+        image_stats = png_stream.read_png_stats(io.BytesIO(image))
+        self.assertEqual((image_stats.width, image_stats.height), (6, 4))
+        self.assertEqual(image_stats.n_non_transparent, 12)
+        self.assertEqual(image_stats.n_colours, 2)
+
+    def test04_greyscale_16_bit_transparent_colour(self):
+        rows = [struct.pack('>3H', 0, 0x1234, 0xffff)] * 2
+        image = make_png(3, rows, colour_type=0, bit_depth=16,
+                         chunks=((b'tRNS', struct.pack('>H', 0)),))
+
+        image_stats = png_stream.read_png_stats(io.BytesIO(image))
+        self.assertEqual(image_stats.n_non_transparent, 4)
+        self.assertEqual(image_stats.n_colours, 2)
+
+    def test05_invalid(self):
+        corrupt_image = bytearray(PNG_CONTENT)
+        corrupt_image[40] ^= 0xff
+        for content in (b'<ServiceExceptionReport/>', PNG_CONTENT[:-100],
+                        bytes(corrupt_image)):
+            with self.assertRaises(png_stream.PngError):
+                png_stream.read_png_stats(io.BytesIO(content))
+
+
+class CheckWmsGetMapTestCase(unittest.TestCase):
+    GET_MAP_URI = ('http://tds.test.ac.uk/thredds/wms/entry00-agg?'
+                   'service=WMS&version=1.3.0&request=GetMap&LAYERS=sst&'
+                   'WIDTH=256&HEIGHT=256&FORMAT=image/png')
+    SERVICE_EXCEPTION_XML = ('<?xml version="1.0"?><ServiceExceptionReport>'
+                             '<ServiceException>Layer not found'
+                             '</ServiceException></ServiceExceptionReport>')
+
+    def setUp(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = FakeTransport()
+        self.result_summary = results.ResultSummary()
+        _OgcTdsValidation.result_sinks = (self.result_summary,)
+        self.validation_cls = _OgcTdsValidation
+
+    def _check(self, content, content_type='image/png'):
+        self.validation_cls.transport.add(
+                                    self.GET_MAP_URI, content,
+                                    headers={'Content-Type': content_type})
+        return self.validation_cls.check_wms_get_map_resp(self.GET_MAP_URI)
+
+    def _get_errors(self):
+        return [error for (_, error) in self.result_summary.errors]
+
+    def test01_ok(self):
+        self.assertTrue(self._check(PNG_CONTENT))
+        self.assertTrue(self.result_summary.ok)
+
+    def test02_service_exception(self):
+        self.assertFalse(self._check(self.SERVICE_EXCEPTION_XML,
+                                     content_type='application/vnd.ogc.se_xml'))
+        self.assertEqual(self._get_errors(),
+                         [results.SERVICE_EXCEPTION_ERROR])
+
+    def test03_blank_tile(self):
+        self.assertFalse(self._check(make_rgba_png(256, 256,
+                                                   transparent=True)))
+        self.assertEqual(self._get_errors(), [results.BLANK_TILE_ERROR])
+
+    def test04_wrong_size(self):
+        self.assertFalse(self._check(make_rgba_png(128, 256)))
+        self.assertEqual(self._get_errors(), [results.IMAGE_ERROR])
+
+    def test05_wrong_content_type(self):
+        self.assertFalse(self._check(PNG_CONTENT, content_type='text/html'))
+        self.assertEqual(self._get_errors(), [results.CONTENT_TYPE_ERROR])
+
+    def test06_unreadable_error_response(self):
+        # The connection is lost reading the body of an error response or
+        # service exception
+        for status_code, content_type in ((500, 'text/html'),
+                                          (200, 'application/xml')):
+            self.validation_cls.transport.get = (
+                lambda uri, **kwargs: UnreadableResponse(
+                                    uri, status_code=status_code,
+                                    headers={'Content-Type': content_type}))
+            self.assertFalse(self.validation_cls.check_wms_get_map_resp(
+                                                        self.GET_MAP_URI))
+
+        self.assertEqual(self._get_errors(), ['ConnectionError'])
+        self.assertEqual(self.result_summary.n_failed[results.WMS_GET_MAP], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""Unit tests for recording and replay of responses
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.replay import (ResponseArchive, RecordingTransport,
+                                      ReplayTransport, ReplayServer,
+                                      FaultInjector, get_base_uri)
+from ceda.tds_ogc_scan.transport import HttpTransport
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.benchmark import run_benchmark
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, FakeTransport,
+                                             PNG_CONTENT,
+                                             make_thredds_transport)
+
+
+class _ErrorTransport(FakeTransport):
+    '''Raise a connection timeout for URIs not found'''
+    def get(self, uri, **kwargs):
+        if uri not in self.responses:
+            raise requests.ConnectTimeout('Timed out')
+
+        return super().get(uri, **kwargs)
+
+
+class ReplayTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(3)]
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.archive_filepath = os.path.join(self.dirpath, 'scan.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def _record_scan(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        with ResponseArchive(self.archive_filepath, mode='w') as archive:
+            _OgcTdsValidation.transport = RecordingTransport(
+                                    make_thredds_transport(self.ENTRY_NAMES),
+                                    archive)
+            return _OgcTdsValidation.check(CATALOG_URI)
+
+    def _replay_scan(self, transport, catalog_uri=CATALOG_URI):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = transport
+        result_summary = results.ResultSummary()
+        _OgcTdsValidation.result_sinks = (result_summary,)
+        return _OgcTdsValidation.check(catalog_uri), result_summary
+
+    def test01_archive(self):
+        with ResponseArchive(self.archive_filepath, mode='w') as archive:
+            archive.add('http://a.test.ac.uk/1', 200,
+                        {'Content-Type': 'image/png'}, PNG_CONTENT)
+            archive.add('http://a.test.ac.uk/2', 200,
+                        {'Content-Type': 'image/png'}, PNG_CONTENT)
+            archive.add('http://a.test.ac.uk/3', error='ConnectTimeout')
+
+        with ResponseArchive(self.archive_filepath) as archive:
+            self.assertEqual(archive.uris, ['http://a.test.ac.uk/{}'.format(i)
+                                            for i in (1, 2, 3)])
+            recorded_resp = archive.get('http://a.test.ac.uk/2')
+            self.assertEqual(recorded_resp.content, PNG_CONTENT)
+            self.assertEqual(recorded_resp.headers['Content-Type'],
+                             'image/png')
+            self.assertIsNone(archive.get('http://a.test.ac.uk/4'))
+
+            transport = ReplayTransport(archive)
+            with self.assertRaises(requests.ConnectTimeout):
+                transport.get('http://a.test.ac.uk/3')
+
+        # Shared bodies are stored once and compressed
+        self.assertLess(os.path.getsize(self.archive_filepath),
+                        len(PNG_CONTENT))
+
+    def test02_record_and_replay(self):
+        recorded_stats = self._record_scan()
+        self.assertTrue(results.stats_ok(recorded_stats))
+
+        with ResponseArchive(self.archive_filepath) as archive:
+            stats, result_summary = self._replay_scan(
+                                                    ReplayTransport(archive))
+
+        self.assertEqual(stats, recorded_stats)
+        self.assertTrue(result_summary.ok)
+
+    def test03_record_error(self):
+        with ResponseArchive(self.archive_filepath, mode='w') as archive:
+            transport = RecordingTransport(_ErrorTransport(), archive)
+            with self.assertRaises(requests.ConnectTimeout):
+                transport.get(CATALOG_URI)
+
+        with ResponseArchive(self.archive_filepath) as archive:
+            self.assertEqual(archive.get(CATALOG_URI).error,
+                             'ConnectTimeout')
+
+    def test04_inject_faults(self):
+        self._record_scan()
+        delays = []
+        with ResponseArchive(self.archive_filepath) as archive:
+            fault_injector = FaultInjector(latency=0.5, error_rate=1.,
+                                           sleep=delays.append)
+            transport = ReplayTransport(archive,
+                                        fault_injector=fault_injector)
+            resp = transport.get(CATALOG_URI)
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(delays, [0.5])
+
+    def test05_replay_server(self):
+        self._record_scan()
+        with ResponseArchive(self.archive_filepath) as archive:
+            server = ReplayServer((ReplayServer.DEFAULT_ADDRESS, 0), archive,
+                                  get_base_uri(CATALOG_URI))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                with HttpTransport(max_retries=0) as transport:
+                    # Links in the replayed catalogues resolve to the server
+                    local_catalog_uri = CATALOG_URI.replace(
+                                        get_base_uri(CATALOG_URI), server.uri)
+                    stats, result_summary = self._replay_scan(
+                                        transport,
+                                        catalog_uri=local_catalog_uri)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        self.assertEqual(stats['catalog_refs_tested'], len(self.ENTRY_NAMES))
+        self.assertTrue(results.stats_ok(stats))
+        self.assertTrue(result_summary.ok)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test01_run_benchmark(self):
+        result = run_benchmark(10, n_scanned=2)
+
+        # Root catalogue and 6 requests for each entry scanned
+        self.assertEqual(result.n_requests, 13)
+        self.assertGreater(result.peak_memory, 0)
+        self.assertGreater(result.throughput, 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
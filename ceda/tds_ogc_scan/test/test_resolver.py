@@ -0,0 +1,99 @@
+"""Unit tests for memoized catalogue resolution
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import shutil
+import tempfile
+import unittest
+
+from ceda.tds_ogc_scan.resolver import CatalogResolver
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+class CatalogResolverTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry00', 'entry01']
+    ENTRY_URI = THREDDS_URI + '/entry00.xml'
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def _make_validation_cls(self, catalog_resolver):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = make_thredds_transport(
+                                                        self.ENTRY_NAMES)
+        _OgcTdsValidation.catalog_resolver = catalog_resolver
+        return _OgcTdsValidation
+
+    def test01_shared_between_wms_and_wcs(self):
+        validation_cls = self._make_validation_cls(CatalogResolver())
+
+        wms_uri = validation_cls.get_wms_uri_from_catalog(self.ENTRY_URI)
+        wcs_uri = validation_cls.get_wcs_uri_from_catalog(self.ENTRY_URI)
+
+        self.assertTrue(wms_uri.endswith('/wms/entry00-agg'))
+        self.assertTrue(wcs_uri.endswith('/wcs/entry00-agg'))
+        self.assertEqual(validation_cls.transport.requested_uris,
+                         [self.ENTRY_URI])
+        self.assertEqual(validation_cls.catalog_resolver.stats['hits'], 1)
+
+    def test02_shared_between_processes(self):
+        filepath = os.path.join(self.dirpath, CatalogResolver.DB_FILENAME)
+        validation_cls1 = self._make_validation_cls(
+                                                CatalogResolver(filepath))
+        validation_cls2 = self._make_validation_cls(
+                                                CatalogResolver(filepath))
+
+        validation_cls1.check(CATALOG_URI)
+        n_requests = len(validation_cls1.transport.requested_uris)
+
+        catalog_ref_uris = list(validation_cls2.get_catalog_ref_uris(
+                                                                CATALOG_URI))
+        self.assertEqual(len(catalog_ref_uris), 2)
+        for catalog_ref_uri in catalog_ref_uris:
+            self.assertIsNotNone(validation_cls2.get_wcs_uri_from_catalog(
+                                                            catalog_ref_uri))
+
+        # No catalogues are read again
+        self.assertEqual(validation_cls2.transport.requested_uris, [])
+        self.assertEqual(len(validation_cls1.transport.requested_uris),
+                         n_requests)
+
+    def test03_ttl(self):
+        validation_cls = self._make_validation_cls(CatalogResolver(ttl=0.))
+        for _ in range(2):
+            validation_cls.get_wms_uri_from_catalog(self.ENTRY_URI)
+
+        self.assertEqual(validation_cls.transport.requested_uris,
+                         [self.ENTRY_URI] * 2)
+
+    def test04_max_entries(self):
+        filepath = os.path.join(self.dirpath, CatalogResolver.DB_FILENAME)
+        catalog_resolver = CatalogResolver(filepath, max_entries=2)
+        for i in range(4):
+            catalog_resolver.set_ogc_uris('http://host/{}.xml'.format(i),
+                                          {'WMS': None, 'WCS': None})
+
+        self.assertEqual(len(catalog_resolver._entries), 2)
+        self.assertIsNone(catalog_resolver.get_ogc_uris('http://host/0.xml'))
+        self.assertIsNotNone(catalog_resolver.get_ogc_uris(
+                                                        'http://host/3.xml'))
+
+        n_rows = catalog_resolver._db.execute(
+                        'SELECT COUNT(*) FROM resolved_catalog').fetchone()[0]
+        self.assertEqual(n_rows, 2)
+        catalog_resolver.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""Unit tests for structured results from endpoint checks
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import csv
+import json
+import unittest
+
+import requests
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, FakeTransport,
+                                             UnreadableResponse,
+                                             make_thredds_transport)
+
+
+class ErrorFakeTransport(FakeTransport):
+    '''Raise a connection error for any URI containing "entry01"'''
+    def get(self, uri, **kwargs):
+        if 'entry01' in uri and 'GetCapabilities' in uri:
+            raise requests.ConnectionError('Connection refused')
+
+        return super().get(uri, **kwargs)
+
+
+class ResultsTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(3)]
+
+    def setUp(self):
+        transport = ErrorFakeTransport(
+                    make_thredds_transport(self.ENTRY_NAMES).responses)
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = transport
+        self.validation_cls = _OgcTdsValidation
+
+    def test01_json_lines(self):
+        result_file = io.StringIO()
+        result_summary = results.ResultSummary()
+        self.validation_cls.result_sinks = (
+                                results.JsonLinesResultWriter(result_file),
+                                result_summary)
+
+        stats = self.validation_cls.check(CATALOG_URI)
+        self.assertFalse(results.stats_ok(stats))
+
+        records = [json.loads(line)
+                   for line in result_file.getvalue().splitlines()]
+
+        # Catalogue, 2 x WMS and 3 x WCS for each of the 3 entries less the
+        # WMS GetMap for the entry where GetCapabilities fails
+        self.assertEqual(len(records), 17)
+        self.assertEqual(records[0]['operation'], results.CATALOG)
+        self.assertEqual(records[0]['status_code'], 200)
+
+        errors = [record['error'] for record in records
+                  if record['error'] is not None]
+        self.assertEqual(errors, ['ConnectionError', 'ConnectionError'])
+
+        self.assertFalse(result_summary.ok)
+        self.assertEqual(result_summary.n_failed[results.WMS_GET_CAPABILITIES],
+                         1)
+        self.assertEqual(result_summary.n_tested[results.WMS_GET_MAP], 2)
+
+        # Where WCS GetCapabilities fails, the coverage for GetCoverage is
+        # found from DescribeCoverage for all coverages
+        self.assertEqual(result_summary.n_tested[results.WCS_GET_COVERAGE], 3)
+
+    def test02_csv(self):
+        result_file = io.StringIO()
+        self.validation_cls.result_sinks = (
+                                results.CsvResultWriter(result_file),)
+        self.validation_cls.check(CATALOG_URI)
+
+        rows = list(csv.reader(io.StringIO(result_file.getvalue())))
+        self.assertEqual(tuple(rows[0]), results.RESULT_FIELD_NAMES)
+        self.assertEqual(len(rows), 18)
+
+    def test03_stats_ok(self):
+        self.assertTrue(results.stats_ok({'wms_get_map_uris_tested': 2,
+                                          'wms_get_map_ok': 2}))
+        self.assertFalse(results.stats_ok({'catalog_refs_tested': 2,
+                                           'catalog_refs_ok': 1}))
+
+    def test04_get_capabilities_error_not_ok(self):
+        # A GetCapabilities document which can't be parsed or lists no
+        # layers fails the check as well as being recorded as an error
+        result_summary = results.ResultSummary()
+        self.validation_cls.result_sinks = (result_summary,)
+        transport = self.validation_cls.transport
+        uris = [uri for uri in transport.responses
+                if 'GetCapabilities' in uri and 'wms' in uri]
+        transport.add(uris[0], '<WMS_Capabilities')
+        transport.add(uris[2], '<WMS_Capabilities xmlns='
+                      '"http://www.opengis.net/wms"/>')
+
+        for uri, error in ((uris[0], results.PARSE_ERROR),
+                           (uris[2], results.NO_LAYERS_ERROR)):
+            ok, layers = self.validation_cls.check_wms_get_capabilities_layers(
+                                                                        uri)
+            self.assertFalse(ok)
+            self.assertEqual(layers, [])
+            self.assertEqual(
+                result_summary.errors[(results.WMS_GET_CAPABILITIES, error)],
+                1)
+
+        stats = self.validation_cls.check(CATALOG_URI)
+        self.assertEqual(stats['wms_get_capabilities_ok'], 0)
+        self.assertEqual(stats['wms_get_capabilities_uris_tested'], 3)
+
+    def test05_unreadable_get_capabilities_error(self):
+        self.validation_cls.transport.get = (
+                lambda uri, **kwargs: UnreadableResponse(uri,
+                                                         status_code=500))
+        result_summary = results.ResultSummary()
+        self.validation_cls.result_sinks = (result_summary,)
+        ok, layers = self.validation_cls.check_wms_get_capabilities_layers(
+                'http://tds.test.ac.uk/thredds/wms/entry00-agg?service=WMS&'
+                'version=1.3.0&request=GetCapabilities')
+        self.assertFalse(ok)
+        self.assertEqual(list(result_summary.errors),
+                         [(results.WMS_GET_CAPABILITIES, 'ConnectionError')])
+
+
+if __name__ == '__main__':
+    unittest.main()
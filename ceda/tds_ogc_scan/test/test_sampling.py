@@ -0,0 +1,270 @@
+"""Unit tests for sampling of WMS GetMap layers and tiles
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import unittest
+from urllib.parse import urlparse, parse_qs
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.sampling import (GetMapSampler, GetMapRequest,
+                                       get_dimension_values)
+from ceda.tds_ogc_scan.concurrency import HostConcurrencyLimiter
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.xml_stream import WmsLayer
+from ceda.tds_ogc_scan.test.fixtures import (FakeResponse, FakeTransport,
+                                             PNG_CONTENT, make_rgba_png,
+                                             make_thredds_transport)
+
+
+class GetMapSamplerTestCase(unittest.TestCase):
+    LAYERS = [WmsLayer('layer{}'.format(i), None, {}) for i in range(10)]
+
+    def _select_layer_names(self, sampler):
+        return [layer.name for layer in sampler.select_layers(self.LAYERS)]
+
+    def test01_select_layers(self):
+        self.assertEqual(self._select_layer_names(
+                                        GetMapSampler(n_layers=2)),
+                         ['layer0', 'layer1'])
+        self.assertEqual(len(self._select_layer_names(
+                                        GetMapSampler(GetMapSampler.ALL))),
+                         10)
+
+        layer_names = self._select_layer_names(
+                        GetMapSampler(GetMapSampler.RANDOM, n_layers=3,
+                                      seed=1))
+        self.assertEqual(len(set(layer_names)), 3)
+        self.assertEqual(layer_names, self._select_layer_names(
+                                GetMapSampler(GetMapSampler.RANDOM,
+                                              n_layers=3, seed=1)))
+
+        # One layer from each of the two halves of the list
+        layer_names = self._select_layer_names(
+                        GetMapSampler(GetMapSampler.STRATIFIED, n_layers=2))
+        self.assertLess(int(layer_names[0][-1]), 5)
+        self.assertGreaterEqual(int(layer_names[1][-1]), 5)
+
+        with self.assertRaises(ValueError):
+            GetMapSampler('every')
+
+    def test02_get_tiles(self):
+        layer = WmsLayer('sst', (-10., 40., 30., 70.),
+                         {'time': ('2000-03-01',
+                                   '2000-01-01,2000-02-01,2000-03-01'),
+                          'elevation': ('0', '0/100/10')})
+
+        tiles = GetMapSampler(n_tiles=3).get_tiles(layer)
+
+        self.assertEqual(tiles[0], ('sst', layer.bbox, None, None))
+        self.assertEqual([tile.time for tile in tiles[1:]],
+                         ['2000-01-01', '2000-03-01'])
+        self.assertEqual([tile.elevation for tile in tiles[1:]],
+                         ['0', '100'])
+        for tile in tiles[1:]:
+            west, south, east, north = tile.bbox
+            self.assertAlmostEqual(east - west, 20.)
+            self.assertAlmostEqual(north - south, 15.)
+            self.assertTrue(-10. <= west and east <= 30.)
+            self.assertTrue(40. <= south and north <= 70.)
+
+    def test03_get_dimension_values(self):
+        self.assertEqual(get_dimension_values(('1', '')), ['1'])
+        self.assertEqual(get_dimension_values((None, ' a, b ')), ['a', 'b'])
+
+
+class LayerFakeTransport(FakeTransport):
+    '''Serve a PNG for any GetMap request for the sst layer and an error for
+    any other layer'''
+    def get(self, uri, **kwargs):
+        if 'request=GetMap' in uri:
+            with self._lock:
+                self.requested_uris.append(uri)
+
+            if 'LAYERS=sst&' in uri:
+                return FakeResponse(uri, content=PNG_CONTENT,
+                                    headers={'Content-Type': 'image/png'})
+
+            return FakeResponse(uri, status_code=500, content='Error')
+
+        return super().get(uri, **kwargs)
+
+
+class CheckWmsEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = LayerFakeTransport(
+                            make_thredds_transport(['entry00']).responses)
+        self.validation_cls = _OgcTdsValidation
+        self.wms_uri = 'http://tds.test.ac.uk/thredds/wms/entry00-agg'
+
+    def test01_default(self):
+        stats = self.validation_cls.check_wms_endpoint(self.wms_uri)
+        self.assertEqual(stats['wms_get_map_uris_tested'], 1)
+        self.assertEqual(stats['wms_get_map_ok'], 1)
+
+    def test02_all_layers_and_tiles(self):
+        self.validation_cls.get_map_sampler = GetMapSampler(GetMapSampler.ALL,
+                                                            n_tiles=3)
+        self.validation_cls.get_map_max_workers = 4
+        self.validation_cls.get_map_host_limiter = HostConcurrencyLimiter(2)
+
+        stats = self.validation_cls.check_wms_endpoint(self.wms_uri)
+
+        # 3 tiles for each of the 2 layers: those for sst_error fail
+        self.assertEqual(stats['wms_get_map_uris_tested'], 6)
+        self.assertEqual(stats['wms_get_map_ok'], 3)
+
+        get_map_uris = [uri for uri in
+                        self.validation_cls.transport.requested_uris
+                        if 'GetMap' in uri]
+        self.assertEqual(len(set(get_map_uris)), 6)
+
+
+
+class BatchFakeTransport(FakeTransport):
+    '''Serve a PNG of the size requested for any GetMap not including a
+    broken layer'''
+    def __init__(self, responses, broken_layer_names):
+        super().__init__(responses)
+        self.broken_layer_names = broken_layer_names
+        self._png_contents = {(256, 256): PNG_CONTENT}
+
+    def get(self, uri, **kwargs):
+        if 'request=GetMap' not in uri:
+            return super().get(uri, **kwargs)
+
+        with self._lock:
+            self.requested_uris.append(uri)
+
+        query_args = parse_qs(urlparse(uri).query)
+        if self.broken_layer_names.intersection(
+                                    query_args['LAYERS'][0].split(',')):
+            return FakeResponse(uri, status_code=500, content='Error')
+
+        size = (int(query_args['WIDTH'][0]), int(query_args['HEIGHT'][0]))
+        with self._lock:
+            if size not in self._png_contents:
+                self._png_contents[size] = make_rgba_png(*size)
+
+        return FakeResponse(uri, content=self._png_contents[size],
+                            headers={'Content-Type': 'image/png'})
+
+
+class CheckWmsGetMapBatchTestCase(unittest.TestCase):
+    LAYER_NAMES = ['layer{:02d}'.format(i) for i in range(32)]
+
+    def setUp(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            get_map_sampler = GetMapSampler(GetMapSampler.ALL)
+            get_map_batch_size = 16
+
+        self.validation_cls = _OgcTdsValidation
+        self.wms_uri = 'http://tds.test.ac.uk/thredds/wms/entry00-agg'
+
+    def _check(self, broken_layer_names):
+        transport = BatchFakeTransport(
+                        make_thredds_transport(
+                                ['entry00'],
+                                layer_names=self.LAYER_NAMES).responses,
+                        set(broken_layer_names))
+        self.validation_cls.transport = transport
+        stats = self.validation_cls.check_wms_endpoint(self.wms_uri)
+        get_map_uris = [uri for uri in transport.requested_uris
+                        if 'GetMap' in uri]
+        return stats, get_map_uris
+
+    def test01_all_ok(self):
+        stats, get_map_uris = self._check([])
+
+        # One request for each batch of layers
+        self.assertEqual(len(get_map_uris), 2)
+        self.assertEqual(stats['wms_get_map_uris_tested'],
+                         len(self.LAYER_NAMES))
+        self.assertEqual(stats['wms_get_map_ok'], len(self.LAYER_NAMES))
+
+    def test02_bisection(self):
+        stats, get_map_uris = self._check(['layer05'])
+
+        # The failing batch is split down to the broken layer: 16, 8, 4, 2
+        # and single layers
+        self.assertEqual(len(get_map_uris), 1 + 1 + 2 * 4)
+        self.assertEqual(stats['wms_get_map_uris_tested'],
+                         len(self.LAYER_NAMES))
+        self.assertEqual(stats['wms_get_map_ok'], len(self.LAYER_NAMES) - 1)
+
+        failed_uri = self.validation_cls.get_wms_get_map_uri(
+                                self.wms_uri,
+                                GetMapRequest('layer05', None, None, None))
+        self.assertIn(failed_uri, get_map_uris)
+
+    def test03_failed_sample(self):
+        self.validation_cls.transport = BatchFakeTransport(
+                        make_thredds_transport(
+                                ['entry00'],
+                                layer_names=self.LAYER_NAMES).responses,
+                        {'layer05', 'layer20'})
+        layers = [WmsLayer(layer_name, None, {})
+                  for layer_name in self.LAYER_NAMES]
+        self.validation_cls.get_map_max_workers = 2
+        n_tested, failed_get_map_uris = \
+            self.validation_cls.check_wms_get_map_sample(self.wms_uri, layers)
+
+        self.assertEqual(n_tested, len(self.LAYER_NAMES))
+        self.assertEqual(sorted(failed_get_map_uris), [
+                    self.validation_cls.get_wms_get_map_uri(
+                            self.wms_uri,
+                            GetMapRequest(layer_name, None, None, None))
+                    for layer_name in ('layer05', 'layer20')])
+
+    def test04_tiles_not_batched(self):
+        self.validation_cls.get_map_sampler = GetMapSampler(GetMapSampler.ALL,
+                                                            n_tiles=2)
+        stats, get_map_uris = self._check([])
+
+        # Tiles at other times and elevations are requested one at a time
+        self.assertEqual(len(get_map_uris), 2 + len(self.LAYER_NAMES))
+        self.assertEqual(stats['wms_get_map_uris_tested'],
+                         2 * len(self.LAYER_NAMES))
+        self.assertEqual(stats['wms_get_map_ok'], 2 * len(self.LAYER_NAMES))
+
+    def test05_failed_batch_not_an_error(self):
+        # A server refusing requests for several layers at once: each batch
+        # is split down to single layers, which pass
+        transport = BatchFakeTransport(
+                        make_thredds_transport(
+                                ['entry00'],
+                                layer_names=self.LAYER_NAMES[:2]).responses,
+                        set())
+        get = transport.get
+
+        def _get(uri, **kwargs):
+            layer_names = parse_qs(urlparse(uri).query).get('LAYERS', [''])
+            if 'request=GetMap' in uri and ',' in layer_names[0]:
+                with transport._lock:
+                    transport.requested_uris.append(uri)
+
+                return FakeResponse(uri, status_code=404, content='Error')
+
+            return get(uri, **kwargs)
+
+        transport.get = _get
+        self.validation_cls.transport = transport
+        result_summary = results.ResultSummary()
+        self.validation_cls.result_sinks = (result_summary,)
+        stats = self.validation_cls.check_wms_endpoint(self.wms_uri)
+
+        self.assertEqual(stats['wms_get_map_ok'], 2)
+        self.assertTrue(result_summary.ok)
+        self.assertEqual(result_summary.errors, {})
+        self.assertEqual(result_summary.n_tested[results.WMS_GET_MAP], 2)
+        self.assertEqual(
+                result_summary.n_failed[results.WMS_GET_MAP_BATCH], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
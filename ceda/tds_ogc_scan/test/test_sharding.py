@@ -0,0 +1,92 @@
+"""Unit tests for sharding of catalogue references
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import unittest
+from collections import Counter
+
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan.sharding import Shard, get_shard_number, run_shards
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+def _get_shard_number(shard):
+    '''Run in a worker process by run_shards'''
+    return shard.number
+
+
+class ShardTestCase(unittest.TestCase):
+    URIS = ['{}/entry{:03d}.xml'.format(THREDDS_URI, i) for i in range(200)]
+
+    def test01_parse(self):
+        self.assertEqual(Shard.parse('2/8'), (2, 8))
+        self.assertEqual(str(Shard(2, 8)), '2/8')
+        for text in ('0/8', '9/8', '1', 'a/b', '1/0'):
+            with self.assertRaises(ValueError):
+                Shard.parse(text)
+
+    def test02_partition(self):
+        # Every URI is in exactly one shard and the shards are of similar
+        # size
+        shards = [Shard(number, 4) for number in range(1, 5)]
+        selected_uris = [shard.select(self.URIS) for shard in shards]
+        self.assertEqual(sorted(sum(selected_uris, [])), self.URIS)
+        for uris in selected_uris:
+            self.assertGreater(len(uris), 30)
+
+        # The assignment is stable
+        self.assertEqual(get_shard_number(self.URIS[0], 4),
+                         get_shard_number(self.URIS[0], 4))
+
+    def test03_run_shards(self):
+        shard_numbers = dict(run_shards(_get_shard_number, 3))
+        self.assertEqual(shard_numbers, {Shard(1, 3): 1, Shard(2, 3): 2,
+                                         Shard(3, 3): 3})
+
+    def test04_split(self):
+        # A sample of 10 over 4 shards is 3, 3, 2 and 2
+        self.assertEqual([Shard(number, 4).split(10)
+                          for number in range(1, 5)], [3, 3, 2, 2])
+        self.assertEqual([Shard(number, 4).split(2)
+                          for number in range(1, 5)], [1, 1, 0, 0])
+
+
+class ShardedCheckTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(10)]
+
+    def test01_check(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = make_thredds_transport(self.ENTRY_NAMES)
+
+        # Merge the results of each shard from JSON Lines
+        stats = Counter()
+        result_summary = results.ResultSummary()
+        for number in (1, 2, 3):
+            result_file = io.StringIO()
+            _OgcTdsValidation.result_sinks = (
+                                results.JsonLinesResultWriter(result_file),)
+            stats.update(_OgcTdsValidation.check(CATALOG_URI,
+                                                 shard=Shard(number, 3)))
+
+            result_file.seek(0)
+            for result in results.iter_json_lines_results(result_file):
+                result_summary.add(result)
+
+        self.assertEqual(stats['catalog_refs_tested'], len(self.ENTRY_NAMES))
+        self.assertEqual(stats['wms_get_map_ok'], len(self.ENTRY_NAMES))
+        self.assertTrue(results.stats_ok(stats))
+        self.assertEqual(result_summary.n_tested[results.CATALOG],
+                         len(self.ENTRY_NAMES))
+        self.assertTrue(result_summary.ok)
+
+
+if __name__ == '__main__':
+    unittest.main()
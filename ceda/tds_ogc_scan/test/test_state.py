@@ -0,0 +1,72 @@
+"""Unit tests for incremental scans using the persisted scan state
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import os
+import shutil
+import tempfile
+import unittest
+
+from ceda.tds_ogc_scan.state import ScanStateStore
+from ceda.tds_ogc_scan.validation import (OgcTdsValidation,
+                                          OgcTdsValidationConfigError)
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             SUB_CATALOG_XML,
+                                             make_thredds_transport)
+
+
+class IncrementalScanTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(4)]
+
+    def setUp(self):
+        self.state_dirpath = tempfile.mkdtemp()
+        transport = make_thredds_transport(self.ENTRY_NAMES)
+
+        # Make GetMap fail for one entry
+        for uri in list(transport.responses):
+            if 'entry03' in uri and 'GetMap' in uri:
+                transport.responses[uri] = (500, 'Error', None)
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            scan_state = ScanStateStore(
+                            os.path.join(self.state_dirpath, 'state.sqlite'))
+
+        _OgcTdsValidation.transport = transport
+        self.transport = transport
+        self.validation_cls = _OgcTdsValidation
+
+    def tearDown(self):
+        self.validation_cls.scan_state.close()
+        shutil.rmtree(self.state_dirpath)
+
+    def test01_incremental(self):
+        stats = self.validation_cls.check(CATALOG_URI, incremental=True)
+        self.assertEqual(stats['catalog_refs_unchanged'], 0)
+        self.assertEqual(stats['wms_get_map_ok'], 3)
+
+        # Change the content of one sub-catalogue
+        self.transport.add('{}/entry01.xml'.format(THREDDS_URI),
+                           SUB_CATALOG_XML.format('entry01') + '\n')
+
+        stats = self.validation_cls.check(CATALOG_URI, incremental=True)
+
+        # entry01 has changed and entry03 failed last time
+        self.assertEqual(stats['catalog_refs_unchanged'], 2)
+        self.assertEqual(stats['wms_get_map_uris_tested'], 2)
+
+    def test02_freshness(self):
+        self.validation_cls.scan_state.freshness = 0
+        self.validation_cls.check(CATALOG_URI, incremental=True)
+        stats = self.validation_cls.check(CATALOG_URI, incremental=True)
+        self.assertEqual(stats['catalog_refs_unchanged'], 0)
+
+    def test03_incremental_requires_state(self):
+        with self.assertRaises(OgcTdsValidationConfigError):
+            OgcTdsValidation.check(CATALOG_URI, incremental=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Offline unit tests for OGC TDS validation using a local stand-in transport
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import unittest
+
+from ceda.tds_ogc_scan.validation import OgcTdsValidation
+from ceda.tds_ogc_scan.transport import HttpTransport
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_URI, THREDDS_URI,
+                                             make_thredds_transport)
+
+
+class OgcTdsValidationTestCase(unittest.TestCase):
+    ENTRY_NAMES = ['entry{:02d}'.format(i) for i in range(6)]
+
+    def setUp(self):
+        transport = make_thredds_transport(self.ENTRY_NAMES)
+
+        # Remove one sub-catalogue to give a failure
+        del transport.responses['{}/entry05.xml'.format(THREDDS_URI)]
+
+        class _OgcTdsValidation(OgcTdsValidation):
+            pass
+
+        _OgcTdsValidation.transport = transport
+        self.transport = transport
+        self.validation_cls = _OgcTdsValidation
+
+    def _check_stats(self, stats):
+        self.assertEqual(stats['catalog_refs_tested'], 6)
+        self.assertEqual(stats['catalog_refs_ok'], 5)
+        self.assertEqual(stats['wms_get_capabilities_ok'], 5)
+        self.assertEqual(stats['wms_get_map_uris_tested'], 5)
+        self.assertEqual(stats['wms_get_map_ok'], 5)
+        self.assertEqual(stats['wcs_get_capabilities_ok'], 5)
+        self.assertEqual(stats['wcs_describe_coverage_ok'], 5)
+        self.assertEqual(stats['wcs_get_coverage_uris_tested'], 5)
+        self.assertEqual(stats['wcs_get_coverage_ok'], 5)
+
+    def test01_get_catalog_ref_uris(self):
+        catalog_ref_uris = list(self.validation_cls.get_catalog_ref_uris(
+                                                                CATALOG_URI))
+        self.assertEqual(catalog_ref_uris,
+                         ['{}/{}.xml'.format(THREDDS_URI, entry_name)
+                          for entry_name in self.ENTRY_NAMES])
+
+    def test02_check(self):
+        stats = self.validation_cls.check(CATALOG_URI)
+        self._check_stats(stats)
+
+    def test03_check_concurrently(self):
+        stats = self.validation_cls.check(CATALOG_URI, max_workers=4,
+                                          max_workers_per_host=2)
+        self._check_stats(stats)
+
+    def test04_default_transport(self):
+        class _OgcTdsValidation(OgcTdsValidation):
+            transport = None
+
+        transport = _OgcTdsValidation.get_transport()
+        self.assertIsInstance(transport, HttpTransport)
+        self.assertIs(_OgcTdsValidation.get_transport(), transport)
+        transport.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -47,34 +47,32 @@ class TdsWcsUnittestMethodFactory:
 
         (
             wcs_get_capabilities_resp_ok,
-            _
+            coverage_names
         ) = OgcTdsValidation.check_wcs_get_capabilities_resp(
-                                                wcs_get_capabilities_uri)
+                            wcs_get_capabilities_uri,
+                            max_coverages=OgcTdsValidation.wcs_max_coverages)
         if not wcs_get_capabilities_resp_ok:
             raise AssertionError("WCS GetCapabilities call failed for "
                                  "{!r}".format(wcs_get_capabilities_uri))
 
-        wcs_describe_coverage_uri = "{}{}".format(wcs_uri,
-                            OgcTdsValidation.WCS_DESCRIBE_COVERAGE_QUERY_ARGS)
-
-        (
-            wcs_describe_coverage_resp_ok,
-            _
-        ) = OgcTdsValidation.check_wcs_describe_coverage_resp(
-                                                    wcs_describe_coverage_uri)
-        if not wcs_describe_coverage_resp_ok:
-            raise AssertionError("WCS DescribeCoverage call failed for "
-                                 "{!r}".format(wcs_describe_coverage_uri))
+        _, failed_uris = OgcTdsValidation.check_wcs_coverage_sample(
+                                                            wcs_uri,
+                                                            coverage_names)
+        if failed_uris:
+            raise AssertionError("WCS DescribeCoverage or GetCoverage calls "
+                                 "failed for {!r}".format(failed_uris))
 
         log.info('WCS tests passed for {!r}'.format(self.catalog_ref_uri))
 
 
-def tds_wcs_testcase_factory(catalog_uri):
-    '''Create TDS WCS TestCase class'''
+def tds_wcs_testcase_factory(catalog_uri, max_workers=1):
+    '''Create TDS WCS TestCase class.  max_workers sets the number of
+    catalogue entries to test concurrently'''
     unittest_case_factory = ThreddsCatalogUnittestCaseFactory(
                                                 catalog_uri,
                                                 TdsWcsUnittestMethodFactory,
-                                                method_extension='wcs')
+                                                method_extension='wcs',
+                                                max_workers=max_workers)
     return unittest_case_factory()
     
         
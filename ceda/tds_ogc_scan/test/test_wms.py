@@ -51,33 +51,35 @@ class TdsWmsUnittestMethodFactory:
  
         (
             wms_get_capabilities_resp_ok,
-            layer_names
-        ) = OgcTdsValidation.check_wms_get_capabilities_resp(
-                                                wms_get_capabilities_uri)
+            layers
+        ) = OgcTdsValidation.check_wms_get_capabilities_layers(
+                        wms_get_capabilities_uri,
+                        max_layers=OgcTdsValidation.get_map_sampler.max_layers)
         if not wms_get_capabilities_resp_ok:
             raise AssertionError("WMS GetCapabilities call failed for "
                                  "{!r}".format(wms_get_capabilities_uri))
         
-        if len(layer_names) > 0:
-            query_args = OgcTdsValidation.WMS_GET_MAP_QUERY_ARGS.format(
-                                                            layer_names[0])
-            wms_get_map_uri = "{}{}".format(wms_uri, query_args)
- 
-            wms_get_map_resp_ok = OgcTdsValidation.check_wms_get_map_resp(
-                                                            wms_get_map_uri)
-            if not wms_get_map_resp_ok:
-                raise AssertionError("WMS GetMap call failed for {!r}".format(
-                                         wms_get_map_uri))
+        if len(layers) > 0:
+            (
+                _,
+                failed_wms_get_map_uris
+            ) = OgcTdsValidation.check_wms_get_map_sample(wms_uri, layers)
+            if failed_wms_get_map_uris:
+                raise AssertionError("WMS GetMap call failed for {}".format(
+                    ', '.join([repr(wms_get_map_uri)
+                               for wms_get_map_uri in failed_wms_get_map_uris])))
 
         log.info('WMS tests passed for {!r}'.format(self.catalog_ref_uri))
 
 
-def tds_wms_testcase_factory(catalog_uri):
-    '''Create TDS WMS TestCase class'''
+def tds_wms_testcase_factory(catalog_uri, max_workers=1):
+    '''Create TDS WMS TestCase class.  max_workers sets the number of
+    catalogue entries to test concurrently'''
     unittest_case_factory = ThreddsCatalogUnittestCaseFactory(
                                                 catalog_uri,
                                                 TdsWmsUnittestMethodFactory,
-                                                method_extension='wms')
+                                                method_extension='wms',
+                                                max_workers=max_workers)
     
     return unittest_case_factory()
 
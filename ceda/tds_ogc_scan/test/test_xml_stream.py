@@ -0,0 +1,143 @@
+"""Unit tests for incremental parsing of catalogue and capabilities documents
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import io
+import itertools
+import unittest
+import xml.etree.ElementTree as ET
+
+from ceda.tds_ogc_scan import xml_stream
+from ceda.tds_ogc_scan.test.fixtures import (CATALOG_XML, CATALOG_REF_XML,
+                                             WMS_LAYER_XML,
+                                             WMS_GET_CAPABILITIES_XML,
+                                             WCS_GET_CAPABILITIES_XML,
+                                             WCS_COVERAGE_OFFERING_XML,
+                                             WCS_DESCRIBE_COVERAGE_XML,
+                                             WCS_COVERAGE_XML)
+
+
+class XmlStreamTestCase(unittest.TestCase):
+    N_ENTRIES = 5000
+
+    def _make_source(self, content):
+        return io.BytesIO(content.encode('utf-8'))
+
+    def test01_iter_catalog_ref_hrefs(self):
+        catalog_refs = ''.join([CATALOG_REF_XML.format('entry{}'.format(i))
+                                for i in range(self.N_ENTRIES)])
+        source = self._make_source(CATALOG_XML.format(catalog_refs))
+
+        hrefs = list(xml_stream.iter_catalog_ref_hrefs(source))
+        self.assertEqual(len(hrefs), self.N_ENTRIES)
+        self.assertEqual(hrefs[0], 'entry0.xml')
+
+    def test04_iter_wms_layer_names_stops_early(self):
+        layers = ''.join([WMS_LAYER_XML.format('layer{}'.format(i))
+                          for i in range(self.N_ENTRIES)])
+        content = WMS_GET_CAPABILITIES_XML.format('entry', layers)
+        source = self._make_source(content)
+
+        layer_names = list(itertools.islice(
+                        xml_stream.iter_wms_layer_names(source), 2))
+
+        self.assertEqual(layer_names, ['layer0', 'layer1'])
+        self.assertLess(source.tell(), len(content))
+
+    def test05_iterparse_paths_discards_elements(self):
+        layers = ''.join([WMS_LAYER_XML.format('layer{}'.format(i))
+                          for i in range(100)])
+        source = self._make_source(WMS_GET_CAPABILITIES_XML.format('entry',
+                                                                   layers))
+        for event, path, elem in xml_stream.iterparse_paths(source):
+            if event == 'start' and len(path) == 1:
+                root_elem = elem
+
+        self.assertEqual(len(root_elem), 0)
+
+    def test06_iter_wms_layers(self):
+        content = '''<?xml version="1.0" encoding="UTF-8"?>
+<WMS_Capabilities xmlns="http://www.opengis.net/wms" version="1.3.0">
+  <Capability>
+    <Layer>
+      <Title>entry</Title>
+      <EX_GeographicBoundingBox>
+        <westBoundLongitude>-10</westBoundLongitude>
+        <eastBoundLongitude>30</eastBoundLongitude>
+        <southBoundLatitude>40</southBoundLatitude>
+        <northBoundLatitude>70</northBoundLatitude>
+      </EX_GeographicBoundingBox>
+      <Dimension name="time" units="ISO8601" default="2000-03-01">
+        2000-01-01,2000-02-01,2000-03-01
+      </Dimension>
+      <Layer><Name>sst</Name></Layer>
+      <Layer>
+        <Name>depth</Name>
+        <Dimension name="elevation" units="m" default="0">0,10,100</Dimension>
+      </Layer>
+    </Layer>
+  </Capability>
+</WMS_Capabilities>
+'''
+        layers = list(xml_stream.iter_wms_layers(self._make_source(content)))
+
+        self.assertEqual([layer.name for layer in layers], ['sst', 'depth'])
+        self.assertEqual(layers[0].bbox, (-10., 40., 30., 70.))
+        self.assertEqual(layers[0].dimensions['time'][0], '2000-03-01')
+        self.assertNotIn('elevation', layers[0].dimensions)
+        self.assertEqual(layers[1].dimensions['elevation'], ('0', '0,10,100'))
+        self.assertIn('time', layers[1].dimensions)
+
+    def test07_iter_wcs_coverage_names(self):
+        coverages = ''.join([WCS_COVERAGE_OFFERING_XML.format(name)
+                             for name in ('sst', 'sst_error')])
+        source = self._make_source(WCS_GET_CAPABILITIES_XML.format(coverages))
+
+        self.assertEqual(list(xml_stream.iter_wcs_coverage_names(source)),
+                         ['sst', 'sst_error'])
+
+    def test08_iter_wcs_coverages(self):
+        content = WCS_DESCRIBE_COVERAGE_XML.format(
+                        WCS_COVERAGE_XML.format('sst') +
+                        '<CoverageOffering><name>mask</name>'
+                        '</CoverageOffering>')
+        coverages = list(xml_stream.iter_wcs_coverages(
+                                                self._make_source(content)))
+
+        self.assertEqual(coverages[0],
+                         xml_stream.WcsCoverage('sst',
+                                                (-180., -90., 180., 90.),
+                                                '2000-01-01T00:00:00Z',
+                                                ['GeoTIFF', 'NetCDF3']))
+        self.assertEqual(coverages[1],
+                         xml_stream.WcsCoverage('mask', None, None, []))
+
+    def test09_iter_wms_layers_malformed_bbox(self):
+        # A layer with an empty or non-numeric bound has no bounding box
+        content = WMS_GET_CAPABILITIES_XML.format(
+            'entry',
+            '<Layer><Name>sst</Name><EX_GeographicBoundingBox>'
+            '<westBoundLongitude></westBoundLongitude>'
+            '<eastBoundLongitude>east</eastBoundLongitude>'
+            '<southBoundLatitude>-90</southBoundLatitude>'
+            '<northBoundLatitude>90</northBoundLatitude>'
+            '</EX_GeographicBoundingBox></Layer>')
+        layers = list(xml_stream.iter_wms_layers(self._make_source(content)))
+        self.assertEqual(layers, [xml_stream.WmsLayer('sst', None, {})])
+
+    def test10_iter_wcs_coverages_malformed_position(self):
+        for pos in ('-180', 'west -90', ''):
+            content = WCS_DESCRIBE_COVERAGE_XML.format(
+                    '<CoverageOffering><name>sst</name><lonLatEnvelope>'
+                    '<gml:pos>{}</gml:pos><gml:pos>180 90</gml:pos>'
+                    '</lonLatEnvelope></CoverageOffering>'.format(pos))
+            with self.assertRaises(ET.ParseError):
+                list(xml_stream.iter_wcs_coverages(
+                                                self._make_source(content)))
+
+
+if __name__ == '__main__':
+    unittest.main()
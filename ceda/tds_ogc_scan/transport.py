@@ -0,0 +1,193 @@
+"""HTTP transport used for all requests made by the OGC TDS validation
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+import time
+import random
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+
+log = logging.getLogger(__name__)
+
+# Errors which can be raised making a request or reading a streamed response
+TRANSPORT_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError)
+
+
+class RetryPolicy:
+    '''Classify failed requests as worth retrying or not and set the delay
+    before each retry.  Only idempotent requests are retried, and only if
+    they failed to connect or were answered with a 502, 503 or 504
+    response.  A request which timed out reading its response is not
+    retried since the server is unlikely to answer any sooner a second
+    time.  Delays grow exponentially with full jitter so that retries of
+    requests which failed together are spread out
+    '''
+    RETRY_STATUS_CODES = (502, 503, 504)
+    IDEMPOTENT_METHODS = ('GET', 'HEAD')
+    DEFAULT_MAX_BACKOFF = 30.
+
+    def __init__(self, max_retries=2, backoff_factor=0.5,
+                 max_backoff=DEFAULT_MAX_BACKOFF, rand=None):
+        '''
+        :param max_retries: number of retries for each request
+        :param backoff_factor: the delay before retry n is chosen at random
+        up to backoff_factor * 2**n seconds
+        :param max_backoff: maximum delay in seconds, also applied to the
+        delay asked for by a Retry-After header
+        :param rand: random.Random to choose delays with
+        '''
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self._rand = rand or random.Random()
+
+    def is_retryable(self, method='GET', error=None, resp=None):
+        '''Check whether a request which raised error or gave resp can be
+        retried'''
+        if method.upper() not in self.IDEMPOTENT_METHODS:
+            return False
+
+        if error is not None:
+            return (isinstance(error, requests.ConnectionError) and
+                    not isinstance(error, requests.exceptions.SSLError))
+
+        return resp is not None and resp.status_code in self.RETRY_STATUS_CODES
+
+    def get_backoff(self, n_retries, resp=None):
+        '''Get the time in seconds to wait before retry n_retries + 1'''
+        retry_after = None
+        if resp is not None:
+            retry_after = resp.headers.get('Retry-After')
+
+        try:
+            backoff = float(retry_after)
+        except (TypeError, ValueError):
+            backoff = self._rand.uniform(
+                                0., self.backoff_factor * 2**n_retries)
+
+        return min(max(backoff, 0.), self.max_backoff)
+
+
+class HttpTransport:
+    '''Wrap a pooled requests.Session so that connections to a THREDDS host
+    are kept alive and reused between validation requests.
+
+    Any object with a compatible get method can be used in place of this
+    class, for example a local stand-in for tests
+    '''
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_CONNECT_TIMEOUT = 10.
+    DEFAULT_READ_TIMEOUT = 60.
+    DEFAULT_MAX_RETRIES = 2
+    DEFAULT_BACKOFF_FACTOR = 0.5
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 keep_alive=True, sleep=time.sleep):
+        '''
+        :param pool_size: maximum number of connections kept open per host
+        :param connect_timeout: timeout in seconds for establishing a
+        connection.  Set to None to wait indefinitely
+        :param read_timeout: timeout in seconds between bytes received from
+        the server.  Set to None to wait indefinitely
+        :param max_retries: number of retries for connection errors and
+        502, 503 and 504 responses.  See RetryPolicy
+        :param backoff_factor: factor for exponential delay between retries
+        :param keep_alive: set to False to close connections after each
+        request
+        :param sleep: function called to wait before a retry
+        '''
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry_policy = RetryPolicy(max_retries=max_retries,
+                                        backoff_factor=backoff_factor)
+        self._sleep = sleep
+
+        # Retries are made by get following retry_policy
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=0)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def get(self, uri, time_limits=None, **kwargs):
+        '''Make a HTTP GET request using the pooled session.  Keywords are
+        passed to requests.Session.get
+
+        :param time_limits: deadline.TimeLimits bounding the request and
+        its retries, or None for no limit.  The timeout of each attempt is
+        cut to the time left and a retry is only made if the time left
+        outlasts the wait before it
+        '''
+        timeout = kwargs.get('timeout', self.timeout)
+        n_retries = 0
+        while True:
+            kwargs['timeout'] = timeout
+            if time_limits is not None:
+                kwargs['timeout'] = time_limits.limit_timeout(timeout)
+
+            try:
+                resp = self.session.get(uri, **kwargs)
+
+            except requests.RequestException as e:
+                if (n_retries >= self.retry_policy.max_retries or
+                    not self.retry_policy.is_retryable(error=e)):
+                    raise
+
+                backoff = self.retry_policy.get_backoff(n_retries)
+                if not self._can_wait(backoff, time_limits):
+                    raise
+
+                log.debug('Retrying %s after error: %s', uri, e)
+            else:
+                if (n_retries >= self.retry_policy.max_retries or
+                    not self.retry_policy.is_retryable(resp=resp)):
+                    return resp
+
+                backoff = self.retry_policy.get_backoff(n_retries, resp=resp)
+                if not self._can_wait(backoff, time_limits):
+                    return resp
+
+                resp.close()
+                log.debug('Retrying %s after %s response', uri,
+                          resp.status_code)
+
+            self._sleep(backoff)
+            n_retries += 1
+
+    @staticmethod
+    def _can_wait(backoff, time_limits):
+        '''Check whether there is time to wait backoff seconds and retry'''
+        if time_limits is None:
+            return True
+
+        remaining = time_limits.remaining()
+        return remaining is None or backoff < remaining
+
+    def close(self):
+        '''Close all pooled connections'''
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
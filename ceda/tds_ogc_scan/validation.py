@@ -7,15 +7,35 @@ __license__ = """BSD - See LICENSE file in top-level directory"""
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = '$Id$'
 import os
-import random
-from six.moves.urllib.parse import urlparse, urlunparse
+import time
+import itertools
+import hashlib
+from collections import Counter
+from six.moves.urllib.parse import urlparse, urlunparse, parse_qs, quote
 import xml.etree.ElementTree as ET
 
-import requests
+import threading
 import logging
 
+from ceda.tds_ogc_scan.concurrency import run_concurrently
+from ceda.tds_ogc_scan.pipeline import ScanPipeline
+from ceda.tds_ogc_scan.transport import HttpTransport, TRANSPORT_ERRORS
+from ceda.tds_ogc_scan.deadline import Deadline, DeadlineTransport
+from ceda.tds_ogc_scan import results
+from ceda.tds_ogc_scan import xml_stream
+from ceda.tds_ogc_scan import catalog_index
+from ceda.tds_ogc_scan import png_stream
+from ceda.tds_ogc_scan import coverage
+from ceda.tds_ogc_scan import metrics
+from ceda.tds_ogc_scan.state import HashingReader
+from ceda.tds_ogc_scan.sampling import GetMapSampler
+from ceda.tds_ogc_scan.entry_sampling import EntrySampler
+
 log = logging.getLogger(__name__)
 
+THREDDS_NS = 'http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0'
+CATALOG_REF_XPATH = '{{{}}}catalogRef'.format(THREDDS_NS)
+
 
 def get_base_uri(uri):
     '''Extract protocol scheme + DNS name from a URI'''
@@ -31,14 +51,89 @@ class OgcTdsValidationConfigError(OgcTdsValidationError):
 
 class OgcTdsCatalogParseError(OgcTdsValidationError):
     """Error parsing TDS Catalogue"""
+    def __init__(self, *args, status_code=None, error=None):
+        """status_code is set if an error response was received for the
+        catalogue.  error names the class of error for result records
+        """
+        super().__init__(*args)
+        self.status_code = status_code
+        self.error = error
 
 
 class OgcTdsValidation:
     '''Check TDS catalogue and carry out validation steps on OGC endpoints
     published
     '''
+    # Default file for the report of results from each endpoint check
     REPORT_FILEPATH = 'wms-error-report.csv'
 
+    # HTTP transport used for all requests.  Set to an HttpTransport or a
+    # compatible object to override the default created by get_transport
+    transport = None
+    _transport_lock = threading.Lock()
+
+    # Time in seconds allowed for each request from when it is made until
+    # its response has been read.  None for no limit
+    request_timeout = None
+
+    # deadline.Deadline after which no more requests are made.  check sets
+    # this for the duration of a scan given a deadline
+    scan_deadline = None
+
+    # Set to a CatalogResponseCache to cache catalogue responses between
+    # runs
+    catalog_cache = None
+
+    # Set to a ScanStateStore to record the outcome of checking each
+    # catalogue reference for incremental scans
+    scan_state = None
+
+    # Set to a CatalogResolver to memoize catalogue references and endpoint
+    # URIs so that each catalogue is read once per monitoring cycle
+    catalog_resolver = None
+
+    # Set to a manifest.EndpointManifest to take the catalogue references
+    # and their endpoints from a manifest compiled beforehand in place of
+    # reading the catalogues.  Catalogue references missing or unresolved in
+    # the manifest are read as usual
+    manifest = None
+
+    # Service types resolved together so that a resolved catalogue can be
+    # shared between the WMS and WCS checks
+    RESOLVED_SERVICE_TYPES = ('WMS', 'WCS')
+
+    # Choice of layers and tiles for GetMap checks
+    get_map_sampler = GetMapSampler()
+
+    # Choice of catalogue entries tested by check given rand_sample.  Set to
+    # an entry_sampling.RotatingEntrySampler to test every entry over a
+    # number of runs.  The outcome of checking each entry is passed to it
+    entry_sampler = EntrySampler()
+
+    # Number of GetMap requests to make concurrently for each WMS endpoint.
+    # Set get_map_host_limiter to a HostConcurrencyLimiter to limit the
+    # GetMap requests in progress against each host across all endpoints
+    get_map_max_workers = 1
+    get_map_host_limiter = None
+
+    # Number of layers to request together in one GetMap.  None or 1 to
+    # request each layer on its own.  A batch which fails is split in two
+    # and each half requested in turn to find the layers which fail
+    get_map_batch_size = None
+
+    # Number of coverages of each WCS endpoint to test with DescribeCoverage
+    # and GetCoverage.  Set to None to test every coverage
+    wcs_max_coverages = 1
+
+    # Reading of a GetCoverage response stops and the connection is closed
+    # after this number of bytes
+    get_coverage_max_bytes = 16 * 2**20
+
+    # Objects with an add method to which an EndpointCheckResult is passed
+    # for each request made in checking endpoints e.g. ResultSummary,
+    # JsonLinesResultWriter
+    result_sinks = ()
+
     WMS_GET_CAPABILITIES_QUERY_ARGS = (
         '?service=WMS&version=1.3.0&request=GetCapabilities'
     )
@@ -49,6 +144,22 @@ class OgcTdsValidation:
         'FORMAT=image/png&COLORSCALERANGE=auto'
     )
 
+    # GetMap for a batch of layers.  Only the response to the batch as a
+    # whole is checked so a small image is requested
+    WMS_GET_MAP_BATCH_QUERY_ARGS = (
+        '?service=WMS&version=1.3.0&request=GetMap&BBOX=-180,-90,180,90&'
+        'LAYERS={layer_names}&CRS=CRS:84&WIDTH=16&HEIGHT=16&STYLES=&'
+        'FORMAT=image/png&COLORSCALERANGE=auto'
+    )
+
+    # GetMap for a tile of a layer.  TIME and ELEVATION are appended if
+    # required
+    WMS_GET_MAP_BBOX_QUERY_ARGS = (
+        '?service=WMS&version=1.3.0&request=GetMap&BBOX={bbox}&'
+        'LAYERS={layer_name}&CRS=CRS:84&WIDTH=256&HEIGHT=256&STYLES=&'
+        'FORMAT=image/png&COLORSCALERANGE=auto'
+    )
+
     WCS_GET_CAPABILITIES_QUERY_ARGS = (
         '?service=WCS&version=1.0.0&request=GetCapabilities'
     )
@@ -57,11 +168,79 @@ class OgcTdsValidation:
         '?service=WCS&version=1.0.0&request=DescribeCoverage'
     )
 
+    # GetCoverage for a subset of a coverage.  TIME is appended if the
+    # coverage has a temporal domain
     WCS_GET_COVERAGE_QUERY_ARGS = (
-        '?service=WCS&version=1.0.0&request=GetCoverage&BBOX=-180,-90,180,90&'
-        '&CRS=CRS:84&FORMAT=netcdf'
+        '?service=WCS&version=1.0.0&request=GetCoverage&COVERAGE={coverage}&'
+        'BBOX={bbox}&CRS=OGC:CRS84&FORMAT={format}'
     )
 
+    # Fraction of the width and height of a coverage's bounding box covered
+    # by the GetCoverage subset, centred on the middle of the box
+    GET_COVERAGE_SUBSET_FRACTION = 0.1
+
+    # Format requested by GetCoverage if DescribeCoverage lists no formats
+    DEFAULT_GET_COVERAGE_FORMAT = 'NetCDF3'
+
+    @classmethod
+    def get_transport(cls):
+        '''Get the transport used for HTTP requests, creating a default
+        HttpTransport if none has been set.  If scan_deadline or
+        request_timeout is set, the transport is wrapped in a
+        deadline.DeadlineTransport
+        '''
+        if cls.transport is None:
+            with cls._transport_lock:
+                if cls.transport is None:
+                    cls.transport = HttpTransport()
+
+        if cls.scan_deadline is None and cls.request_timeout is None:
+            return cls.transport
+
+        return DeadlineTransport(cls.transport, deadline=cls.scan_deadline,
+                                 total_timeout=cls.request_timeout)
+
+    @classmethod
+    def record_result(cls, uri, operation, timer, status_code=None,
+                      n_bytes=0, error=None):
+        """Pass a result record to each of the result sinks
+
+        :param timer: metrics.RequestTimer started when the request was made
+        :param error: name of the class of error or None if the check passed
+        """
+        if not cls.result_sinks:
+            return
+
+        result = results.EndpointCheckResult(uri, operation, status_code,
+                                             timer.elapsed(), timer.ttfb,
+                                             timer.parse_time, n_bytes, error)
+        for result_sink in cls.result_sinks:
+            result_sink.add(result)
+
+    @staticmethod
+    def get_n_bytes_read(resp):
+        """Get the number of bytes read so far from the raw stream of a
+        streamed response.  Call before closing the response
+        """
+        try:
+            return resp.raw.tell()
+        except (AttributeError, ValueError, IOError):
+            return 0
+
+    @staticmethod
+    def read_message(resp):
+        """Read the body of a response for logging, with line breaks removed.
+        Reading a streamed body can fail, in which case the transport error
+        is returned in place of the message
+
+        :return: tuple of message and transport error, one of which is None
+        """
+        try:
+            return resp.text.replace('\r\n', ''), None
+
+        except TRANSPORT_ERRORS as e:
+            return None, e
+
     @classmethod
     def parse_thredds_catalog(cls, uri):
         '''Parse thredds Catalogue XML given by input URI and return list
@@ -69,16 +248,13 @@ class OgcTdsValidation:
         '''
         root = cls.read_catalog(uri)
 
-        catalog_ref_elems = root.findall('{http://www.unidata.ucar.edu/'
-                                         'namespaces/thredds/InvCatalog/v1.0}'
-                                         'catalogRef')
-        return catalog_ref_elems
+        return root.findall(CATALOG_REF_XPATH)
     
     @classmethod
     def read_catalog(cls, catalog_uri):
         """Read catalogue from URI and return as ElementTree Element
         """
-        catalog_resp = requests.get(catalog_uri)
+        catalog_resp = cls.get_transport().get(catalog_uri)
         if not catalog_resp.ok:
             error_msg = "{} response for catalogue {!r}".format(
                         catalog_resp.status_code, catalog_uri)
@@ -89,374 +265,1349 @@ class OgcTdsValidation:
         
         return catalog_elem
     
+    @classmethod
+    def open_stream(cls, uri):
+        """Make a streamed GET request for the given URI.  The raw response
+        body can be read incrementally from resp.raw.  Callers must close the
+        response when done with it
+        """
+        resp = cls.get_transport().get(uri, stream=True)
+
+        # Ensure gzip or deflate encoded content is decoded by the time it is
+        # read from the raw stream
+        resp.raw.decode_content = True
+        return resp
+
+    @classmethod
+    def open_catalog_stream(cls, catalog_uri):
+        """Open a streamed response for a catalogue, raising
+        OgcTdsCatalogParseError for an error response.  If a catalogue cache
+        is set, the response is served from or stored in the cache
+        """
+        try:
+            if cls.catalog_cache is not None:
+                catalog_resp = cls.catalog_cache.get(cls.get_transport(),
+                                                     catalog_uri)
+            else:
+                catalog_resp = cls.open_stream(catalog_uri)
+
+        except TRANSPORT_ERRORS as e:
+            error_msg = "Error requesting catalogue {!r}: {}".format(
+                        catalog_uri, e)
+            log.error(error_msg)
+            raise OgcTdsCatalogParseError(error_msg, error=type(e).__name__)
+
+        if not catalog_resp.ok:
+            catalog_resp.close()
+            error_msg = "{} response for catalogue {!r}".format(
+                        catalog_resp.status_code, catalog_uri)
+            log.error(error_msg)
+            raise OgcTdsCatalogParseError(
+                                    error_msg,
+                                    status_code=catalog_resp.status_code,
+                                    error=results.HTTP_ERROR)
+
+        return catalog_resp
+
     @classmethod
     def get_catalog_ref_uris(cls, uri):
-        catalog_ref_elems = cls.parse_thredds_catalog(uri)
+        """Yield URIs of the catalogue references in the catalogue given by
+        uri.  The catalogue is parsed incrementally so that URIs are yielded
+        as they are read.  If manifest is set, the URIs are read from it.
+        Otherwise if catalog_resolver is set, URIs resolved within its TTL
+        are used instead
+
+        :raises manifest.EndpointManifestError: if manifest was compiled for
+        a different catalogue
+        """
+        if cls.manifest is not None:
+            cls.manifest.check_catalog_uri(uri)
+            yield from cls.manifest.iter_catalog_ref_uris()
+            return
+
+        if cls.catalog_resolver is None:
+            yield from cls._iter_catalog_ref_uris(uri)
+            return
 
+        catalog_ref_uris = cls.catalog_resolver.get_catalog_ref_uris(uri)
+        if catalog_ref_uris is None:
+            catalog_ref_uris = list(cls._iter_catalog_ref_uris(uri))
+            cls.catalog_resolver.set_catalog_ref_uris(uri, catalog_ref_uris)
+
+        yield from catalog_ref_uris
+
+    @classmethod
+    def _iter_catalog_ref_uris(cls, uri):
         parsed_uri = urlparse(uri)
         thredds_prefix = urlunparse(
                         [parsed_uri.scheme, parsed_uri.netloc,
                          os.path.dirname(parsed_uri.path), '', '', ''])
 
-        for catalog_ref_elem in catalog_ref_elems:
-            catalog_ref_uri_path = catalog_ref_elem.attrib[
-                                        '{http://www.w3.org/1999/xlink}href']
-            catalog_ref_uri = "{}/{}".format(thredds_prefix,
-                                             catalog_ref_uri_path)
+        catalog_resp = cls.open_catalog_stream(uri)
+        try:
+            for catalog_ref_uri_path in xml_stream.iter_catalog_ref_hrefs(
+                                                            catalog_resp.raw):
+                catalog_ref_uri = "{}/{}".format(thredds_prefix,
+                                                 catalog_ref_uri_path)
+
+                yield catalog_ref_uri
+        finally:
+            catalog_resp.close()
+
+    @classmethod
+    def get_ogc_uris_from_catalog(cls, catalog_uri,
+                                  service_types=('WMS', 'WCS'),
+                                  content_hash=None):
+        """Read the catalogue from the given URI and extract the first
+        endpoint for each of the given OGC service types.  Reading stops as
+        soon as each service type has been found or is known to be absent.
+
+        If manifest is set, the endpoints compiled for the catalogue are
+        used.  Otherwise if catalog_resolver is set, endpoints resolved
+        within its TTL are used instead of reading the catalogue
+
+        :param content_hash: hashlib object to update with the catalogue
+        content.  If set, the whole catalogue is always read
+
+        :return: dictionary of endpoint URIs keyed by service type.  The URI
+        is None where the catalogue has no endpoint for a service type
+        """
+        if cls.manifest is not None and content_hash is None:
+            entry = cls.manifest.get(catalog_uri)
+            if entry is not None and entry.ogc_uris is not None:
+                return {service_type: entry.ogc_uris.get(service_type)
+                        for service_type in service_types}
+
+            log.info("Catalogue {!r} not resolved in the manifest: reading "
+                     "the catalogue".format(catalog_uri))
+
+        if cls.catalog_resolver is None:
+            return cls._read_ogc_uris_from_catalog(catalog_uri, service_types,
+                                                   content_hash)
+
+        ogc_uris = None
+        if content_hash is None:
+            ogc_uris = cls.catalog_resolver.get_ogc_uris(catalog_uri)
+
+        if ogc_uris is None or not set(service_types).issubset(ogc_uris):
+            resolved_service_types = cls.RESOLVED_SERVICE_TYPES + tuple(
+                                service_type for service_type in service_types
+                                if service_type not in
+                                cls.RESOLVED_SERVICE_TYPES)
+            ogc_uris = cls._read_ogc_uris_from_catalog(
+                                                    catalog_uri,
+                                                    resolved_service_types,
+                                                    content_hash)
+            cls.catalog_resolver.set_ogc_uris(catalog_uri, ogc_uris)
+
+        return {service_type: ogc_uris[service_type]
+                for service_type in service_types}
+
+    @classmethod
+    def _read_ogc_uris_from_catalog(cls, catalog_uri, service_types,
+                                    content_hash):
+        timer = metrics.RequestTimer()
+        try:
+            catalog_resp = cls.open_catalog_stream(catalog_uri)
+
+        except OgcTdsCatalogParseError as e:
+            cls.record_result(catalog_uri, results.CATALOG, timer,
+                              status_code=e.status_code, error=e.error)
+            raise
+
+        timer.received()
+        try:
+            if content_hash is None:
+                uri_paths = catalog_index.find_service_uri_paths(
+                                            catalog_resp.raw, service_types)
+            else:
+                hashing_reader = HashingReader(catalog_resp.raw, content_hash)
+                uri_paths = catalog_index.find_service_uri_paths(
+                                            hashing_reader, service_types)
+                hashing_reader.drain()
+
+            timer.parsed()
+
+        except (ET.ParseError,) + TRANSPORT_ERRORS as e:
+            error_msg = "Error parsing catalogue {!r}: {}".format(catalog_uri,
+                                                                  e)
+            log.error(error_msg)
+            error = (results.PARSE_ERROR if isinstance(e, ET.ParseError)
+                     else type(e).__name__)
+            cls.record_result(catalog_uri, results.CATALOG, timer,
+                              status_code=catalog_resp.status_code,
+                              n_bytes=cls.get_n_bytes_read(catalog_resp),
+                              error=error)
+            raise OgcTdsCatalogParseError(
+                                    error_msg,
+                                    status_code=catalog_resp.status_code,
+                                    error=error)
+        else:
+            cls.record_result(catalog_uri, results.CATALOG, timer,
+                              status_code=catalog_resp.status_code,
+                              n_bytes=cls.get_n_bytes_read(catalog_resp))
+        finally:
+            catalog_resp.close()
+
+        return cls._get_ogc_uris(catalog_uri, uri_paths)
+
+    @classmethod
+    def _get_ogc_uris(cls, catalog_uri, uri_paths):
+        '''Make endpoint URIs from (base, urlPath) tuples keyed by service
+        type'''
+        base_prefix = get_base_uri(catalog_uri)
+        ogc_uris = {}
+        for service_type, (base_path, uri_path) in uri_paths.items():
+            if base_path is None or uri_path is None:
+                log.info("No {} endpoint for catalogue {!r}".format(
+                         service_type, catalog_uri))
+                ogc_uris[service_type] = None
+            else:
+                ogc_uris[service_type] = "{}{}{}".format(base_prefix,
+                                                         base_path, uri_path)
+
+        return ogc_uris
+
+    @classmethod
+    def get_ogc_uris_from_catalog_elem(cls, catalog_uri, catalog_elem,
+                                       service_types=('WMS', 'WCS')):
+        """Extract the first endpoint for each of the given OGC service
+        types from a catalogue already parsed into an ElementTree element.
+        The element is indexed in a single pass
 
-            yield catalog_ref_uri
+        :return: dictionary of endpoint URIs keyed by service type.  The URI
+        is None where the catalogue has no endpoint for a service type
+        """
+        uri_paths = catalog_index.CatalogIndex.from_element(
+                                    catalog_elem).get_uri_paths(service_types)
+        return cls._get_ogc_uris(catalog_uri, uri_paths)
 
     @classmethod
-    def check(cls, uri, catalog_entries_filter=None, rand_sample=None):
+    def check(cls, uri, catalog_entries_filter=None, rand_sample=None,
+              max_workers=1, max_workers_per_host=None, incremental=False,
+              shard=None, catalog_workers=None, wms_workers=None,
+              wcs_workers=None, queue_size=ScanPipeline.DEFAULT_QUEUE_SIZE,
+              deadline=None):
         """Iterate through a THREDDS catalogue (given by uri) and test all
-        WMS endpoints
+        WMS endpoints.  Entries are checked in a pipeline.ScanPipeline as
+        they are read from the catalogue
 
         :param uri: THREDDS Catalogue XML HTTP endpoint
         :param catalog_entries_filter: filter individual catalogue entries
         based on this list.  Entries not included will not be tested
         :rand_sample: set to an integer number of sample catalogue elements to
-        try out.  The element indices are selected at random.  The number of
-        elements picked out is normalised so that is at least one less than the
-        total number of elements found in the catalogue.
+        try out.  The elements are chosen by entry_sampler as the catalogue is
+        read.  All elements are tested if there are no more than this number
+        :param max_workers: default number of workers for each stage of the
+        pipeline: the number of sub-catalogues read, and of WMS and of WCS
+        endpoints checked, concurrently
+        :param max_workers_per_host: limit on the number of requests in
+        progress in each stage of the pipeline against any one host.  None
+        means no limit
+        :param incremental: skip catalogue entries which are unchanged and
+        passed all their checks in a recent scan.  scan_state must be set
+        :param shard: sharding.Shard.  Only catalogue entries belonging to
+        this shard are tested.  Any filter or random sample is applied
+        within the shard
+        :param catalog_workers: number of sub-catalogues read concurrently.
+        Defaults to max_workers
+        :param wms_workers: number of WMS endpoints checked concurrently.
+        Defaults to max_workers
+        :param wcs_workers: number of WCS endpoints checked concurrently.
+        Defaults to max_workers
+        :param queue_size: maximum number of catalogue references read ahead
+        of the sub-catalogues being checked
+        :param deadline: time in seconds after which the scan stops.  Checks
+        in progress are abandoned, the counts of the entries completed so
+        far are returned and the entries not completed are logged as
+        untested.  Defaults to the scan_deadline set, if any
         """
-        catalog_ref_uris = tuple(cls.get_catalog_ref_uris(uri))
+        if incremental and cls.scan_state is None:
+            raise OgcTdsValidationConfigError("scan_state must be set for an "
+                                              "incremental scan")
+
+        if incremental and cls.manifest is not None:
+            raise OgcTdsValidationConfigError("An incremental scan can't be "
+                                              "made from a manifest")
+
+        if rand_sample is not None and catalog_entries_filter is not None:
+            raise OgcTdsValidationConfigError("rand_sample and "
+                                              "catalog_entries_filter "
+                                              "keywords can't be set "
+                                              "together")
+
+        # Bound every request made during the scan by the deadline
+        scan_deadline = cls.scan_deadline
+        if deadline is not None:
+            cls.scan_deadline = Deadline(deadline)
+
+        try:
+            # Include reading of the top-level catalogue in the cache counts
+            catalog_cache_stats = cls.get_catalog_cache_stats()
+
+            catalog_ref_uris = cls.get_catalog_ref_uris(uri)
+
+            if shard is not None:
+                catalog_ref_uris = cls._select_shard(catalog_ref_uris, shard)
 
-        # Initialise stats
-        n_catalog_refs_tested = 0
-        n_catalog_refs_ok = 0
-        
-        n_wms_get_capabilities_uris_tested = 0
-        n_wms_get_capabilities_ok = 0
-        n_wms_get_map_uris_tested = 0
-        n_wms_get_map_ok = 0
-
-        n_wcs_get_capabilities_uris_tested = 0
-        n_wcs_get_capabilities_ok = 0
-        n_wcs_describe_coverage_uris_tested = 0
-        n_wcs_describe_coverage_ok = 0
-
-        if catalog_entries_filter is not None:
-            log.info("Specific catalogue reference elements selected for "
-                     "testing: %s", '", "'.join(catalog_entries_filter))
-
-        # Choose whether to iterate over catalogue elements or pick a random
-        # sample
-        n_catalog_ref_uris = len(catalog_ref_uris)
-        if rand_sample is None:
-            catalog_ref_indices = range(n_catalog_ref_uris)
-        else:
             if catalog_entries_filter is not None:
-                raise OgcTdsValidationConfigError("rand_sample and "
-                                                  "catalog_entries_filter"
-                                                  " keywords can't be set "
-                                                  "together")
-
-            n_sample_elems = min(rand_sample, n_catalog_ref_uris)
-            catalog_ref_indices = random.sample(range(n_catalog_ref_uris),
-                                                n_sample_elems)
-            log.info("%d randomly selected elements chosen for testing",
-                     n_sample_elems)
-
-        for i in catalog_ref_indices:
-            catalog_ref_uri = catalog_ref_uris[i]
-
-            # If filter is set, then only process entries contained in filter
-            # list
-            if (catalog_entries_filter is not None and
-                catalog_ref_uri not in catalog_entries_filter):
-                continue
-
-            log.info("+"*46)
-            log.info("Testing catalogue reference URI {!r}".format(
-                                                            catalog_ref_uri))
-
-            n_catalog_refs_tested += 1
-            
-            # Parse reference catalogue
-            try:
-                catalog_ref_elem = cls.read_catalog(catalog_ref_uri)
-                
-            except OgcTdsCatalogParseError:
-                # Error reading this reference catalogue - skip to the next
-                continue
-            
-            n_catalog_refs_ok += 1
-            
-            # Test for WMS endpoints
-            wms_uri = cls.get_wms_uri_from_catalog(catalog_ref_uri,
-                                                catalog_elem=catalog_ref_elem)                
-            if wms_uri is not None:
-                # WMS URIs found in this catalogue
-                wms_get_capabilities_uri = "{}{}".format(wms_uri,
-                                        cls.WMS_GET_CAPABILITIES_QUERY_ARGS)
-    
-                (wms_get_capabilities_resp_ok,
-                 layer_names) = cls.check_wms_get_capabilities_resp(
-                                                    wms_get_capabilities_uri)
-                if wms_get_capabilities_resp_ok:
-                    n_wms_get_capabilities_ok += 1
-    
-                n_wms_get_capabilities_uris_tested += 1
-    
-                if len(layer_names) > 0:
-                    n_wms_get_map_uris_tested += 1
-                    wms_get_map_uri = "{}{}".format(wms_uri,
-                            cls.WMS_GET_MAP_QUERY_ARGS.format(layer_names[0]))
-    
-                    wms_get_map_resp_ok = cls.check_wms_get_map_resp(
-                                                            wms_get_map_uri)
-    
-                    if wms_get_map_resp_ok:
-                        n_wms_get_map_ok += 1
-
-            # Test for WCS endpoints
-            wcs_uri = cls.get_wcs_uri_from_catalog(catalog_ref_uri,
-                                            catalog_elem=catalog_ref_elem)
-            if wcs_uri is not None:
-                # Catalogue contains a WCS entry
-                wcs_get_capabilities_uri = "{}{}".format(wcs_uri,
-                                        cls.WCS_GET_CAPABILITIES_QUERY_ARGS)
-    
-                (wcs_get_capabilities_resp_ok,
-                 layer_names) = cls.check_wcs_get_capabilities_resp(
-                                                    wcs_get_capabilities_uri)
-                if wcs_get_capabilities_resp_ok:
-                    n_wcs_get_capabilities_ok += 1
-    
-                n_wcs_get_capabilities_uris_tested += 1
-    
-                wcs_describe_coverage_uri = "{}{}".format(wcs_uri,
-                                        cls.WCS_DESCRIBE_COVERAGE_QUERY_ARGS)
-    
-                (wcs_describe_coverage_resp_ok,
-                 layer_names) = cls.check_wcs_describe_coverage_resp(
-                                             wcs_describe_coverage_uri)
-                if wcs_describe_coverage_resp_ok:
-                    n_wcs_describe_coverage_ok += 1
-    
-                n_wcs_describe_coverage_uris_tested += 1
+                log.info("Specific catalogue reference elements selected for "
+                         "testing: %s", '", "'.join(catalog_entries_filter))
+                selected_uris = set(catalog_entries_filter)
+                catalog_ref_uris = (catalog_ref_uri
+                                    for catalog_ref_uri in catalog_ref_uris
+                                    if catalog_ref_uri in selected_uris)
+
+            # Sampled entries are chosen as the catalogue is read
+            if rand_sample is not None:
+                catalog_ref_uris = cls.entry_sampler.sample(catalog_ref_uris,
+                                                            rand_sample)
+
+            pipeline = ScanPipeline(
+                            cls,
+                            catalog_workers=catalog_workers or max_workers,
+                            wms_workers=wms_workers or max_workers,
+                            wcs_workers=wcs_workers or max_workers,
+                            queue_size=queue_size,
+                            max_workers_per_host=max_workers_per_host,
+                            incremental=incremental,
+                            deadline=cls.scan_deadline)
+            stats = pipeline.run(catalog_ref_uris)
+            if pipeline.deadline_exceeded:
+                cls.log_untested(pipeline.untested_uris, pipeline.catalog_read)
+
+            return cls.summarise_stats(stats, catalog_cache_stats)
+        finally:
+            if deadline is not None:
+                cls.scan_deadline = scan_deadline
+
+    @staticmethod
+    def log_untested(untested_uris, catalog_read):
+        '''Log the catalogue references left untested when a scan reached
+        its deadline'''
+        log.warning("Scan deadline exceeded: %d catalogue references "
+                    "untested", len(untested_uris))
+        for catalog_ref_uri in untested_uris:
+            log.warning("Untested catalogue reference URI %r",
+                        catalog_ref_uri)
+
+        if not catalog_read:
+            log.warning("Scan deadline exceeded before the catalogue was "
+                        "read to the end")
+
+    @staticmethod
+    def _select_shard(catalog_ref_uris, shard):
+        n_catalog_ref_uris = 0
+        n_selected = 0
+        for catalog_ref_uri in catalog_ref_uris:
+            n_catalog_ref_uris += 1
+            if shard.includes(catalog_ref_uri):
+                n_selected += 1
+                yield catalog_ref_uri
+
+        log.info("Shard %s: %d of %d catalogue references selected", shard,
+                 n_selected, n_catalog_ref_uris)
+
+    @classmethod
+    def check_endpoints(cls, endpoints, max_workers=1,
+                        max_workers_per_host=None):
+        """Test a stream of OGC endpoints as they arrive, for example from
+        ThreddsCatalogCrawler.crawl.  Endpoints are objects with service_type
+        and uri attributes.  The summary is not logged so that the caller can
+        add its own counts to it
+
+        :return: collections.Counter of test counts
+        """
+        return cls.run_checks(
+                    lambda endpoint: cls.check_endpoint(endpoint.service_type,
+                                                        endpoint.uri),
+                    endpoints,
+                    max_workers=max_workers,
+                    max_workers_per_host=max_workers_per_host,
+                    get_uri=lambda endpoint: endpoint.uri,
+                    log_summary=False)
+
+    @classmethod
+    def run_checks(cls, check_func, items, max_workers=1,
+                   max_workers_per_host=None, get_uri=None, log_summary=True,
+                   catalog_cache_stats=None):
+        """Call check_func for each item, concurrently if max_workers is
+        greater than one, and sum the test counts returned.  Catalogue cache
+        counts for the run are added to the totals
+
+        :param catalog_cache_stats: catalogue cache counts from
+        get_catalog_cache_stats at the start of the scan.  If not set, counts
+        are taken from the start of this call
+        :return: collections.Counter of test counts
+        """
+        if catalog_cache_stats is None:
+            catalog_cache_stats = cls.get_catalog_cache_stats()
+
+        stats = Counter()
+        for item_stats in run_concurrently(
+                                    check_func, items,
+                                    max_workers=max_workers,
+                                    max_workers_per_host=max_workers_per_host,
+                                    get_uri=get_uri):
+            stats.update(item_stats)
+
+        return cls.summarise_stats(stats, catalog_cache_stats,
+                                   log_summary=log_summary)
+
+    @classmethod
+    def summarise_stats(cls, stats, catalog_cache_stats, log_summary=True):
+        """Add catalogue cache counts since catalog_cache_stats were taken
+        to the test counts of a scan and log the summary
+
+        :return: stats
+        """
+        if cls.catalog_cache is not None:
+            catalog_cache_stats = cls.catalog_cache.stats - catalog_cache_stats
+            for name in ('hits', 'misses', 'revalidated'):
+                stats['catalog_cache_' + name] = catalog_cache_stats[name]
+
+        if log_summary:
+            cls.log_summary(stats)
+
+        return stats
+
+    @classmethod
+    def get_catalog_cache_stats(cls):
+        """Get a copy of the catalogue cache counts or None if no cache is
+        set
+        """
+        if cls.catalog_cache is None:
+            return None
+
+        return cls.catalog_cache.stats.copy()
+
+    @classmethod
+    def check_catalog_ref(cls, catalog_ref_uri, incremental=False):
+        """Test the WMS and WCS endpoints for a single catalogue reference.
+        Requests are made in dependency order: sub-catalogue, then
+        GetCapabilities, then GetMap / DescribeCoverage.
+
+        If scan_state is set, the outcome is recorded against a hash of the
+        sub-catalogue content
+
+        :param incremental: skip the OGC checks if the sub-catalogue is
+        unchanged since it last passed all its checks
+        :return: collections.Counter of test counts for this entry
+        """
+        start_time = time.perf_counter()
+        stats, catalog_hash, ogc_uris = cls.resolve_catalog_ref(
+                                                    catalog_ref_uri,
+                                                    incremental=incremental)
+        if ogc_uris is not None:
+            for service_type in ('WMS', 'WCS'):
+                if ogc_uris[service_type] is not None:
+                    stats.update(cls.check_endpoint(service_type,
+                                                    ogc_uris[service_type]))
+
+        cls.catalog_ref_checked(catalog_ref_uri, catalog_hash, stats,
+                                elapsed=time.perf_counter() - start_time)
+        return stats
+
+    @classmethod
+    def resolve_catalog_ref(cls, catalog_ref_uri, incremental=False):
+        """Read the sub-catalogue of a catalogue reference and resolve its
+        WMS and WCS endpoints
+
+        :param incremental: return no endpoints if the sub-catalogue is
+        unchanged since it last passed all its checks
+        :return: tuple of collections.Counter of test counts, hex digest of
+        the sub-catalogue content or None if scan_state is not set or
+        manifest is, and a dictionary of endpoint URIs keyed by service
+        type.  The dictionary is None if the sub-catalogue could not be read
+        or is unchanged
+        """
+        stats = Counter()
+
+        log.info("+"*46)
+        log.info("Testing catalogue reference URI {!r}".format(
+                                                        catalog_ref_uri))
+
+        stats['catalog_refs_tested'] += 1
+
+        # Catalogues are not read when the endpoints are taken from a
+        # manifest
+        catalog_hash = None
+        if cls.scan_state is not None and cls.manifest is None:
+            catalog_hash = hashlib.sha256()
+
+        # Parse reference catalogue
+        try:
+            ogc_uris = cls.get_ogc_uris_from_catalog(
+                                                catalog_ref_uri,
+                                                content_hash=catalog_hash)
+
+        except OgcTdsCatalogParseError:
+            # Error reading this reference catalogue - skip to the next
+            return stats, None, None
+
+        stats['catalog_refs_ok'] += 1
+
+        if catalog_hash is not None:
+            catalog_hash = catalog_hash.hexdigest()
+
+            if incremental and cls.scan_state.is_unchanged(catalog_ref_uri,
+                                                           catalog_hash):
+                log.info("Skipping unchanged catalogue reference URI "
+                         "{!r}".format(catalog_ref_uri))
+                stats['catalog_refs_unchanged'] += 1
+                return stats, catalog_hash, None
+
+        return stats, catalog_hash, ogc_uris
+
+    @classmethod
+    def catalog_ref_checked(cls, catalog_ref_uri, catalog_hash, stats,
+                            elapsed=None):
+        """Called once all the checks of a catalogue reference are complete.
+        If scan_state is set, the outcome is recorded unless the entry was
+        skipped as unchanged.  The outcome is passed to entry_sampler
+
+        :param catalog_hash: hex digest of the sub-catalogue content or None
+        if it could not be read
+        :param stats: collections.Counter of test counts for the entry
+        :param elapsed: time in seconds spent checking the entry
+        """
+        if cls.scan_state is not None and not stats['catalog_refs_unchanged']:
+            cls.scan_state.update(catalog_ref_uri, catalog_hash, stats)
+
+        cls.entry_sampler.entry_checked(catalog_ref_uri, stats,
+                                        elapsed=elapsed)
+
+    @classmethod
+    def check_endpoint(cls, service_type, uri):
+        """Test a WMS or WCS endpoint
+
+        :return: collections.Counter of test counts
+        """
+        if service_type == 'WMS':
+            return cls.check_wms_endpoint(uri)
+
+        elif service_type == 'WCS':
+            return cls.check_wcs_endpoint(uri)
+
+        raise OgcTdsValidationConfigError("No check for service type "
+                                          "{!r}".format(service_type))
+
+    @classmethod
+    def check_wms_endpoint(cls, wms_uri):
+        """Test WMS GetCapabilities and GetMap for the layers and tiles
+        chosen by get_map_sampler
+
+        :return: collections.Counter of test counts
+        """
+        stats = Counter()
+
+        wms_get_capabilities_uri = "{}{}".format(wms_uri,
+                                cls.WMS_GET_CAPABILITIES_QUERY_ARGS)
+
+        # Stop reading the capabilities document once the sampler has all
+        # the layers it needs
+        (wms_get_capabilities_resp_ok,
+         layers) = cls.check_wms_get_capabilities_layers(
+                                    wms_get_capabilities_uri,
+                                    max_layers=cls.get_map_sampler.max_layers)
+        if wms_get_capabilities_resp_ok:
+            stats['wms_get_capabilities_ok'] += 1
+
+        stats['wms_get_capabilities_uris_tested'] += 1
+
+        if len(layers) > 0:
+            n_tested, failed_get_map_uris = cls.check_wms_get_map_sample(
+                                                                wms_uri,
+                                                                layers)
+            stats['wms_get_map_uris_tested'] += n_tested
+            stats['wms_get_map_ok'] += n_tested - len(failed_get_map_uris)
+
+        return stats
+
+    @classmethod
+    def check_wcs_endpoint(cls, wcs_uri):
+        """Test WCS GetCapabilities, then DescribeCoverage and GetCoverage
+        for up to wcs_max_coverages coverages
+
+        :return: collections.Counter of test counts
+        """
+        stats = Counter()
+
+        wcs_get_capabilities_uri = "{}{}".format(wcs_uri,
+                                cls.WCS_GET_CAPABILITIES_QUERY_ARGS)
 
-        # Log stats
+        (wcs_get_capabilities_resp_ok,
+         coverage_names) = cls.check_wcs_get_capabilities_resp(
+                                    wcs_get_capabilities_uri,
+                                    max_coverages=cls.wcs_max_coverages)
+        if wcs_get_capabilities_resp_ok:
+            stats['wcs_get_capabilities_ok'] += 1
+
+        stats['wcs_get_capabilities_uris_tested'] += 1
+
+        coverage_stats, _ = cls.check_wcs_coverage_sample(wcs_uri,
+                                                          coverage_names)
+        stats.update(coverage_stats)
+
+        return stats
+
+    @classmethod
+    def log_summary(cls, stats):
+        '''Log summary of test counts accumulated by check'''
         log.info("+"*46)
         log.info("Summary")
         log.info("=======")
-        log.info('{} sub-catalogues tested'.format(n_catalog_refs_tested))
+        log.info('{} sub-catalogues tested'.format(
+                            stats['catalog_refs_tested']))
         log.info('{} sub-catalogues reads failed'.format(
-                            n_catalog_refs_tested - n_catalog_refs_ok))
-        
+                stats['catalog_refs_tested'] - stats['catalog_refs_ok']))
+
+        if stats['catalog_refs_unchanged'] > 0:
+            log.info('{} unchanged sub-catalogues skipped'.format(
+                                stats['catalog_refs_unchanged']))
+
+        if stats['scan_deadline_exceeded'] > 0:
+            log.info('{} sub-catalogues untested: scan deadline '
+                     'exceeded'.format(stats['catalog_refs_untested']))
+
+        if cls.catalog_cache is not None:
+            log.info('{} catalogues read from cache'.format(
+                                stats['catalog_cache_hits']))
+            log.info('{} catalogues revalidated as not modified'.format(
+                                stats['catalog_cache_revalidated']))
+            log.info('{} catalogues not found in cache'.format(
+                                stats['catalog_cache_misses']))
+
         log.info('{} WMS endpoints tested'.format(
-            n_wms_get_capabilities_uris_tested))
+            stats['wms_get_capabilities_uris_tested']))
         log.info('{} WMS GetCapabilities calls succeeded'.format(
-                            n_wms_get_capabilities_ok))
+                            stats['wms_get_capabilities_ok']))
         log.info('{} WMS GetCapabilities calls failed'.format(
-            n_wms_get_capabilities_uris_tested - n_wms_get_capabilities_ok))
+            stats['wms_get_capabilities_uris_tested'] -
+            stats['wms_get_capabilities_ok']))
         log.info('{} WMS GetMap endpoints tested'.format(
-            n_wms_get_map_uris_tested))
+            stats['wms_get_map_uris_tested']))
         log.info('{} WMS GetMap calls succeeded'.format(
-                            n_wms_get_map_uris_tested))
+                            stats['wms_get_map_ok']))
         log.info('{} WMS GetMap calls failed'.format(
-                            n_wms_get_map_uris_tested - n_wms_get_map_ok))
+            stats['wms_get_map_uris_tested'] - stats['wms_get_map_ok']))
 
         log.info('{} WCS GetCapabilities endpoints tested'.format(
-            n_wcs_get_capabilities_uris_tested))
+            stats['wcs_get_capabilities_uris_tested']))
         log.info('{} WCS GetCapabilities calls succeeded'.format(
-            n_wcs_get_capabilities_ok))
+            stats['wcs_get_capabilities_ok']))
         log.info('{} WCS GetCapabilities calls failed'.format(
-            n_wcs_get_capabilities_uris_tested - n_wcs_get_capabilities_ok))
+            stats['wcs_get_capabilities_uris_tested'] -
+            stats['wcs_get_capabilities_ok']))
 
         log.info('{} WCS DescribeCoverage endpoints tested'.format(
-                 n_wcs_describe_coverage_uris_tested))
+                 stats['wcs_describe_coverage_uris_tested']))
         log.info('{} WCS DescribeCoverage calls succeeded'.format(
-                            n_wcs_describe_coverage_ok))
+                            stats['wcs_describe_coverage_ok']))
         log.info('{} WCS DescribeCoverage calls failed'.format(
-            n_wcs_describe_coverage_uris_tested - n_wcs_describe_coverage_ok))
-           
+            stats['wcs_describe_coverage_uris_tested'] -
+            stats['wcs_describe_coverage_ok']))
+
+        log.info('{} WCS GetCoverage endpoints tested'.format(
+                 stats['wcs_get_coverage_uris_tested']))
+        log.info('{} WCS GetCoverage calls succeeded'.format(
+                            stats['wcs_get_coverage_ok']))
+        log.info('{} WCS GetCoverage calls failed'.format(
+            stats['wcs_get_coverage_uris_tested'] -
+            stats['wcs_get_coverage_ok']))
+
     @classmethod
     def get_wms_uri_from_catalog(cls, catalog_uri, catalog_elem=None):
         '''Get catalogue from given URI or ElementTree element and extract the 
         first WMS endpoint
         
-        If catalog_elem is set, then required info is parsed from this
+        If catalog_elem is set, then required info is parsed from this,
+        otherwise the catalogue is read incrementally from catalog_uri
         '''
         if catalog_elem is None:
-            catalog_elem = cls.read_catalog(catalog_uri)
-            
-        base_prefix = get_base_uri(catalog_uri)
-         
-        wms_service_elem = catalog_elem.findall(
-            "{http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/"
-            "v1.0}service[@serviceType='WMS']")
-        if len(wms_service_elem) == 0:
-            log.info("No WMS endpoint for catalogue {!r}".format(catalog_uri))
-            return None
-        
-        wms_base_path = wms_service_elem[0].attrib['base']
-        wms_base_uri = base_prefix + wms_base_path
+            return cls.get_ogc_uris_from_catalog(catalog_uri,
+                                                 service_types=('WMS',))['WMS']
 
-        # Find WMS endpoint in catalogue
-        wms_uri_elems = catalog_elem.findall(
-            "{http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/"
-            "v1.0}dataset/{http://www.unidata.ucar.edu/namespaces/thredds/"
-            "InvCatalog/v1.0}dataset/{http://www.unidata.ucar.edu/"
-            "namespaces/thredds/InvCatalog/v1.0}access[@serviceName='wms']")
-
-        wms_uri_path = wms_uri_elems[0].attrib['urlPath']
-        wms_uri = wms_base_uri + wms_uri_path
-
-        return wms_uri
+        return cls.get_ogc_uris_from_catalog_elem(catalog_uri, catalog_elem,
+                                                  ('WMS',))['WMS']
 
     @classmethod
-    def check_wms_get_capabilities_resp(cls, wms_get_capabilities_uri):
+    def check_wms_get_capabilities_resp(cls, wms_get_capabilities_uri,
+                                        max_layer_names=None):
         '''Perform sanity checks on GetCapabilities response from WMS
         endpoint
+
+        :param max_layer_names: stop reading the response once this number
+        of layer names has been found.  Set to None to read all layer names
+        :return: tuple of response OK flag and list of layer names
         '''
-        get_capabilities_resp = requests.get(wms_get_capabilities_uri)
+        ok, layers = cls.check_wms_get_capabilities_layers(
+                                                wms_get_capabilities_uri,
+                                                max_layers=max_layer_names)
+        return ok, [layer.name for layer in layers]
 
-        if get_capabilities_resp.ok:
-            log.info('WMS GetCapabilities OK for: {}'.format(
-                                                wms_get_capabilities_uri))
-        else:
-            get_capabilities_stripped_resp = get_capabilities_resp.text.replace(
-                                                                    '\r\n', '')
-            log.error('WMS GetCapabilities failed for: {}: status code={}, '
-                      'message={}'.format(wms_get_capabilities_uri,
-                      get_capabilities_resp.status_code,
-                      get_capabilities_stripped_resp))
+    @classmethod
+    def check_wms_get_capabilities_layers(cls, wms_get_capabilities_uri,
+                                          max_layers=None):
+        '''Perform sanity checks on GetCapabilities response from WMS
+        endpoint and read the named layers with their bounding boxes and
+        dimensions
+
+        :param max_layers: stop reading the response once this number of
+        layers has been found.  Set to None to read all layers
+        :return: tuple of response OK flag and list of xml_stream.WmsLayer
+        '''
+        timer = metrics.RequestTimer()
+        try:
+            get_capabilities_resp = cls.open_stream(wms_get_capabilities_uri)
 
-            return get_capabilities_resp.ok, []
+        except TRANSPORT_ERRORS as e:
+            log.error('WMS GetCapabilities failed for: {}: {}'.format(
+                      wms_get_capabilities_uri, e))
+            cls.record_result(wms_get_capabilities_uri,
+                              results.WMS_GET_CAPABILITIES, timer,
+                              error=type(e).__name__)
+            return False, []
 
+        timer.received()
         try:
-            get_capabilities_elem = ET.fromstring(get_capabilities_resp.text)
-
-        except ET.ParseError:
-            log.exception("WMS GetCapabilities call failed for {}".format(
-                          wms_get_capabilities_uri))
-            return get_capabilities_resp.ok, []
-
-        # Check for layer names
-        layer_name_elems = get_capabilities_elem.findall(
-                                    '{http://www.opengis.net/wms}Capability/'
-                                    '{http://www.opengis.net/wms}Layer/'
-                                    '{http://www.opengis.net/wms}Layer/'
-                                    '{http://www.opengis.net/wms}Layer/'
-                                    '{http://www.opengis.net/wms}Name')
-        if len(layer_name_elems) == 0:
+            if get_capabilities_resp.ok:
+                log.info('WMS GetCapabilities OK for: {}'.format(
+                                                    wms_get_capabilities_uri))
+            else:
+                message, read_error = cls.read_message(get_capabilities_resp)
+                if read_error is None:
+                    log.error('WMS GetCapabilities failed for: {}: status '
+                              'code={}, message={}'.format(
+                                            wms_get_capabilities_uri,
+                                            get_capabilities_resp.status_code,
+                                            message))
+                    error = results.HTTP_ERROR
+                    n_bytes = len(get_capabilities_resp.content)
+                else:
+                    log.error('WMS GetCapabilities failed for: {}: status '
+                              'code={}, message not read: {}'.format(
+                                            wms_get_capabilities_uri,
+                                            get_capabilities_resp.status_code,
+                                            read_error))
+                    error = type(read_error).__name__
+                    n_bytes = cls.get_n_bytes_read(get_capabilities_resp)
+
+                cls.record_result(wms_get_capabilities_uri,
+                                  results.WMS_GET_CAPABILITIES, timer,
+                                  status_code=get_capabilities_resp.status_code,
+                                  n_bytes=n_bytes, error=error)
+                return get_capabilities_resp.ok, []
+
+            # Check for layers
+            try:
+                layers = list(itertools.islice(
+                        xml_stream.iter_wms_layers(get_capabilities_resp.raw),
+                        max_layers))
+                timer.parsed()
+
+            except (ET.ParseError,) + TRANSPORT_ERRORS as e:
+                log.exception("WMS GetCapabilities call failed for {}".format(
+                              wms_get_capabilities_uri))
+                error = (results.PARSE_ERROR if isinstance(e, ET.ParseError)
+                         else type(e).__name__)
+                cls.record_result(wms_get_capabilities_uri,
+                                  results.WMS_GET_CAPABILITIES, timer,
+                                  status_code=get_capabilities_resp.status_code,
+                                  n_bytes=cls.get_n_bytes_read(
+                                                    get_capabilities_resp),
+                                  error=error)
+                return False, []
+
+            n_bytes = cls.get_n_bytes_read(get_capabilities_resp)
+        finally:
+            get_capabilities_resp.close()
+
+        error = None
+        if len(layers) == 0:
             log.error('WMS GetCapabilities yielded no layer names for '
                       '{}'.format(wms_get_capabilities_uri))
-            return get_capabilities_resp.ok, []
-        else:
-            layer_names = [layer_name_elem.text
-                           for layer_name_elem in layer_name_elems]
-            return get_capabilities_resp.ok, layer_names
+            error = results.NO_LAYERS_ERROR
+
+        cls.record_result(wms_get_capabilities_uri,
+                          results.WMS_GET_CAPABILITIES, timer,
+                          status_code=get_capabilities_resp.status_code,
+                          n_bytes=n_bytes, error=error)
+
+        return error is None, layers
+
+    @classmethod
+    def get_wms_get_map_uri(cls, wms_uri, get_map_request):
+        '''Make a GetMap URI for a sampling.GetMapRequest'''
+        if (get_map_request.bbox is None and get_map_request.time is None and
+            get_map_request.elevation is None):
+            return "{}{}".format(wms_uri, cls.WMS_GET_MAP_QUERY_ARGS.format(
+                                                get_map_request.layer_name))
+
+        bbox = get_map_request.bbox or GetMapSampler.GLOBAL_BBOX
+        query_args = cls.WMS_GET_MAP_BBOX_QUERY_ARGS.format(
+                            bbox=','.join(['{:.4f}'.format(coord)
+                                           for coord in bbox]),
+                            layer_name=get_map_request.layer_name)
+
+        if get_map_request.time is not None:
+            query_args += '&TIME={}'.format(quote(get_map_request.time))
+
+        if get_map_request.elevation is not None:
+            query_args += '&ELEVATION={}'.format(
+                                            quote(get_map_request.elevation))
+
+        return "{}{}".format(wms_uri, query_args)
+
+    @classmethod
+    def get_wms_get_map_batch_uri(cls, wms_uri, layer_names):
+        '''Make a GetMap URI requesting a list of layers together'''
+        return "{}{}".format(wms_uri, cls.WMS_GET_MAP_BATCH_QUERY_ARGS.format(
+                                        layer_names=','.join(layer_names)))
+
+    @classmethod
+    def check_wms_get_map_sample(cls, wms_uri, layers):
+        '''Check GetMap for the layers and tiles chosen by get_map_sampler.
+        Requests are made concurrently by up to get_map_max_workers threads,
+        limited per host by get_map_host_limiter.  If get_map_batch_size is
+        set, the first tile of each layer is checked in batches of layers
+
+        :param layers: list of xml_stream.WmsLayer from GetCapabilities
+        :return: tuple of the number of GetMap checks made and a list of
+        the URIs of those which failed.  Each layer in a batch counts as a
+        check
+        '''
+        batch_size = cls.get_map_batch_size or 1
+        batch_requests = []
+        get_map_uris = []
+        for layer in cls.get_map_sampler.select_layers(layers):
+            # Only the first tile of each layer, covering its whole extent at
+            # the default time and elevation, is requested in a batch
+            tiles = cls.get_map_sampler.get_tiles(layer)
+            if batch_size > 1:
+                batch_requests.append(tiles.pop(0))
+
+            get_map_uris.extend([cls.get_wms_get_map_uri(wms_uri,
+                                                         get_map_request)
+                                 for get_map_request in tiles])
+
+        batches = [batch_requests[i:i + batch_size]
+                   for i in range(0, len(batch_requests), batch_size)]
+
+        failed_get_map_uris = []
+        n_requests = 0
+        for n_item_requests, failed_uris in run_concurrently(
+                    lambda item: cls.check_wms_get_map_item(wms_uri, item),
+                    batches + get_map_uris,
+                    max_workers=cls.get_map_max_workers,
+                    host_limiter=cls.get_map_host_limiter,
+                    get_uri=lambda item: wms_uri):
+            n_requests += n_item_requests
+            failed_get_map_uris.extend(failed_uris)
+
+        n_tested = len(get_map_uris) + sum([len(batch) for batch in batches])
+        if batches:
+            log.info('%d GetMap requests made for %d checks of: %s',
+                     n_requests, n_tested, wms_uri)
+
+        return n_tested, failed_get_map_uris
+
+    @classmethod
+    def check_wms_get_map_item(cls, wms_uri, item):
+        '''Check a GetMap URI or a batch of sampling.GetMapRequest
+
+        :return: tuple of the number of requests made and a list of the URIs
+        of those which failed
+        '''
+        if isinstance(item, list):
+            return cls.check_wms_get_map_batch(wms_uri, item)
+
+        if cls.check_wms_get_map_resp(item):
+            return 1, []
+
+        return 1, [item]
+
+    @classmethod
+    def check_wms_get_map_batch(cls, wms_uri, get_map_requests):
+        '''Check GetMap for a batch of layers in one request.  If it fails,
+        the batch is split in two and each half checked in the same way, so
+        that a few failing layers among many are found with a number of
+        requests growing with the log of the batch size.  A single layer is
+        checked with the GetMap request for its own tile, so a failure is
+        reported with the URI it would have had without batching
+
+        Images for a batch are drawn with all its layers together: a layer
+        which draws a blank tile is only found if all the others in its
+        batch do too
+
+        :param get_map_requests: list of sampling.GetMapRequest for the first
+        tile of each layer
+        :return: tuple of the number of requests made and a list of the
+        GetMap URIs of the layers which failed
+        '''
+        if len(get_map_requests) == 1:
+            return cls.check_wms_get_map_item(
+                        wms_uri, cls.get_wms_get_map_uri(wms_uri,
+                                                         get_map_requests[0]))
+
+        get_map_uri = cls.get_wms_get_map_batch_uri(
+                                wms_uri, [get_map_request.layer_name
+                                          for get_map_request in
+                                          get_map_requests])
+        if cls.check_wms_get_map_resp(get_map_uri,
+                                      operation=results.WMS_GET_MAP_BATCH):
+            return 1, []
+
+        log.info('Splitting GetMap batch of %d layers for: %s',
+                 len(get_map_requests), wms_uri)
+        n_requests = 1
+        failed_get_map_uris = []
+        middle = len(get_map_requests) // 2
+        for half in (get_map_requests[:middle], get_map_requests[middle:]):
+            n_half_requests, failed_uris = cls.check_wms_get_map_batch(
+                                                                wms_uri, half)
+            n_requests += n_half_requests
+            failed_get_map_uris.extend(failed_uris)
+
+        return n_requests, failed_get_map_uris
 
     @classmethod
-    def check_wms_get_map_resp(cls, wms_get_map_uri):
+    def check_wms_get_map_resp(cls, wms_get_map_uri,
+                               operation=results.WMS_GET_MAP):
         '''Perform sanity checks on GetMap response from WMS
-        endpoint
+        endpoint: the content type must match the format requested and a PNG
+        image must decode to the requested size with some non-transparent
+        pixels
+
+        :param operation: operation the result is recorded under
         '''
-        get_map_resp = requests.get(wms_get_map_uri)
-        if get_map_resp.ok:
-            log.info('WMS GetMap OK for: {}'.format(wms_get_map_uri))
-        else:
-            get_map_stripped_resp = get_map_resp.text.replace('\r\n', '')
-            log.error('WMS GetMap failed for: {}: status code={}, '
-                      'message={}'.format(wms_get_map_uri,
-                                          get_map_resp.status_code,
-                                          get_map_stripped_resp))
+        timer = metrics.RequestTimer()
+        try:
+            get_map_resp = cls.open_stream(wms_get_map_uri)
 
-        return get_map_resp.ok
+        except TRANSPORT_ERRORS as e:
+            log.error('WMS GetMap failed for: {}: {}'.format(wms_get_map_uri,
+                                                             e))
+            cls.record_result(wms_get_map_uri, operation, timer,
+                              error=type(e).__name__)
+            return False
+
+        timer.received()
+        try:
+            if get_map_resp.ok:
+                error = cls.check_wms_get_map_content(wms_get_map_uri,
+                                                      get_map_resp)
+                timer.parsed()
+                n_bytes = cls.get_n_bytes_read(get_map_resp)
+                if error is None:
+                    log.info('WMS GetMap OK for: {}'.format(wms_get_map_uri))
+            else:
+                message, read_error = cls.read_message(get_map_resp)
+                if read_error is None:
+                    log.error('WMS GetMap failed for: {}: status code={}, '
+                              'message={}'.format(wms_get_map_uri,
+                                                  get_map_resp.status_code,
+                                                  message))
+                    error = results.HTTP_ERROR
+                    n_bytes = len(get_map_resp.content)
+                else:
+                    log.error('WMS GetMap failed for: {}: status code={}, '
+                              'message not read: {}'.format(
+                                                    wms_get_map_uri,
+                                                    get_map_resp.status_code,
+                                                    read_error))
+                    error = type(read_error).__name__
+                    n_bytes = cls.get_n_bytes_read(get_map_resp)
+
+            cls.record_result(wms_get_map_uri, operation, timer,
+                              status_code=get_map_resp.status_code,
+                              n_bytes=n_bytes, error=error)
+        finally:
+            get_map_resp.close()
+
+        return error is None
+
+    @classmethod
+    def check_wms_get_map_content(cls, wms_get_map_uri, get_map_resp):
+        '''Check the content of a successful GetMap response.  PNG images
+        are decoded incrementally from the response stream
+
+        :return: name of the class of error or None if the content is valid
+        '''
+        query = urlparse(wms_get_map_uri).query
+        query_args = {name.upper(): values[0]
+                      for name, values in parse_qs(query).items()}
+        expected_content_type = query_args.get('FORMAT', 'image/png').lower()
+        content_type = get_map_resp.headers.get(
+                            'Content-Type', '').split(';')[0].strip().lower()
+
+        if content_type != expected_content_type:
+            if 'xml' in content_type:
+                # WMS servers report errors as XML service exceptions
+                message, read_error = cls.read_message(get_map_resp)
+                if read_error is not None:
+                    log.error('WMS GetMap failed for: {}: {}'.format(
+                              wms_get_map_uri, read_error))
+                    return type(read_error).__name__
+
+                log.error('WMS GetMap service exception for: {}: '
+                          'message={}'.format(wms_get_map_uri, message))
+                return results.SERVICE_EXCEPTION_ERROR
+
+            log.error('WMS GetMap for: {}: expecting content type {!r}; got '
+                      '{!r}'.format(wms_get_map_uri, expected_content_type,
+                                    content_type))
+            return results.CONTENT_TYPE_ERROR
+
+        if content_type != 'image/png':
+            return None
+
+        try:
+            image_stats = png_stream.read_png_stats(get_map_resp.raw)
+
+        except png_stream.PngError as e:
+            log.error('WMS GetMap for: {}: {}'.format(wms_get_map_uri, e))
+            return results.IMAGE_ERROR
+
+        except TRANSPORT_ERRORS as e:
+            log.error('WMS GetMap failed for: {}: {}'.format(wms_get_map_uri,
+                                                             e))
+            return type(e).__name__
+
+        for name in ('WIDTH', 'HEIGHT'):
+            expected_size = query_args.get(name)
+            size = getattr(image_stats, name.lower())
+            if expected_size is not None and str(size) != expected_size:
+                log.error('WMS GetMap for: {}: expecting image {} {}; got '
+                          '{}'.format(wms_get_map_uri, name.lower(),
+                                      expected_size, size))
+                return results.IMAGE_ERROR
+
+        if image_stats.n_non_transparent is not None:
+            log.debug('WMS GetMap for: {}: {:.1%} non-transparent pixels, {} '
+                      'colours'.format(wms_get_map_uri,
+                                       image_stats.fraction_non_transparent,
+                                       image_stats.n_colours))
+
+            if image_stats.n_non_transparent == 0:
+                log.error('WMS GetMap returned a blank tile for: '
+                          '{}'.format(wms_get_map_uri))
+                return results.BLANK_TILE_ERROR
+
+        return None
 
     @classmethod
     def get_wcs_uri_from_catalog(cls, catalog_uri, catalog_elem=None):
         '''Get catalogue from given URI and extract the first WCS endpoint
         Return None if no WCS endpoint is found
          
-        If catalog_elem is set, then required info is parsed from this
+        If catalog_elem is set, then required info is parsed from this,
+        otherwise the catalogue is read incrementally from catalog_uri
         '''
         if catalog_elem is None:
-            catalog_elem = cls.read_catalog(catalog_uri)
-            
-        base_prefix = get_base_uri(catalog_uri)
+            return cls.get_ogc_uris_from_catalog(catalog_uri,
+                                                 service_types=('WCS',))['WCS']
 
-        wcs_service_elem = catalog_elem.findall(
-            "{http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/"
-            "v1.0}service[@serviceType='WCS']")
-        if len(wcs_service_elem) == 0:
-            log.info("No WCS endpoint for catalogue {!r}".format(catalog_uri))
-            return None
-                
-        wcs_base_path = wcs_service_elem[0].attrib['base']
-        wcs_base_uri = "{}{}".format(base_prefix, wcs_base_path)
-
-        # Find WCS endpoint in catalogue
-        wcs_uri_elems = catalog_elem.findall(
-            "{http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/"
-            "v1.0}dataset/{http://www.unidata.ucar.edu/namespaces/thredds/"
-            "InvCatalog/v1.0}dataset/{http://www.unidata.ucar.edu/"
-            "namespaces/thredds/InvCatalog/v1.0}access[@serviceName='wcs']")
+        return cls.get_ogc_uris_from_catalog_elem(catalog_uri, catalog_elem,
+                                                  ('WCS',))['WCS']
 
-        wcs_uri_path = wcs_uri_elems[0].attrib['urlPath']
-        wcs_uri = "{}{}".format(wcs_base_uri, wcs_uri_path)
+    @classmethod
+    def check_wcs_get_capabilities_resp(cls, wcs_get_capabilities_uri,
+                                        max_coverages=None):
+        '''Perform sanity checks on GetCapabilities response from WCS
+        endpoint
 
-        return wcs_uri
+        :param max_coverages: stop reading the response once this number of
+        coverage names has been found.  Set to None to read all names
+        :return: tuple of response OK flag and list of coverage names
+        '''
+        return cls._check_wcs_resp(wcs_get_capabilities_uri,
+                                   results.WCS_GET_CAPABILITIES,
+                                   xml_stream.iter_wcs_coverage_names,
+                                   max_items=max_coverages)
 
     @classmethod
-    def check_wcs_get_capabilities_resp(cls, wcs_get_capabilities_uri):
-        '''Perform sanity checks on GetCapabilities response from WCS
+    def check_wcs_describe_coverage_resp(cls, wcs_describe_coverage_uri):
+        '''Perform sanity checks on DescribeCoverage response from WCS
         endpoint
+
+        :return: tuple of response OK flag and list of xml_stream.WcsCoverage
         '''
-        get_capabilities_resp = requests.get(wcs_get_capabilities_uri)
+        return cls._check_wcs_resp(wcs_describe_coverage_uri,
+                                   results.WCS_DESCRIBE_COVERAGE,
+                                   xml_stream.iter_wcs_coverages)
 
-        if get_capabilities_resp.ok:
-            log.info('WCS GetCapabilities OK for: {}'.format(
-                                                wcs_get_capabilities_uri))
-        else:
-            get_capabilities_stripped_resp = get_capabilities_resp.text.replace(
-                                                                    '\r\n', '')
-            log.error('WCS GetCapabilities failed for: {}: status code={}, '
-                      'message={}'.format(wcs_get_capabilities_uri,
-                      get_capabilities_resp.status_code,
-                      get_capabilities_stripped_resp))
+    @classmethod
+    def _check_wcs_resp(cls, wcs_uri, operation, iter_items,
+                        max_items=None):
+        '''Check that a WCS request gives a well formed XML response and
+        read items from it with iter_items, a function taking the response
+        stream
+        '''
+        timer = metrics.RequestTimer()
+        try:
+            wcs_resp = cls.open_stream(wcs_uri)
 
-            return get_capabilities_resp.ok, []
+        except TRANSPORT_ERRORS as e:
+            log.error('{} failed for: {}: {}'.format(operation, wcs_uri, e))
+            cls.record_result(wcs_uri, operation, timer,
+                              error=type(e).__name__)
+            return False, []
 
+        timer.received()
+        items = []
         try:
-            get_capabilities_elem = ET.fromstring(get_capabilities_resp.text)
+            if wcs_resp.ok:
+                log.info('{} OK for: {}'.format(operation, wcs_uri))
+            else:
+                message, read_error = cls.read_message(wcs_resp)
+                if read_error is None:
+                    log.error('{} failed for: {}: status code={}, '
+                              'message={}'.format(operation, wcs_uri,
+                                                  wcs_resp.status_code,
+                                                  message))
+                    error = results.HTTP_ERROR
+                    n_bytes = len(wcs_resp.content)
+                else:
+                    log.error('{} failed for: {}: status code={}, message '
+                              'not read: {}'.format(operation, wcs_uri,
+                                                    wcs_resp.status_code,
+                                                    read_error))
+                    error = type(read_error).__name__
+                    n_bytes = cls.get_n_bytes_read(wcs_resp)
 
-        except ET.ParseError:
-            log.exception("WCS GetCapabilities call failed for {}".format(
-                          wcs_get_capabilities_uri))
-            return get_capabilities_resp.ok, []
+                cls.record_result(wcs_uri, operation, timer,
+                                  status_code=wcs_resp.status_code,
+                                  n_bytes=n_bytes, error=error)
+                return wcs_resp.ok, []
 
-        return get_capabilities_resp.ok, []
+            error = None
+            try:
+                for item in itertools.islice(iter_items(wcs_resp.raw),
+                                             max_items):
+                    items.append(item)
+                timer.parsed()
+
+            except (ET.ParseError,) + TRANSPORT_ERRORS as e:
+                log.exception("{} call failed for {}".format(operation,
+                                                             wcs_uri))
+                error = (results.PARSE_ERROR if isinstance(e, ET.ParseError)
+                         else type(e).__name__)
+
+            cls.record_result(wcs_uri, operation, timer,
+                              status_code=wcs_resp.status_code,
+                              n_bytes=cls.get_n_bytes_read(wcs_resp),
+                              error=error)
+        finally:
+            wcs_resp.close()
+
+        return error is None, items
 
     @classmethod
-    def check_wcs_describe_coverage_resp(cls, wcs_describe_coverage_uri):
-        '''Perform sanity checks on DescribeCoverage response from WCS
-        endpoint
+    def get_wcs_describe_coverage_uri(cls, wcs_uri, coverage_name=None):
+        '''Make a DescribeCoverage URI for a named coverage or, if
+        coverage_name is None, for all the coverages of an endpoint'''
+        uri = "{}{}".format(wcs_uri, cls.WCS_DESCRIBE_COVERAGE_QUERY_ARGS)
+        if coverage_name is not None:
+            uri += '&COVERAGE={}'.format(quote(coverage_name))
+
+        return uri
+
+    @classmethod
+    def get_wcs_get_coverage_format(cls, wcs_coverage):
+        '''Choose a NetCDF or HDF5 format from those supported by a
+        xml_stream.WcsCoverage.  Return None if it supports neither'''
+        if not wcs_coverage.formats:
+            return cls.DEFAULT_GET_COVERAGE_FORMAT
+
+        for coverage_format in wcs_coverage.formats:
+            if ('netcdf' in coverage_format.lower() or
+                'hdf' in coverage_format.lower()):
+                return coverage_format
+
+        return None
+
+    @classmethod
+    def get_wcs_get_coverage_uri(cls, wcs_uri, wcs_coverage,
+                                 coverage_format):
+        '''Make a GetCoverage URI for a small subset in the middle of the
+        bounding box of a xml_stream.WcsCoverage at its first time position
         '''
-        wcs_describe_coverage_resp = requests.get(wcs_describe_coverage_uri)
+        west, south, east, north = (wcs_coverage.bbox or
+                                    GetMapSampler.GLOBAL_BBOX)
+        half_width = (east - west) * cls.GET_COVERAGE_SUBSET_FRACTION / 2.
+        half_height = (north - south) * cls.GET_COVERAGE_SUBSET_FRACTION / 2.
+        centre_x = (west + east) / 2.
+        centre_y = (south + north) / 2.
+        bbox = (centre_x - half_width, centre_y - half_height,
+                centre_x + half_width, centre_y + half_height)
 
-        if wcs_describe_coverage_resp.ok:
-            log.info('WCS DescribeCoverage OK for: {}'.format(
-                                                wcs_describe_coverage_uri))
-        else:
-            wcs_describe_coverage_stripped_resp = \
-                wcs_describe_coverage_resp.text.replace('\r\n', '')
-            log.error('WCS GetCapabilities failed for: {}: status code={}, '
-                      'message={}'.format(wcs_describe_coverage_uri,
-                      wcs_describe_coverage_resp.status_code,
-                      wcs_describe_coverage_stripped_resp))
+        query_args = cls.WCS_GET_COVERAGE_QUERY_ARGS.format(
+                            coverage=quote(wcs_coverage.name),
+                            bbox=','.join(['{:.4f}'.format(coord)
+                                           for coord in bbox]),
+                            format=quote(coverage_format))
+
+        if wcs_coverage.time is not None:
+            query_args += '&TIME={}'.format(quote(wcs_coverage.time))
+
+        return "{}{}".format(wcs_uri, query_args)
+
+    @classmethod
+    def check_wcs_coverage_sample(cls, wcs_uri, coverage_names):
+        '''Check DescribeCoverage for up to wcs_max_coverages of the named
+        coverages of a WCS endpoint and GetCoverage for a subset of each
+        coverage described.  With no coverage names, DescribeCoverage is
+        checked for all the coverages of the endpoint and GetCoverage for the
+        first of them
+
+        :return: tuple of collections.Counter of test counts and a list of
+        the URIs of the requests which failed
+        '''
+        stats = Counter()
+        failed_uris = []
+
+        if cls.wcs_max_coverages is not None:
+            coverage_names = coverage_names[:cls.wcs_max_coverages]
 
-            return wcs_describe_coverage_resp.ok, []
+        describe_coverage_uris = (
+            [cls.get_wcs_describe_coverage_uri(wcs_uri, coverage_name)
+             for coverage_name in coverage_names] or
+            [cls.get_wcs_describe_coverage_uri(wcs_uri)])
 
+        for describe_coverage_uri in describe_coverage_uris:
+            (describe_coverage_resp_ok,
+             wcs_coverages) = cls.check_wcs_describe_coverage_resp(
+                                                    describe_coverage_uri)
+            stats['wcs_describe_coverage_uris_tested'] += 1
+            if describe_coverage_resp_ok:
+                stats['wcs_describe_coverage_ok'] += 1
+            else:
+                failed_uris.append(describe_coverage_uri)
+
+            for wcs_coverage in wcs_coverages[:1]:
+                coverage_format = cls.get_wcs_get_coverage_format(
+                                                                wcs_coverage)
+                if coverage_format is None:
+                    log.info('Skipping WCS GetCoverage for coverage {!r} of '
+                             '{}: no NetCDF or HDF5 format is '
+                             'supported'.format(wcs_coverage.name, wcs_uri))
+                    continue
+
+                get_coverage_uri = cls.get_wcs_get_coverage_uri(
+                                                            wcs_uri,
+                                                            wcs_coverage,
+                                                            coverage_format)
+                stats['wcs_get_coverage_uris_tested'] += 1
+                if cls.check_wcs_get_coverage_resp(get_coverage_uri):
+                    stats['wcs_get_coverage_ok'] += 1
+                else:
+                    failed_uris.append(get_coverage_uri)
+
+        return stats, failed_uris
+
+    @classmethod
+    def check_wcs_get_coverage_resp(cls, wcs_get_coverage_uri):
+        '''Perform sanity checks on GetCoverage response from WCS endpoint:
+        the content must start with a NetCDF or HDF5 signature.  The content
+        is read in chunks up to get_coverage_max_bytes and then the
+        connection closed
+        '''
+        timer = metrics.RequestTimer()
         try:
-            wcs_describe_coverage_elem = ET.fromstring(
-                                              wcs_describe_coverage_resp.text)
+            get_coverage_resp = cls.open_stream(wcs_get_coverage_uri)
+
+        except TRANSPORT_ERRORS as e:
+            log.error('WCS GetCoverage failed for: {}: {}'.format(
+                      wcs_get_coverage_uri, e))
+            cls.record_result(wcs_get_coverage_uri, results.WCS_GET_COVERAGE,
+                              timer, error=type(e).__name__)
+            return False
+
+        timer.received()
+        try:
+            if get_coverage_resp.ok:
+                error = cls.check_wcs_get_coverage_content(
+                                                        wcs_get_coverage_uri,
+                                                        get_coverage_resp)
+                timer.parsed()
+                n_bytes = cls.get_n_bytes_read(get_coverage_resp)
+                if error is None:
+                    log.info('WCS GetCoverage OK for: {}'.format(
+                                                        wcs_get_coverage_uri))
+            else:
+                message, read_error = cls.read_message(get_coverage_resp)
+                if read_error is None:
+                    log.error('WCS GetCoverage failed for: {}: status '
+                              'code={}, message={}'.format(
+                                            wcs_get_coverage_uri,
+                                            get_coverage_resp.status_code,
+                                            message))
+                    error = results.HTTP_ERROR
+                    n_bytes = len(get_coverage_resp.content)
+                else:
+                    log.error('WCS GetCoverage failed for: {}: status '
+                              'code={}, message not read: {}'.format(
+                                            wcs_get_coverage_uri,
+                                            get_coverage_resp.status_code,
+                                            read_error))
+                    error = type(read_error).__name__
+                    n_bytes = cls.get_n_bytes_read(get_coverage_resp)
+
+            cls.record_result(wcs_get_coverage_uri, results.WCS_GET_COVERAGE,
+                              timer, status_code=get_coverage_resp.status_code,
+                              n_bytes=n_bytes, error=error)
+        finally:
+            get_coverage_resp.close()
+
+        return error is None
 
-        except ET.ParseError:
-            log.exception("WCS DescribeCoverage call failed for {}".format(
-                          wcs_describe_coverage_uri))
-            return wcs_describe_coverage_resp.ok, []
+    @classmethod
+    def check_wcs_get_coverage_content(cls, wcs_get_coverage_uri,
+                                       get_coverage_resp):
+        '''Check the content of a successful GetCoverage response read from
+        the response stream
+
+        :return: name of the class of error or None if the content is valid
+        '''
+        content_type = get_coverage_resp.headers.get(
+                            'Content-Type', '').split(';')[0].strip().lower()
+        if 'xml' in content_type:
+            # WCS servers report errors as XML service exceptions
+            message, read_error = cls.read_message(get_coverage_resp)
+            if read_error is not None:
+                log.error('WCS GetCoverage failed for: {}: {}'.format(
+                          wcs_get_coverage_uri, read_error))
+                return type(read_error).__name__
+
+            log.error('WCS GetCoverage service exception for: {}: '
+                      'message={}'.format(wcs_get_coverage_uri, message))
+            return results.SERVICE_EXCEPTION_ERROR
+
+        try:
+            coverage_stats = coverage.read_coverage_stats(
+                                                get_coverage_resp.raw,
+                                                cls.get_coverage_max_bytes)
+
+        except coverage.CoverageError as e:
+            log.error('WCS GetCoverage for: {}: {}'.format(
+                      wcs_get_coverage_uri, e))
+            return results.COVERAGE_FORMAT_ERROR
+
+        except TRANSPORT_ERRORS as e:
+            log.error('WCS GetCoverage failed for: {}: {}'.format(
+                      wcs_get_coverage_uri, e))
+            return type(e).__name__
+
+        if coverage_stats.truncated:
+            log.info('WCS GetCoverage for: {}: stopped reading {} content '
+                     'after {} bytes'.format(wcs_get_coverage_uri,
+                                             coverage_stats.format,
+                                             coverage_stats.n_bytes))
+        else:
+            log.debug('WCS GetCoverage for: {}: read {} bytes of {} '
+                      'content'.format(wcs_get_coverage_uri,
+                                       coverage_stats.n_bytes,
+                                       coverage_stats.format))
 
-        return wcs_describe_coverage_resp.ok, []
+        return None
@@ -0,0 +1,218 @@
+"""Incremental parsing of THREDDS catalogue and OGC capabilities documents
+
+Documents are parsed with iterparse from a file-like object such as the raw
+stream of a HTTP response.  Elements are discarded as soon as they have been
+processed so that memory use does not grow with the size of the document,
+and callers can stop reading as soon as they have the content they need.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "Copyright 2018 United Kingdom Research and Innovation"
+__license__ = """BSD - See LICENSE file in top-level directory"""
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+from collections import namedtuple
+import xml.etree.ElementTree as ET
+
+XLINK_HREF_ATTR_NAME = '{http://www.w3.org/1999/xlink}href'
+
+CATALOG_REF_PATH = ('catalog', 'catalogRef')
+
+WMS_LAYER_NAME_PATH = ('WMS_Capabilities', 'Capability', 'Layer', 'Layer',
+                       'Layer', 'Name')
+WMS_BBOX_ELEM_NAMES = ('westBoundLongitude', 'eastBoundLongitude',
+                       'southBoundLatitude', 'northBoundLatitude')
+
+# Named layer from a WMS capabilities document.  bbox is a (west, south,
+# east, north) tuple or None and dimensions a dictionary keyed by dimension
+# name of (default, values) where values is the text of the Dimension element
+WmsLayer = namedtuple('WmsLayer', ('name', 'bbox', 'dimensions'))
+
+WCS_COVERAGE_NAME_PATH = ('WCS_Capabilities', 'ContentMetadata',
+                          'CoverageOfferingBrief', 'name')
+
+# Coverage from a WCS 1.0.0 DescribeCoverage document.  bbox is a (west,
+# south, east, north) tuple from the lonLatEnvelope or None, time the first
+# time position of the temporal domain or None and formats a list of the
+# supported formats
+WcsCoverage = namedtuple('WcsCoverage', ('name', 'bbox', 'time', 'formats'))
+
+
+def local_name(tag):
+    '''Strip namespace from an ElementTree tag'''
+    return tag.rpartition('}')[2]
+
+
+def iterparse_paths(source):
+    '''Parse XML from file-like source yielding (event, path, elem) tuples
+    for 'start' and 'end' events.  path is a tuple of the element local names
+    from the root element down to elem.
+
+    Text and children of elem are only complete for 'end' events.  Elements
+    are cleared and detached from their parent once the 'end' event has been
+    consumed so must not be retained by the caller.
+    '''
+    path = []
+    elem_stack = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            path.append(local_name(elem.tag))
+            elem_stack.append(elem)
+            yield event, tuple(path), elem
+        else:
+            yield event, tuple(path), elem
+            path.pop()
+            elem_stack.pop()
+            elem.clear()
+            if elem_stack:
+                elem_stack[-1].remove(elem)
+
+
+def drain(source):
+    '''Parse a whole document to check it is well formed, discarding elements
+    as they are read
+    '''
+    for _ in iterparse_paths(source):
+        pass
+
+
+def iter_catalog_ref_hrefs(source):
+    '''Yield catalogRef hrefs from a THREDDS catalogue document'''
+    for event, path, elem in iterparse_paths(source):
+        if event == 'start' and path == CATALOG_REF_PATH:
+            yield elem.attrib[XLINK_HREF_ATTR_NAME]
+
+
+def iter_wms_layer_names(source):
+    '''Yield names of layers from a WMS 1.3.0 GetCapabilities document'''
+    for event, path, elem in iterparse_paths(source):
+        if event == 'end' and path == WMS_LAYER_NAME_PATH:
+            yield elem.text
+
+
+def iter_wms_layers(source):
+    '''Yield a WmsLayer for each named layer at any depth in a WMS 1.3.0
+    GetCapabilities document.  A layer inherits the geographic bounding box
+    and dimensions of its parent unless it declares its own.  Each layer is
+    yielded once its element has been read
+    '''
+    layer_stack = []
+    for event, path, elem in iterparse_paths(source):
+        name = path[-1]
+        parent_name = path[-2] if len(path) > 1 else None
+
+        if event == 'start':
+            if name == 'Layer':
+                if layer_stack:
+                    parent = layer_stack[-1]
+                    layer_stack.append({'name': None,
+                                        'bbox': parent['bbox'],
+                                        'dimensions': dict(
+                                                    parent['dimensions'])})
+                else:
+                    layer_stack.append({'name': None, 'bbox': None,
+                                        'dimensions': {}})
+
+            elif name == 'EX_GeographicBoundingBox' and layer_stack:
+                layer_stack[-1]['bbox'] = {}
+            continue
+
+        if not layer_stack:
+            continue
+
+        layer = layer_stack[-1]
+        if name == 'Name' and parent_name == 'Layer':
+            layer['name'] = (elem.text or '').strip() or None
+
+        elif (parent_name == 'EX_GeographicBoundingBox' and
+              name in WMS_BBOX_ELEM_NAMES):
+            # An empty or non-numeric bound leaves the layer with no
+            # bounding box
+            try:
+                layer['bbox'][name] = float(elem.text)
+            except (TypeError, ValueError):
+                pass
+
+        elif name == 'EX_GeographicBoundingBox':
+            bbox = layer['bbox']
+            if all(bbox_elem_name in bbox
+                   for bbox_elem_name in WMS_BBOX_ELEM_NAMES):
+                layer['bbox'] = (bbox['westBoundLongitude'],
+                                 bbox['southBoundLatitude'],
+                                 bbox['eastBoundLongitude'],
+                                 bbox['northBoundLatitude'])
+            else:
+                layer['bbox'] = None
+
+        elif name == 'Dimension' and parent_name == 'Layer':
+            layer['dimensions'][elem.attrib.get('name', '').lower()] = (
+                elem.attrib.get('default'), (elem.text or '').strip())
+
+        elif name == 'Layer':
+            layer_stack.pop()
+            if layer['name'] is not None:
+                yield WmsLayer(layer['name'], layer['bbox'],
+                               layer['dimensions'])
+
+
+def iter_wcs_coverage_names(source):
+    '''Yield names of coverages from a WCS 1.0.0 GetCapabilities document'''
+    for event, path, elem in iterparse_paths(source):
+        if event == 'end' and path == WCS_COVERAGE_NAME_PATH:
+            yield (elem.text or '').strip()
+
+
+def _parse_position(text):
+    '''Parse the longitude and latitude of a gml:pos element, raising
+    ParseError if they are missing or not numbers'''
+    coords = text.split()[:2]
+    try:
+        if len(coords) == 2:
+            return tuple(float(coord) for coord in coords)
+
+    except ValueError:
+        pass
+
+    raise ET.ParseError('Invalid position {!r} in lonLatEnvelope'.format(
+                        text))
+
+
+def iter_wcs_coverages(source):
+    '''Yield a WcsCoverage for each CoverageOffering in a WCS 1.0.0
+    DescribeCoverage document once its element has been read
+    '''
+    coverage = None
+    for event, path, elem in iterparse_paths(source):
+        name = path[-1]
+        if event == 'start':
+            if name == 'CoverageOffering':
+                coverage = {'name': None, 'positions': [], 'time': None,
+                            'formats': []}
+            continue
+
+        if coverage is None:
+            continue
+
+        parent_name = path[-2]
+        text = (elem.text or '').strip()
+        if name == 'name' and parent_name == 'CoverageOffering':
+            coverage['name'] = text
+
+        elif name == 'pos' and parent_name == 'lonLatEnvelope':
+            coverage['positions'].append(_parse_position(text))
+
+        elif (name == 'timePosition' and parent_name == 'temporalDomain' and
+              coverage['time'] is None):
+            coverage['time'] = text
+
+        elif name == 'formats' and parent_name == 'supportedFormats':
+            coverage['formats'].append(text)
+
+        elif name == 'CoverageOffering':
+            bbox = None
+            if len(coverage['positions']) == 2:
+                (west, south), (east, north) = coverage['positions']
+                bbox = (west, south, east, north)
+
+            yield WcsCoverage(coverage['name'], bbox, coverage['time'],
+                              coverage['formats'])
+            coverage = None
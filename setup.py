@@ -63,6 +63,8 @@ Data server catalogue
     entry_points={
         'console_scripts': [
             'ceda_tds_ogc_scan = ceda.tds_ogc_scan.script:main',
+            'ceda_tds_ogc_replay = ceda.tds_ogc_scan.replay:main',
+            'ceda_tds_ogc_daemon = ceda.tds_ogc_scan.daemon:main',
             'cci_odp_wms_test = '
             'ceda.tds_ogc_scan.nagios_test.wms_test:main',
             'cci_odp_wcs_test = '